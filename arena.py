@@ -0,0 +1,323 @@
+from array import array
+
+from token_ import Token
+from ast import *
+
+###################
+# Kinds
+###################
+# Node classes, indexed by kind. A node's operands are stored in the order
+# of its class's __slots__.
+KIND_CLASSES = [
+    Program,
+    Block,
+    ConstAssignNode,
+    VarAssignNode,
+    ReturnNode,
+    NumberNode,
+    StringNode,
+    IdentifierNode,
+    ListNode,
+    SetNode,
+    BinaryOperationNode,
+    UnaryOperationNode,
+    IfNode,
+    ArgNode,
+    FunctionNode,
+    CallNode,
+    IndexNode,
+    WhileNode,
+    ForNode,
+    BreakNode,
+    ContinueNode,
+]
+KIND_OF = {node_class: kind for kind, node_class in enumerate(KIND_CLASSES)}
+
+# Entries that are not ast nodes: a token, a list of operands, or a plain
+# value such as a function's name.
+TOKEN = len(KIND_CLASSES)
+LIST = TOKEN + 1
+VALUE = TOKEN + 2
+
+KIND_NAMES = [node_class.__name__ for node_class in KIND_CLASSES] + ["Token", "list", "value"]
+
+# Operand index standing for None, and offset standing for a missing position.
+NO_NODE = -1
+NO_POSITION = -1
+
+
+###################
+# Arena
+###################
+class Arena(object):
+    """A syntax tree stored column-wise, with nodes referenced by index.
+
+    Node `i` has kind `kinds[i]` and source offsets `starts[i]`/`ends[i]`.
+    Its operands are `operands[first[i]:first[i] + count[i]]`, node indexes
+    in __slots__ order. A token keeps its type in `count` and the index of
+    its value in `values` in `first`, and a plain value only uses `first`.
+    Values are shared, so each distinct name or literal is stored once.
+
+    Nodes are numbered in pre-order, so a parent comes before its children
+    and a subtree is a contiguous run of indexes.
+    """
+    def __init__(self):
+        self.kinds = array("B")
+        self.starts = array("q")
+        self.ends = array("q")
+        self.first = array("i")
+        self.count = array("i")
+        self.operands = array("i")
+        self.values = []
+        self.root = NO_NODE
+
+    def __len__(self):
+        return len(self.kinds)
+
+    @classmethod
+    def from_tree(cls, root):
+        """Copy an ast.py tree into a new arena."""
+        arena = cls()
+        kinds = arena.kinds
+        starts = arena.starts
+        ends = arena.ends
+        first = arena.first
+        count = arena.count
+        operands = arena.operands
+        values = arena.values
+        interned = {}
+
+        def intern(value):
+            if value is None:
+                return -1
+            key = (type(value), value)
+            index = interned.get(key)
+            if index is None:
+                index = interned[key] = len(values)
+                values.append(value)
+            return index
+
+        # (item, operand slot that will hold its index); the root has none.
+        work = [(root, -1)]
+        while work:
+            item, slot = work.pop()
+            if item is None:
+                index = NO_NODE
+            else:
+                index = len(kinds)
+                if isinstance(item, Token):
+                    kinds.append(TOKEN)
+                    starts.append(item.position_start)
+                    ends.append(item.position_end)
+                    first.append(intern(item.value))
+                    count.append(item.type)
+                elif isinstance(item, list):
+                    kinds.append(LIST)
+                    starts.append(NO_POSITION)
+                    ends.append(NO_POSITION)
+                    first.append(len(operands))
+                    count.append(len(item))
+                    work.extend((item[k], len(operands) + k) for k in reversed(range(len(item))))
+                    operands.extend([NO_NODE] * len(item))
+                elif type(item) in KIND_OF:
+                    kind = KIND_OF[type(item)]
+                    names = KIND_CLASSES[kind].__slots__
+                    kinds.append(kind)
+                    starts.append(NO_POSITION if item.position_start is None else item.position_start)
+                    ends.append(NO_POSITION if item.position_end is None else item.position_end)
+                    first.append(len(operands))
+                    count.append(len(names))
+                    work.extend((getattr(item, names[k]), len(operands) + k) for k in reversed(range(len(names))))
+                    operands.extend([NO_NODE] * len(names))
+                else:
+                    kinds.append(VALUE)
+                    starts.append(NO_POSITION)
+                    ends.append(NO_POSITION)
+                    first.append(intern(item))
+                    count.append(0)
+            if slot < 0:
+                arena.root = index
+            else:
+                operands[slot] = index
+        return arena
+
+    def to_tree(self, index=None):
+        """Rebuild the ast.py tree rooted at `index` (default: the root)."""
+        kinds = self.kinds
+        starts = self.starts
+        ends = self.ends
+        first = self.first
+        count = self.count
+        operands = self.operands
+        values = self.values
+
+        result = [None]
+        # (node index, object or list to store it in, attribute or position)
+        work = [(self.root if index is None else index, result, 0)]
+        while work:
+            index, target, key = work.pop()
+            if index == NO_NODE:
+                item = None
+            else:
+                kind = kinds[index]
+                if kind == TOKEN:
+                    value = first[index]
+                    item = Token(count[index], None if value < 0 else values[value], starts[index], ends[index])
+                elif kind == VALUE:
+                    item = values[first[index]]
+                elif kind == LIST:
+                    offset = first[index]
+                    item = [None] * count[index]
+                    work.extend((operands[offset + k], item, k) for k in range(count[index]))
+                else:
+                    node_class = KIND_CLASSES[kind]
+                    item = node_class.__new__(node_class)
+                    item.position_start = None if starts[index] == NO_POSITION else starts[index]
+                    item.position_end = None if ends[index] == NO_POSITION else ends[index]
+                    offset = first[index]
+                    work.extend((operands[offset + k], item, name) for k, name in enumerate(node_class.__slots__))
+            if type(target) is list:
+                target[key] = item
+            else:
+                setattr(target, key, item)
+        return result[0]
+
+    def kind_name(self, index):
+        return KIND_NAMES[self.kinds[index]]
+
+    def children(self, index):
+        """Operand indexes of a node or list; empty for tokens and values."""
+        if self.kinds[index] >= TOKEN and self.kinds[index] != LIST:
+            return self.operands[0:0]
+        offset = self.first[index]
+        return self.operands[offset:offset + self.count[index]]
+
+    def walk(self, index=None):
+        """Indexes of the subtree rooted at `index`, in pre-order."""
+        index = self.root if index is None else index
+        if index == NO_NODE:
+            return range(0)
+        # Pre-order numbering makes every subtree one contiguous run, ending
+        # at the end of its rightmost path.
+        kinds = self.kinds
+        first = self.first
+        count = self.count
+        operands = self.operands
+        last = index
+        while True:
+            kind = kinds[last]
+            if kind >= TOKEN and kind != LIST:
+                break
+            offset = first[last]
+            child = NO_NODE
+            for k in range(count[last] - 1, -1, -1):
+                child = operands[offset + k]
+                if child != NO_NODE:
+                    break
+            if child == NO_NODE:
+                break
+            last = child
+        return range(index, last + 1)
+
+    def node(self, index):
+        """A view of node `index` that reads like its ast.py class.
+
+        Views are instances of subclasses of the ast.py classes with the
+        same names, so tree visitors such as Interpreter and Compiler walk
+        an arena unchanged. Tokens come back as Token objects, lists as
+        lists of views.
+        """
+        if index == NO_NODE:
+            return None
+        kind = self.kinds[index]
+        if kind < TOKEN:
+            view = VIEW_CLASSES[kind].__new__(VIEW_CLASSES[kind])
+            view.arena = self
+            view.index = index
+            return view
+        if kind == TOKEN:
+            value = self.first[index]
+            return Token(self.count[index], None if value < 0 else self.values[value], self.starts[index], self.ends[index])
+        if kind == VALUE:
+            return self.values[self.first[index]]
+        return [self.node(child) for child in self.children(index)]
+
+
+###################
+# Views
+###################
+def view_operand(position):
+    def get(self):
+        arena = self.arena
+        return arena.node(arena.operands[arena.first[self.index] + position])
+    return property(get)
+
+
+def view_offset(column):
+    def get(self):
+        offset = getattr(self.arena, column)[self.index]
+        return None if offset == NO_POSITION else offset
+    return property(get)
+
+
+def view_eq(self, other):
+    return isinstance(other, Node) and getattr(other, "arena", None) is self.arena and other.index == self.index
+
+
+def view_hash(self):
+    return hash((id(self.arena), self.index))
+
+
+def make_view_class(node_class):
+    # Views are made on every access, so two views of the same node compare
+    # equal and can key the same dict entry, as in resolver.Resolver.
+    namespace = {
+        "__slots__": ("arena", "index"),
+        "__eq__": view_eq,
+        "__hash__": view_hash,
+        "position_start": view_offset("starts"),
+        "position_end": view_offset("ends"),
+    }
+    for position, name in enumerate(node_class.__slots__):
+        namespace[name] = view_operand(position)
+    return type(node_class.__name__, (node_class,), namespace)
+
+
+VIEW_CLASSES = [make_view_class(node_class) for node_class in KIND_CLASSES]
+
+
+###################
+# ArenaVisitor
+###################
+class ArenaVisitor(object):
+    """Walks an arena by node index.
+
+    Subclasses define visit_<kind name>(index) methods, named like the
+    tree visitors' (visit_BinaryOperationNode, ...) plus visit_Token,
+    visit_list and visit_value. The handler for each kind is looked up once,
+    so dispatch is a list index. Nodes and lists without a handler visit
+    their operands; tokens and values without one are skipped.
+    """
+    def __init__(self, arena):
+        self.arena = arena
+        self.handlers = [
+            getattr(self, "visit_" + name, self.generic_visit if kind < TOKEN or kind == LIST else self.skip)
+            for kind, name in enumerate(KIND_NAMES)
+        ]
+
+    def visit(self, index):
+        if index == NO_NODE:
+            return None
+        return self.handlers[self.arena.kinds[index]](index)
+
+    def generic_visit(self, index):
+        arena = self.arena
+        kinds = arena.kinds
+        handlers = self.handlers
+        offset = arena.first[index]
+        for child in arena.operands[offset:offset + arena.count[index]]:
+            if child != NO_NODE:
+                handlers[kinds[child]](child)
+
+    def skip(self, index):
+        return None
@@ -1,62 +1,100 @@
-class Program:
+###################
+# Node
+###################
+class Node(object):
+    """Base of all syntax tree nodes.
+
+    Nodes have no instance dict. The base holds the source offsets and each
+    subclass lists its child attributes in `__slots__`, which is also what
+    the walks in arena.py and incremental.py iterate over.
+    optimizer.children lists the child nodes of each class by hand instead,
+    leaving out a function's argument and flattening a call's arguments.
+    """
+    __slots__ = ("position_start", "position_end")
+
+
+class Program(Node):
+    __slots__ = ("statements",)
+
     def __init__(self):
         self.statements = []
 
+        self.position_start = None
+        self.position_end = None
+
     def __repr__(self):
         string = ""
         for statement in self.statements:
             string += f" [ {statement} ] "
         return string
 
-class Block:
-    def __init__(self):
+class Block(Node):
+    __slots__ = ("statements",)
+
+    def __init__(self, position_start=None, position_end=None):
         self.statements = []
 
+        self.position_start = position_start
+        self.position_end = position_end
+
     def __repr__(self):
         string = ""
         for statement in self.statements:
             string += f" [ {statement} ] "
         return string
 
-class ConstAssignNode:
+class ConstAssignNode(Node):
+    __slots__ = ("const_name", "const_value")
+
     def __init__(self, const_name, const_value, position_start, position_end):
         self.const_name = const_name
         self.const_value = const_value
 
+        self.position_start = position_start
+        self.position_end = position_end
+
     def __repr__(self):
         return f"( LET {self.const_name} = {self.const_value} )"
 
-class VarAssignNode:
+class VarAssignNode(Node):
+    __slots__ = ("var_name", "var_value")
+
     def __init__(self, var_name, var_value, position_start, position_end):
         self.var_name = var_name
         self.var_value = var_value
+
+        self.position_start = position_start
+        self.position_end = position_end
     
     def __repr__(self):
         return f"( VAR {self.var_name} = {self.var_value} )"
 
-class ReturnNode:
+class ReturnNode(Node):
+    __slots__ = ("return_value",)
+
     def __init__(self, return_value, position_start, position_end):
         self.return_value = return_value
 
-    def get_c_code(self):
-        return f"return {self.return_value};"
+        self.position_start = position_start
+        self.position_end = position_end
 
     def __repr__(self):
         return f"( RETURN {self.return_value} )"
 
-class NumberNode:
+class NumberNode(Node):
+    __slots__ = ("tok",)
+
     def __init__(self, tok, position_start, position_end):
         self.tok = tok
         self.position_start = position_start
         self.position_end = position_end
 
-    def get_c_code(self):
-        return f"{self.tok.value}"
-
     def __repr__(self):
         return f"{self.tok}"
 
-class StringNode:
+class StringNode(Node):
+    __slots__ = ("tok",)
+
     def __init__(self, tok, position_start, position_end):
         self.tok = tok
         self.position_start = position_start
@@ -65,7 +103,9 @@ class StringNode:
     def __repr__(self):
         return f"{self.tok}"
 
-class IdentifierNode:
+class IdentifierNode(Node):
+    __slots__ = ("tok",)
+
     def __init__(self, tok, position_start, position_end):
         self.tok = tok
         self.position_start = position_start
@@ -74,7 +114,9 @@ class IdentifierNode:
     def __repr__(self):
         return f"{self.tok}"
 
-class ListNode:
+class ListNode(Node):
+    __slots__ = ("elements",)
+
     def __init__(self, elements, position_start, position_end):
         self.elements = elements
         self.position_start = position_start
@@ -83,7 +125,9 @@ class ListNode:
     def __repr__(self):
         return f"{self.elements}"
 
-class SetNode:
+class SetNode(Node):
+    __slots__ = ("elements",)
+
     def __init__(self, elements, position_start, position_end):
         self.elements = elements
         self.position_start = position_start
@@ -92,7 +136,9 @@ class SetNode:
     def __repr__(self):
         return f"{self.elements}"
 
-class BinaryOperationNode:
+class BinaryOperationNode(Node):
+    __slots__ = ("left_node", "operation_tok", "right_node")
+
     def __init__(self, left_node, operation_tok, right_node, position_start, position_end):
         self.left_node = left_node
         self.operation_tok = operation_tok
@@ -105,7 +151,9 @@ class BinaryOperationNode:
         return f"({self.left_node} {self.operation_tok} {self.right_node})"
 
 
-class UnaryOperationNode:
+class UnaryOperationNode(Node):
+    __slots__ = ("operation_tok", "node")
+
     def __init__(self, operation_tok, node, position_start, position_end):
         self.operation_tok = operation_tok
         self.node = node
@@ -116,7 +164,9 @@ class UnaryOperationNode:
     def __repr__(self):
         return f"({self.operation_tok} {self.node})"
 
-class IfNode:
+class IfNode(Node):
+    __slots__ = ("if_condition", "if_block_statement", "elif_conditions", "elif_block_statements", "else_block_statement")
+
     def __init__(self, if_condition, if_block_statement, elif_conditions=None, elif_block_statements=None, else_block_statements=None, position_start=None, position_end=None):
         self.if_condition = if_condition
         self.if_block_statement = if_block_statement
@@ -138,7 +188,63 @@ class IfNode:
         string += ')'
         return string
 
-class ArgNode:
+class WhileNode(Node):
+    __slots__ = ("condition", "block")
+
+    def __init__(self, condition, block, position_start, position_end):
+        self.condition = condition
+        self.block = block
+
+        self.position_start = position_start
+        self.position_end = position_end
+
+    def __repr__(self):
+        return f"( WHILE {self.condition} DO {self.block} )"
+
+class ForNode(Node):
+    """`for name = start, end, step { ... }`; step_value is None when it
+    is left out."""
+    __slots__ = ("var_name", "start_value", "end_value", "step_value", "block")
+
+    def __init__(self, var_name, start_value, end_value, step_value, block, position_start, position_end):
+        self.var_name = var_name
+        self.start_value = start_value
+        self.end_value = end_value
+        self.step_value = step_value
+        self.block = block
+
+        self.position_start = position_start
+        self.position_end = position_end
+
+    def __repr__(self):
+        string = f"( FOR {self.var_name} = {self.start_value}, {self.end_value}"
+        if self.step_value is not None:
+            string += f", {self.step_value}"
+        return string + f" DO {self.block} )"
+
+class BreakNode(Node):
+    __slots__ = ()
+
+    def __init__(self, position_start, position_end):
+        self.position_start = position_start
+        self.position_end = position_end
+
+    def __repr__(self):
+        return "( BREAK )"
+
+class ContinueNode(Node):
+    __slots__ = ()
+
+    def __init__(self, position_start, position_end):
+        self.position_start = position_start
+        self.position_end = position_end
+
+    def __repr__(self):
+        return "( CONTINUE )"
+
+class ArgNode(Node):
+    __slots__ = ("args",)
+
     def __init__(self, args, position_start, position_end):
         self.args = args
 
@@ -148,7 +254,9 @@ class ArgNode:
     def __repr__(self):
         return f"{self.args}"
 
-class FunctionNode:
+class FunctionNode(Node):
+    __slots__ = ("name", "arg_node", "code_block")
+
     def __init__(self, name, arg_node, code_block, position_start, position_end):
         self.name = name
         self.arg_node = arg_node
@@ -159,7 +267,9 @@ class FunctionNode:
     def __repr__(self):
         return f"( FUNCTION {self.name} ( {self.arg_node} ) CODE {self.code_block} )"
 
-class CallNode:
+class CallNode(Node):
+    __slots__ = ("operand", "arg_node")
+
     def __init__(self, operand, arg_node, position_start, position_end):
         self.operand = operand
         self.arg_node = arg_node
@@ -172,7 +282,9 @@ class CallNode:
 
         return string
 
-class IndexNode:
+class IndexNode(Node):
+    __slots__ = ("operand", "index_expr")
+
     def __init__(self, operand, index_expr, position_start, position_end):
         self.operand = operand
         self.index_expr = index_expr
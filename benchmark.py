@@ -0,0 +1,890 @@
+import io
+import os
+import sys
+import time
+import argparse
+import tempfile
+import contextlib
+import subprocess
+from collections import namedtuple
+
+from lexer import Lexer
+from parser_ import Parser
+from interpreter import Interpreter, Context
+from closures import ClosureCompiler
+from raising import RaisingCompiler
+from unboxed import UnboxedCompiler
+from stackless import StacklessCompiler
+from transpile import Transpiler
+from registers import RegisterCompiler
+from compiler import Compiler
+from peephole import Peephole
+from vm import VM
+from objfile import ObjectFile
+
+
+###################
+# Sample programs
+###################
+STATEMENTS = [
+    'var x{i} = 12 + 3.5 * (y{i} - 4);',
+    'if x{i} >= 10 {{ write("big"); }} elif x{i} == 3 {{ return 1; }} else {{ x{i} = 0; }}',
+    'f{i} = a => {{ return a / 2 - [1, 2, 3]; }};',
+    'let c{i} = (1, 2, x{i}) ;',
+    'write(f{i}(x{i}) <= 100);',
+]
+
+
+def generate_program(lines):
+    return "\n".join(STATEMENTS[i % len(STATEMENTS)].format(i=i) for i in range(lines)) + "\n"
+
+
+def best_of(repeat, func):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def parse(code):
+    """The tree of `code` and its Source."""
+    lexer = Lexer(code, "bench")
+    tokens, errors = lexer.tokenize()
+    return Parser(tokens, lexer.source).parse_program(), lexer.source
+
+
+###################
+# Engines
+###################
+def vm_engine(program, source, peephole=True):
+    """Compile `program` for the VM, as an engine like the others. The
+    peephole pass runs unless told not to, as in run.py."""
+    compiler = Compiler()
+    compiler.visit(program)
+    if peephole:
+        Peephole().optimize(compiler)
+    vm = VM(ObjectFile.from_compiler(compiler), source)
+    return lambda context: vm.run()
+
+
+# How each engine turns a tree and its source into a function that runs
+# the program in a Context and returns (result, error).
+ENGINES = {
+    "tree": lambda program, source: lambda context: Interpreter().visit(program, context),
+    "closure": lambda program, source: ClosureCompiler().compile(program),
+    "raising": lambda program, source: RaisingCompiler().compile(program),
+    "unboxed": lambda program, source: UnboxedCompiler().compile(program),
+    "stackless": lambda program, source: StacklessCompiler().compile(program),
+    "transpile": lambda program, source: Transpiler().compile(program),
+    "vm": vm_engine,
+    "registers": lambda program, source: RegisterCompiler().compile(program),
+}
+
+# What one run of a program gave, and the context it ran in.
+Run = namedtuple("Run", ("output", "result", "error", "context"))
+
+
+def run_engine(name, program, source):
+    """Compile `program` with the engine `name`. Returns a function that
+    runs it once in a new program context, with what it writes captured,
+    and returns a Run."""
+    run = ENGINES[name](program, source)
+
+    def execute():
+        context = Context("<program>", source=source)
+        context.make_main_symbol_table()
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            result, error = run(context)
+        return Run(output.getvalue(), result, error, context)
+    return execute
+
+
+###################
+# Benchmarks
+###################
+def bench_lexer(args):
+    code = generate_program(args.lines)
+
+    streams = {}
+    for engine in Lexer.ENGINES:
+        tokens, errors = Lexer(code, "bench", engine).tokenize()
+        streams[engine] = [(tok.type, tok.value, tok.position_start, tok.position_end) for tok in tokens]
+    if streams["table"] != streams["scan"]:
+        sys.exit("lexer engines disagree on the token stream")
+
+    count = len(streams["table"])
+    print(f"{len(code)} chars, {count} tokens")
+    for engine in Lexer.ENGINES:
+        elapsed = best_of(args.repeat, lambda: Lexer(code, "bench", engine).tokenize())
+        print(f"  {engine:<6} {elapsed * 1000:9.2f} ms  {count / elapsed:12,.0f} tokens/sec")
+
+
+# Peak resident set size of the current process in KiB. ru_maxrss survives
+# exec on Linux and would include the parent's peak, VmHWM does not.
+PEAK_RSS = """
+import resource
+def peak_rss():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+"""
+
+# Run in a fresh interpreter so the peak only reflects one pipeline. Only the
+# public Lexer/Parser API is used, which lets `--tree` point at an older
+# checkout for before/after numbers.
+MEMORY_SCRIPT = PEAK_RSS + """
+import sys, time
+from lexer import Lexer
+from parser_ import Parser
+code = sys.stdin.read()
+baseline = peak_rss()
+start = time.perf_counter()
+tokens, errors = Lexer(code, "bench").tokenize()
+lexed = time.perf_counter()
+program = Parser(tokens).parse_program()
+parsed = time.perf_counter()
+peak = peak_rss()
+del program
+import tracemalloc
+tracemalloc.start()
+program = Parser(tokens).parse_program()
+tree_size = tracemalloc.get_traced_memory()[0]
+tracemalloc.stop()
+print(len(tokens), baseline, peak, tree_size, lexed - start, parsed - lexed)
+"""
+
+
+def bench_memory(args):
+    code = generate_program(args.lines)
+    tree = os.path.abspath(args.tree or os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run(
+        [sys.executable, "-c", MEMORY_SCRIPT],
+        input=code, capture_output=True, text=True, cwd=tree, check=True,
+    ).stdout
+    fields = output.split()
+    count, baseline, peak, tree_size = (int(field) for field in fields[:4])
+    lex_time, parse_time = (float(field) for field in fields[4:])
+    print(f"{tree}: {len(code)} chars, {count} tokens")
+    print(f"  peak RSS {peak / 1024:8.1f} MiB  (+{(peak - baseline) / 1024:.1f} MiB for lexing and parsing)")
+    print(f"  syntax tree {tree_size / 1024 / 1024:8.1f} MiB")
+    print(f"  lex {lex_time * 1000:9.2f} ms, parse {parse_time * 1000:9.2f} ms")
+
+
+STREAM_SCRIPT = PEAK_RSS + """
+import sys
+from lexer import Lexer, StreamLexer
+from parser_ import Parser
+from token_ import TokenBuffer
+path, mode = sys.argv[1:]
+if mode == "stream":
+    lexer = StreamLexer(path, "bench")
+    parser = Parser(TokenBuffer(lexer.iter_tokens()), lexer.source)
+    count = sum(1 for stmt in parser.iter_statements())
+else:
+    with open(path) as f:
+        tokens, errors = Lexer(f.read(), "bench").tokenize()
+    count = len(Parser(tokens).parse_program().statements)
+print(count, peak_rss())
+"""
+
+
+def bench_stream(args):
+    here = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as directory:
+        for lines in (args.lines, args.lines * 4):
+            path = os.path.join(directory, f"program_{lines}.oas")
+            with open(path, "w") as f:
+                f.write(generate_program(lines))
+            size = os.path.getsize(path)
+            for mode in ("whole", "stream"):
+                output = subprocess.run(
+                    [sys.executable, "-c", STREAM_SCRIPT, path, mode],
+                    capture_output=True, text=True, cwd=here, check=True,
+                ).stdout
+                count, peak = (int(field) for field in output.split())
+                print(f"  {size / 1024 / 1024:7.1f} MiB file, {mode:<6} {count} statements, peak RSS {peak / 1024:8.1f} MiB")
+
+
+# Parses the generated program, an expression-heavy one and deeply nested
+# expressions. Like MEMORY_SCRIPT it only uses the public API, so `--tree`
+# can measure an older checkout.
+PARSER_SCRIPT = """
+import sys, time
+from lexer import Lexer
+from parser_ import Parser
+repeat = int(sys.argv[1])
+programs = sys.stdin.read().split("\\0")
+for name, code in zip(programs[::2], programs[1::2]):
+    tokens, errors = Lexer(code, "bench").tokenize()
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            Parser(tokens).parse_program()
+        except RecursionError:
+            best = None
+            break
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(name, len(tokens), best if best is not None else "RecursionError")
+"""
+
+
+def bench_parser(args):
+    tree = os.path.abspath(args.tree or os.path.dirname(os.path.abspath(__file__)))
+    depth = 100000
+    programs = {
+        "program": generate_program(args.lines),
+        "expressions": "".join(
+            f"var e{i} = (a{i} + {i}) * -b[{i}] / f(x, {i}) - (c + d * (e - {i})) <= g{i};\n" for i in range(args.lines)
+        ),
+        "nested_parens": "var v = " + "(" * depth + "x" + ")" * depth + ";",
+        "unary_chain": "var v = " + "- " * depth + "x;",
+    }
+    output = subprocess.run(
+        [sys.executable, "-c", PARSER_SCRIPT, str(args.repeat)],
+        input="\0".join(part for item in programs.items() for part in item),
+        capture_output=True, text=True, cwd=tree, check=True,
+    ).stdout
+    print(tree)
+    for line in output.splitlines():
+        name, count, elapsed = line.split()
+        if elapsed == "RecursionError":
+            print(f"  {name:<14} {int(count):9} tokens  RecursionError")
+        else:
+            elapsed = float(elapsed)
+            print(f"  {name:<14} {int(count):9} tokens {elapsed * 1000:9.2f} ms  {int(count) / elapsed:12,.0f} tokens/sec")
+
+
+# One run.py startup: import everything, then lex and parse (or load) the
+# file. The parent times the whole process, the script the parse alone.
+CACHE_SCRIPT = """
+import sys, time
+from cache import ParseCache
+from run import parse_file
+path, directory = sys.argv[1:]
+start = time.perf_counter()
+parse_file(path, ParseCache(directory) if directory else None)
+print(time.perf_counter() - start)
+"""
+
+
+def bench_cache(args):
+    here = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "program.oas")
+        with open(path, "w") as f:
+            f.write(generate_program(args.lines))
+        cache_directory = os.path.join(directory, "cache")
+
+        def startup(cache):
+            start = time.perf_counter()
+            output = subprocess.run(
+                [sys.executable, "-c", CACHE_SCRIPT, path, cache],
+                capture_output=True, text=True, cwd=here, check=True,
+            ).stdout
+            return time.perf_counter() - start, float(output)
+
+        print(f"{args.lines} lines, {os.path.getsize(path)} bytes")
+        for name, cache in (("no cache", ""), ("cold", cache_directory), ("warm", cache_directory)):
+            runs = [startup(cache) for _ in range(1 if name == "cold" else args.repeat)]
+            total, parse = min(runs)
+            print(f"  {name:<9} startup {total * 1000:9.2f} ms  parse/load {parse * 1000:9.2f} ms")
+        size = sum(entry.stat().st_size for entry in os.scandir(cache_directory))
+        print(f"  cache entry {size / 1024:.1f} KiB")
+
+
+def bench_arena(args):
+    import gc
+    import tracemalloc
+    from ast import Node, BinaryOperationNode
+    from parser_ import Parser
+    from arena import KIND_OF, Arena, ArenaVisitor
+
+    code = generate_program(args.lines)
+    tokens, errors = Lexer(code, "bench").tokenize()
+
+    tracemalloc.start()
+    program = Parser(tokens).parse_program()
+    tree_size = tracemalloc.get_traced_memory()[0]
+    arena = Arena.from_tree(program)
+    arena_size = tracemalloc.get_traced_memory()[0] - tree_size
+    tracemalloc.stop()
+
+    count = len(arena)
+    print(f"{args.lines} lines, {count} arena entries (nodes, tokens and lists)")
+    print(f"  objects {tree_size / 1024 / 1024:8.1f} MiB  {tree_size / count:6.1f} bytes/entry")
+    print(f"  arena   {arena_size / 1024 / 1024:8.1f} MiB  {arena_size / count:6.1f} bytes/entry")
+
+    gc.disable()
+    print(f"  from_tree  {best_of(args.repeat, lambda: Arena.from_tree(program)) * 1000:9.2f} ms")
+    print(f"  to_tree    {best_of(args.repeat, lambda: arena.to_tree()) * 1000:9.2f} ms")
+    gc.enable()
+
+    # The same full traversal both ways: count the binary operations.
+    def walk_tree():
+        found = 0
+        stack = [program]
+        while stack:
+            node = stack.pop()
+            if type(node) is list:
+                stack.extend(node)
+            elif isinstance(node, Node):
+                if type(node) is BinaryOperationNode:
+                    found += 1
+                for name in node.__slots__:
+                    stack.append(getattr(node, name))
+        return found
+
+    class BinaryCounter(ArenaVisitor):
+        found = 0
+
+        def visit_BinaryOperationNode(self, index):
+            self.found += 1
+            self.generic_visit(index)
+
+    def visit_arena():
+        counter = BinaryCounter(arena)
+        counter.visit(arena.root)
+        return counter.found
+
+    kind = KIND_OF[BinaryOperationNode]
+    expected = walk_tree()
+    if visit_arena() != expected or arena.kinds.count(kind) != expected:
+        sys.exit("arena traversal disagrees with the tree")
+    print(f"  walk objects     {best_of(args.repeat, walk_tree) * 1000:9.2f} ms")
+    print(f"  ArenaVisitor     {best_of(args.repeat, visit_arena) * 1000:9.2f} ms")
+    print(f"  scan kinds array {best_of(args.repeat, lambda: arena.kinds.count(kind)) * 1000:9.2f} ms")
+
+
+# Interprets and compiles long arithmetic expressions, which is almost
+# nothing but visitor dispatch. Public API only, so `--tree` works.
+DISPATCH_SCRIPT = """
+import sys, time
+from lexer import Lexer
+from parser_ import Parser
+from interpreter import Interpreter, Context
+from compiler import Compiler
+repeat = int(sys.argv[1])
+code = sys.stdin.read()
+lexer = Lexer(code, "bench")
+tokens, errors = lexer.tokenize()
+program = Parser(tokens, lexer.source).parse_program()
+
+def interpret():
+    context = Context("<program>", source=lexer.source)
+    context.make_main_symbol_table()
+    result, error = Interpreter().visit(program, context)
+    assert error is None
+
+def compile():
+    compiler = Compiler()
+    compiler.code = []
+    compiler.visit(program)
+
+for name, func in (("interpreter", interpret), ("compiler", compile)):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(name, best)
+"""
+
+
+def bench_dispatch(args):
+    tree = os.path.abspath(args.tree or os.path.dirname(os.path.abspath(__file__)))
+    # Left-deep chains of 200 operators: 401 visits per statement, shallow
+    # enough for the recursive visitors.
+    terms = " + ".join(f"{i % 9 + 1} * 2 - 3" for i in range(67))
+    statements = max(1, args.lines // 200)
+    code = f"{terms};\n" * statements
+    output = subprocess.run(
+        [sys.executable, "-c", DISPATCH_SCRIPT, str(args.repeat)],
+        input=code, capture_output=True, text=True, cwd=tree, check=True,
+    ).stdout
+    visits = statements * (terms.count(" ") + 1)
+    print(f"{tree}: {statements} statements, {visits} node visits per pass")
+    for line in output.splitlines():
+        name, elapsed = line.split()
+        elapsed = float(elapsed)
+        print(f"  {name:<12} {elapsed * 1000:9.2f} ms  {visits / elapsed:12,.0f} visits/sec")
+
+
+ENGINE_PROGRAMS = {
+    "calls": "var g = x => { if x < 0 { return 0 - x; } return x * 2 + 1; };\n" + "var y = g(3) + g(-4);\n" * 2000,
+    "arithmetic": "var x = 3;\n" + "var y = (x * 2 + 1) / 4 - x * (x - 1) <= 10;\n" * 2000,
+    "variables": "var a = 1; var b = 2; var c = 3;\n"
+    + "var t = a + b * c; a = b; b = c - t; c = t + a - b; var u = t * a;\n" * 4000,
+    "locals": "var h = n => { var s = n + 1; var p = s * n; s = p - s + n; return s + p; };\n"
+    + "var y = h(2) + h(3);\n" * 2000,
+}
+
+
+def bench_engines(args):
+    for name, code in ENGINE_PROGRAMS.items():
+        program, source = parse(code)
+        print(name)
+        results = {}
+        for engine in ("tree", "closure", "raising", "unboxed"):
+            execute = run_engine(engine, program, source)
+            runs = []
+            print(f"  {engine:<8} {best_of(args.repeat, lambda: runs.append(execute())) * 1000:9.2f} ms")
+            results[engine] = (runs[-1].result, runs[-1].error and runs[-1].error.as_string())
+        if any(result != results["tree"] for result in results.values()):
+            sys.exit(f"engines disagree on {name}")
+        compile_time = best_of(args.repeat, lambda: ClosureCompiler().compile(program))
+        print(f"  compiling to closures {compile_time * 1000:9.2f} ms")
+
+
+FIB = "var fib = n => {{ if n < 2 {{ return n; }} return fib(n - 1) + fib(n - 2); }};\nvar r = fib({n});\n"
+COUNT = "var count = n => {{ if n < 1 {{ return 0; }} return count(n - 1); }};\nvar r = count({n});\n"
+SUM = "var sum = n => {{ if n < 1 {{ return 0; }} return n + sum(n - 1); }};\nvar r = sum({n});\n"
+# A function with many locals, called where many variables are defined.
+WIDE = (
+    "".join(f"var g{i} = {i};\n" for i in range(500))
+    + "var w = n => { " + " ".join(f"var l{i} = n + {i};" for i in range(40)) + " return l39; };\n"
+    + "var r = w(1) + w(2);\n" * 2000
+)
+
+
+def bench_calls(args):
+    n = 18
+    # fib(k) makes one call plus those of fib(k - 1) and fib(k - 2).
+    fib_calls = [1, 1]
+    while len(fib_calls) <= n:
+        fib_calls.append(1 + fib_calls[-1] + fib_calls[-2])
+    programs = {
+        f"fib({n})": (FIB.format(n=n), fib_calls[n], None),
+        "wide": (WIDE, 4000, None),
+        # Deeper than Python's stack allows the other engines to go.
+        "tail count(100000)": (COUNT.format(n=100000), 100001, ["stackless"]),
+        "sum(5000)": (SUM.format(n=5000), 5001, ["stackless", "vm", "registers"]),
+    }
+    for name, (code, calls, only) in programs.items():
+        program, source = parse(code)
+        print(f"{name}: {calls} calls")
+        for engine in only or ENGINES:
+            execute = run_engine(engine, program, source)
+            runs = []
+            elapsed = best_of(args.repeat, lambda: runs.append(execute()))
+            if runs[-1].error:
+                sys.exit(runs[-1].error.as_string())
+            print(f"  {engine:<9} {elapsed * 1000:9.2f} ms  {calls / elapsed:12,.0f} calls/sec")
+
+
+LOOPS = {
+    "while": "var s = 0; var i = 0;\nwhile i < {n} {{ s = s + i; i = i + 1; }}\nwrite(s);\n",
+    "for": "var s = 0;\nfor i = 0, {n} {{ s = s + i; }}\nwrite(s);\n",
+    # A body that can leave the loop is checked after every iteration.
+    "for, break and continue": "var s = 0;\nfor i = 0, {n} {{ if i < 0 {{ continue; }} s = s + i; if s < 0 {{ break; }} }}\nwrite(s);\n",
+    # How a program had to count before there were loops.
+    "tail recursion": "var s = 0;\nvar count = i => {{ if i == {n} {{ return 0; }} s = s + i; return count(i + 1); }};\ncount(0);\nwrite(s);\n",
+}
+
+
+def bench_loops(args):
+    n = 100000
+    for name, code in LOOPS.items():
+        program, source = parse(code.format(n=n))
+        engines = ENGINES
+        if name == "tail recursion":
+            # Only this engine goes that deep.
+            engines = ["stackless"]
+        print(f"{name}: {n} iterations")
+        outputs = set()
+        for engine in engines:
+            execute = run_engine(engine, program, source)
+            runs = []
+            elapsed = best_of(args.repeat, lambda: runs.append(execute()))
+            if runs[-1].error:
+                sys.exit(runs[-1].error.as_string())
+            outputs.add(runs[-1].output)
+            print(f"  {engine:<9} {elapsed * 1000:9.2f} ms  {n / elapsed:12,.0f} iterations/sec")
+        if len(outputs) != 1:
+            sys.exit(f"engines disagree on {name}")
+
+
+# Every statement keeps its result in a new variable, so what the values
+# cost shows up in the memory still allocated after the run: a number and a
+# comparison per line.
+KEPT = "var x = 3;\n" + "".join(f"var v{i} = (x * 2 + {i}) / 4 - x * (x - 1); var w{i} = v{i} <= {i};\n" for i in range(2000))
+
+
+def bench_allocations(args):
+    import tracemalloc
+
+    programs = {"arithmetic": ENGINE_PROGRAMS["arithmetic"], "kept": KEPT}
+    for name, code in programs.items():
+        program, source = parse(code)
+        print(f"{name}: {len(program.statements)} statements")
+        for engine in ("tree", "closure", "raising", "unboxed"):
+            execute = run_engine(engine, program, source)
+            runs = []
+            elapsed = best_of(args.repeat, lambda: runs.append(execute()))
+            if runs[-1].error:
+                sys.exit(runs[-1].error.as_string())
+            del runs
+
+            # tracemalloc only sees blocks that are still allocated, so the
+            # peak stands for the temporaries and what the context holds
+            # afterwards for the values kept.
+            tracemalloc.start()
+            before = tracemalloc.take_snapshot()
+            context = execute().context
+            current, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            kept = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+            kept_size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+            del context
+            print(f"  {engine:<8} {elapsed * 1000:9.2f} ms  peak {peak / 1024:8.1f} KiB"
+                  f"  kept {kept:7,} blocks {kept_size / 1024:8.1f} KiB")
+
+
+def bench_vm(args):
+    from objfile import save, load
+
+    # Arithmetic on literals, where every statement leaves a value to compare.
+    terms = " + ".join(f"{i % 9 + 1} * 2 - 3 / {i % 5 + 1}" for i in range(50))
+    program, source = parse(f"{terms};\n" * max(1, args.lines // 200))
+    compiler = Compiler()
+    compiler.visit(program)
+    vm = VM(ObjectFile.from_compiler(compiler))
+    tree = run_engine("tree", program, source)
+    closure = run_engine("closure", program, source)
+
+    results = {
+        "tree": tree().result,
+        "closure": closure().result,
+        "vm": vm.run()[0],
+    }
+    if not results["tree"] == results["closure"] == results["vm"]:
+        sys.exit("the VM and the interpreters disagree")
+    count = vm.instruction_count()
+
+    print(f"{len(program.statements)} statements, {len(vm.code)} bytes of code, {count} instructions per run")
+    timings = {
+        "tree": tree,
+        "closure": closure,
+        "vm": vm.run,
+    }
+    for name, func in timings.items():
+        elapsed = best_of(args.repeat, func)
+        print(f"  {name:<8} {elapsed * 1000:9.2f} ms  {count / elapsed:12,.0f} instructions/sec")
+
+    # The object file against the old text format, one decimal per byte.
+    text = " ".join(str(byte) for byte in compiler.code)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "program.bin")
+        save(path, vm.program)
+        size = os.path.getsize(path)
+        loaded = best_of(args.repeat, lambda: load(path))
+        mapped = VM(load(path))
+        if mapped.run()[0] != results["vm"]:
+            sys.exit("the loaded object file runs differently")
+        print(f"  object file {size} bytes (text format {len(text)} bytes), load {loaded * 1000:.3f} ms")
+        print(f"  text parse  {best_of(args.repeat, lambda: bytes(int(field) for field in text.split())) * 1000:.3f} ms")
+        print(f"  vm on the mapped file {best_of(args.repeat, mapped.run) * 1000:9.2f} ms")
+
+
+# Constants worth folding and inlining, and a branch on one of them.
+OPTIMIZER_PROGRAM = (
+    "let scale = 2 * 3.5; let offset = 10 - 4 / 2;\nvar x = 3;\n"
+    + "var y = x * scale + offset - (1 + 2) * 4; if scale > 5 { y = y + 1; } else { y = y - 1; }\n" * 2000
+    + "write(y);\n"
+)
+
+
+def bench_optimizer(args):
+    from optimizer import Optimizer
+
+    program, source = parse(OPTIMIZER_PROGRAM)
+    optimizer = Optimizer()
+    optimized = optimizer.optimize(parse(OPTIMIZER_PROGRAM)[0])
+    print(f"{len(program.statements)} statements")
+    print("  " + optimizer.report().replace("\n", "\n  "))
+    print(f"  optimizing {best_of(args.repeat, lambda: Optimizer().optimize(program)) * 1000:9.2f} ms")
+
+    for engine in ("tree", "unboxed"):
+        outputs = []
+        timings = []
+        for tree in (program, optimized):
+            execute = run_engine(engine, tree, source)
+            runs = []
+            timings.append(best_of(args.repeat, lambda: runs.append(execute())))
+            if runs[-1].error:
+                sys.exit(runs[-1].error.as_string())
+            outputs.append(runs[-1].output)
+        if len(set(outputs)) != 1:
+            sys.exit(f"the optimized program prints something else on {engine}")
+        print(f"  {engine:<8} {timings[0] * 1000:9.2f} ms  optimized {timings[1] * 1000:9.2f} ms")
+
+    # Arithmetic on literals, which the optimizer folds away entirely.
+    terms = " + ".join(f"{i % 9 + 1} * 2 - 3 / {i % 5 + 1}" for i in range(50))
+    program = parse(f"{terms};\n" * max(1, args.lines // 200))[0]
+    values = []
+    for name, tree in (("compiled", program), ("optimized", Optimizer().optimize(program))):
+        compiler = Compiler()
+        compiler.visit(tree)
+        vm = VM(ObjectFile.from_compiler(compiler))
+        values.append(vm.run()[0])
+        elapsed = best_of(args.repeat, vm.run)
+        print(f"  {name:<9} {len(compiler.code):7} bytes of code, vm {elapsed * 1000:9.2f} ms")
+    if values[0] != values[1]:
+        sys.exit("the optimized program computes something else on the VM")
+
+
+def bench_peephole(args):
+    programs = {
+        "fib(18)": FIB.format(n=18),
+        "while": LOOPS["while"].format(n=20000),
+        "for, break and continue": LOOPS["for, break and continue"].format(n=20000),
+        # Constant expressions and branches, as the tree optimizer would
+        # find them but left for the peephole pass.
+        "constants": "var x = 3;\n" + "var y = x * (2 * 3.5) + (10 - 4 / 2) - (1 + 2) * 4; if 2 > 1 { y = y + 1; } else { y = y - 1; }\n" * 500 + "write(y);\n",
+    }
+    for name, code in programs.items():
+        program, source = parse(code)
+        peephole = Peephole()
+        vms = {}
+        for variant in ("compiled", "peephole"):
+            compiler = Compiler()
+            compiler.visit(program)
+            if variant == "peephole":
+                peephole.optimize(compiler)
+            vms[variant] = VM(ObjectFile.from_compiler(compiler), source)
+        print(f"{name}: {peephole.before} -> {peephole.after} instructions, {peephole.eliminated()} eliminated in {peephole.elapsed * 1000:.2f} ms")
+
+        outputs = set()
+        for variant, vm in vms.items():
+            def execute():
+                output = io.StringIO()
+                with contextlib.redirect_stdout(output):
+                    values, error = vm.run()
+                if error:
+                    sys.exit(error.as_string())
+                outputs.add((output.getvalue(), tuple(values)))
+            execute()
+            dispatches = vm.instruction_count()
+            elapsed = best_of(args.repeat, execute)
+            print(f"  {variant:<9} {elapsed * 1000:9.2f} ms  {dispatches:10,} instructions run")
+        if len(outputs) != 1:
+            sys.exit(f"the peephole pass changes what {name} does")
+
+
+def bench_registers(args):
+    from registers import RegisterVM
+
+    programs = {
+        "fib(18)": FIB.format(n=18) + "write(r);\n",
+        "while": LOOPS["while"].format(n=20000),
+        "for, break and continue": LOOPS["for, break and continue"].format(n=20000),
+        "constants": "var x = 3;\n" + "var y = x * (2 * 3.5) + (10 - 4 / 2) - (1 + 2) * 4; if 2 > 1 { y = y + 1; } else { y = y - 1; }\n" * 500 + "write(y);\n",
+        "variables": ENGINE_PROGRAMS["variables"],
+        "locals": ENGINE_PROGRAMS["locals"],
+    }
+    for name, code in programs.items():
+        program, source = parse(code)
+        peephole = Peephole()
+        vms = {}
+        sizes = {}
+        for variant in ("stack", "peephole"):
+            compiler = Compiler()
+            compiler.visit(program)
+            if variant == "peephole":
+                peephole.optimize(compiler)
+            vms[variant] = VM(ObjectFile.from_compiler(compiler), source)
+        sizes["stack"] = peephole.before
+        sizes["peephole"] = peephole.after
+        compiler = RegisterCompiler()
+        start = time.perf_counter()
+        main = compiler.translate(program)
+        elapsed = time.perf_counter() - start
+        prototypes = [main] + compiler.functions
+        vms["registers"] = RegisterVM(main, compiler.functions, source)
+        sizes["registers"] = sum(len(prototype.code) for prototype in prototypes)
+        temps = sum(prototype.temps for prototype in prototypes)
+        registers = sum(prototype.registers for prototype in prototypes)
+        print(f"{name}: {temps} temporaries in {registers} registers, compiled in {elapsed * 1000:.2f} ms")
+
+        outputs = set()
+        for variant, vm in vms.items():
+            def execute():
+                output = io.StringIO()
+                with contextlib.redirect_stdout(output):
+                    values, error = vm.run()
+                if error:
+                    sys.exit(error.as_string())
+                outputs.add((output.getvalue(), tuple(values)))
+            execute()
+            dispatches = vm.instruction_count()
+            elapsed = best_of(args.repeat, execute)
+            print(f"  {variant:<9} {sizes[variant]:8,} instructions  {elapsed * 1000:9.2f} ms  {dispatches:10,} instructions run")
+        if len(outputs) != 1:
+            sys.exit(f"the register VM and the stack VM disagree on {name}")
+
+
+def bench_incremental(args):
+    from parser_ import Parser
+    from incremental import Document
+
+    code = generate_program(args.lines)
+
+    def full():
+        tokens, errors = Lexer(code, "bench").tokenize()
+        Parser(tokens).parse_program()
+
+    print(f"{args.lines} lines, {len(code)} chars")
+    print(f"  full lex + parse   {best_of(args.repeat, full) * 1000:9.2f} ms")
+
+    start = time.perf_counter()
+    document = Document(code, "bench")
+    print(f"  Document()         {(time.perf_counter() - start) * 1000:9.2f} ms")
+
+    # Typing " + 1" into an expression and deleting it again, at a few
+    # places in the file, then edits that jump between both ends of it.
+    def typing(offset):
+        edits = [(offset + i, 0, char) for i, char in enumerate(" + 1")]
+        edits += [(offset + i, 1, "") for i in reversed(range(4))]
+        return edits
+
+    sessions = {}
+    for fraction in (0.1, 0.5, 0.9):
+        offset = code.index(";", int(len(code) * fraction))
+        sessions[f"typing at {int(fraction * 100)}%"] = typing(offset) * 10
+    head, tail = code.index(";"), code.rindex(";")
+    sessions["jumping ends"] = [(head, 0, "1"), (tail + 1, 0, "1"), (tail + 1, 1, ""), (head, 1, "")] * 10
+
+    for name, edits in sessions.items():
+        times = []
+        for offset, deleted, inserted in edits:
+            start = time.perf_counter()
+            document.edit(offset, deleted, inserted)
+            times.append(time.perf_counter() - start)
+        print(f"  {name:<17} {sum(times) / len(times) * 1000:9.2f} ms/edit  (max {max(times) * 1000:.2f} ms)")
+
+    if document.text != code or document.errors:
+        sys.exit("edits did not restore the original program")
+
+
+NATIVE_PROGRAMS = {
+    "fib(22)": FIB.format(n=22) + "write(r);\n",
+    "for loop": LOOPS["for"].format(n=200000),
+    "nested loops": "var s = 0;\nfor i = 0, 400 {\n  var j = 0;\n  while j < i { s = s + i * j / 3; j = j + 1; }\n}\nwrite(s);\n",
+}
+
+
+def bench_native(args):
+    from native import CGenerator, build
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, code in NATIVE_PROGRAMS.items():
+            program, source = parse(code)
+            c_path = os.path.join(directory, "program.c")
+            executable = os.path.join(directory, "program")
+            with open(c_path, "w") as f:
+                f.write(CGenerator(source).generate(program))
+            start = time.perf_counter()
+            error = build(c_path, executable)
+            if error:
+                sys.exit(error)
+            print(f"{name}: built in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+            outputs = set()
+
+            def interpret(engine):
+                execute = run_engine(engine, program, source)
+
+                def run():
+                    output, result, error, context = execute()
+                    if error:
+                        sys.exit(error.as_string())
+                    outputs.add(output)
+                return run
+
+            def execute_native():
+                # Includes starting the process.
+                outputs.add(subprocess.run([executable], capture_output=True, text=True, check=True).stdout)
+
+            engines = {
+                "tree": interpret("tree"),
+                "unboxed": interpret("unboxed"),
+                "native": execute_native,
+            }
+            times = {}
+            for engine, execute in engines.items():
+                times[engine] = best_of(args.repeat, execute)
+                print(f"  {engine:<8} {times[engine] * 1000:9.2f} ms  {times['tree'] / times[engine]:8.1f}x tree")
+            if len(outputs) != 1:
+                sys.exit(f"engines disagree on {name}")
+
+
+def bench_transpile(args):
+    from transpile import CodeCache
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, code in NATIVE_PROGRAMS.items():
+            program, source = parse(code)
+            cache = CodeCache(directory)
+            Transpiler(cache).compile(program)
+            transpiled = best_of(args.repeat, lambda: Transpiler().compile(program))
+            cached = best_of(args.repeat, lambda: Transpiler(cache).compile(program))
+            print(f"{name}: transpiled in {transpiled * 1000:.2f} ms, {cached * 1000:.2f} ms from the cache")
+
+            outputs = set()
+            times = {}
+            for engine in ("tree", "unboxed", "transpile"):
+                execute = run_engine(engine, program, source)
+                runs = []
+                times[engine] = best_of(args.repeat, lambda: runs.append(execute()))
+                if runs[-1].error:
+                    sys.exit(runs[-1].error.as_string())
+                outputs.add(runs[-1].output)
+                print(f"  {engine:<9} {times[engine] * 1000:9.2f} ms  {times['tree'] / times[engine]:8.1f}x tree")
+            if len(outputs) != 1:
+                sys.exit(f"engines disagree on {name}")
+
+
+BENCHMARKS = {
+    "allocations": bench_allocations,
+    "arena": bench_arena,
+    "cache": bench_cache,
+    "calls": bench_calls,
+    "dispatch": bench_dispatch,
+    "engines": bench_engines,
+    "incremental": bench_incremental,
+    "lexer": bench_lexer,
+    "loops": bench_loops,
+    "memory": bench_memory,
+    "native": bench_native,
+    "optimizer": bench_optimizer,
+    "parser": bench_parser,
+    "peephole": bench_peephole,
+    "registers": bench_registers,
+    "stream": bench_stream,
+    "transpile": bench_transpile,
+    "vm": bench_vm,
+}
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Micro benchmarks for the language pipeline")
+    arg_parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    arg_parser.add_argument("--lines", type=int, default=20000)
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    arg_parser.add_argument("--tree", help="checkout to measure instead of this one")
+    args = arg_parser.parse_args()
+
+    BENCHMARKS[args.benchmark](args)
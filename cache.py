@@ -0,0 +1,261 @@
+import os
+import marshal
+import hashlib
+import tempfile
+
+from token_ import Token
+from ast import *
+from collector import paused_gc
+
+# Bump LANGUAGE_VERSION whenever the lexer or parser would build a different
+# tree for the same text, and FORMAT_VERSION whenever the encoding below
+# changes. Both are part of the cache key, so old entries are never read.
+LANGUAGE_VERSION = 2
+FORMAT_VERSION = 1
+
+MAGIC = b"OASAST"
+HEADER = MAGIC + bytes((FORMAT_VERSION,))
+
+DEFAULT_DIRECTORY = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "oas", "ast"
+)
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+
+###################
+# Encoding
+###################
+# A tree is written as a flat list in post-order: every entry is an op code
+# followed by its inline operands, and the children of a node come before
+# it. Reading it back only needs a value stack, so neither side recurses and
+# marshal never sees nesting deeper than one list.
+NONE = 0  # push None
+VALUE = 1  # push the next entry (a name or other plain value)
+TOKEN = 2  # type, value, start, end
+LIST = 3  # length; pops that many values
+PROGRAM = 4  # pops the statement list
+BLOCK = 5  # start, end; pops the statement list
+LEAF = 6  # node tag, token type, value, start, token end, node end
+FIRST_NODE = 7  # start, end; pops the fields in NODE_FIELDS order
+
+# Node classes from FIRST_NODE on and the attributes passed to their
+# constructors, in order, before the two positions.
+NODE_FIELDS = [
+    (ConstAssignNode, ("const_name", "const_value")),
+    (VarAssignNode, ("var_name", "var_value")),
+    (ReturnNode, ("return_value",)),
+    (NumberNode, ("tok",)),
+    (StringNode, ("tok",)),
+    (IdentifierNode, ("tok",)),
+    (ListNode, ("elements",)),
+    (SetNode, ("elements",)),
+    (BinaryOperationNode, ("left_node", "operation_tok", "right_node")),
+    (UnaryOperationNode, ("operation_tok", "node")),
+    (IfNode, ("if_condition", "if_block_statement", "elif_conditions", "elif_block_statements", "else_block_statement")),
+    (ArgNode, ("args",)),
+    (FunctionNode, ("name", "arg_node", "code_block")),
+    (CallNode, ("operand", "arg_node")),
+    (IndexNode, ("operand", "index_expr")),
+    (WhileNode, ("condition", "block")),
+    (ForNode, ("var_name", "start_value", "end_value", "step_value", "block")),
+    (BreakNode, ()),
+    (ContinueNode, ()),
+]
+NODE_CLASSES = [node_class for node_class, fields in NODE_FIELDS]
+NODE_ARITY = [len(fields) for node_class, fields in NODE_FIELDS]
+NODE_TAGS = {node_class: FIRST_NODE + i for i, node_class in enumerate(NODE_CLASSES)}
+# Nodes that wrap a single token starting where they start.
+LEAF_CLASSES = frozenset((NumberNode, StringNode, IdentifierNode))
+
+
+def encode_tree(root):
+    out = []
+    emit = out.append
+    work = [(False, root)]
+    while work:
+        done, item = work.pop()
+        if done:
+            out.extend(item)
+        elif item is None:
+            emit(NONE)
+        elif isinstance(item, Token):
+            out.extend((TOKEN, item.type, item.value, item.position_start, item.position_end))
+        elif isinstance(item, list):
+            work.append((True, (LIST, len(item))))
+            work.extend((False, child) for child in reversed(item))
+        elif isinstance(item, Program):
+            work.append((True, (PROGRAM,)))
+            work.append((False, item.statements))
+        elif isinstance(item, Block):
+            work.append((True, (BLOCK, item.position_start, item.position_end)))
+            work.append((False, item.statements))
+        elif type(item) in LEAF_CLASSES and isinstance(item.tok, Token) and item.tok.position_start == item.position_start:
+            tok = item.tok
+            out.extend((LEAF, NODE_TAGS[type(item)], tok.type, tok.value, tok.position_start, tok.position_end, item.position_end))
+        elif type(item) in NODE_TAGS:
+            tag = NODE_TAGS[type(item)]
+            work.append((True, (tag, item.position_start, item.position_end)))
+            for name in reversed(NODE_FIELDS[tag - FIRST_NODE][1]):
+                work.append((False, getattr(item, name)))
+        else:
+            emit(VALUE)
+            emit(item)
+    return out
+
+
+def decode_tree(data):
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    classes = NODE_CLASSES
+    arity = NODE_ARITY
+    i = 0
+    count = len(data)
+    while i < count:
+        op = data[i]
+        if op >= FIRST_NODE:
+            n = arity[op - FIRST_NODE]
+            if n:
+                fields = stack[-n:]
+                del stack[-n:]
+            else:
+                fields = ()
+            push(classes[op - FIRST_NODE](*fields, data[i + 1], data[i + 2]))
+            i += 3
+        elif op == LEAF:
+            start = data[i + 4]
+            push(classes[data[i + 1] - FIRST_NODE](Token(data[i + 2], data[i + 3], start, data[i + 5]), start, data[i + 6]))
+            i += 7
+        elif op == TOKEN:
+            push(Token(data[i + 1], data[i + 2], data[i + 3], data[i + 4]))
+            i += 5
+        elif op == LIST:
+            n = data[i + 1]
+            if n:
+                items = stack[-n:]
+                del stack[-n:]
+            else:
+                items = []
+            push(items)
+            i += 2
+        elif op == NONE:
+            push(None)
+            i += 1
+        elif op == VALUE:
+            push(data[i + 1])
+            i += 2
+        elif op == BLOCK:
+            node = Block(data[i + 1], data[i + 2])
+            node.statements = pop()
+            push(node)
+            i += 3
+        elif op == PROGRAM:
+            node = Program()
+            node.statements = pop()
+            push(node)
+            i += 1
+        else:
+            raise ValueError(f"bad op code {op} at {i}")
+    if len(stack) != 1:
+        raise ValueError("truncated tree")
+    return stack[0]
+
+
+###################
+# ParseCache
+###################
+class ParseCache(object):
+    """Parsed programs stored on disk, keyed by a hash of their source.
+
+    Entries are files named after the key. A hit touches its file, and
+    `store` removes the least recently used entries once the directory
+    grows past `max_size` bytes. Unreadable or stale entries count as
+    misses. Subclasses cache other things by overriding `key`, `encode`
+    and `decode` along with the file `suffix` and `header`.
+    """
+    suffix = ".ast"
+    header = HEADER
+
+    def __init__(self, _directory=None, _max_size=DEFAULT_MAX_SIZE):
+        self.directory = _directory or DEFAULT_DIRECTORY
+        self.max_size = _max_size
+
+    def key(self, code):
+        digest = hashlib.sha256(f"{LANGUAGE_VERSION}.{FORMAT_VERSION}\0".encode())
+        digest.update(code.encode("utf-8", "surrogatepass"))
+        return digest.hexdigest()
+
+    def path(self, code):
+        return os.path.join(self.directory, self.key(code) + self.suffix)
+
+    def encode(self, program):
+        with paused_gc():
+            return marshal.dumps(encode_tree(program))
+
+    def decode(self, data):
+        with paused_gc():
+            return decode_tree(marshal.loads(data))
+
+    def load(self, code):
+        path = self.path(code)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        try:
+            if not data.startswith(self.header):
+                raise ValueError("bad header")
+            value = self.decode(data[len(self.header):])
+        except (ValueError, EOFError, TypeError, IndexError):
+            self.discard(path)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def store(self, code, value):
+        data = self.header + self.encode(value)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        except OSError:
+            return False
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, self.path(code))
+        except OSError:
+            # Leave no partial file in the cache.
+            self.discard(temp_path)
+            return False
+        self.evict()
+        return True
+
+    def evict(self):
+        entries = []
+        total = 0
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if not entry.name.endswith(self.suffix):
+                        continue
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+        except OSError:
+            return
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            self.discard(path)
+            total -= size
+
+    def discard(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
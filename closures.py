@@ -0,0 +1,492 @@
+from errors import RTError
+from token_ import *
+from ast import *
+from visitor import Visitor
+from resolver import Resolver
+from optimizer import children
+from collector import paused_gc
+from interpreter import Interpreter, Function, Number, NoneType, global_vars, BREAK, CONTINUE, loop_stops, loop_range, truth
+
+# Value a call returns when its body never reached a `return`: the tree
+# walker hands back Interpreter's shared default.
+NO_RETURN = Interpreter.return_value
+
+
+###################
+# ClosureCompiler
+###################
+class ClosureCompiler(Visitor):
+    """Turns a tree into nested Python closures, one per node.
+
+    Each closure takes a Context and returns (value, error) exactly like
+    the matching Interpreter.visit_* method, but the choices the tree
+    walker makes on every run (which operator, how to read a literal,
+    whether there are elif or else branches) are made once here. The value
+    of the innermost `return` is kept on the running context, which plays
+    the part of the tree walker's per-call Interpreter.
+
+    Variables live in `context.frame`, a list laid out by resolver.Resolver,
+    so reading or assigning one is a list index, and names from enclosing
+    functions are reached through `context.parent`. The program's frame
+    starts with the values the context's symbol table has for the names in
+    interpreter.global_vars, and the symbol table is not updated afterwards.
+    """
+    def visit(self, node):
+        func = self.handlers.get(type(node))
+        if func is None:
+            func = self.handler(type(node))
+        return func(self, node)
+
+    def compile(self, node):
+        """A function that runs `node` in a given context."""
+        closure = self.build(node)
+        names = self.resolver.scopes[node].names
+
+        def run(context):
+            symbols = context.symbol_table.symbols
+            context.frame = [symbols.get(name) for name in names]
+            context.return_value = NO_RETURN
+            return closure(context)
+        return run
+
+    def run(self, node, context):
+        """Compile `node` and run it in `context`."""
+        return self.compile(node)(context)
+
+    def build(self, node):
+        """Resolve the variables under `node` and make its closure."""
+        with paused_gc():
+            self.resolver = Resolver().resolve(node, global_vars)
+            return self.visit(node)
+
+    def no_visit_method(self, node):
+        # The tree walker only fails once it reaches the node.
+        message = f"No visit method for {type(node).__name__}"
+
+        def unsupported(context):
+            raise NotImplementedError(message)
+        return unsupported
+
+    def visit_Program(self, node):
+        return self.compile_statements(node.statements)
+
+    def visit_Block(self, node):
+        return self.compile_statements(node.statements)
+
+    def compile_statements(self, statements):
+        statements = [self.visit(stmt) for stmt in statements]
+
+        def run_statements(context):
+            res = []
+            for stmt in statements:
+                value, error = stmt(context)
+                if error:
+                    return None, error
+                if not isinstance(context.return_value, NoneType):
+                    break
+                res.append(value.repr())
+            return res, None
+        return run_statements
+
+    def visit_NumberNode(self, node):
+        literal = node.tok.value
+        literal = int(literal) if str(int(literal)) == literal else float(literal)
+        position_start = node.position_start
+        position_end = node.position_end
+
+        def number(context):
+            return Number(literal).set_context(context).set_pos(position_start, position_end), None
+        return number
+
+    def visit_IdentifierNode(self, node):
+        name = node.tok.value
+        address = self.resolver.addresses[node]
+        depth, slot = address[0]
+        position_start = node.position_start
+        position_end = node.position_end
+
+        outer = address[1:]
+        if depth == 0 and outer:
+            # Look outside only when the name is not set here.
+            def identifier(context):
+                value = context.frame[slot]
+                if value is None:
+                    for depth, outer_slot in outer:
+                        value = frame_of(context, depth)[outer_slot]
+                        if value is not None:
+                            return value, None
+                    return None, RTError(f"Name {name} does not exist", position_start, position_end, context)
+                return value, None
+        elif outer:
+            def identifier(context):
+                for depth, slot in address:
+                    value = frame_of(context, depth)[slot]
+                    if value is not None:
+                        return value, None
+                return None, RTError(f"Name {name} does not exist", position_start, position_end, context)
+        elif depth == 0:
+            def identifier(context):
+                value = context.frame[slot]
+                if value is None:
+                    return None, RTError(f"Name {name} does not exist", position_start, position_end, context)
+                return value, None
+        else:
+            def identifier(context):
+                value = frame_of(context, depth)[slot]
+                if value is None:
+                    return None, RTError(f"Name {name} does not exist", position_start, position_end, context)
+                return value, None
+        return identifier
+
+    def visit_UnaryOperationNode(self, node):
+        operand = self.visit(node.node)
+        operation_tok = node.operation_tok
+
+        def unary(context):
+            value, error = operand(context)
+            if error:
+                return None, error
+            return value.unary(operation_tok)
+        return unary
+
+    def visit_BinaryOperationNode(self, node):
+        left = self.visit(node.left_node)
+        right = self.visit(node.right_node)
+        make = BINARY_OPERATIONS[node.operation_tok.type]
+        return make(left, right, node.position_start, node.position_end)
+
+    def visit_VarAssignNode(self, node):
+        return self.assignment(node.var_name, node.var_value)
+
+    def visit_ConstAssignNode(self, node):
+        return self.assignment(node.const_name, node.const_value)
+
+    def assignment(self, name_node, value_node):
+        value_closure = self.visit(value_node)
+        # The first entry is always this scope's own slot.
+        address = self.resolver.addresses[name_node]
+        slot = address[0][1]
+        outer = address[1:]
+
+        if outer:
+            def assign(context):
+                value, error = value_closure(context)
+                if error:
+                    return None, error
+                frame = context.frame
+                if frame[slot] is None:
+                    for depth, outer_slot in outer:
+                        outer_frame = frame_of(context, depth)
+                        if outer_frame[outer_slot] is not None:
+                            outer_frame[outer_slot] = value
+                            return NoneType(), None
+                frame[slot] = value
+                return NoneType(), None
+        else:
+            def assign(context):
+                value, error = value_closure(context)
+                if error:
+                    return None, error
+                context.frame[slot] = value
+                return NoneType(), None
+        return assign
+
+    def visit_FunctionNode(self, node):
+        name = "anonymous"
+        position_start = node.position_start
+        position_end = node.position_end
+        arg_node = node.arg_node
+        if not isinstance(arg_node, IdentifierNode):
+            def bad_argument(context):
+                return None, RTError("Function argument must be an identifier", arg_node.position_start, arg_node.position_end, context)
+            return bad_argument
+
+        arg_names = [arg_node.tok.value]
+        code_node = node.code_block
+        body = self.visit(code_node)
+        scope = self.resolver.scopes[node]
+
+        def function(context):
+            return Function(name, arg_names, code_node, body, scope).set_context(context).set_pos(position_start, position_end), None
+        return function
+
+    def visit_CallNode(self, node):
+        operand = self.visit(node.operand)
+        args = [self.visit(arg) for arg in node.arg_node.args]
+        position_start = node.position_start
+        position_end = node.position_end
+
+        def call(context):
+            value, error = operand(context)
+            if error:
+                return None, error
+            value = value.set_pos(position_start, position_end)
+            arg_values = []
+            for arg in args:
+                v, error = arg(context)
+                if error:
+                    return None, error
+                arg_values.append(v)
+
+            return_value, error = value.execute(arg_values)
+            if error:
+                return None, error
+            return return_value, None
+        return call
+
+    def visit_ReturnNode(self, node):
+        value_closure = self.visit(node.return_value)
+
+        def return_(context):
+            value, error = value_closure(context)
+            if error:
+                return None, error
+            context.return_value = value
+            return value, None
+        return return_
+
+    def visit_IfNode(self, node):
+        # (condition closure, condition node, block closure) of the if and
+        # each elif, in order.
+        branches = [(self.visit(node.if_condition), node.if_condition, self.visit(node.if_block_statement))]
+        for condition, block in zip(node.elif_conditions or (), node.elif_block_statements or ()):
+            branches.append((self.visit(condition), condition, self.visit(block)))
+        else_block = self.visit(node.else_block_statement) if node.else_block_statement else None
+
+        def if_(context):
+            for condition, condition_node, block in branches:
+                value, error = condition(context)
+                if error:
+                    return None, error
+                true, error = truth(value, condition_node, context)
+                if error:
+                    return None, error
+                if true:
+                    res, error = block(context)
+                    if error:
+                        return None, error
+                    return NoneType(), None
+            if else_block is not None:
+                res, error = else_block(context)
+                if error:
+                    return None, error
+
+            return NoneType(), None
+        return if_
+
+    def visit_WhileNode(self, node):
+        condition = self.visit(node.condition)
+        condition_node = node.condition
+        body = self.compile_loop_body(node.block)
+        leaves = can_leave(node.block)
+
+        def while_(context):
+            while True:
+                value, error = condition(context)
+                if error:
+                    return None, error
+                true, error = truth(value, condition_node, context)
+                if error:
+                    return None, error
+                if not true:
+                    break
+                error = body(context)
+                if error:
+                    return None, error
+                if leaves and context.return_value is not NO_RETURN and loop_stops(context):
+                    break
+            return NoneType(), None
+        return while_
+
+    def visit_ForNode(self, node):
+        bounds = [self.visit(node.start_value), self.visit(node.end_value)]
+        if node.step_value is not None:
+            bounds.append(self.visit(node.step_value))
+        body = self.compile_loop_body(node.block)
+        leaves = can_leave(node.block)
+        address = self.resolver.addresses[node.var_name]
+        slot = address[0][1]
+        outer = address[1:]
+        position_start = node.var_name.position_start
+        position_end = node.var_name.position_end
+
+        def for_(context):
+            values = []
+            for bound in bounds:
+                value, error = bound(context)
+                if error:
+                    return None, error
+                values.append(value.value if type(value) is Number else value)
+            if len(values) == 2:
+                values.append(1)
+            numbers, error = loop_range(*values, node, context)
+            if error:
+                return None, error
+            if numbers:
+                # The name is assigned before every iteration, always in the
+                # same frame.
+                frame, frame_slot = assignment_target(context, slot, outer)
+                for i in numbers:
+                    frame[frame_slot] = Number(i).set_context(context).set_pos(position_start, position_end)
+                    error = body(context)
+                    if error:
+                        return None, error
+                    if leaves and context.return_value is not NO_RETURN and loop_stops(context):
+                        break
+            return NoneType(), None
+        return for_
+
+    def compile_loop_body(self, block):
+        # Like compile_statements, but the values are not kept, so a run
+        # returns just the error. Only statements that can end the
+        # iteration need the check after them.
+        statements = [(self.visit(stmt), can_leave(stmt)) for stmt in block.statements]
+
+        def run_body(context):
+            for stmt, leaves in statements:
+                value, error = stmt(context)
+                if error:
+                    return error
+                if leaves and not isinstance(context.return_value, NoneType):
+                    break
+            return None
+        return run_body
+
+    def visit_BreakNode(self, node):
+        def break_(context):
+            context.return_value = BREAK
+            return BREAK, None
+        return break_
+
+    def visit_ContinueNode(self, node):
+        def continue_(context):
+            context.return_value = CONTINUE
+            return CONTINUE, None
+        return continue_
+
+
+def can_leave(node):
+    """Whether running `node` can end a loop iteration early, that is, it
+    has a `return`, `break` or `continue` outside the functions in it."""
+    if isinstance(node, (ReturnNode, BreakNode, ContinueNode)):
+        return True
+    if isinstance(node, FunctionNode):
+        return False
+    for child in children(node):
+        if can_leave(child):
+            return True
+    return False
+
+
+def assignment_target(context, slot, outer):
+    """The frame and slot an assignment to a name writes to, as in
+    ClosureCompiler.assignment."""
+    frame = context.frame
+    if frame[slot] is None:
+        for depth, outer_slot in outer:
+            outer_frame = frame_of(context, depth)
+            if outer_frame[outer_slot] is not None:
+                return outer_frame, outer_slot
+    return frame, slot
+
+
+def frame_of(context, depth):
+    # A function's context has the context it was defined in as parent.
+    for _ in range(depth):
+        context = context.parent
+    return context.frame
+
+
+###################
+# Binary operations
+###################
+# One factory per operator, so the closure calls the operation directly.
+def make_add(left, right, position_start, position_end):
+    def add(context):
+        left_value, error = left(context)
+        if error:
+            return None, error
+        right_value, error = right(context)
+        if error:
+            return None, error
+        result, error = left_value.add(right_value)
+        if error:
+            return None, error
+        return result.set_pos(position_start, position_end), None
+    return add
+
+
+def make_sub(left, right, position_start, position_end):
+    def sub(context):
+        left_value, error = left(context)
+        if error:
+            return None, error
+        right_value, error = right(context)
+        if error:
+            return None, error
+        result, error = left_value.sub(right_value)
+        if error:
+            return None, error
+        return result.set_pos(position_start, position_end), None
+    return sub
+
+
+def make_mul(left, right, position_start, position_end):
+    def mul(context):
+        left_value, error = left(context)
+        if error:
+            return None, error
+        right_value, error = right(context)
+        if error:
+            return None, error
+        result, error = left_value.mul(right_value)
+        if error:
+            return None, error
+        return result.set_pos(position_start, position_end), None
+    return mul
+
+
+def make_div(left, right, position_start, position_end):
+    def div(context):
+        left_value, error = left(context)
+        if error:
+            return None, error
+        right_value, error = right(context)
+        if error:
+            return None, error
+        result, error = left_value.div(right_value)
+        if error:
+            return None, error
+        return result.set_pos(position_start, position_end), None
+    return div
+
+
+def make_comparison(method):
+    def make(left, right, position_start, position_end):
+        def compare(context):
+            left_value, error = left(context)
+            if error:
+                return None, error
+            right_value, error = right(context)
+            if error:
+                return None, error
+            result, error = method(left_value, right_value)
+            if error:
+                return None, error
+            return result.set_pos(position_start, position_end), None
+        return compare
+    return make
+
+
+BINARY_OPERATIONS = {
+    PLUS: make_add,
+    MINUS: make_sub,
+    ASTERISK: make_mul,
+    SLASH: make_div,
+    LESS_THAN: make_comparison(lambda left, right: left.lt(right)),
+    GREATER_THAN: make_comparison(lambda left, right: left.gt(right)),
+    LESS_THAN_OR_EQUAL: make_comparison(lambda left, right: left.lt_or_eq(right)),
+    GREATER_THAN_OR_EQUAL: make_comparison(lambda left, right: left.gt_or_eq(right)),
+    DOUBLE_EQUAL: make_comparison(lambda left, right: left.eq(right)),
+    NOT_EQUAL: make_comparison(lambda left, right: left.ne(right)),
+}
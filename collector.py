@@ -0,0 +1,23 @@
+import gc
+from contextlib import contextmanager
+
+
+###################
+# Collector
+###################
+@contextmanager
+def paused_gc():
+    """Pause the cyclic garbage collector for the body of the `with`.
+
+    For code that makes many objects that never form reference cycles,
+    such as tokens, tree nodes and closures, which the collector would
+    otherwise rescan again and again while they are made. It is enabled
+    again afterwards only if it was enabled before.
+    """
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
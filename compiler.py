@@ -1,4 +1,10 @@
 from token_ import *
+from ast import *
+from visitor import Visitor
+from resolver import Resolver, Scope
+from interpreter import global_vars
+from objfile import VARIABLE_BASE, CONSTANT_BASE, STRING_BASE, ADDRESS_END
+from vm import *
 
 class Variable(object):
     def __init__(self, type, data, address):
@@ -12,54 +18,409 @@ class Constant(object):
         self.data = data
         self.address = address
 
-class Compiler(object):
-    code = []
+class Loop(object):
+    # Where `continue` goes, the jumps `break` leaves to be patched, and
+    # whether an iterator is on the stack for `break` to pop.
+    def __init__(self, start, iterates):
+        self.start = start
+        self.breaks = []
+        self.iterates = iterates
 
-    variables = {}
-    constants = {}
+class Compiler(Visitor):
+    """Compiles a tree to bytecode for vm.VM.
+
+    Every instance starts from empty state. Integer literals that fit in 16
+    bits are pushed as immediates; other numbers go to the constant pool,
+    one entry per distinct value, and are pushed by address. String
+    literals, and the names of variables for the error when one is not
+    set, go to the string pool the same way. `positions` holds the source
+    range of each instruction that can fail at run time, as (offset,
+    start, end), for error messages.
+
+    Names are resolved with resolver.Resolver. The program's variables are
+    in `variables`, at addresses from VARIABLE_BASE by slot; a function's are in
+    the slots of its frame, and those of the functions around it are
+    reached by how many frames out they are. A name that may be in more
+    than one place is looked for in each in turn. Function bodies are
+    compiled where they are defined, jumped over, and listed in
+    `functions` as (offset, slot count, argument slot). Jumps forward are
+    patched once their target is known.
+
+    The values of the program's expression statements are left on the
+    stack; inside blocks and functions they are popped.
+    """
+    def __init__(self):
+        self.code = bytearray()
+
+        self.variables = {}
+        self.constants = {}
+        self.strings = {}
+        self.functions = []
+        self.positions = []
+
+        self.last_variable_address = VARIABLE_BASE
+        self.last_constant_address = CONSTANT_BASE
+        self.last_string_address = STRING_BASE
+
+        self.resolver = None
+        self.scope = None
+        self.root = None
+        self.loops = []
 
-    last_variable_address = 0x2000
-    last_constant_address = 0x3000
-    
     def visit(self, node):
-        func = getattr(self, "visit_" + type(node).__name__, self.no_visit_method)
-        func(node)
+        func = self.handlers.get(type(node))
+        if func is None:
+            func = self.handler(type(node))
+        func(self, node)
 
-    def no_visit_method(self, node):
-        raise NotImplementedError(f"No visit method for {type(node).__name__}")
-    
     def visit_Program(self, node):
+        self.resolver = Resolver().resolve(node, global_vars)
+        self.scope = self.root = self.resolver.scopes[node]
+        self.add_variables()
+        for stmt in node.statements:
+            self.statement(stmt, True)
+
+        self.add8bit(HALT)
+
+    def compile_statement(self, stmt):
+        """Compile `stmt` as the next statement of the program, for code
+        that is compiled as it is parsed. `finish` ends the program."""
+        if self.root is None:
+            self.resolver = Resolver()
+            self.scope = self.root = Scope(None)
+            for name in global_vars:
+                self.root.declare(name)
+        self.resolver.resolve(stmt, root=self.root)
+        self.add_variables()
+        self.statement(stmt, True)
+
+    def finish(self):
+        if self.root is not None:
+            self.add_variables()
+        self.add8bit(HALT)
+
+    def add_variables(self):
+        for name in self.root.names[len(self.variables):]:
+            check_address(self.last_variable_address, VARIABLE_BASE, CONSTANT_BASE, "variables")
+            self.variables[name] = Variable(IDENTIFIER, name, self.last_variable_address)
+            self.last_variable_address += 1
+
+    ###################
+    # Statements
+    ###################
+    def statement(self, stmt, top_level=False):
+        self.visit(stmt)
+        if not top_level and not isinstance(stmt, STATEMENTS):
+            self.add8bit(POP)
+
+    def visit_Block(self, node):
         for stmt in node.statements:
-            self.visit(stmt)
+            self.statement(stmt)
+
+    def visit_VarAssignNode(self, node):
+        self.visit(node.var_value)
+        self.store(node.var_name)
+
+    def visit_ConstAssignNode(self, node):
+        self.visit(node.const_value)
+        self.store(node.const_name)
+
+    def visit_ReturnNode(self, node):
+        # A `return` whose value is none does not end the body; RETURN
+        # checks.
+        self.visit(node.return_value)
+        self.add8bit(RETURN)
+
+    def visit_IfNode(self, node):
+        # Each condition jumps to the next when false; each block jumps to
+        # the end, except the last one there is.
+        conditions = [node.if_condition] + (node.elif_conditions or [])
+        blocks = [node.if_block_statement] + (node.elif_block_statements or [])
+        to_end = []
+        for i, (condition, block) in enumerate(zip(conditions, blocks)):
+            to_next = self.condition(condition)
+            self.visit(block)
+            if i < len(conditions) - 1 or node.else_block_statement:
+                to_end.append(self.jump(JUMP))
+            self.patch(to_next)
+        if node.else_block_statement:
+            self.visit(node.else_block_statement)
+        for operand in to_end:
+            self.patch(operand)
+
+    def condition(self, node):
+        """Jump past what follows when `node` is false; returns what to
+        `patch`. The jump fails if the value is not a number."""
+        self.visit(node)
+        self.mark(node)
+        return self.jump(JUMP_IF_FALSE)
+
+    def visit_WhileNode(self, node):
+        start = len(self.code)
+        to_end = self.condition(node.condition)
+        self.loop_body(node.block, start, False)
+        self.add8bit(JUMP)
+        self.add32bit(start)
+        self.patch(to_end)
+        self.patch_breaks()
+
+    def visit_ForNode(self, node):
+        bounds = [node.start_value, node.end_value, node.step_value]
+        for bound in bounds:
+            if bound is None:
+                self.add8bit(PUSH16)
+                self.add16bit(1)
+            else:
+                self.visit(bound)
+        # Every bound is evaluated before any is checked. The default step
+        # is checked too, which only makes it an int.
+        for depth, bound in zip((2, 1, 0), bounds):
+            if bound is not None:
+                self.mark(bound)
+            self.add8bit(CHECK_BOUND)
+            self.add8bit(depth)
+        if node.step_value is not None:
+            self.mark(node.step_value)
+        self.add8bit(FOR_PREP)
+        start = len(self.code)
+        to_end = self.jump(FOR_ITER)
+        self.store(node.var_name)
+        self.loop_body(node.block, start, True)
+        self.add8bit(JUMP)
+        self.add32bit(start)
+        self.patch(to_end)
+        self.patch_breaks()
+
+    def loop_body(self, block, start, iterates):
+        self.loops.append(Loop(start, iterates))
+        self.visit(block)
+
+    def patch_breaks(self):
+        for operand in self.loops.pop().breaks:
+            self.patch(operand)
 
-        self.add8bit(9)
+    def visit_BreakNode(self, node):
+        loop = self.loops[-1]
+        if loop.iterates:
+            self.add8bit(POP)
+        loop.breaks.append(self.jump(JUMP))
 
+    def visit_ContinueNode(self, node):
+        self.add8bit(JUMP)
+        self.add32bit(self.loops[-1].start)
+
+    ###################
+    # Expressions
+    ###################
     def visit_NumberNode(self, node):
-        self.add8bit(3)
-        self.add16bit(node.tok.value)
+        value = node.tok.value
+        if type(value) is int and 0 <= value <= 0xffff:
+            self.add8bit(PUSH16)
+            self.add16bit(value)
+        else:
+            self.add8bit(PUSHC)
+            self.add32bit(self.add_constant(FLOAT, float(value)).address)
 
-    def visit_IdentifierNode(self, node):
-        pass
-    
     def visit_StringNode(self, node):
-        pass
+        self.add8bit(PUSHS)
+        self.add32bit(self.add_string(node.tok.value).address)
+
+    def visit_IdentifierNode(self, node):
+        address = self.resolver.addresses[node]
+        name = self.add_string(node.tok.value).address
+        if len(address) == 1:
+            self.mark(node)
+            self.load(address[0], name)
+            return
+        # Try each place in turn and load from the first that is set.
+        found = []
+        for place in address:
+            self.load(place, NO_NAME)
+            found.append(self.jump(JUMP_IF_SET))
+        self.mark(node)
+        self.add8bit(ERROR)
+        self.add32bit(self.add_string(f"Name {node.tok.value} does not exist").address)
+        to_end = []
+        for i, place in enumerate(address):
+            if i:
+                to_end.append(self.jump(JUMP))
+            self.patch(found[i])
+            self.load(place, NO_NAME)
+        for operand in to_end:
+            self.patch(operand)
+
+    def visit_UnaryOperationNode(self, node):
+        self.visit(node.node)
+        self.mark(node)
+        if node.operation_tok.type == MINUS:
+            self.add8bit(NEG)
+        else:
+            # Anything but a minus fails; the VM makes the error.
+            self.add8bit(UNARY)
+            self.add8bit(node.operation_tok.type)
 
     def visit_BinaryOperationNode(self, node):
         self.visit(node.left_node)
         self.visit(node.right_node)
+        self.mark(node)
+        self.add8bit(BINARY_OPCODES[node.operation_tok.type])
+
+    def visit_FunctionNode(self, node):
+        if not isinstance(node.arg_node, IdentifierNode):
+            self.mark(node.arg_node)
+            self.add8bit(ERROR)
+            self.add32bit(self.add_string("Function argument must be an identifier").address)
+            return
+
+        scope = self.resolver.scopes[node]
+        over = self.jump(JUMP)
+        self.functions.append((len(self.code), len(scope.names), scope.arg_slots[0]))
+        index = len(self.functions) - 1
+        outer_scope, outer_loops = self.scope, self.loops
+        self.scope, self.loops = scope, []
+        self.visit(node.code_block)
+        self.add8bit(RETURN_NONE)
+        self.scope, self.loops = outer_scope, outer_loops
+        self.patch(over)
+        self.add8bit(MAKE_FUNCTION)
+        self.add32bit(index)
+
+    def visit_CallNode(self, node):
+        self.visit(node.operand)
+        for arg in node.arg_node.args:
+            self.visit(arg)
+        self.mark(node)
+        self.add8bit(CALL)
+        self.add8bit(len(node.arg_node.args))
+
+    ###################
+    # Variables
+    ###################
+    def place(self, depth, slot):
+        # (opcode kind, operands) of a slot `depth` scopes out.
+        scope = self.scope
+        for _ in range(depth):
+            scope = scope.parent
+        if scope is self.root:
+            return "global", check_address(VARIABLE_BASE + slot, VARIABLE_BASE, CONSTANT_BASE, "variables")
+        if depth == 0:
+            return "local", slot
+        return "outer", slot
+
+    def load(self, place, name):
+        depth, slot = place
+        kind, operand = self.place(depth, slot)
+        if kind == "global":
+            self.add8bit(LOAD_GLOBAL)
+        elif kind == "local":
+            self.add8bit(LOAD_LOCAL)
+        else:
+            self.add8bit(LOAD_OUTER)
+            self.add8bit(depth)
+        self.add32bit(operand)
+        self.add32bit(name)
+
+    def store_to(self, place):
+        depth, slot = place
+        kind, operand = self.place(depth, slot)
+        if kind == "global":
+            self.add8bit(STORE_GLOBAL)
+        elif kind == "local":
+            self.add8bit(STORE_LOCAL)
+        else:
+            self.add8bit(STORE_OUTER)
+            self.add8bit(depth)
+        self.add32bit(operand)
 
-        if node.operation_tok.type == PLUS:
-            self.add8bit(5)
-        elif node.operation_tok.type == MINUS:
-            self.add8bit(6)
-        elif node.operation_tok.type == ASTERISK:
-            self.add8bit(7)
-        elif node.operation_tok.type == SLASH:
-            self.add8bit(8)
+    def store(self, name_node):
+        # As closures.assignment_target: the name's own slot, unless it is
+        # unset and an enclosing scope has the name set.
+        address = self.resolver.addresses[name_node]
+        if len(address) == 1:
+            self.store_to(address[0])
+            return
+        found = []
+        for place in address:
+            self.load(place, NO_NAME)
+            found.append(self.jump(JUMP_IF_SET))
+        self.store_to(address[0])
+        to_end = []
+        for place, operand in zip(address, found):
+            to_end.append(self.jump(JUMP))
+            self.patch(operand)
+            self.store_to(place)
+        for operand in to_end:
+            self.patch(operand)
+
+    ###################
+    # Output
+    ###################
+    def add_constant(self, type, data):
+        # Keyed on the repr so that 0.0 and -0.0 stay apart.
+        key = (type, repr(data))
+        constant = self.constants.get(key)
+        if constant is None:
+            check_address(self.last_constant_address, CONSTANT_BASE, STRING_BASE, "constants")
+            constant = Constant(type, data, self.last_constant_address)
+            self.constants[key] = constant
+            self.last_constant_address += 1
+        return constant
+
+    def add_string(self, data):
+        string = self.strings.get(data)
+        if string is None:
+            check_address(self.last_string_address, STRING_BASE, ADDRESS_END, "strings")
+            string = Constant(STRING, data, self.last_string_address)
+            self.strings[data] = string
+            self.last_string_address += 1
+        return string
+
+    def jump(self, op):
+        """Add a jump to a target not known yet; returns what to `patch`."""
+        self.add8bit(op)
+        self.add32bit(0)
+        return len(self.code) - 4
+
+    def patch(self, operand):
+        """Point the jump added by `jump` at the end of the code."""
+        self.code[operand:operand + 4] = len(self.code).to_bytes(4, "big")
+
+    def mark(self, node):
+        position = (node.position_start, node.position_end)
+        if not self.positions or self.positions[-1][1:] != position:
+            self.positions.append((len(self.code),) + position)
 
     def add8bit(self, value):
-        self.code.append(str(value))
+        self.code.append(value)
 
     def add16bit(self, value):
-        self.code.append(str((value >> 8) & 0xff))
-        self.code.append(str(value & 0xff))
+        self.code.append((value >> 8) & 0xff)
+        self.code.append(value & 0xff)
+
+    def add32bit(self, value):
+        self.code += value.to_bytes(4, "big")
+
+
+def check_address(address, base, end, pool):
+    """`address` if it is inside the region [base, end) of `pool`."""
+    if address >= end:
+        raise ValueError(f"too many {pool}: an object file has room for {end - base}")
+    return address
+
+
+# Statements that leave nothing on the stack. A tuple for isinstance, so
+# that subclasses such as arena views count too.
+STATEMENTS = (VarAssignNode, ConstAssignNode, ReturnNode, IfNode, WhileNode, ForNode, BreakNode, ContinueNode)
+
+BINARY_OPCODES = {
+    PLUS: ADD,
+    MINUS: SUB,
+    ASTERISK: MUL,
+    SLASH: DIV,
+    LESS_THAN: LT,
+    GREATER_THAN: GT,
+    LESS_THAN_OR_EQUAL: LE,
+    GREATER_THAN_OR_EQUAL: GE,
+    DOUBLE_EQUAL: EQ,
+    NOT_EQUAL: NE,
+}
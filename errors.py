@@ -1,38 +1,49 @@
 ###################
 # Errors
 ###################
+def describe_location(source, position):
+    if source is None or position is None:
+        return "File <unknown>"
+    return f"File {source.filename}, line {str(source.line_of(position) + 1)}"
+
+
 class Error(object):
-    def __init__(self, _error, _text, _position_start, _position_end):
+    def __init__(self, _error, _text, _position_start, _position_end, _source=None):
         self.error = _error
         self.text = _text
         self.position_start = _position_start
         self.position_end = _position_end
+        self.source = _source
 
     def as_string(self):
-        _error = f'File {self.position_start.filename}, line {str(self.position_start.line + 1)}, in main\n'
+        _error = f'{describe_location(self.source, self.position_start)}, in main\n'
         _error += f"{self.error}: {self.text}"
         return _error
 
 
 class IllegalCharError(Error):
-    def __init__(self, _text, _position_start, _position_end):
-        super().__init__("Illegal Character Error", _text, _position_start, _position_end)
+    def __init__(self, _text, _position_start, _position_end, _source=None):
+        super().__init__("Illegal Character Error", _text, _position_start, _position_end, _source)
 
 class UnexpectedCharError(Error):
-    def __init__(self, _text, _position_start, _position_end):
-        super().__init__("Unexpected Character Error", _text, _position_start, _position_end)
+    def __init__(self, _text, _position_start, _position_end, _source=None):
+        super().__init__("Unexpected Character Error", _text, _position_start, _position_end, _source)
 
 class CharacterNotFoundError(Error):
-    def __init__(self, _text, _position_start, _position_end):
-        super().__init__("Character Not Found Error", _text, _position_start, _position_end)
+    def __init__(self, _text, _position_start, _position_end, _source=None):
+        super().__init__("Character Not Found Error", _text, _position_start, _position_end, _source)
 
 class InvalidSyntaxError(Error):
-    def __init__(self, _text, _position_start, _position_end):
-        super().__init__("Invalid Syntax Error", _text, _position_start, _position_end)
+    def __init__(self, _text, _position_start, _position_end, _source=None):
+        super().__init__("Invalid Syntax Error", _text, _position_start, _position_end, _source)
+
+class CompileError(Error):
+    def __init__(self, _text, _position_start, _position_end, _source=None):
+        super().__init__("Compile Error", _text, _position_start, _position_end, _source)
 
 class RTError(Error):
     def __init__(self, _text, _position_start, _position_end, context):
-        super().__init__("RuntimeError", _text, _position_start, _position_end)
+        super().__init__("RuntimeError", _text, _position_start, _position_end, context.source if context else None)
         self.context = context
     
     def as_string(self):
@@ -47,9 +58,16 @@ class RTError(Error):
         ctx = self.context
 
         while ctx:
-            result = f'  File {pos.filename}, line {str(pos.line + 1)}, in {ctx.name}\n' + result
+            result = f'  {describe_location(ctx.source, pos)}, in {ctx.name}\n' + result
             pos = ctx.parent_start_pos
             ctx = ctx.parent
 
         return 'Traceback (most recent call last):\n' + result
 
+
+class RTException(Exception):
+    """An RTError raised instead of returned, by engines that run in
+    exception mode."""
+    def __init__(self, error):
+        super().__init__(error.text)
+        self.error = error
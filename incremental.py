@@ -0,0 +1,425 @@
+from array import array
+from bisect import bisect_left, bisect_right
+
+from token_ import *
+from source import Source
+from lexer import iter_tokens
+from parser_ import Parser
+from ast import *
+
+# Tokens after which a new statement is always parsed from scratch.
+STATEMENT_END = frozenset((SEMICOLON, LBRACKET, RBRACKET))
+
+
+###################
+# Helpers
+###################
+def shift_positions(nodes, threshold, delta):
+    """Move every offset at or after `threshold` in the given trees by `delta`.
+
+    Nodes that only start before `threshold` (the parents of an edited
+    block) keep their start and get their end moved. A `threshold` of None
+    moves every offset.
+    """
+    stack = list(nodes)
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Token):
+            if threshold is None or node.position_start >= threshold:
+                node.position_start += delta
+            if threshold is None or node.position_end >= threshold:
+                node.position_end += delta
+            continue
+        if not isinstance(node, Node):
+            continue
+        value = node.position_start
+        if value is not None and (threshold is None or value >= threshold):
+            node.position_start = value + delta
+        value = node.position_end
+        if value is not None and (threshold is None or value >= threshold):
+            node.position_end = value + delta
+        for name in node.__slots__:
+            value = getattr(node, name)
+            if isinstance(value, list):
+                stack.extend(value)
+            elif isinstance(value, (Token, Node)):
+                stack.append(value)
+
+
+def shift_errors(errors, start, end, delta, source):
+    """Drop errors in [start, end) and move the ones after it by `delta`.
+    The errors kept are located in `source`, the edited text."""
+    kept = []
+    for error in errors:
+        if error.position_start is None or error.position_start < start:
+            kept.append(error)
+        elif error.position_start >= end:
+            error.position_start += delta
+            if error.position_end is not None:
+                error.position_end += delta
+            kept.append(error)
+    for error in kept:
+        error.source = source
+    return kept
+
+
+def shift_array(offsets, start, end, delta):
+    if delta and start < end:
+        offsets[start:end] = array("q", map(delta.__add__, offsets[start:end]))
+
+
+def iter_blocks(node):
+    """(block, in_loop) for every block under `node`, where `in_loop` says
+    whether `break` and `continue` can be used in it."""
+    stack = [(node, False)]
+    while stack:
+        node, in_loop = stack.pop()
+        if not isinstance(node, Node):
+            continue
+        if isinstance(node, Block):
+            yield node, in_loop
+        elif isinstance(node, (WhileNode, ForNode)):
+            in_loop = True
+        elif isinstance(node, FunctionNode):
+            in_loop = False
+        for name in node.__slots__:
+            value = getattr(node, name)
+            if isinstance(value, list):
+                stack.extend((item, in_loop) for item in value)
+            elif isinstance(value, Node):
+                stack.append((value, in_loop))
+
+
+class ShiftedOffsets(object):
+    """Read-only view of offsets where the entries from `gap` on are stored
+    `shift` too low. Supports len() and indexing, so it can be bisected.
+    """
+    def __init__(self, items, gap=None, shift=0, attribute=None):
+        self.items = items
+        self.gap = len(items) if gap is None else gap
+        self.shift = shift
+        self.attribute = attribute
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        offset = self.items[index]
+        if self.attribute is not None:
+            offset = getattr(offset, self.attribute)
+        if index >= self.gap:
+            offset += self.shift
+        return offset
+
+
+class StatementStarts(object):
+    """Current start offsets of a Document's top-level statements."""
+    def __init__(self, document):
+        self.statements = document._program.statements
+        self.pending = document.statement_pending
+        self.gap = document.statement_gap
+        self.shift = document.statement_shift
+
+    def __len__(self):
+        return len(self.statements)
+
+    def __getitem__(self, index):
+        offset = self.statements[index].position_start + self.pending[index]
+        if index >= self.gap:
+            offset += self.shift
+        return offset
+
+
+###################
+# Document
+###################
+class Document(object):
+    """A source file kept lexed and parsed across edits.
+
+    `edit` re-lexes only the tokens around the changed text and re-parses
+    only the statements of the innermost Block (or of the Program) whose
+    tokens changed. Everything else is reused.
+
+    Moving the offsets of everything after an edit would cost about as much
+    as parsing a large file again, so it is done lazily. Tokens from
+    `token_gap` on are stored `token_shift` too low, and an edit only fixes
+    up the tokens between the previous edit and itself. Top-level
+    statements work the same way, except that the fix-up goes to
+    `statement_pending` and a statement's tree is only rewritten when it is
+    re-parsed around or handed out. The `tokens` and `program` properties
+    apply whatever is left.
+    """
+    def __init__(self, text, filename):
+        self.source = Source(text, filename)
+        self.lexer_errors = []
+
+        # Token columns as in TokenStream, but with a value slot for every
+        # token so that splicing never has to renumber them.
+        self.kinds = array("B")
+        self.starts = array("q")
+        self.ends = array("q")
+        self.values = []
+        for tok in iter_tokens(text, 0, self.source, self.lexer_errors):
+            self.kinds.append(tok.type)
+            self.starts.append(tok.position_start)
+            self.ends.append(tok.position_end)
+            self.values.append(tok.value)
+        self.kinds.append(EOF)
+        self.starts.append(len(text))
+        self.ends.append(len(text))
+        self.values.append(None)
+        self.token_gap = len(self.kinds)
+        self.token_shift = 0
+
+        parser = Parser(self.tokens, self.source)
+        self._program = parser.parse_program()
+        self.parser_errors = parser.errors.errors
+        count = len(self._program.statements)
+        self.statement_pending = array("q", bytes(8 * count))
+        self.statement_gap = count
+        self.statement_shift = 0
+
+        self.relexed = len(self.kinds)
+        self.reparsed = len(self._program.statements)
+
+    @property
+    def text(self):
+        return self.source.text
+
+    @property
+    def errors(self):
+        return self.lexer_errors + self.parser_errors
+
+    @property
+    def program(self):
+        self.move_statement_gap(len(self._program.statements))
+        for index in range(len(self._program.statements)):
+            self.settle_statement(index)
+        return self._program
+
+    @property
+    def tokens(self):
+        self.move_token_gap(len(self.kinds))
+        tokens = TokenStream()
+        tokens.kinds = self.kinds
+        tokens.starts = self.starts
+        tokens.ends = self.ends
+        tokens.values = {index: value for index, value in enumerate(self.values) if value is not None}
+        return tokens
+
+    def tokens_from(self, index):
+        kinds, starts, ends, values = self.kinds, self.starts, self.ends, self.values
+        gap, shift = self.token_gap, self.token_shift
+        for index in range(index, len(kinds)):
+            if index < gap:
+                yield Token(kinds[index], values[index], starts[index], ends[index])
+            else:
+                yield Token(kinds[index], values[index], starts[index] + shift, ends[index] + shift)
+
+    def move_token_gap(self, gap):
+        if gap > self.token_gap:
+            shift_array(self.starts, self.token_gap, gap, self.token_shift)
+            shift_array(self.ends, self.token_gap, gap, self.token_shift)
+        elif gap < self.token_gap:
+            shift_array(self.starts, gap, self.token_gap, -self.token_shift)
+            shift_array(self.ends, gap, self.token_gap, -self.token_shift)
+        self.token_gap = gap
+
+    def move_statement_gap(self, gap):
+        if gap > self.statement_gap:
+            shift_array(self.statement_pending, self.statement_gap, gap, self.statement_shift)
+        elif gap < self.statement_gap:
+            shift_array(self.statement_pending, gap, self.statement_gap, -self.statement_shift)
+        self.statement_gap = gap
+
+    def settle_statement(self, index):
+        """Apply the offset change still pending on a top-level statement
+        before the gap to its whole tree."""
+        pending = self.statement_pending[index]
+        if pending:
+            shift_positions(self._program.statements[index:index + 1], None, pending)
+            self.statement_pending[index] = 0
+
+    def statement_starts(self, container):
+        if container is self._program:
+            return StatementStarts(self)
+        return ShiftedOffsets(container.statements, attribute="position_start")
+
+    def edit(self, offset, deleted, inserted):
+        """Replace `deleted` characters at `offset` with `inserted`."""
+        old_text = self.source.text
+        text = old_text[:offset] + inserted + old_text[offset + deleted:]
+        delta = len(inserted) - deleted
+        self.source = Source(text, self.source.filename)
+
+        changed_start, changed_end, kind_before_end = self.relex(text, offset, offset + len(inserted), delta)
+        self.reparse(changed_start, changed_end, kind_before_end, delta)
+
+    def relex(self, text, offset, edit_end, delta):
+        """Lex from the first token touching the edit until the new tokens
+        line up with old ones again, and splice them into the columns.
+
+        Returns the old offsets [changed_start, changed_end) of the text
+        whose tokens were replaced, and the kind of the old token right
+        before changed_end.
+        """
+        last = len(self.kinds) - 1
+        first = min(bisect_left(ShiftedOffsets(self.ends, self.token_gap, self.token_shift), offset), last)
+        self.move_token_gap(first)
+        old_starts = self.starts
+        shift = self.token_shift
+
+        # Restart right after the last token that ends before the edit. Text
+        # the lexer dropped with an error (an unclosed string, a number with
+        # two dots) has no token of its own and is lexed again as well.
+        changed_start = self.ends[first - 1] if first > 0 else 0
+
+        errors = []
+        new_tokens = []
+        resume = last
+        for tok in iter_tokens(text, changed_start, self.source, errors):
+            # Lexing only depends on the text ahead, so once a token starts
+            # where an old one did past the edit, the rest is unchanged.
+            if tok.position_start >= edit_end:
+                old_start = tok.position_start - delta - shift
+                index = bisect_left(old_starts, old_start, first, last)
+                if index < last and old_starts[index] == old_start:
+                    resume = index
+                    break
+            new_tokens.append(tok)
+        changed_end = old_starts[resume] + shift
+        kind_before_end = self.kinds[resume - 1] if resume > 0 else None
+
+        self.lexer_errors = sorted(
+            shift_errors(self.lexer_errors, changed_start, changed_end, delta, self.source) + errors,
+            key=lambda error: error.position_start,
+        )
+        self.relexed = len(new_tokens)
+
+        self.kinds[first:resume] = array("B", [tok.type for tok in new_tokens])
+        self.starts[first:resume] = array("q", [tok.position_start for tok in new_tokens])
+        self.ends[first:resume] = array("q", [tok.position_end for tok in new_tokens])
+        self.values[first:resume] = [tok.value for tok in new_tokens]
+        self.token_gap = first + len(new_tokens)
+        self.token_shift = shift + delta
+
+        return changed_start, changed_end, kind_before_end
+
+    def reparse(self, changed_start, changed_end, kind_before_end, delta):
+        program = self._program
+        statements = program.statements
+
+        # The top-level statement holding the change, and the blocks inside
+        # it that enclose the whole changed range, innermost last.
+        top = max(bisect_right(self.statement_starts(program), changed_start) - 1, 0)
+        self.move_statement_gap(min(top + 1, len(statements)))
+        containers = [program]
+        loop_blocks = set()
+        if statements:
+            self.settle_statement(top)
+            blocks = [
+                (block, in_loop) for block, in_loop in iter_blocks(statements[top])
+                if block.position_end is not None
+                and block.position_start < changed_start
+                and changed_end <= block.position_end - 1
+            ]
+            blocks.sort(key=lambda item: item[0].position_start)
+            containers.extend(block for block, in_loop in blocks)
+            loop_blocks.update(block for block, in_loop in blocks if in_loop)
+
+        # A statement node does not always start where its parse did (a
+        # parenthesized expression starts at its inner node, error recovery
+        # skips tokens), so only statements right after `;`, `{` or `}` that
+        # no error points at are safe places to start or stop. Offsets here
+        # are old ones; the tokens before the change have not moved.
+        error_positions = {error.position_start for error in self.parser_errors}
+        new_starts = ShiftedOffsets(self.starts, self.token_gap, self.token_shift)
+
+        def is_boundary(offset):
+            if offset in error_positions:
+                return False
+            if offset == changed_end:
+                kind = kind_before_end
+            else:
+                if offset > changed_end:
+                    offset += delta
+                index = bisect_left(new_starts, offset)
+                kind = self.kinds[index - 1] if index > 0 else None
+            return kind is None or kind in STATEMENT_END
+
+        for container in reversed(containers):
+            result = self.parse_container(container, changed_start, changed_end, delta, is_boundary, container in loop_blocks)
+            if result is not None:
+                break
+        first, new_statements, resume, parse_start, parse_end, errors = result
+
+        # The change can start before the first token re-parsed, as when it
+        # deletes the token an error was reported at.
+        self.parser_errors = sorted(
+            shift_errors(self.parser_errors, min(changed_start, parse_start), parse_end, delta, self.source) + errors,
+            key=lambda error: error.position_start,
+        )
+        if container is program:
+            self.move_statement_gap(resume)
+            statements[first:resume] = new_statements
+            self.statement_pending[first:resume] = array("q", bytes(8 * len(new_statements)))
+            self.statement_gap = first + len(new_statements)
+        else:
+            shift_positions(statements[top:top + 1], changed_end, delta)
+            container.statements[first:resume] = new_statements
+        self.statement_shift += delta
+        self.reparsed = len(new_statements)
+
+    def parse_container(self, container, changed_start, changed_end, delta, is_boundary, in_loop=False):
+        """Re-parse the statements of `container` touched by the change.
+
+        Returns None when the new tokens no longer fit inside the block, so
+        the caller can retry one level further out. `in_loop` is whether
+        `break` and `continue` may be used in the block.
+        """
+        is_block = container is not self._program
+        statements = container.statements
+        starts = self.statement_starts(container)
+        token_starts = ShiftedOffsets(self.starts, self.token_gap, self.token_shift)
+
+        # Start one statement early: an `if` looks at the token after its
+        # block to find `elif`/`else`.
+        first = max(bisect_right(starts, changed_start) - 2, 0)
+        while first > 0 and not is_boundary(starts[first]):
+            first -= 1
+        if first > 0:
+            start_index = bisect_left(token_starts, starts[first])
+        elif is_block:
+            start_index = bisect_left(token_starts, container.position_start) + 1
+        else:
+            start_index = 0
+
+        parser = Parser(TokenBuffer(self.tokens_from(start_index), 256), self.source)
+        parser.loop_depth = int(in_loop)
+        parse_start = parser.tok_start
+        new_statements = []
+
+        while True:
+            if parser.tok_start >= changed_end + delta:
+                index = bisect_left(starts, parser.tok_start - delta, first)
+                if index < len(statements) and starts[index] == parser.tok_start - delta and is_boundary(starts[index]):
+                    resume = index
+                    parse_end = starts[index]
+                    break
+            if is_block and parser.tok_type == RBRACKET:
+                if parser.tok_start != container.position_end - 1 + delta:
+                    return None
+                resume = len(statements)
+                parse_end = container.position_end
+                break
+            if parser.tok_type == EOF:
+                if is_block:
+                    return None
+                resume = len(statements)
+                parse_end = len(self.source.text) - delta + 1
+                break
+            stmt = parser.parse_statement()
+            if stmt:
+                new_statements.append(stmt)
+
+        return first, new_statements, resume, parse_start, parse_end, parser.errors.errors
@@ -1,14 +1,20 @@
 import sys
+import math
+from functools import partial
 from errors import RTError
 from token_ import *
 from ast import *
+from visitor import Visitor
 
 # ---------------------------------------------
 
 class Value(object):
+    __slots__ = ("position_start", "position_end", "context")
+
     def __init__(self):
-        self.set_pos()
-        self.set_context()
+        self.position_start = None
+        self.position_end = None
+        self.context = None
     
     def set_pos(self, position_start=None, position_end=None):
         self.position_start = position_start
@@ -43,11 +49,17 @@ class Value(object):
     def gt_or_eq(self, other):
         return None, RTError('Illegal Operation', self.position_start, other.position_end, self.context)
 
+    def eq(self, other):
+        return None, RTError('Illegal Operation', self.position_start, other.position_end, self.context)
+
+    def ne(self, other):
+        return None, RTError('Illegal Operation', self.position_start, other.position_end, self.context)
+
     def unary(self, tok):
         return None, RTError('Illegal Operation', tok.position_start, self.position_end, self.context)
 
     def execute(self, args):
-        return None, RTError('Illegal Operation', args.position_start, args.position_end, self.context)
+        return None, RTError('Illegal Operation', self.position_start, self.position_end, self.context)
 
     def is_true(self, args):
         return None, RTError('Illegal Operation', args.position_start, args.position_end, self.context)
@@ -65,8 +77,12 @@ class Value(object):
         return None, RTError('Illegal Operation', self.position_start, self.position_end, self.context)
 
 class Number(Value):
+    __slots__ = ("value",)
+
     def __init__(self, value):
-        super().__init__()
+        self.position_start = None
+        self.position_end = None
+        self.context = None
         self.value = value
     
     def add(self, other):
@@ -125,11 +141,17 @@ class Number(Value):
         else:
             return None, RTError('Illegal Operation', self.position_start, other.position_end, self.context)
 
+    def ne(self, other):
+        if isinstance(other, Number):
+            return Number(int(self.value != other.value)).set_context(self.context), None
+        else:
+            return None, RTError('Illegal Operation', self.position_start, other.position_end, self.context)
+
     def unary(self, tok):
         if tok.type == MINUS:
             return Number(-self.value).set_context(self.context), None
         else:
-            return None, RTError(f"Unsupported unary operation for {tok.type}", tok.position_start, tok.position_end, self.context)
+            return None, RTError(f"Unsupported unary operation for {TOKEN_NAMES[tok.type]}", tok.position_start, tok.position_end, self.context)
 
     def is_true(self):
         if self.value == 0:
@@ -141,30 +163,52 @@ class Number(Value):
         return self.value
 
 class Function(Value):
-    def __init__(self, name, arg_names, code_node):
+    def __init__(self, name, arg_names, code_node, body=None, scope=None):
         self.name = name
         self.arg_names = arg_names
         self.code_node = code_node
+        # Runs the body in a context: Interpreter.visit on the code node, or
+        # the closure closures.ClosureCompiler made of it together with the
+        # resolver.Scope laying out its frame.
+        self.body = body
+        self.scope = scope
     
     def execute(self, args):
+        if self.scope is not None:
+            return self.execute_compiled(args)
         args, error = self.check_and_populate_args(args)
         if error:
             return None, error
-        interpreter = Interpreter()
 
+        # The new symbol table is chained to the one the function was
+        # defined in, so names are found and assigned through it directly.
         exec_ctx = Context(self.name, parent=self.context, parent_start_pos=self.position_start)
-        for key, value in args.items():
-            exec_ctx.symbol_table.symbols[key] = value
+        exec_ctx.symbol_table.symbols = args
 
-        stmts, error = interpreter.visit(self.code_node, exec_ctx)
+        stmts, error = self.body(exec_ctx)
         if error:
             return None, error
-        
-        for key in exec_ctx.symbol_table.symbols.keys():
-            if key in self.context.symbol_table.symbols.keys():
-                self.context.symbol_table.symbols[key] = exec_ctx.symbol_table.symbols[key]
-        
-        return interpreter.return_value, None
+        return exec_ctx.return_value, None
+
+    def execute_compiled(self, arg_values):
+        # As above, with variables kept in the frame slots the resolver gave
+        # them rather than in a symbol table.
+        if len(arg_values) != len(self.arg_names):
+            return self.check_and_populate_args(arg_values)
+        scope = self.scope
+        pool = scope.pool
+        exec_ctx = Context(self.name, parent=self.context, parent_start_pos=self.position_start)
+        exec_ctx.frame = frame = pool.pop() if pool else [None] * len(scope.names)
+        for i in range(len(arg_values)):
+            frame[scope.arg_slots[i]] = arg_values[i]
+
+        stmts, error = self.body(exec_ctx)
+        if not scope.has_functions:
+            frame[:] = scope.empty_frame
+            pool.append(frame)
+        if error:
+            return None, error
+        return exec_ctx.return_value, None
 
     def check_and_populate_args(self, arg_values):
         if len(arg_values) != len(self.arg_names):
@@ -180,6 +224,7 @@ class Function(Value):
     
 class BuiltInFunction(Value):
     def __init__(self, name, arg_names):
+        super().__init__()
         self.name = name
         self.arg_names = arg_names
 
@@ -207,10 +252,61 @@ class BuiltInFunction(Value):
         
         return args, None
 
+    def repr(self):
+        return f"BUILTIN FUNCTION {self.name}"
+
 class NoneType(Value):
     def repr(self):
         return "none"
 
+class LoopSignal(Value):
+    """What `break` and `continue` leave in a context's return_value.
+
+    It is not a NoneType, so the blocks between the statement and its loop
+    stop running as they do after a `return`, and the loop takes it back.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def repr(self):
+        return self.name
+
+BREAK = LoopSignal("break")
+CONTINUE = LoopSignal("continue")
+
+def loop_stops(context):
+    """After an iteration that changed context.return_value: take back a
+    `break` or `continue` and say whether the loop ends there."""
+    signal = context.return_value
+    if signal is CONTINUE:
+        context.return_value = Interpreter.return_value
+        return False
+    if signal is BREAK:
+        context.return_value = Interpreter.return_value
+        return True
+    return not isinstance(signal, NoneType)
+
+def truth(value, node, context):
+    """Whether the value of the condition `node` is true, and an error if
+    it is not a Number, the only values that have a truth."""
+    if not isinstance(value, Number):
+        return None, RTError('Illegal Operation', node.position_start, node.position_end, context)
+    return value.value != 0, None
+
+def loop_range(start, end, step, node, context):
+    """The ints a `for` loop runs over, given the bare numbers its bounds
+    evaluated to, and an error if they are not whole numbers."""
+    bounds = []
+    for value, bound_node in ((start, node.start_value), (end, node.end_value), (step, node.step_value)):
+        if type(value) is float and math.isfinite(value) and value.is_integer():
+            value = int(value)
+        if type(value) is not int:
+            return None, RTError("For loop bounds must be whole numbers", bound_node.position_start, bound_node.position_end, context)
+        bounds.append(value)
+    if bounds[2] == 0:
+        return None, RTError("For loop step must not be 0", node.step_value.position_start, node.step_value.position_end, context)
+    return range(*bounds), None
+
 # ---------------------------------------------
 
 global_vars = {
@@ -223,11 +319,16 @@ global_vars = {
 # ---------------------------------------------
 
 class Context:
-    def __init__(self, name, parent=None, parent_start_pos=None):
+    def __init__(self, name, parent=None, parent_start_pos=None, source=None):
         self.name = name
         self.parent = parent
         self.parent_start_pos = parent_start_pos
-        self.symbol_table = SymbolTable()
+        self.source = source if source is not None or parent is None else parent.source
+        self.symbol_table = SymbolTable(parent.symbol_table if parent is not None else None)
+        # Slot-addressed variables, for engines that use resolver.Resolver.
+        self.frame = None
+        # Set by the first `return` that runs in this context.
+        self.return_value = Interpreter.return_value
     
     def make_main_symbol_table(self):
         base_symbols = {}
@@ -235,31 +336,41 @@ class Context:
         self.symbol_table.symbols = base_symbols
 
 class SymbolTable(object):
-    def __init__(self):
+    def __init__(self, parent=None):
         self.symbols = {}
+        self.parent = parent
     
     def get(self, name):
-        if name in self.symbols.keys():
-            return self.symbols[name], True
-        else:
+        symbols = self.symbols
+        if name in symbols:
+            return symbols[name], True
+        if self.parent is None:
             return None, False
+        return self.parent.get(name)
     
     def set(self, name, value):
-        self.symbols[name] = value
+        # Assigning updates the innermost table that has the name, and only
+        # adds it here when none does.
+        table = self
+        while name not in table.symbols:
+            table = table.parent
+            if table is None:
+                table = self
+                break
+        table.symbols[name] = value
 
     def remove(self, name):
         del self.symbols[name]
 
-class Interpreter(object):
+class Interpreter(Visitor):
+    # What a context's return_value is until a `return` runs in it.
     return_value = NoneType()
        
     def visit(self, node, context):
-        func = getattr(self, "visit_" + type(node).__name__, self.no_visit_method)
-        value, error = func(node, context)
-        return value, error
-    
-    def no_visit_method(self, node, context):
-        raise NotImplementedError(f"No visit method for {type(node).__name__}")
+        func = self.handlers.get(type(node))
+        if func is None:
+            func = self.handler(type(node))
+        return func(self, node, context)
 
     def visit_Program(self, node, context):
         res = []
@@ -267,7 +378,7 @@ class Interpreter(object):
             value, error = self.visit(stmt, context)
             if error:
                 return None, error
-            if not isinstance(self.return_value, NoneType):
+            if not isinstance(context.return_value, NoneType):
                 break
             res.append(value.repr())
         return res, None
@@ -278,7 +389,7 @@ class Interpreter(object):
             value, error = self.visit(stmt, context)
             if error:
                 return None, error
-            if not isinstance(self.return_value, NoneType):
+            if not isinstance(context.return_value, NoneType):
                 break
             res.append(value.repr())
         return res, None
@@ -295,8 +406,10 @@ class Interpreter(object):
         return value, None
 
     def visit_UnaryOperationNode(self, node, context):
-        value, _ = self.visit(node.node, context)
-        return value.unary(node.operation_tok)          
+        value, error = self.visit(node.node, context)
+        if error:
+            return None, error
+        return value.unary(node.operation_tok)
     
     def visit_BinaryOperationNode(self, node, context):
         left, error = self.visit(node.left_node, context)
@@ -324,16 +437,24 @@ class Interpreter(object):
             result, error = left.gt_or_eq(right)
         elif op_tok.type == DOUBLE_EQUAL:
             result, error = left.eq(right)
+        elif op_tok.type == NOT_EQUAL:
+            result, error = left.ne(right)
         
         if error:
             return None, error
         return result.set_pos(node.position_start, node.position_end), None
     
     def visit_VarAssignNode(self, node, context):
-        value, error = self.visit(node.var_value, context)
+        return self.assign(node.var_name, node.var_value, context)
+
+    def visit_ConstAssignNode(self, node, context):
+        return self.assign(node.const_name, node.const_value, context)
+
+    def assign(self, name_node, value_node, context):
+        value, error = self.visit(value_node, context)
         if error:
             return None, error
-        context.symbol_table.set(node.var_name.tok.value, value)
+        context.symbol_table.set(name_node.tok.value, value)
         return NoneType(), None
 
     def visit_FunctionNode(self, node, context):
@@ -346,7 +467,7 @@ class Interpreter(object):
             arg_names.append(node.arg_node.tok.value)
         else:
             return None, RTError("Function argument must be an identifier", node.arg_node.position_start, node.arg_node.position_end, context)
-        function = Function(name, arg_names, node.code_block).set_context(context).set_pos(node.position_start, node.position_end)
+        function = Function(name, arg_names, node.code_block, partial(self.visit, node.code_block)).set_context(context).set_pos(node.position_start, node.position_end)
         
         if name != "anonymous":
             context.symbol_table.set(name, function)
@@ -375,30 +496,87 @@ class Interpreter(object):
         if error:
             return None, error
         
-        self.return_value = value
-        return self.return_value, None
+        context.return_value = value
+        return value, None
 
-    def visit_IfNode(self, node, context):
-        if_condition, error = self.visit(node.if_condition, context)
+    def visit_WhileNode(self, node, context):
+        while True:
+            condition, error = self.visit(node.condition, context)
+            if error:
+                return None, error
+            true, error = truth(condition, node.condition, context)
+            if error:
+                return None, error
+            if not true:
+                break
+            error = self.run_loop_body(node.block, context)
+            if error:
+                return None, error
+            if context.return_value is not self.return_value and loop_stops(context):
+                break
+        return NoneType(), None
+
+    def visit_ForNode(self, node, context):
+        bounds = []
+        for bound_node in (node.start_value, node.end_value, node.step_value):
+            if bound_node is None:
+                bounds.append(1)
+                continue
+            value, error = self.visit(bound_node, context)
+            if error:
+                return None, error
+            bounds.append(value.value if type(value) is Number else value)
+        numbers, error = loop_range(*bounds, node, context)
         if error:
             return None, error
 
-        if if_condition.value == 0:
-            if node.elif_conditions:
-                for i in range(len(node.elif_conditions)):
-                    elif_condition, error = self.visit(node.elif_conditions[i], context)
-                    if error:
-                        return None, error
-                    if not elif_condition.value == 0:
-                        res, error = self.visit(node.if_block_statements[i], context)
-                        if error:
-                            return None, error
-            if node.else_block_statement:
-                res, error = self.visit(node.else_block_statement, context)
+        name = node.var_name.tok.value
+        for i in numbers:
+            context.symbol_table.set(name, Number(i).set_context(context).set_pos(node.var_name.position_start, node.var_name.position_end))
+            error = self.run_loop_body(node.block, context)
+            if error:
+                return None, error
+            if context.return_value is not self.return_value and loop_stops(context):
+                break
+        return NoneType(), None
+
+    def run_loop_body(self, block, context):
+        # Like visit_Block, but without keeping the values; returns the error.
+        for stmt in block.statements:
+            value, error = self.visit(stmt, context)
+            if error:
+                return error
+            if not isinstance(context.return_value, NoneType):
+                break
+        return None
+
+    def visit_BreakNode(self, node, context):
+        context.return_value = BREAK
+        return BREAK, None
+
+    def visit_ContinueNode(self, node, context):
+        context.return_value = CONTINUE
+        return CONTINUE, None
+
+    def visit_IfNode(self, node, context):
+        # The block of the first condition that is true runs, or the else
+        # block when none is.
+        conditions = [node.if_condition] + (node.elif_conditions or [])
+        blocks = [node.if_block_statement] + (node.elif_block_statements or [])
+        for condition_node, block in zip(conditions, blocks):
+            condition, error = self.visit(condition_node, context)
+            if error:
+                return None, error
+            true, error = truth(condition, condition_node, context)
+            if error:
+                return None, error
+            if true:
+                res, error = self.visit(block, context)
                 if error:
                     return None, error
-        else:
-            res, error = self.visit(node.if_block_statement, context)
+                return NoneType(), None
+        if node.else_block_statement:
+            res, error = self.visit(node.else_block_statement, context)
             if error:
                 return None, error
 
@@ -1,6 +1,10 @@
+import re
+import mmap
 import string
 from token_ import *
+from source import Source, FileSource
 from errors import IllegalCharError, UnexpectedCharError, CharacterNotFoundError
+from collector import paused_gc
 
 ###################
 # Constants
@@ -8,6 +12,94 @@ from errors import IllegalCharError, UnexpectedCharError, CharacterNotFoundError
 DIGITS = '0123456789'
 LETTERS = string.ascii_letters
 
+KEYWORD_SET = frozenset(keywords)
+
+# Every alternative of the master pattern is tried at the current offset, so
+# the final catch-all group guarantees `finditer` never skips a character.
+TOKEN_REGEX = r"""
+    (?P<SKIP>[ \n\t]+)
+  | (?P<NUMBER>[0-9]+(?:\.[0-9]*(?P<BADDOT>\.)?)?)
+  | (?P<NAME>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<STRING>"[^"]*"?)
+  | (?P<OP>==|=>|<=|>=|[-+*/()\[\]{}=<>:;,])
+  | (?P<ILLEGAL>ILLEGAL_CHAR)
+"""
+TOKEN_PATTERN = re.compile(TOKEN_REGEX.replace("ILLEGAL_CHAR", "."), re.VERBOSE | re.DOTALL)
+# The streaming lexer matches raw bytes; an illegal character is a whole
+# UTF-8 sequence so it is reported once, as with text input.
+TOKEN_BYTES_PATTERN = re.compile(
+    TOKEN_REGEX.replace("ILLEGAL_CHAR", r"[\xc0-\xf7][\x80-\xbf]*|.").encode(),
+    re.VERBOSE | re.DOTALL,
+)
+
+OPERATORS = {
+    "+": PLUS,
+    "-": MINUS,
+    "*": ASTERISK,
+    "/": SLASH,
+    "(": LPAREN,
+    ")": RPAREN,
+    "[": LSQUAREBRACKET,
+    "]": RSQUAREBRACKET,
+    "{": LBRACKET,
+    "}": RBRACKET,
+    "=": EQUAL,
+    "==": DOUBLE_EQUAL,
+    "=>": ARROW,
+    "<": LESS_THAN,
+    "<=": LESS_THAN_OR_EQUAL,
+    ">": GREATER_THAN,
+    ">=": GREATER_THAN_OR_EQUAL,
+    ":": COLON,
+    ";": SEMICOLON,
+    ",": COMMA,
+}
+
+
+def match_token(match, base, source, errors):
+    """The (type, value) of the token a TOKEN_PATTERN or TOKEN_BYTES_PATTERN
+    match other than whitespace found, or None for an error, which is
+    appended to `errors`. `base` is the offset the match's offsets are from.
+    """
+    kind = match.lastgroup
+    value = match.group()
+    if type(value) is bytes:
+        value = value.decode("utf-8", "replace")
+    if kind == "OP":
+        return OPERATORS[value], None
+    if kind == "NAME":
+        return KEYWORD if value in KEYWORD_SET else IDENTIFIER, value
+    if kind == "NUMBER":
+        if match.group("BADDOT"):
+            dot = base + match.start("BADDOT")
+            errors.append(UnexpectedCharError("Unexpected character '.'", dot, dot + 1, source))
+            return None
+        if "." in value:
+            return FLOAT, float(value)
+        return INT, int(value)
+    start, end = base + match.start(), base + match.end()
+    if kind == "STRING":
+        if len(value) < 2 or value[-1] != '"':
+            errors.append(CharacterNotFoundError("String quotation marks are not closed", start, end, source))
+            return None
+        return STRING, value[1:-1]
+    errors.append(IllegalCharError(f"Illegal character {value}", start, end, source))
+    return None
+
+
+def iter_tokens(text, pos, source, errors):
+    """Yield the tokens of `text` from offset `pos` on, without the EOF token.
+
+    Errors are appended to `errors`. Used where lexing has to start or stop
+    part way through the input, such as re-lexing an edited region.
+    """
+    for match in TOKEN_PATTERN.finditer(text, pos):
+        if match.lastgroup == "SKIP":
+            continue
+        token = match_token(match, 0, source, errors)
+        if token is not None:
+            yield Token(token[0], token[1], match.start(), match.end())
+
 
 ###################
 # Position
@@ -28,17 +120,20 @@ class Position(object):
             self.line += 1
             self.column = 0
 
-    def copy(self):
-        return Position(self.index, self.column, self.line, self.ftext, self.filename)
-
 
 ###################
 # Lexer
 ###################
 class Lexer(object):
-    def __init__(self, _input, _filename):
+    ENGINES = ("table", "scan")
+
+    def __init__(self, _input, _filename, _engine="table"):
+        if _engine not in self.ENGINES:
+            raise ValueError(f"Unknown lexer engine {_engine!r}")
         self.input = _input
         self.filename = _filename
+        self.engine = _engine
+        self.source = Source(_input, _filename)
         self.position = Position(-1, -1, 0, self.input, self.filename)
         self.current_char = None
         self.errors = []
@@ -50,6 +145,49 @@ class Lexer(object):
         self.current_char = self.input[self.position.index] if self.position.index < len(self.input) else None
 
     def tokenize(self):
+        with paused_gc():
+            if self.engine == "table":
+                return self.tokenize_table()
+            return self.tokenize_scan()
+
+    def tokenize_table(self):
+        """Single pass over the input driven by TOKEN_PATTERN.
+
+        Produces the same tokens and errors as `tokenize_scan` without
+        touching every character from Python code, writing straight into
+        the columns of a TokenStream.
+        """
+        text = self.input
+        source = self.source
+        tokens = TokenStream()
+        errors = self.errors
+        add_kind = tokens.kinds.append
+        add_start = tokens.starts.append
+        add_end = tokens.ends.append
+        values = tokens.values
+        count = 0
+
+        for match in TOKEN_PATTERN.finditer(text):
+            if match.lastgroup == "SKIP":
+                continue
+            token = match_token(match, 0, source, errors)
+            if token is None:
+                continue
+            _type, value = token
+            add_kind(_type)
+            if value is not None:
+                values[count] = value
+            add_start(match.start())
+            add_end(match.end())
+            count += 1
+
+        tokens.append(EOF, None, len(text), len(text))
+
+        if errors:
+            return None, errors
+        return tokens, None
+
+    def tokenize_scan(self):
         tokens = []
 
         while self.current_char is not None:
@@ -62,34 +200,34 @@ class Lexer(object):
             elif self.current_char == '"':
                 tokens.append(self.make_string())
             elif self.current_char == "+":
-                tokens.append(Token(PLUS, _position_start=self.position.copy()))
+                tokens.append(Token(PLUS, _position_start=self.position.index))
                 self.advance()
             elif self.current_char == "-":
-                tokens.append(Token(MINUS, _position_start=self.position.copy()))
+                tokens.append(Token(MINUS, _position_start=self.position.index))
                 self.advance()
             elif self.current_char == "*":
-                tokens.append(Token(ASTERISK, _position_start=self.position.copy()))
+                tokens.append(Token(ASTERISK, _position_start=self.position.index))
                 self.advance()
             elif self.current_char == "/":
-                tokens.append(Token(SLASH, _position_start=self.position.copy()))
+                tokens.append(Token(SLASH, _position_start=self.position.index))
                 self.advance()
             elif self.current_char == "(":
-                tokens.append(Token(LPAREN, _position_start=self.position.copy()))
+                tokens.append(Token(LPAREN, _position_start=self.position.index))
                 self.advance()
             elif self.current_char == ")":
-                tokens.append(Token(RPAREN, _position_start=self.position.copy()))
+                tokens.append(Token(RPAREN, _position_start=self.position.index))
                 self.advance()
             elif self.current_char == "[":
-                tokens.append(Token(LSQUAREBRACKET, _position_start=self.position.copy()))
+                tokens.append(Token(LSQUAREBRACKET, _position_start=self.position.index))
                 self.advance()
             elif self.current_char == "]":
-                tokens.append(Token(RSQUAREBRACKET, _position_start=self.position.copy()))
+                tokens.append(Token(RSQUAREBRACKET, _position_start=self.position.index))
                 self.advance()
             elif self.current_char == "{":
-                tokens.append(Token(LBRACKET, _position_start=self.position.copy()))
+                tokens.append(Token(LBRACKET, _position_start=self.position.index))
                 self.advance()
             elif self.current_char == "}":
-                tokens.append(Token(RBRACKET, _position_start=self.position.copy()))
+                tokens.append(Token(RBRACKET, _position_start=self.position.index))
                 self.advance()
             elif self.current_char == "=":
                 tokens.append(self.make_equals())
@@ -101,122 +239,111 @@ class Lexer(object):
                 tokens.append(self.make_greater_than())
                 self.advance()
             elif self.current_char == ":":
-                tokens.append(Token(COLON, _position_start=self.position.copy()))
+                tokens.append(Token(COLON, _position_start=self.position.index))
                 self.advance()
             elif self.current_char == ";":
-                tokens.append(Token(SEMICOLON, _position_start=self.position.copy()))
+                tokens.append(Token(SEMICOLON, _position_start=self.position.index))
                 self.advance()
             elif self.current_char == ",":
-                tokens.append(Token(COMMA, _position_start=self.position.copy()))
+                tokens.append(Token(COMMA, _position_start=self.position.index))
                 self.advance()
             else:
-                # TODO: FIND A CLEANER SOLUTION!!!
-                _position_start = self.position.copy()
-                pos_start = _position_start
-                _position_start.advance()
-                _position_end = _position_start
-
-                self.errors.append(IllegalCharError(f"Illegal character {self.current_char}", pos_start, _position_end))
+                self.errors.append(IllegalCharError(f"Illegal character {self.current_char}", self.position.index, self.position.index + 1, self.source))
                 self.advance()
 
-        tokens.append(Token(EOF, _position_start=self.position))
+        tokens.append(Token(EOF, None, len(self.input), len(self.input)))
 
         if self.errors:
             return None, self.errors
-        return tokens, None
+        return TokenStream.from_tokens(tokens), None
 
     def make_number(self):
-        position_start = self.position.copy()
+        position_start = self.position.index
         dot_count = 0
         while self.is_number(self.current_char) or self.current_char == ".":
             if self.current_char == ".":
                 dot_count += 1
             if dot_count > 1:
-                _position_start = self.position.copy()
-                pos_start = _position_start
-                _position_start.advance()
-                _position_end = _position_start
-
-                self.errors.append(UnexpectedCharError(f"Unexpected character '{self.current_char}'", pos_start, _position_end))
+                self.errors.append(UnexpectedCharError(f"Unexpected character '{self.current_char}'", self.position.index, self.position.index + 1, self.source))
                 
                 self.advance()
                 return
             self.advance()
         
         if dot_count == 0:
-            return Token(INT, int(self.input[position_start.index:self.position.index]), position_start, self.position.copy())
+            return Token(INT, int(self.input[position_start:self.position.index]), position_start, self.position.index)
         else:
-            return Token(FLOAT, float(self.input[position_start.index:self.position.index]), position_start, self.position.copy())
+            return Token(FLOAT, float(self.input[position_start:self.position.index]), position_start, self.position.index)
         
     def make_identifier(self):
-        position_start = self.position.copy()
+        position_start = self.position.index
 
         while self.is_letter(self.current_char, mode=1):
             self.advance()
 
-        identifier = self.input[position_start.index:self.position.index]
+        identifier = self.input[position_start:self.position.index]
         if identifier in keywords:
-            return Token(KEYWORD, identifier, position_start, self.position.copy())
+            return Token(KEYWORD, identifier, position_start, self.position.index)
         else:
-            return Token(IDENTIFIER, identifier, position_start, self.position.copy())
+            return Token(IDENTIFIER, identifier, position_start, self.position.index)
 
     def make_string(self):
-        position_start = self.position.copy()
+        position_start = self.position.index
 
         self.advance()
 
         while self.current_char != "\"":
             self.advance()
             if self.current_char == None:
-                self.errors.append(CharacterNotFoundError(f"String quotation marks are not closed", position_start, self.position.copy()))
+                self.errors.append(CharacterNotFoundError("String quotation marks are not closed", position_start, self.position.index, self.source))
                 return
 
         self.advance()
 
-        return Token(STRING, self.input[position_start.index+1:self.position.index-1], position_start, self.position.copy())
+        return Token(STRING, self.input[position_start+1:self.position.index-1], position_start, self.position.index)
 
     def make_equals(self):
-        position_start = self.position.copy()
+        position_start = self.position.index
 
         try:
             if self.input[self.position.index + 1] == "=":
                 self.advance()
-                return Token(DOUBLE_EQUAL, _position_start=position_start, _position_end=self.position.copy())
+                return Token(DOUBLE_EQUAL, _position_start=position_start, _position_end=self.position.index + 1)
             elif self.input[self.position.index + 1] == ">":
                 self.advance()
-                return Token(ARROW, _position_start=position_start, _position_end=self.position.copy())
+                return Token(ARROW, _position_start=position_start, _position_end=self.position.index + 1)
         except:
             pass
         return Token(EQUAL, _position_start=position_start)
     
     def make_not_equals(self):
-        position_start = self.position.copy()
+        position_start = self.position.index
 
         try:
             if self.input[self.position.index + 1] == "=":
                 self.advance()
-                return Token(NOT_EQUAL, _position_start=position_start, _position_end=self.position.copy())
+                return Token(NOT_EQUAL, _position_start=position_start, _position_end=self.position.index + 1)
         except:
             pass
         return Token(NOT, _position_start=position_start)
     def make_less_than(self):
-        position_start = self.position.copy()
+        position_start = self.position.index
 
         try:
             if self.input[self.position.index + 1] == "=":
                 self.advance()
-                return Token(LESS_THAN_OR_EQUAL, _position_start=position_start, _position_end=self.position.copy())
+                return Token(LESS_THAN_OR_EQUAL, _position_start=position_start, _position_end=self.position.index + 1)
         except:
             pass
         return Token(LESS_THAN, _position_start=position_start)
 
     def make_greater_than(self):
-        position_start = self.position.copy()
+        position_start = self.position.index
 
         try:
             if self.input[self.position.index + 1] == "=":
                 self.advance()
-                return Token(GREATER_THAN_OR_EQUAL, _position_start=position_start, _position_end=self.position.copy())
+                return Token(GREATER_THAN_OR_EQUAL, _position_start=position_start, _position_end=self.position.index + 1)
         except:
             pass
         return Token(GREATER_THAN, _position_start=position_start)
@@ -239,6 +366,86 @@ class Lexer(object):
                 return False
 
 
+###################
+# StreamLexer
+###################
+class MappedReader(object):
+    """Sequential reads from a memory-mapped file.
+
+    Pages that have already been copied out are released again, so the
+    mapping does not add the whole file to the resident set.
+    """
+    def __init__(self, _mapped):
+        self.mapped = _mapped
+        self.released = 0
+
+    def read(self, size):
+        chunk = self.mapped.read(size)
+        done = self.mapped.tell() // mmap.PAGESIZE * mmap.PAGESIZE
+        if done > self.released and hasattr(mmap, "MADV_DONTNEED"):
+            self.mapped.madvise(mmap.MADV_DONTNEED, self.released, done - self.released)
+            self.released = done
+        return chunk
+
+
+class StreamLexer(object):
+    """Lexes a file chunk by chunk and yields tokens as they are found.
+
+    The file is memory mapped when possible, so only the current chunk and
+    the token being matched are held in memory. Offsets are byte offsets
+    into the file, and errors are collected in `errors` while the tokens
+    are consumed.
+    """
+    def __init__(self, _path, _filename=None, _chunk_size=1 << 16):
+        self.path = _path
+        self.filename = _filename or _path
+        self.chunk_size = _chunk_size
+        self.source = FileSource(_path, self.filename)
+        self.errors = []
 
-
-
+    def iter_tokens(self):
+        with open(self.path, "rb") as f:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, OSError):
+                # Empty files and pipes cannot be mapped.
+                yield from self.scan(f)
+                return
+            try:
+                yield from self.scan(MappedReader(mapped))
+            finally:
+                mapped.close()
+
+    def scan(self, reader):
+        source = self.source
+        errors = self.errors
+        chunk_size = self.chunk_size
+        buffer = b""
+        base = 0
+        pos = 0
+        at_eof = False
+
+        while True:
+            match = TOKEN_BYTES_PATTERN.match(buffer, pos)
+            # A match that runs into the end of the buffer may continue in
+            # the next chunk ("=" before "=", a number, an open string), so
+            # it is only trusted once the whole file has been read.
+            if match is None or (not at_eof and match.end() == len(buffer)):
+                if at_eof:
+                    break
+                chunk = reader.read(max(chunk_size, 2 * (len(buffer) - pos)))
+                if not chunk:
+                    at_eof = True
+                base += pos
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+
+            pos = match.end()
+            if match.lastgroup == "SKIP":
+                continue
+            token = match_token(match, base, source, errors)
+            if token is not None:
+                yield Token(token[0], token[1], base + match.start(), base + pos)
+
+        yield Token(EOF, None, base + pos, base + pos)
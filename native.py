@@ -0,0 +1,859 @@
+import os
+import re
+import subprocess
+from token_ import *
+from ast import *
+from visitor import Visitor
+from resolver import Resolver
+from stackless import MAX_DEPTH, mark_tail_returns
+from interpreter import Number, BuiltInFunction, global_vars
+
+# The compiler `build` runs when none is given and $CC is not set.
+DEFAULT_CC = "cc"
+DEFAULT_CFLAGS = ("-O2",)
+
+
+###################
+# Runtime
+###################
+# Included at the top of every program. Values are tagged; T_UNSET marks a
+# frame slot whose name is not set, as None does in the closure engines.
+RUNTIME = r"""#include <math.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+enum { T_UNSET, T_NONE, T_INT, T_FLOAT, T_FUNCTION, T_BUILTIN, T_TAIL };
+
+typedef struct Env Env;
+typedef struct Function Function;
+
+typedef struct Value {
+    int tag;
+    union {
+        int64_t i;
+        double f;
+        Function *fn;
+    } as;
+} Value;
+
+/* A frame. `kept` is set on the frames that are never freed: the program's,
+   those on the C stack, and heap frames a function that sees them may have
+   escaped from. `functions` are the functions made in the frame, which are
+   freed with it. A frame whose functions a tail call uses is `deferred`: it
+   is freed once the tail call returns, and until then is on the list of
+   `pending` frames. */
+struct Env {
+    Value *slots;
+    int size;
+    Env *parent;
+    const char *name;
+    int call_line;
+    int kept;
+    int deferred;
+    Function *functions;
+    Env *pending;
+};
+
+typedef Value (*Code)(Function *self, Value arg, int call_line);
+
+struct Function {
+    Code code;
+    Env *env;
+    Function *next;
+};
+
+static const char *rt_filename;
+static long rt_max_depth;
+static long rt_depth;
+/* The call a T_TAIL value asks its caller to make. */
+static Function *rt_tail_function;
+static Value rt_tail_arg;
+static int rt_tail_line;
+static Env *rt_pending;
+
+static const Value rt_none = {T_NONE, {0}};
+static const Value rt_write = {T_BUILTIN, {0}};
+
+static inline Value rt_int(int64_t i) {
+    Value v;
+    v.tag = T_INT;
+    v.as.i = i;
+    return v;
+}
+
+static inline Value rt_float(double f) {
+    Value v;
+    v.tag = T_FLOAT;
+    v.as.f = f;
+    return v;
+}
+
+static inline int rt_is_number(Value v) {
+    return v.tag == T_INT || v.tag == T_FLOAT;
+}
+
+static inline double rt_double(Value v) {
+    return v.tag == T_INT ? (double)v.as.i : v.as.f;
+}
+
+/* A Python exception the tree walker would have died with. */
+static void rt_crash(const char *type, const char *text) {
+    fflush(stdout);
+    fprintf(stderr, "%s: %s\n", type, text);
+    exit(1);
+}
+
+static void *rt_alloc(size_t size) {
+    void *p = calloc(1, size);
+    if (p == NULL)
+        rt_crash("MemoryError", "out of memory");
+    return p;
+}
+
+static void rt_location(int line) {
+    if (line > 0)
+        printf("File %s, line %d", rt_filename, line);
+    else
+        printf("File <unknown>");
+}
+
+static void rt_traceback(Env *env, int line) {
+    if (env == NULL)
+        return;
+    rt_traceback(env->parent, env->call_line);
+    printf("  ");
+    rt_location(line);
+    printf(", in %s\n", env->name);
+}
+
+/* An RTError, printed as RTError.as_string would. A NULL `env` is an error
+   without a context, which has no traceback lines. */
+static void rt_error(Env *env, int line, const char *text) {
+    printf("Traceback (most recent call last):\n");
+    rt_traceback(env, line);
+    printf("RuntimeError: %s\n", text);
+    exit(1);
+}
+
+/* The frame of the context the tree walker gives `v`: none and the builtin
+   have none, and other values are taken to be from the current one. */
+static inline Env *rt_context_of(Env *env, Value v) {
+    return v.tag == T_NONE || v.tag == T_BUILTIN ? NULL : env;
+}
+
+static inline Env *rt_new_env(Env *parent, int size, const char *name, int call_line) {
+    Env *env = rt_alloc(sizeof(Env));
+    env->slots = rt_alloc(size * sizeof(Value));
+    env->size = size;
+    env->parent = parent;
+    env->name = name;
+    env->call_line = call_line;
+    return env;
+}
+
+static inline Value rt_function(Code code, Env *env) {
+    Value v;
+    v.tag = T_FUNCTION;
+    v.as.fn = rt_alloc(sizeof(Function));
+    v.as.fn->code = code;
+    v.as.fn->env = env;
+    v.as.fn->next = env->functions;
+    env->functions = v.as.fn;
+    return v;
+}
+
+/* `v` may outlive the call it is in: keep the frames a function sees. */
+static inline void rt_escape(Value v) {
+    Env *env;
+    if (v.tag != T_FUNCTION)
+        return;
+    for (env = v.as.fn->env; env != NULL && !env->kept; env = env->parent)
+        env->kept = 1;
+}
+
+/* Whether the function `v` sees the frame `env`. */
+static inline int rt_sees(Value v, Env *env) {
+    Env *seen;
+    if (v.tag != T_FUNCTION)
+        return 0;
+    for (seen = v.as.fn->env; seen != NULL; seen = seen->parent)
+        if (seen == env)
+            return 1;
+    return 0;
+}
+
+/* Free a heap frame whose call has returned, and its functions, unless one
+   of them may have escaped, in which case so may the values it holds. */
+static void rt_free_env(Env *env) {
+    Function *function, *next;
+    int i;
+    if (env->kept) {
+        for (i = 0; i < env->size; i++)
+            rt_escape(env->slots[i]);
+        return;
+    }
+    for (function = env->functions; function != NULL; function = next) {
+        next = function->next;
+        free(function);
+    }
+    free(env->slots);
+    free(env);
+}
+
+/* Return `result` from a call with a heap frame. */
+static inline Value rt_leave(Env *env, Value result) {
+    rt_escape(result);
+    if (env->deferred) {
+        env->pending = rt_pending;
+        rt_pending = env;
+    } else {
+        rt_free_env(env);
+    }
+    return result;
+}
+
+/* repr() of a Python float: the shortest digits that read back as `x`. */
+static void rt_format_float(double x, char *out) {
+    char buffer[40];
+    char digits[20];
+    int precision, exponent, count = 0, i;
+    const char *p;
+
+    if (isnan(x)) {
+        strcpy(out, "nan");
+        return;
+    }
+    if (isinf(x)) {
+        strcpy(out, x < 0 ? "-inf" : "inf");
+        return;
+    }
+    for (precision = 1; precision < 17; precision++) {
+        snprintf(buffer, sizeof buffer, "%.*e", precision - 1, x);
+        if (strtod(buffer, NULL) == x)
+            break;
+    }
+    snprintf(buffer, sizeof buffer, "%.*e", precision - 1, x);
+    p = buffer;
+    if (*p == '-') {
+        *out++ = '-';
+        p++;
+    }
+    for (; *p != 'e'; p++)
+        if (*p != '.')
+            digits[count++] = *p;
+    exponent = atoi(p + 1);
+    while (count > 1 && digits[count - 1] == '0')
+        count--;
+
+    if (exponent < -4 || exponent >= 16) {
+        *out++ = digits[0];
+        if (count > 1) {
+            *out++ = '.';
+            memcpy(out, digits + 1, count - 1);
+            out += count - 1;
+        }
+        sprintf(out, "e%c%02d", exponent < 0 ? '-' : '+', abs(exponent));
+    } else if (exponent < 0) {
+        *out++ = '0';
+        *out++ = '.';
+        for (i = -1; i > exponent; i--)
+            *out++ = '0';
+        memcpy(out, digits, count);
+        out[count] = '\0';
+    } else {
+        for (i = 0; i <= exponent || i < count; i++) {
+            if (i == exponent + 1)
+                *out++ = '.';
+            *out++ = i < count ? digits[i] : '0';
+        }
+        if (count <= exponent + 1) {
+            *out++ = '.';
+            *out++ = '0';
+        }
+        *out = '\0';
+    }
+}
+
+static Value rt_call_write(Value v) {
+    char text[40];
+    switch (v.tag) {
+    case T_INT:
+        printf("%lld", (long long)v.as.i);
+        break;
+    case T_FLOAT:
+        rt_format_float(v.as.f, text);
+        fputs(text, stdout);
+        break;
+    case T_FUNCTION:
+        fputs("FUNCTION anonymous", stdout);
+        break;
+    case T_BUILTIN:
+        fputs("BUILTIN FUNCTION write", stdout);
+        break;
+    default:
+        fputs("none", stdout);
+    }
+    return rt_none;
+}
+
+/* An operation on a value that does not support it, at `line` of the
+   position the value has. */
+static void rt_illegal(Env *env, int line, Value v) {
+    rt_error(rt_context_of(env, v), line, "Illegal Operation");
+}
+
+/* Truth of an `if` or `while` condition; only Numbers have one. */
+static inline int rt_truth(Env *env, int line, Value v) {
+    if (v.tag == T_FLOAT)
+        return v.as.f != 0;
+    if (v.tag == T_INT)
+        return v.as.i != 0;
+    rt_error(env, line, "Illegal Operation");
+    return 0;
+}
+
+/* Binary operations. The inline parts handle two floats, which is what
+   number literals are, and the rest is left to rt_binary. */
+enum { OP_ADD, OP_SUB, OP_MUL, OP_DIV, OP_LT, OP_GT, OP_LE, OP_GE, OP_EQ, OP_NE };
+
+static Value rt_binary(Env *env, int line, int op, Value a, Value b) {
+    double x, y;
+    if (!rt_is_number(a))
+        rt_illegal(env, line, a);
+    if (!rt_is_number(b))
+        rt_illegal(env, line, a);
+    if (a.tag == T_INT && b.tag == T_INT) {
+        /* Wrapping, where Python's ints would grow. */
+        uint64_t i = (uint64_t)a.as.i, j = (uint64_t)b.as.i;
+        switch (op) {
+        case OP_ADD: return rt_int((int64_t)(i + j));
+        case OP_SUB: return rt_int((int64_t)(i - j));
+        case OP_MUL: return rt_int((int64_t)(i * j));
+        case OP_LT: return rt_int(a.as.i < b.as.i);
+        case OP_GT: return rt_int(a.as.i > b.as.i);
+        case OP_LE: return rt_int(a.as.i <= b.as.i);
+        case OP_GE: return rt_int(a.as.i >= b.as.i);
+        case OP_EQ: return rt_int(a.as.i == b.as.i);
+        case OP_NE: return rt_int(a.as.i != b.as.i);
+        }
+    }
+    x = rt_double(a);
+    y = rt_double(b);
+    switch (op) {
+    case OP_ADD: return rt_float(x + y);
+    case OP_SUB: return rt_float(x - y);
+    case OP_MUL: return rt_float(x * y);
+    case OP_DIV:
+        if (y == 0)
+            rt_error(env, line, "Division by 0");
+        return rt_float(x / y);
+    case OP_LT: return rt_int(x < y);
+    case OP_GT: return rt_int(x > y);
+    case OP_LE: return rt_int(x <= y);
+    case OP_GE: return rt_int(x >= y);
+    case OP_EQ: return rt_int(x == y);
+    default: return rt_int(x != y);
+    }
+}
+
+#define RT_ARITHMETIC(name, op, OP) \
+    static inline Value name(Env *env, int line, Value a, Value b) { \
+        if (a.tag == T_FLOAT && b.tag == T_FLOAT) \
+            return rt_float(a.as.f op b.as.f); \
+        return rt_binary(env, line, OP, a, b); \
+    }
+
+#define RT_COMPARISON(name, op, OP) \
+    static inline Value name(Env *env, int line, Value a, Value b) { \
+        if (a.tag == T_FLOAT && b.tag == T_FLOAT) \
+            return rt_int(a.as.f op b.as.f); \
+        return rt_binary(env, line, OP, a, b); \
+    }
+
+RT_ARITHMETIC(rt_add, +, OP_ADD)
+RT_ARITHMETIC(rt_sub, -, OP_SUB)
+RT_ARITHMETIC(rt_mul, *, OP_MUL)
+RT_COMPARISON(rt_lt, <, OP_LT)
+RT_COMPARISON(rt_gt, >, OP_GT)
+RT_COMPARISON(rt_le, <=, OP_LE)
+RT_COMPARISON(rt_ge, >=, OP_GE)
+RT_COMPARISON(rt_eq, ==, OP_EQ)
+RT_COMPARISON(rt_ne, !=, OP_NE)
+
+static inline Value rt_div(Env *env, int line, Value a, Value b) {
+    if (a.tag == T_FLOAT && b.tag == T_FLOAT && b.as.f != 0)
+        return rt_float(a.as.f / b.as.f);
+    return rt_binary(env, line, OP_DIV, a, b);
+}
+
+static inline Value rt_unsupported_unary(Env *env, int line, Value v, const char *text) {
+    if (rt_is_number(v))
+        rt_error(env, line, text);
+    rt_illegal(env, line, v);
+    return v;
+}
+
+static inline Value rt_negate(Env *env, int line, Value v) {
+    if (v.tag == T_FLOAT)
+        return rt_float(-v.as.f);
+    if (v.tag == T_INT)
+        return rt_int((int64_t)(0 - (uint64_t)v.as.i));
+    rt_illegal(env, line, v);
+    return v;
+}
+
+/* A bound of a `for` loop as a whole number. */
+static inline int64_t rt_bound(Env *env, int line, Value v) {
+    if (v.tag == T_INT)
+        return v.as.i;
+    if (v.tag == T_FLOAT && isfinite(v.as.f) && v.as.f == floor(v.as.f)
+            && v.as.f >= -9223372036854775808.0 && v.as.f < 9223372036854775808.0)
+        return (int64_t)v.as.f;
+    rt_error(env, line, "For loop bounds must be whole numbers");
+    return 0;
+}
+
+static Value rt_call(Env *env, int line, Value callee, Value arg) {
+    if (callee.tag == T_FUNCTION) {
+        Function *function = callee.as.fn;
+        Env *pending = rt_pending;
+        Value result;
+        if (rt_depth >= rt_max_depth) {
+            char text[80];
+            snprintf(text, sizeof text, "Maximum call depth of %ld exceeded", rt_max_depth);
+            rt_error(env, line, text);
+        }
+        rt_depth++;
+        result = function->code(function, arg, line);
+        while (result.tag == T_TAIL)
+            result = rt_tail_function->code(rt_tail_function, rt_tail_arg, rt_tail_line);
+        rt_depth--;
+        while (rt_pending != pending) {
+            Env *done = rt_pending;
+            rt_pending = done->pending;
+            rt_free_env(done);
+        }
+        return result;
+    }
+    if (callee.tag == T_BUILTIN)
+        return rt_call_write(arg);
+    rt_illegal(env, line, callee);
+    return rt_none;
+}
+
+/* A call with other than one argument, which is always an error. */
+static inline Value rt_call_arity(Env *env, int line, Value callee, int count) {
+    char text[80];
+    if (callee.tag != T_FUNCTION && callee.tag != T_BUILTIN)
+        rt_illegal(env, line, callee);
+    snprintf(text, sizeof text, "Method takes only 1, %d were given.", count);
+    rt_error(rt_context_of(env, callee), line, text);
+    return rt_none;
+}
+
+/* `return f(x)` at the end of a body: the caller's rt_call makes the call
+   once this body has returned, so tail calls do not grow the C stack. */
+static inline Value rt_tail_call(Env *env, int line, Value callee, Value arg) {
+    Value tail = {T_TAIL, {0}};
+    if (callee.tag != T_FUNCTION)
+        return rt_call(env, line, callee, arg);
+    if (rt_sees(callee, env) || rt_sees(arg, env))
+        env->deferred = 1;
+    rt_tail_function = callee.as.fn;
+    rt_tail_arg = arg;
+    rt_tail_line = line;
+    return tail;
+}
+"""
+
+
+###################
+# CGenerator
+###################
+class CGenerator(Visitor):
+    """Translates a whole program into one C translation unit.
+
+    Each function literal becomes a C function and the program itself
+    becomes `program`, called from `main`. Expressions are flattened into
+    temporaries, so they are evaluated in the same order as by the tree
+    walker. Variables have the slots resolver.Resolver gives them, in
+    frames that are C arrays, allocated on the heap for scopes with
+    functions inside them, since those frames can outlive their call.
+    A heap frame is freed when its call returns, unless a function that
+    sees it has been returned or assigned outside the call, either of
+    which may keep it.
+    Values are tagged; number literals are doubles and ints come from
+    comparisons, `true`, `false` and loop variables, as in the other
+    engines.
+
+    Output and error messages are those of the tree walker. Errors are
+    located where the value is used, as in the unboxed engine. Calls are
+    limited to `max_depth` deep and `return f(...)` at the end of a body
+    is a tail call, as in the stackless engine. Ints are 64-bit.
+    """
+    def __init__(self, source=None, max_depth=MAX_DEPTH):
+        self.source = source
+        self.max_depth = max_depth
+
+    def visit(self, node):
+        func = self.handlers.get(type(node))
+        if func is None:
+            func = self.handler(type(node))
+        return func(self, node)
+
+    def generate(self, node):
+        """The C source of the program `node`."""
+        self.resolver = Resolver().resolve(node, global_vars)
+        self.functions = []
+        self.prototypes = []
+        self.tail_returns = set()
+        self.temps = 0
+        self.lines = []
+        self.indent = 1
+        self.in_function = False
+        self.heap_frame = False
+        self.visit(node)
+        program = self.lines
+
+        root = self.resolver.scopes[node]
+        filename = self.source.filename if self.source is not None else "<unknown>"
+        main = [
+            "int main(void) {",
+            f"    static Value slots[{len(root.names) + 1}];",
+            '    Env root = {.slots = slots, .name = "<program>", .kept = 1};',
+            f"    rt_filename = {c_string(filename)};",
+            f"    rt_max_depth = {self.max_depth};",
+        ]
+        for name, value in global_vars.items():
+            main.append(f"    slots[{root.slots[name]}] = {c_constant(value)};")
+        main += ["    program(&root);", "    return 0;", "}"]
+
+        parts = [RUNTIME]
+        parts += self.prototypes
+        parts.append("")
+        for function in self.functions:
+            parts += function
+            parts.append("")
+        parts.append("static void program(Env *env) {")
+        if uses(program, "slots"):
+            parts.append("    Value *slots = env->slots;")
+        parts += program
+        parts.append("}")
+        parts.append("")
+        parts += main
+        return "\n".join(parts) + "\n"
+
+    def emit(self, line):
+        self.lines.append("    " * self.indent + line)
+
+    def temp(self, code):
+        """Evaluate the C expression `code` into a new temporary."""
+        self.temps += 1
+        name = f"t{self.temps}"
+        self.emit(f"Value {name} = {code};")
+        return name
+
+    def line(self, position):
+        # Line of a position as errors print it, 0 for unknown.
+        if self.source is None or position is None:
+            return 0
+        return self.source.line_of(position) + 1
+
+    def crash(self, exception, message):
+        self.emit(f"rt_crash({c_string(exception)}, {c_string(message)});")
+
+    def no_visit_method(self, node):
+        # The tree walker only fails once it reaches the node.
+        self.crash("NotImplementedError", f"No visit method for {type(node).__name__}")
+        return "rt_none"
+
+    def visit_Program(self, node):
+        self.visit_statements(node.statements)
+
+    def visit_Block(self, node):
+        self.visit_statements(node.statements)
+        return "rt_none"
+
+    def visit_statements(self, statements):
+        for stmt in statements:
+            value = self.visit(stmt)
+            if not value.isidentifier():
+                self.emit(f"{value};")
+
+    def block(self, node):
+        self.indent += 1
+        self.visit(node)
+        self.indent -= 1
+
+    def visit_NumberNode(self, node):
+        return f"rt_float({c_double(float(node.tok.value))})"
+
+    def visit_IdentifierNode(self, node):
+        address = self.resolver.addresses[node]
+        name = self.temp(slot(*address[0]))
+        for depth, frame_slot in address[1:]:
+            self.emit(f"if ({name}.tag == T_UNSET) {name} = {slot(depth, frame_slot)};")
+        self.emit(f"if ({name}.tag == T_UNSET) rt_error(env, {self.line(node.position_start)}, {c_string(f'Name {node.tok.value} does not exist')});")
+        return name
+
+    def visit_UnaryOperationNode(self, node):
+        operand = self.temp(self.visit(node.node))
+        line = self.line(node.operation_tok.position_start)
+        operation = node.operation_tok.type
+        if operation == MINUS:
+            return f"rt_negate(env, {line}, {operand})"
+        message = f"Unsupported unary operation for {TOKEN_NAMES[operation]}"
+        return f"rt_unsupported_unary(env, {line}, {operand}, {c_string(message)})"
+
+    def visit_BinaryOperationNode(self, node):
+        left = self.temp(self.visit(node.left_node))
+        right = self.visit(node.right_node)
+        function = BINARY_OPERATIONS[node.operation_tok.type]
+        return f"{function}(env, {self.line(node.position_start)}, {left}, {right})"
+
+    def visit_VarAssignNode(self, node):
+        return self.assign(node.var_name, node.var_value)
+
+    def visit_ConstAssignNode(self, node):
+        return self.assign(node.const_name, node.const_value)
+
+    def assign(self, name_node, value_node):
+        value = self.temp(self.visit(value_node))
+        if any(depth for depth, frame_slot in self.resolver.addresses[name_node]):
+            self.emit(f"rt_escape({value});")
+        self.emit(f"*{self.assignment_target(name_node)} = {value};")
+        return "rt_none"
+
+    def assignment_target(self, name_node):
+        # As closures.assignment_target: the name's own slot, unless it is
+        # unset and an enclosing scope has the name set.
+        address = self.resolver.addresses[name_node]
+        self.temps += 1
+        target = f"p{self.temps}"
+        self.emit(f"Value *{target} = &{slot(*address[0])};")
+        if len(address) > 1:
+            self.emit(f"if ({target}->tag == T_UNSET) {{")
+            keyword = "if"
+            for depth, frame_slot in address[1:]:
+                self.emit(f"    {keyword} ({slot(depth, frame_slot)}.tag != T_UNSET) {target} = &{slot(depth, frame_slot)};")
+                keyword = "else if"
+            self.emit("}")
+        return target
+
+    def visit_FunctionNode(self, node):
+        arg_node = node.arg_node
+        if not isinstance(arg_node, IdentifierNode):
+            self.emit(f'rt_error(env, {self.line(arg_node.position_start)}, "Function argument must be an identifier");')
+            return "rt_none"
+
+        name = f"fn_{len(self.functions) + 1}"
+        scope = self.resolver.scopes[node]
+        signature = f"static Value {name}(Function *self, Value arg, int call_line)"
+        self.prototypes.append(signature + ";")
+        # Reserve the place so nested functions are numbered after this one.
+        index = len(self.functions)
+        self.functions.append(None)
+
+        saved = self.lines, self.indent, self.in_function, self.heap_frame
+        self.lines, self.indent, self.in_function, self.heap_frame = [], 1, True, scope.has_functions
+        mark_tail_returns(node.code_block, self.tail_returns)
+        self.visit(node.code_block)
+        self.emit(f"return {self.leave('rt_none')};")
+        body, self.lines = self.lines, []
+        size = len(scope.names) + 1
+        if scope.has_functions:
+            self.emit(f'Env *env = rt_new_env(self->env, {size}, "anonymous", call_line);')
+            self.emit("Value *slots = env->slots;")
+        else:
+            self.emit(f"Value slots[{size}] = {{{{T_UNSET, {{0}}}}}};")
+            self.emit('Env frame = {.slots = slots, .parent = self->env, .name = "anonymous", .call_line = call_line, .kept = 1};')
+            self.emit("Env *env = &frame;")
+            # Only errors use the frame of a function without functions.
+            if not uses(body, "env"):
+                self.emit("(void)env;")
+        self.emit(f"slots[{scope.arg_slots[0]}] = arg;")
+        self.functions[index] = [signature + " {"] + self.lines + body + ["}"]
+        self.lines, self.indent, self.in_function, self.heap_frame = saved
+
+        return f"rt_function({name}, env)"
+
+    def leave(self, value):
+        # What a function body returns `value` with.
+        return f"rt_leave(env, {value})" if self.heap_frame else value
+
+    def visit_CallNode(self, node):
+        operand = self.temp(self.visit(node.operand))
+        args = [self.temp(self.visit(arg)) for arg in node.arg_node.args]
+        line = self.line(node.position_start)
+        if len(args) != 1:
+            return f"rt_call_arity(env, {line}, {operand}, {len(args)})"
+        return f"rt_call(env, {line}, {operand}, {args[0]})"
+
+    def visit_ReturnNode(self, node):
+        # A `return` whose value is none does not end the body.
+        value_node = node.return_value
+        if node in self.tail_returns and len(value_node.arg_node.args) == 1:
+            operand = self.temp(self.visit(value_node.operand))
+            arg = self.temp(self.visit(value_node.arg_node.args[0]))
+            value = self.temp(f"rt_tail_call(env, {self.line(value_node.position_start)}, {operand}, {arg})")
+        else:
+            value = self.temp(self.visit(value_node))
+        leave = f"return {self.leave(value)}" if self.in_function else "return"
+        self.emit(f"if ({value}.tag != T_NONE) {leave};")
+        return value
+
+    def condition(self, node):
+        """(test, lines) for the condition `node`: the C test of its truth
+        and the statements that have to run before it."""
+        lines, self.lines = self.lines, []
+        value = self.visit(node)
+        lines, self.lines = self.lines, lines
+        return f"rt_truth(env, {self.line(node.position_start)}, {value})", lines
+
+    def visit_IfNode(self, node):
+        test, lines = self.condition(node.if_condition)
+        self.lines += lines
+        self.emit(f"if ({test}) {{")
+        self.block(node.if_block_statement)
+        nested = 0
+        for condition, block in zip(node.elif_conditions or (), node.elif_block_statements or ()):
+            self.indent += 1
+            test, lines = self.condition(condition)
+            self.indent -= 1
+            if lines:
+                # Only an else block can hold the statements before the test.
+                self.emit("} else {")
+                self.indent += 1
+                nested += 1
+                self.lines += lines
+                self.emit(f"if ({test}) {{")
+            else:
+                self.emit(f"}} else if ({test}) {{")
+            self.block(block)
+        if node.else_block_statement:
+            self.emit("} else {")
+            self.block(node.else_block_statement)
+        self.emit("}")
+        for _ in range(nested):
+            self.indent -= 1
+            self.emit("}")
+        return "rt_none"
+
+    def visit_WhileNode(self, node):
+        self.emit("for (;;) {")
+        self.indent += 1
+        test, lines = self.condition(node.condition)
+        self.lines += lines
+        self.emit(f"if (!{test}) break;")
+        self.visit(node.block)
+        self.indent -= 1
+        self.emit("}")
+        return "rt_none"
+
+    def visit_ForNode(self, node):
+        self.emit("{")
+        self.indent += 1
+        bounds = [node.start_value, node.end_value]
+        if node.step_value is not None:
+            bounds.append(node.step_value)
+        values = [self.temp(self.visit(bound)) for bound in bounds]
+        start, end = [f"rt_bound(env, {self.line(bound.position_start)}, {value})" for bound, value in zip(bounds, values)][:2]
+        self.emit(f"int64_t start = {start}, end = {end}, step = 1;")
+        if node.step_value is not None:
+            line = self.line(node.step_value.position_start)
+            self.emit(f"step = rt_bound(env, {line}, {values[2]});")
+            self.emit(f'if (step == 0) rt_error(env, {line}, "For loop step must not be 0");')
+        target = self.assignment_target(node.var_name)
+        condition = "i < end" if node.step_value is None else "(step > 0 ? i < end : i > end)"
+        self.emit(f"for (int64_t i = start; {condition}; i += step) {{")
+        self.indent += 1
+        self.emit(f"*{target} = rt_int(i);")
+        self.visit(node.block)
+        self.indent -= 1
+        self.emit("}")
+        self.indent -= 1
+        self.emit("}")
+        return "rt_none"
+
+    def visit_BreakNode(self, node):
+        self.emit("break;")
+        return "rt_none"
+
+    def visit_ContinueNode(self, node):
+        self.emit("continue;")
+        return "rt_none"
+
+
+BINARY_OPERATIONS = {
+    PLUS: "rt_add",
+    MINUS: "rt_sub",
+    ASTERISK: "rt_mul",
+    SLASH: "rt_div",
+    LESS_THAN: "rt_lt",
+    GREATER_THAN: "rt_gt",
+    LESS_THAN_OR_EQUAL: "rt_le",
+    GREATER_THAN_OR_EQUAL: "rt_ge",
+    DOUBLE_EQUAL: "rt_eq",
+    NOT_EQUAL: "rt_ne",
+}
+
+
+def uses(lines, name):
+    """Whether the C `lines` mention the variable `name`."""
+    pattern = re.compile(rf"\b{name}\b")
+    return any(pattern.search(line) for line in lines)
+
+
+def slot(depth, frame_slot):
+    """The C lvalue of a frame slot `depth` scopes out."""
+    if depth == 0:
+        return f"slots[{frame_slot}]"
+    return "env" + "->parent" * depth + f"->slots[{frame_slot}]"
+
+
+def c_string(text):
+    escaped = []
+    for char in text:
+        if char in '"\\':
+            escaped.append("\\" + char)
+        elif " " <= char <= "~":
+            escaped.append(char)
+        else:
+            escaped.append("".join(f"\\{byte:03o}" for byte in char.encode("utf-8")))
+    return '"' + "".join(escaped) + '"'
+
+
+def c_double(value):
+    # Hex floats are exact.
+    if value == float("inf"):
+        return "HUGE_VAL"
+    return value.hex()
+
+
+def c_constant(value):
+    """The C Value for one of interpreter.global_vars."""
+    if type(value) is Number:
+        if type(value.value) is int:
+            return f"rt_int({value.value})"
+        return f"rt_float({c_double(value.value)})"
+    if type(value) is BuiltInFunction:
+        return "rt_write"
+    return "rt_none"
+
+
+###################
+# Building
+###################
+def build(c_path, executable, cc=None, flags=DEFAULT_CFLAGS):
+    """Compile the C file at `c_path` to `executable`. Returns the compiler's
+    error output, or None if it succeeded."""
+    cc = cc or os.environ.get("CC", DEFAULT_CC)
+    try:
+        result = subprocess.run([cc, *flags, "-o", executable, c_path, "-lm"], capture_output=True, text=True)
+    except OSError as e:
+        return str(e)
+    if result.returncode != 0:
+        return result.stderr or f"{cc} exited with status {result.returncode}"
+    return None
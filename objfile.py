@@ -0,0 +1,242 @@
+import mmap
+import struct
+from bisect import bisect_right
+
+###################
+# Layout
+###################
+# A file starts with the header: magic, format version, a reserved field,
+# then the (offset, size) of each section in SECTIONS order. Sections are
+# 8-byte aligned so the constant pool can be viewed as doubles in place.
+MAGIC = b"OASB"
+FORMAT_VERSION = 5
+SECTIONS = ("code", "constants", "strings", "functions", "symbols", "positions")
+HEADER = struct.Struct("<4sHH" + "II" * len(SECTIONS))
+
+# Addresses of the program's variables, the constant pool and the string
+# pool start here, as in Compiler. Each region ends where the next one
+# starts, and the strings where NO_NAME does. A region holds 0x20000000
+# entries, as many doubles as a section's 32-bit size allows.
+VARIABLE_BASE = 0x20000000
+CONSTANT_BASE = 0x40000000
+STRING_BASE = 0x60000000
+ADDRESS_END = 0x80000000
+
+# A symbol entry is its address, its type, and the length of its UTF-8
+# name, followed by the name.
+SYMBOL = struct.Struct("<IBH")
+
+# A string is the length of its UTF-8 encoding followed by the encoding.
+STRING = struct.Struct("<I")
+
+# A function is the offset of its body, how many slots its frame has and
+# which one the argument goes in.
+FUNCTION = struct.Struct("<III")
+
+
+def align(size):
+    return (size + 7) & ~7
+
+
+###################
+# Varints
+###################
+# The position table is a list of (code offset, start, end) rows stored as
+# deltas from the previous row: offset and start as zigzag varints, end as
+# a varint length.
+def write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def unzigzag(value):
+    return value >> 1 if not value & 1 else -(value >> 1) - 1
+
+
+def encode_positions(positions):
+    out = bytearray()
+    last_offset = 0
+    last_start = 0
+    for offset, start, end in positions:
+        if start is None or end is None:
+            continue
+        write_varint(out, offset - last_offset)
+        write_varint(out, zigzag(start - last_start))
+        write_varint(out, end - start)
+        last_offset = offset
+        last_start = start
+    return out
+
+
+def decode_positions(data):
+    offsets = []
+    ranges = []
+    offset = 0
+    start = 0
+    pos = 0
+    while pos < len(data):
+        delta, pos = read_varint(data, pos)
+        offset += delta
+        delta, pos = read_varint(data, pos)
+        start += unzigzag(delta)
+        length, pos = read_varint(data, pos)
+        offsets.append(offset)
+        ranges.append((start, start + length))
+    return offsets, ranges
+
+
+###################
+# ObjectFile
+###################
+class ObjectFile(object):
+    """A compiled program: code, constant pool, string pool, function
+    table, symbols and positions.
+
+    Loaded files keep views into their buffer rather than copies: `code` is
+    a memoryview of bytes and `constants` a memoryview of doubles indexed
+    by constant address minus CONSTANT_BASE. `strings` is a list indexed
+    by string address minus STRING_BASE and `functions` a list of (offset,
+    slot count, argument slot). The position table is only decoded the
+    first time `position_of` is called.
+    """
+    def __init__(self, code, constants, symbols, positions, strings=(), functions=()):
+        self.code = code
+        self.constants = constants
+        self.symbols = symbols
+        self.positions = positions
+        self.strings = list(strings)
+        self.functions = list(functions)
+        self._position_index = None
+
+    @classmethod
+    def from_compiler(cls, compiler):
+        constants = [0.0] * len(compiler.constants)
+        for constant in compiler.constants.values():
+            constants[constant.address - CONSTANT_BASE] = constant.data
+        strings = [""] * len(compiler.strings)
+        for string in compiler.strings.values():
+            strings[string.address - STRING_BASE] = string.data
+        symbols = {name: (variable.address, variable.type) for name, variable in compiler.variables.items()}
+        return cls(
+            bytes(compiler.code),
+            memoryview(struct.pack(f"<{len(constants)}d", *constants)).cast("d"),
+            symbols,
+            encode_positions(compiler.positions),
+            strings,
+            compiler.functions,
+        )
+
+    @classmethod
+    def from_buffer(cls, buffer):
+        """Read an object file from a bytes-like object without copying."""
+        view = memoryview(buffer)
+        if len(view) < HEADER.size:
+            raise ValueError("object file is truncated")
+        fields = HEADER.unpack_from(view)
+        magic, version = fields[:2]
+        if magic != MAGIC:
+            raise ValueError("not an object file")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"object file format {version} is not supported (expected {FORMAT_VERSION})")
+        sections = {}
+        for i, name in enumerate(SECTIONS):
+            offset, size = fields[3 + 2 * i], fields[4 + 2 * i]
+            if offset + size > len(view):
+                raise ValueError(f"{name} section runs past the end of the file")
+            sections[name] = view[offset:offset + size]
+
+        symbols = {}
+        data = sections["symbols"]
+        pos = 0
+        while pos < len(data):
+            address, type, length = SYMBOL.unpack_from(data, pos)
+            pos += SYMBOL.size
+            symbols[bytes(data[pos:pos + length]).decode("utf-8")] = (address, type)
+            pos += length
+
+        strings = []
+        data = sections["strings"]
+        pos = 0
+        while pos < len(data):
+            length, = STRING.unpack_from(data, pos)
+            pos += STRING.size
+            strings.append(bytes(data[pos:pos + length]).decode("utf-8", "surrogatepass"))
+            pos += length
+
+        functions = list(FUNCTION.iter_unpack(sections["functions"]))
+        return cls(sections["code"], sections["constants"].cast("d"), symbols, sections["positions"], strings, functions)
+
+    def to_bytes(self):
+        symbols = bytearray()
+        for name, (address, type) in self.symbols.items():
+            encoded = name.encode("utf-8")
+            symbols += SYMBOL.pack(address, type, len(encoded)) + encoded
+
+        strings = bytearray()
+        for string in self.strings:
+            encoded = string.encode("utf-8", "surrogatepass")
+            strings += STRING.pack(len(encoded)) + encoded
+
+        contents = {
+            "code": bytes(self.code),
+            "constants": self.constants.tobytes(),
+            "strings": bytes(strings),
+            "functions": b"".join(FUNCTION.pack(*function) for function in self.functions),
+            "symbols": bytes(symbols),
+            "positions": bytes(self.positions),
+        }
+        out = bytearray(HEADER.size)
+        offsets = []
+        for name in SECTIONS:
+            out += bytes(align(len(out)) - len(out))
+            offsets += (len(out), len(contents[name]))
+            out += contents[name]
+        HEADER.pack_into(out, 0, MAGIC, FORMAT_VERSION, 0, *offsets)
+        return bytes(out)
+
+    def position_of(self, pc):
+        """Source range of the instruction at `pc`, or (None, None)."""
+        if self._position_index is None:
+            self._position_index = decode_positions(self.positions)
+        offsets, ranges = self._position_index
+        i = bisect_right(offsets, pc) - 1
+        if i < 0:
+            return None, None
+        return ranges[i]
+
+
+def save(path, program):
+    with open(path, "wb") as f:
+        f.write(program.to_bytes())
+
+
+def load(path):
+    """Map an object file into memory and read it in place.
+
+    Falls back to reading the file for empty files or where mmap is not
+    available.
+    """
+    with open(path, "rb") as f:
+        try:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            buffer = f.read()
+    return ObjectFile.from_buffer(buffer)
@@ -0,0 +1,521 @@
+import math
+import time
+import operator
+from token_ import *
+from ast import *
+from visitor import Visitor
+from interpreter import global_vars
+
+
+###################
+# Constants
+###################
+# How the engines compute each operator on two numbers. Comparisons give an
+# int, like Number.lt and the others.
+OPERATIONS = {
+    PLUS: operator.add,
+    MINUS: operator.sub,
+    ASTERISK: operator.mul,
+    SLASH: operator.truediv,
+    LESS_THAN: lambda left, right: int(left < right),
+    GREATER_THAN: lambda left, right: int(left > right),
+    LESS_THAN_OR_EQUAL: lambda left, right: int(left <= right),
+    GREATER_THAN_OR_EQUAL: lambda left, right: int(left >= right),
+    DOUBLE_EQUAL: lambda left, right: int(left == right),
+    NOT_EQUAL: lambda left, right: int(left != right),
+}
+
+
+def constant_value(node):
+    """The number `node` evaluates to on every run, or None when that
+    depends on run time or evaluating it is an error."""
+    if isinstance(node, NumberNode):
+        # Number literals always evaluate to floats.
+        return float(node.tok.value)
+    if isinstance(node, UnaryOperationNode):
+        return negate(node.operation_tok.type, constant_value(node.node))
+    if isinstance(node, BinaryOperationNode):
+        if node.operation_tok.type not in OPERATIONS:
+            return None
+        left = constant_value(node.left_node)
+        if left is None:
+            return None
+        return evaluate(node.operation_tok.type, left, constant_value(node.right_node))
+    return None
+
+
+def negate(operation, value):
+    if operation != MINUS or value is None:
+        return None
+    return -value
+
+
+def evaluate(operation, left, right):
+    if left is None or right is None or operation not in OPERATIONS:
+        return None
+    if operation == SLASH and right == 0:
+        return None
+    value = OPERATIONS[operation](left, right)
+    return value if math.isfinite(value) else None
+
+
+def make_number(value, position_start, position_end):
+    """A NumberNode for the float `value`."""
+    # Whole numbers get an INT token so Compiler can push them as
+    # immediates; they still evaluate to floats.
+    if value.is_integer() and 0 <= value <= 0xffff and math.copysign(1, value) > 0:
+        tok = Token(INT, int(value), position_start, position_end)
+    else:
+        tok = Token(FLOAT, value, position_start, position_end)
+    return NumberNode(tok, position_start, position_end)
+
+
+###################
+# Transformer
+###################
+class Transformer(Visitor):
+    """Base of the optimizer passes: rebuilds the tree bottom up.
+
+    Nodes are never changed in place, since parse trees can be shared with
+    the parse cache and incremental reparsing. A visit returns the node
+    itself when nothing under it changed and a new node otherwise. Lists
+    of statements go through `visit_statements`, which passes override
+    to replace a statement by several or by none.
+
+    `counts` holds what the pass did, by description.
+    """
+    name = None
+
+    def __init__(self):
+        self.counts = {}
+
+    def visit(self, node):
+        func = self.handlers.get(type(node))
+        if func is None:
+            func = self.handler(type(node))
+        return func(self, node)
+
+    def run(self, program):
+        return self.visit(program)
+
+    def count(self, description, n=1):
+        if n:
+            self.counts[description] = self.counts.get(description, 0) + n
+
+    def no_visit_method(self, node):
+        # Strings, lists, sets and indexing are left as they are.
+        return node
+
+    def visit_statements(self, statements):
+        new_statements = []
+        changed = False
+        for stmt in statements:
+            new = self.visit(stmt)
+            if new is not stmt:
+                changed = True
+            new_statements.append(new)
+        return new_statements if changed else statements
+
+    def visit_Program(self, node):
+        statements = self.visit_statements(node.statements)
+        if statements is node.statements:
+            return node
+        program = Program()
+        program.statements = statements
+        program.position_start = node.position_start
+        program.position_end = node.position_end
+        return program
+
+    def visit_Block(self, node):
+        statements = self.visit_statements(node.statements)
+        if statements is node.statements:
+            return node
+        block = Block(node.position_start, node.position_end)
+        block.statements = statements
+        return block
+
+    def visit_NumberNode(self, node):
+        return node
+
+    def visit_IdentifierNode(self, node):
+        return node
+
+    def visit_UnaryOperationNode(self, node):
+        operand = self.visit(node.node)
+        if operand is node.node:
+            return node
+        return UnaryOperationNode(node.operation_tok, operand, node.position_start, node.position_end)
+
+    def visit_BinaryOperationNode(self, node):
+        left = self.visit(node.left_node)
+        right = self.visit(node.right_node)
+        if left is node.left_node and right is node.right_node:
+            return node
+        return BinaryOperationNode(left, node.operation_tok, right, node.position_start, node.position_end)
+
+    def visit_VarAssignNode(self, node):
+        value = self.visit(node.var_value)
+        if value is node.var_value:
+            return node
+        return VarAssignNode(node.var_name, value, node.position_start, node.position_end)
+
+    def visit_ConstAssignNode(self, node):
+        value = self.visit(node.const_value)
+        if value is node.const_value:
+            return node
+        return ConstAssignNode(node.const_name, value, node.position_start, node.position_end)
+
+    def visit_ReturnNode(self, node):
+        value = self.visit(node.return_value)
+        if value is node.return_value:
+            return node
+        return ReturnNode(value, node.position_start, node.position_end)
+
+    def visit_FunctionNode(self, node):
+        code_block = self.visit(node.code_block)
+        if code_block is node.code_block:
+            return node
+        return FunctionNode(node.name, node.arg_node, code_block, node.position_start, node.position_end)
+
+    def visit_CallNode(self, node):
+        operand = self.visit(node.operand)
+        args = [self.visit(arg) for arg in node.arg_node.args]
+        if operand is node.operand and all(new is old for new, old in zip(args, node.arg_node.args)):
+            return node
+        arg_node = ArgNode(args, node.arg_node.position_start, node.arg_node.position_end)
+        return CallNode(operand, arg_node, node.position_start, node.position_end)
+
+    def visit_IfNode(self, node):
+        if_condition = self.visit(node.if_condition)
+        if_block = self.visit(node.if_block_statement)
+        elif_conditions = node.elif_conditions and [self.visit(condition) for condition in node.elif_conditions]
+        elif_blocks = node.elif_block_statements and [self.visit(block) for block in node.elif_block_statements]
+        else_block = node.else_block_statement and self.visit(node.else_block_statement)
+        if (if_condition is node.if_condition and if_block is node.if_block_statement
+                and else_block is node.else_block_statement
+                and all(new is old for new, old in zip(elif_conditions or (), node.elif_conditions or ()))
+                and all(new is old for new, old in zip(elif_blocks or (), node.elif_block_statements or ()))):
+            return node
+        return IfNode(if_condition, if_block, elif_conditions, elif_blocks, else_block, node.position_start, node.position_end)
+
+    def visit_WhileNode(self, node):
+        condition = self.visit(node.condition)
+        block = self.visit(node.block)
+        if condition is node.condition and block is node.block:
+            return node
+        return WhileNode(condition, block, node.position_start, node.position_end)
+
+    def visit_ForNode(self, node):
+        start_value = self.visit(node.start_value)
+        end_value = self.visit(node.end_value)
+        step_value = node.step_value and self.visit(node.step_value)
+        block = self.visit(node.block)
+        if (start_value is node.start_value and end_value is node.end_value
+                and step_value is node.step_value and block is node.block):
+            return node
+        return ForNode(node.var_name, start_value, end_value, step_value, block, node.position_start, node.position_end)
+
+    def visit_BreakNode(self, node):
+        return node
+
+    def visit_ContinueNode(self, node):
+        return node
+
+
+###################
+# Passes
+###################
+class FoldConstants(Transformer):
+    """Replaces arithmetic on literals with its result.
+
+    Only results that are floats become literals, as every literal is read
+    as a float; a comparison, which gives an int, is folded only as part of
+    a larger expression. Division by 0 is left for run time to report.
+    """
+    name = "fold"
+
+    def __init__(self):
+        super().__init__()
+        # Values of the constant nodes seen so far, so each node is only
+        # evaluated once.
+        self.values = {}
+
+    def visit_NumberNode(self, node):
+        self.values[node] = float(node.tok.value)
+        return node
+
+    def visit_UnaryOperationNode(self, node):
+        node = super().visit_UnaryOperationNode(node)
+        value = negate(node.operation_tok.type, self.values.get(node.node))
+        if value is not None:
+            self.values[node] = value
+        return node
+
+    def visit_BinaryOperationNode(self, node):
+        node = super().visit_BinaryOperationNode(node)
+        value = evaluate(node.operation_tok.type, self.values.get(node.left_node), self.values.get(node.right_node))
+        if type(value) is float:
+            self.count("expressions folded")
+            node = make_number(value, node.position_start, node.position_end)
+        if value is not None:
+            self.values[node] = value
+        return node
+
+
+class EliminateDeadBranches(Transformer):
+    """Drops the branches of `if` statements whose conditions are constant.
+
+    The statements of the one branch that always runs take the place of
+    the `if`, which runs no differently since blocks have no scope of their
+    own. A `while` whose condition is constant and false is dropped.
+    """
+    name = "branches"
+
+    def visit_statements(self, statements):
+        new_statements = []
+        changed = False
+        for stmt in statements:
+            if isinstance(stmt, WhileNode) and constant_value(stmt.condition) == 0:
+                changed = True
+                self.count("loops removed")
+                continue
+            block = self.taken_block(stmt) if isinstance(stmt, IfNode) else stmt
+            if block is stmt:
+                new = self.visit(stmt)
+                if new is not stmt:
+                    changed = True
+                new_statements.append(new)
+                continue
+            changed = True
+            self.count("ifs resolved")
+            self.count("blocks removed", self.block_count(stmt) - (block is not None))
+            if block is not None:
+                new_statements.extend(self.visit(block).statements)
+        return new_statements if changed else statements
+
+    def taken_block(self, node):
+        """The block `node` always runs, None if it never runs one, or
+        `node` itself when that is not known before run time."""
+        condition = constant_value(node.if_condition)
+        if condition is None:
+            return node
+        if condition != 0:
+            return node.if_block_statement
+        for elif_condition, elif_block in zip(node.elif_conditions or (), node.elif_block_statements or ()):
+            condition = constant_value(elif_condition)
+            if condition is None:
+                return node
+            if condition != 0:
+                return elif_block
+        return node.else_block_statement
+
+    def block_count(self, node):
+        return 1 + len(node.elif_conditions or ()) + (node.else_block_statement is not None)
+
+
+class PropagateLets(Transformer):
+    """Replaces the names of `let` constants with their values.
+
+    A `let` at the top level of the program or of a function body whose
+    value is a constant float, and whose name is not bound anywhere else
+    in that body nor by any scope around it, is inlined into every later
+    use. A `let` runs like a `var`, so where an outer scope binds the name
+    it writes that binding and has to stay. Uses in functions whose
+    argument has the same name are left alone. The `let` itself is then
+    dropped, unless one of those or a use before it still reads the name.
+
+    Every other `let` becomes a `var`, which is how the engines run it.
+    """
+    name = "let"
+
+    def __init__(self):
+        super().__init__()
+        # Constants in effect: name -> value.
+        self.constants = {}
+        # Names read and not inlined in the body being visited.
+        self.reads = set()
+        # Names bound by the scopes around the body being visited.
+        self.bound = set()
+
+    def run(self, program):
+        return self.visit_scope(program, global_vars)
+
+    def visit_scope(self, node, names=()):
+        # `node` is the program or a function body and `names` the names
+        # it binds besides its assignments. Only its own statement list is
+        # checked for lets to inline; the lets inside `if` blocks may not
+        # run.
+        outer_constants = self.constants
+        outer_reads = self.reads
+        outer_bound = self.bound
+        self.constants = dict(outer_constants)
+        self.reads = set()
+        bindings = {}
+        count_bindings(node, bindings)
+        self.bound = outer_bound | own_bindings(node) | set(names)
+
+        statements = []
+        inlined = []
+        changed = False
+        for stmt in node.statements:
+            if isinstance(stmt, ConstAssignNode):
+                name = stmt.const_name.tok.value
+                value_node = self.visit(stmt.const_value)
+                value = constant_value(value_node)
+                changed = True
+                if type(value) is float and bindings[name] == 1 and name not in outer_bound:
+                    self.constants[name] = value
+                    inlined.append((len(statements), stmt, value_node))
+                    continue
+                self.count("lets made vars")
+                statements.append(VarAssignNode(stmt.const_name, value_node, stmt.position_start, stmt.position_end))
+                continue
+            new = self.visit(stmt)
+            if new is not stmt:
+                changed = True
+            statements.append(new)
+        reads = self.reads
+        self.constants = outer_constants
+        self.reads = outer_reads
+        self.bound = outer_bound
+        outer_reads.update(reads)
+
+        # Put back the lets whose names are still read, before the let or
+        # where an argument hides it, from the last so the recorded indices
+        # stay right.
+        for index, stmt, value_node in reversed(inlined):
+            name = stmt.const_name.tok.value
+            if name in reads:
+                self.count("lets made vars")
+                statements.insert(index, VarAssignNode(stmt.const_name, value_node, stmt.position_start, stmt.position_end))
+            else:
+                self.count("lets removed")
+
+        if not changed:
+            return node
+        if isinstance(node, Program):
+            new_node = Program()
+            new_node.position_start = node.position_start
+            new_node.position_end = node.position_end
+        else:
+            new_node = Block(node.position_start, node.position_end)
+        new_node.statements = statements
+        return new_node
+
+    def visit_ConstAssignNode(self, node):
+        # A let not at the top level of its body.
+        self.count("lets made vars")
+        return VarAssignNode(node.const_name, self.visit(node.const_value), node.position_start, node.position_end)
+
+    def visit_IdentifierNode(self, node):
+        value = self.constants.get(node.tok.value)
+        if value is None:
+            self.reads.add(node.tok.value)
+            return node
+        self.count("uses inlined")
+        return make_number(value, node.position_start, node.position_end)
+
+    def visit_FunctionNode(self, node):
+        outer_constants = self.constants
+        if isinstance(node.arg_node, IdentifierNode) and node.arg_node.tok.value in outer_constants:
+            self.constants = dict(outer_constants)
+            del self.constants[node.arg_node.tok.value]
+        names = [node.arg_node.tok.value] if isinstance(node.arg_node, IdentifierNode) else []
+        code_block = self.visit_scope(node.code_block, names)
+        self.constants = outer_constants
+        if code_block is node.code_block:
+            return node
+        return FunctionNode(node.name, node.arg_node, code_block, node.position_start, node.position_end)
+
+
+def count_bindings(node, bindings):
+    """Add to `bindings` how many times each name is assigned, declared
+    with `let` or used by a `for` loop under `node`."""
+    if isinstance(node, (VarAssignNode, ConstAssignNode, ForNode)):
+        name = (node.const_name if isinstance(node, ConstAssignNode) else node.var_name).tok.value
+        bindings[name] = bindings.get(name, 0) + 1
+    for child in children(node):
+        count_bindings(child, bindings)
+
+
+def own_bindings(node):
+    """The names assigned, declared with `let` or used by a `for` loop
+    under `node`, leaving out the bodies of functions."""
+    names = set()
+    if isinstance(node, (VarAssignNode, ConstAssignNode, ForNode)):
+        names.add((node.const_name if isinstance(node, ConstAssignNode) else node.var_name).tok.value)
+    if not isinstance(node, FunctionNode):
+        for child in children(node):
+            names |= own_bindings(child)
+    return names
+
+
+def children(node):
+    """The nodes directly under `node`, including the name being assigned."""
+    if isinstance(node, (Program, Block)):
+        return node.statements
+    if isinstance(node, CallNode):
+        return [node.operand] + node.arg_node.args
+    if isinstance(node, IfNode):
+        return ([node.if_condition, node.if_block_statement] + list(node.elif_conditions or ())
+                + list(node.elif_block_statements or ()) + [node.else_block_statement] * (node.else_block_statement is not None))
+    if isinstance(node, FunctionNode):
+        return [node.code_block]
+    if isinstance(node, UnaryOperationNode):
+        return [node.node]
+    if isinstance(node, BinaryOperationNode):
+        return [node.left_node, node.right_node]
+    if isinstance(node, VarAssignNode):
+        return [node.var_name, node.var_value]
+    if isinstance(node, ConstAssignNode):
+        return [node.const_name, node.const_value]
+    if isinstance(node, ReturnNode):
+        return [node.return_value]
+    if isinstance(node, WhileNode):
+        return [node.condition, node.block]
+    if isinstance(node, ForNode):
+        return [node.var_name, node.start_value, node.end_value] + [node.step_value] * (node.step_value is not None) + [node.block]
+    return []
+
+
+###################
+# Optimizer
+###################
+PASSES = {
+    "branches": EliminateDeadBranches,
+    "fold": FoldConstants,
+    "let": PropagateLets,
+}
+# Inlining lets first gives folding more to work with, and folding turns
+# conditions into the literals branch elimination looks for.
+DEFAULT_PASSES = ("let", "fold", "branches")
+
+
+class Optimizer(object):
+    """Runs a list of passes over a parsed program, between Parser and any
+    of the engines or Compiler.
+
+    `stats` has a (pass name, seconds, counts) entry for every pass run.
+    """
+    def __init__(self, passes=DEFAULT_PASSES):
+        for name in passes:
+            if name not in PASSES:
+                raise ValueError(f"unknown optimizer pass {name!r} (expected one of {', '.join(sorted(PASSES))})")
+        self.passes = list(passes)
+        self.stats = []
+
+    def optimize(self, program):
+        for name in self.passes:
+            optimization = PASSES[name]()
+            start = time.perf_counter()
+            program = optimization.run(program)
+            self.stats.append((name, time.perf_counter() - start, optimization.counts))
+        return program
+
+    def report(self):
+        """What each pass did and how long it took."""
+        lines = [f"{len(self.stats)} optimizer passes, {sum(stat[1] for stat in self.stats) * 1000:.2f} ms"]
+        for name, elapsed, counts in self.stats:
+            done = ", ".join(f"{n} {description}" for description, n in counts.items()) or "no changes"
+            lines.append(f"  {name:<8} {elapsed * 1000:8.2f} ms  {done}")
+        return "\n".join(lines)
@@ -1,13 +1,62 @@
 from token_ import *
 from errors import InvalidSyntaxError
+from collector import paused_gc
 from ast import *
 
 
+# Token type sets tested on the hot paths of the parser.
+STATEMENT_START = frozenset((INT, FLOAT, STRING, IDENTIFIER, PLUS, MINUS, LPAREN, LSQUAREBRACKET, KEYWORD))
+EXPRESSION_START = frozenset((INT, FLOAT, STRING, IDENTIFIER, PLUS, MINUS, LPAREN, LSQUAREBRACKET))
+COMPARISON_OPERATORS = frozenset((LESS_THAN, LESS_THAN_OR_EQUAL, GREATER_THAN, GREATER_THAN_OR_EQUAL, DOUBLE_EQUAL, NOT_EQUAL))
+ADDITIVE_OPERATORS = frozenset((PLUS, MINUS))
+MULTIPLICATIVE_OPERATORS = frozenset((ASTERISK, SLASH))
+POSTFIX_START = frozenset((LPAREN, LSQUAREBRACKET))
+UNARY_OPERATORS = frozenset((PLUS, MINUS, NOT))
+LIST_SEPARATORS = frozenset((RSQUAREBRACKET, COMMA))
+
+# Binding power of each binary operator, indexed by token type; 0 for
+# tokens that are not one.
+COMPARISON_PRECEDENCE = 1
+BINARY_PRECEDENCE = [0] * len(TOKEN_NAMES)
+for _type in COMPARISON_OPERATORS:
+    BINARY_PRECEDENCE[_type] = COMPARISON_PRECEDENCE
+for _type in ADDITIVE_OPERATORS:
+    BINARY_PRECEDENCE[_type] = 2
+for _type in MULTIPLICATIVE_OPERATORS:
+    BINARY_PRECEDENCE[_type] = 3
+
+# Entries of the expression parser's stack. Operators waiting for their
+# right operand are (precedence, left, operator token, start); everything
+# else is (-1, kind, start, ...) so that folding stops at it.
+ROOT = 0  # the caller
+PAREN = 1  # the expression inside '(' ... ')'
+SET = 2  # the next element of a set literal
+CALL = 3  # the next argument of a call
+INDEX = 4  # the expression inside '[' ... ']'
+ROOT_FRAME = (-1, ROOT)
+
+# Node class for each literal or name token type, indexed by token type.
+PRIMARY_NODES = [None] * len(TOKEN_NAMES)
+PRIMARY_NODES[INT] = NumberNode
+PRIMARY_NODES[FLOAT] = NumberNode
+PRIMARY_NODES[STRING] = StringNode
+PRIMARY_NODES[IDENTIFIER] = IdentifierNode
+
+# Steps of the expression parser after an operand, in the order they run.
+FACTOR = 0
+POSTFIX = 1
+INFIX = 2
+CONTEXT = 3
+
+
 class ParserErrors:
-    def __init__(self):
+    def __init__(self, source=None):
+        self.source = source
         self.errors = []
 
     def register_error(self, error):
+        if error.source is None:
+            error.source = self.source
         self.errors.append(error)
 
 
@@ -15,55 +64,101 @@ class ParserErrors:
 # Parser
 ###################
 class Parser(object):
-    def __init__(self, tokens):
+    def __init__(self, tokens, source=None):
+        if not isinstance(tokens, TokenStream):
+            tokens = TokenStream.from_tokens(tokens)
         self.tokens = tokens
+        self.kinds = tokens.kinds
+        self.starts = tokens.starts
+        self.ends = tokens.ends
+        self.values = tokens.values
+        self.last = len(tokens) - 1
         self.index = -1
-        self.current_tok = None
-        self.errors = ParserErrors()
+        self.errors = ParserErrors(source)
+        # Loops around the current statement in the function body being
+        # parsed, for `break` and `continue`.
+        self.loop_depth = 0
 
         self.advance()
 
     def advance(self):
-        self.index += 1
-        self.current_tok = self.tokens[self.index] if self.index < len(self.tokens) else None
+        # Past the end the parser stays on the final EOF token.
+        index = self.index
+        if index < self.last:
+            index += 1
+            self.index = index
+        elif not self.tokens.complete:
+            index = self.refill()
+        self.tok_type = self.kinds[index]
+        self.tok_start = self.starts[index]
+        self.tok_end = self.ends[index]
+
+    def refill(self):
+        # Only the current token is ever looked at, so a streamed window can
+        # be replaced wholesale once the parser has moved past its end.
+        self.tokens.fill()
+        self.last = len(self.tokens) - 1
+        self.index = 0
+        return 0
+
+    @property
+    def current_tok(self):
+        return Token(self.tok_type, self.values.get(self.index), self.tok_start, self.tok_end)
+
+    def matches(self, _type, _val):
+        return self.tok_type == _type and self.values.get(self.index) == _val
 
     def parse_program(self):
-        program = Program()
-
-        while self.current_tok.type is not EOF:
+        with paused_gc():
+            program = Program()
+            program.statements.extend(self.iter_statements())
+            return program
+
+    def iter_statements(self):
+        """Parse top-level statements one at a time.
+
+        Together with a TokenBuffer this lets a caller handle a program
+        without ever holding all of its tokens or statements.
+        """
+        while self.tok_type != EOF:
             stmt = self.parse_statement()
 
             if stmt:
-                program.statements.append(stmt)
-
-        return program
+                yield stmt
 
     def parse_statement(self):
-        if self.current_tok.matches(KEYWORD, "let"):
+        keyword = self.values[self.index] if self.tok_type == KEYWORD else None
+        if keyword == "let":
             return self.parse_let_statement()
-        elif self.current_tok.matches(KEYWORD, "var"):
+        elif keyword == "var":
             return self.parse_var_statement()
-        elif self.current_tok.matches(KEYWORD, "return"):
+        elif keyword == "return":
             return self.parse_return_statement()
-        elif self.current_tok.type in (INT, FLOAT, STRING, IDENTIFIER, PLUS, MINUS, LPAREN, LSQUAREBRACKET, KEYWORD):
+        elif keyword == "while":
+            return self.parse_while_statement()
+        elif keyword == "for":
+            return self.parse_for_statement()
+        elif keyword == "break" or keyword == "continue":
+            return self.parse_jump_statement(keyword)
+        elif self.tok_type in STATEMENT_START:
             stmt = self.parse_expression_statement()
             return stmt
         else:
             self.errors.register_error(InvalidSyntaxError(
                 "Expected INT, IDENTIFIER, '+', '-', '(', '['",
-                self.current_tok.position_start,
-                self.current_tok.position_end,
+                self.tok_start,
+                self.tok_end,
             ))
             self.advance()
             return None
 
     def parse_let_statement(self):
-        position_start = self.current_tok.position_start
-        if not self.current_tok.matches(KEYWORD, "let"):
+        position_start = self.tok_start
+        if not self.matches(KEYWORD, "let"):
             self.errors.register_error(InvalidSyntaxError(
                 "Expected 'let'",
-                self.current_tok.position_start,
-                self.current_tok.position_end,
+                self.tok_start,
+                self.tok_end,
             ))
             return None
 
@@ -73,40 +168,40 @@ class Parser(object):
         if not isinstance(constant_name, IdentifierNode):
             self.errors.register_error(InvalidSyntaxError(
                 f"You can't assign a value to {constant_name}",
-                self.current_tok.position_start,
-                self.current_tok.position_end,
+                self.tok_start,
+                self.tok_end,
             ))
             return None
 
-        if self.current_tok.type != EQUAL:
+        if self.tok_type != EQUAL:
             self.errors.register_error(InvalidSyntaxError(
                 "Expected '='",
-                self.current_tok.position_start,
-                self.current_tok.position_end,
+                self.tok_start,
+                self.tok_end,
             ))
             return None
 
         self.advance()
         constant_value = self.parse_math_expression()
 
-        if self.current_tok.type != SEMICOLON:
+        if self.tok_type != SEMICOLON:
             self.errors.register_error(InvalidSyntaxError(
                 "Expected ';'",
-                self.current_tok.position_start,
-                self.current_tok.position_end,
+                self.tok_start,
+                self.tok_end,
             ))
             return None
 
         self.advance()
-        return ConstAssignNode(constant_name, constant_value, position_start, self.current_tok.position_end)
+        return ConstAssignNode(constant_name, constant_value, position_start, self.tok_end)
 
     def parse_var_statement(self):
-        position_start = self.current_tok.position_start
-        if not self.current_tok.matches(KEYWORD, "var"):
+        position_start = self.tok_start
+        if not self.matches(KEYWORD, "var"):
             self.errors.register_error(InvalidSyntaxError(
                 "Expected 'var'",
-                self.current_tok.position_start,
-                self.current_tok.position_end,
+                self.tok_start,
+                self.tok_end,
             ))
             return None
         
@@ -115,40 +210,40 @@ class Parser(object):
         if not isinstance(variable_name, IdentifierNode):
             self.errors.register_error(InvalidSyntaxError(
                 f"You can't assign a value to {variable_name}",
-                self.current_tok.position_start,
-                self.current_tok.position_end,
+                self.tok_start,
+                self.tok_end,
             ))
             return None
 
-        if self.current_tok.type != EQUAL:
+        if self.tok_type != EQUAL:
             self.errors.register_error(InvalidSyntaxError(
                 "Expected '='",
-                self.current_tok.position_start,
-                self.current_tok.position_end,
+                self.tok_start,
+                self.tok_end,
             ))
             return None
 
         self.advance()
         variable_value = self.parse_math_expression()
 
-        if self.current_tok.type != SEMICOLON:
+        if self.tok_type != SEMICOLON:
             self.errors.register_error(InvalidSyntaxError(
                 "Expected ';' or a new line",
-                self.current_tok.position_start,
-                self.current_tok.position_end,
+                self.tok_start,
+                self.tok_end,
             ))
             return None
 
         self.advance()
-        return VarAssignNode(variable_name, variable_value, position_start, self.current_tok.position_end)
+        return VarAssignNode(variable_name, variable_value, position_start, self.tok_end)
 
     def parse_return_statement(self):
-        position_start = self.current_tok.position_start
-        if not self.current_tok.matches(KEYWORD, "return"):
+        position_start = self.tok_start
+        if not self.matches(KEYWORD, "return"):
             self.errors.register_error(InvalidSyntaxError(
                 "Expected 'return'",
-                self.current_tok.position_start,
-                self.current_tok.position_end,
+                self.tok_start,
+                self.tok_end,
             ))
             return None
 
@@ -156,28 +251,121 @@ class Parser(object):
 
         return_value = self.parse_math_expression()
 
-        if self.current_tok.type != SEMICOLON:
+        if self.tok_type != SEMICOLON:
+            self.errors.register_error(InvalidSyntaxError(
+                "Expected ';'",
+                self.tok_start,
+                self.tok_end,
+            ))
+            return None
+
+        self.advance()
+        return ReturnNode(return_value, position_start, self.tok_end)
+
+    def parse_while_statement(self):
+        position_start = self.tok_start
+        self.advance()
+
+        if self.tok_type == EOF:
+            self.errors.register_error(InvalidSyntaxError(
+                "Expected INT, IDENTIFIER, '+', '-', '(', ')', '[', ']'",
+                self.tok_start,
+                self.tok_end,
+            ))
+            return None
+
+        condition = self.parse_math_expression()
+        block = self.parse_loop_block()
+        self.advance()
+        return WhileNode(condition, block, position_start, self.tok_end)
+
+    def parse_for_statement(self):
+        position_start = self.tok_start
+        self.advance()
+
+        variable_name = self.factor()
+        if not isinstance(variable_name, IdentifierNode):
+            self.errors.register_error(InvalidSyntaxError(
+                f"You can't assign a value to {variable_name}",
+                self.tok_start,
+                self.tok_end,
+            ))
+            return None
+
+        if self.tok_type != EQUAL:
+            self.errors.register_error(InvalidSyntaxError(
+                "Expected '='",
+                self.tok_start,
+                self.tok_end,
+            ))
+            return None
+
+        self.advance()
+        start_value = self.parse_math_expression()
+
+        if self.tok_type != COMMA:
+            self.errors.register_error(InvalidSyntaxError(
+                "Expected ','",
+                self.tok_start,
+                self.tok_end,
+            ))
+            return None
+
+        self.advance()
+        end_value = self.parse_math_expression()
+
+        step_value = None
+        if self.tok_type == COMMA:
+            self.advance()
+            step_value = self.parse_math_expression()
+
+        block = self.parse_loop_block()
+        self.advance()
+        return ForNode(variable_name, start_value, end_value, step_value, block, position_start, self.tok_end)
+
+    def parse_loop_block(self):
+        self.loop_depth += 1
+        block = self.parse_block_statement()
+        self.loop_depth -= 1
+        return block
+
+    def parse_jump_statement(self, keyword):
+        position_start = self.tok_start
+        if not self.loop_depth:
+            self.errors.register_error(InvalidSyntaxError(
+                f"'{keyword}' outside a loop",
+                self.tok_start,
+                self.tok_end,
+            ))
+
+        self.advance()
+
+        if self.tok_type != SEMICOLON:
             self.errors.register_error(InvalidSyntaxError(
                 "Expected ';'",
-                self.current_tok.position_start,
-                self.current_tok.position_end,
+                self.tok_start,
+                self.tok_end,
             ))
             return None
 
         self.advance()
-        return ReturnNode(return_value, position_start, self.current_tok.position_end)
+        if not self.loop_depth:
+            return None
+        if keyword == "break":
+            return BreakNode(position_start, self.tok_end)
+        return ContinueNode(position_start, self.tok_end)
 
     def parse_expression_statement(self):
-        if self.current_tok.matches(KEYWORD, "if"):
+        if self.matches(KEYWORD, "if"):
             stmt = self.parse_if_expression()
             return stmt
-        elif self.current_tok.type in (INT, FLOAT, STRING, IDENTIFIER, PLUS, MINUS, LPAREN, LSQUAREBRACKET):
+        elif self.tok_type in EXPRESSION_START:
             stmt = self.parse_assign_expression()
-            if self.current_tok.type != SEMICOLON:
+            if self.tok_type != SEMICOLON:
                 self.errors.register_error(InvalidSyntaxError(
                     "Expected ';'",
-                    self.current_tok.position_start,
-                    self.current_tok.position_end,
+                    self.tok_start,
+                    self.tok_end,
                 ))
                 return None
             self.advance()
@@ -185,28 +373,29 @@ class Parser(object):
         else:
             self.errors.register_error(InvalidSyntaxError(
                 "Expected INT, IDENTIFIER, '+', '-', '(', '[', 'if'",
-                self.current_tok.position_start,
-                self.current_tok.position_end,
+                self.tok_start,
+                self.tok_end,
             ))
+            self.advance()
             return None
 
     def parse_if_expression(self):
-        position_start = self.current_tok.position_start
-        if not self.current_tok.matches(KEYWORD, "if"):
+        position_start = self.tok_start
+        if not self.matches(KEYWORD, "if"):
             self.errors.register_error(InvalidSyntaxError(
                 "Expected 'if'",
-                self.current_tok.position_start,
-                self.current_tok.position_end,
+                self.tok_start,
+                self.tok_end,
             ))
             return None
 
         self.advance()
 
-        if self.current_tok.type == EOF:
+        if self.tok_type == EOF:
             self.errors.register_error(InvalidSyntaxError(
                     "Expected INT, IDENTIFIER, '+', '-', '(', ')', '[', ']'",
-                    self.current_tok.position_start,
-                    self.current_tok.position_end,
+                    self.tok_start,
+                    self.tok_end,
                 ))
             return None
 
@@ -215,17 +404,17 @@ class Parser(object):
         if_block = self.parse_block_statement()
         self.advance()
 
-        if self.current_tok.matches(KEYWORD, "elif"):
+        if self.matches(KEYWORD, "elif"):
             elif_conditions = []
             elif_blocks_statements = []
 
-            while self.current_tok.matches(KEYWORD, "elif"):
+            while self.matches(KEYWORD, "elif"):
                 self.advance()
-                if self.current_tok.type == EOF:
+                if self.tok_type == EOF:
                     self.errors.register_error(InvalidSyntaxError(
                         "Expected INT, IDENTIFIER, '+', '-', '(', ')', '[', ']'",
-                        self.current_tok.position_start,
-                        self.current_tok.position_end,
+                        self.tok_start,
+                        self.tok_end,
                     ))
                     return None
                 elif_condition = self.parse_math_expression()
@@ -237,44 +426,44 @@ class Parser(object):
                 elif_conditions.append(elif_condition)
                 elif_blocks_statements.append(elif_block)
 
-            if self.current_tok.matches(KEYWORD, "else"):
+            if self.matches(KEYWORD, "else"):
                 self.advance()
 
                 else_block = self.parse_block_statement()
                 self.advance()
 
-                return IfNode(if_condition, if_block, elif_conditions, elif_blocks_statements, else_block, position_start=position_start, position_end=self.current_tok.position_end)
+                return IfNode(if_condition, if_block, elif_conditions, elif_blocks_statements, else_block, position_start=position_start, position_end=self.tok_end)
             else:
-                return IfNode(if_condition, if_block, elif_conditions, elif_blocks_statements, position_start=position_start, position_end=self.current_tok.position_end)
+                return IfNode(if_condition, if_block, elif_conditions, elif_blocks_statements, position_start=position_start, position_end=self.tok_end)
 
-        elif self.current_tok.matches(KEYWORD, "else"):
+        elif self.matches(KEYWORD, "else"):
             self.advance()
 
             else_block = self.parse_block_statement()
             self.advance()
 
-            return IfNode(if_condition, if_block, else_block_statements=else_block, position_start=position_start, position_end=self.current_tok.position_end)
+            return IfNode(if_condition, if_block, else_block_statements=else_block, position_start=position_start, position_end=self.tok_end)
         else:
-            return IfNode(if_condition, if_block, position_start=position_start, position_end=self.current_tok.position_end)
+            return IfNode(if_condition, if_block, position_start=position_start, position_end=self.tok_end)
 
     def parse_block_statement(self):
-        if self.current_tok.type != LBRACKET:
+        if self.tok_type != LBRACKET:
             self.errors.register_error(InvalidSyntaxError(
                 "Expected '{'",
-                self.current_tok.position_start,
-                self.current_tok.position_end,
+                self.tok_start,
+                self.tok_end,
             ))
             return None
 
+        block = Block(self.tok_start)
         self.advance()
-        block = Block()
 
-        while self.current_tok.type != RBRACKET:
-            if self.current_tok.type == EOF:
+        while self.tok_type != RBRACKET:
+            if self.tok_type == EOF:
                 self.errors.register_error(InvalidSyntaxError(
                     "EOF error(maybe you forgot a '}') :))",
-                    self.current_tok.position_start,
-                    self.current_tok.position_end,
+                    self.tok_start,
+                    self.tok_end,
                 ))
                 return None
             stmt = self.parse_statement()
@@ -282,223 +471,267 @@ class Parser(object):
             if stmt:
                 block.statements.append(stmt)
 
+        block.position_end = self.tok_end
         return block
 
     def parse_assign_expression(self):
-        position_start = self.current_tok.position_start
+        position_start = self.tok_start
         left = self.parse_math_expression()
-        if self.current_tok.type == EQUAL:
+        if self.tok_type == EQUAL:
             if not isinstance(left, IdentifierNode):
                 self.errors.register_error(InvalidSyntaxError(
                     f"You can't assign a value to {left}",
-                    self.current_tok.position_start,
-                    self.current_tok.position_end,
+                    self.tok_start,
+                    self.tok_end,
                 ))
                 return None
             self.advance()
             right = self.parse_math_expression()
-            return VarAssignNode(left, right, position_start, self.current_tok.position_end)
+            return VarAssignNode(left, right, position_start, self.tok_end)
         return left
 
     def parse_math_expression(self):
-        if self.current_tok.type in (INT, FLOAT, STRING, IDENTIFIER, PLUS, MINUS, LPAREN, LSQUAREBRACKET):
-            return self.parse_comparator_expression()
-        else:
+        return self.parse_expression(False)
+
+    def factor(self):
+        return self.parse_expression(True)
+
+    def parse_expression(self, factor_only):
+        """Parse an expression, or only a single factor.
+
+        Binary operators are folded by precedence (BINARY_PRECEDENCE) and
+        everything still waiting for an operand is kept on an explicit
+        stack, so nesting depth is not limited by Python's recursion limit.
+        `parse_prefix` reads each operand and `parse_infix` what follows
+        it, until the stack is empty.
+        """
+        stack = [ROOT_FRAME]
+        check_start = not factor_only
+        while True:
+            operand = self.parse_prefix(stack, check_start)
+            if operand is not None:
+                node, start, prefix, resume = operand
+                node = self.parse_infix(stack, factor_only, node, start, prefix, resume)
+                if not stack:
+                    return node
+            # An operator's operand is not checked against EXPRESSION_START,
+            # so a keyword there is reported with the message that lists 'if'.
+            check_start = stack[-1][0] < 0
+
+    def parse_prefix(self, stack, check_start):
+        """Parse unary operators and a primary.
+
+        Returns the operand as (node, start, prefix, resume), or None after
+        pushing the frame of a '(' whose contents come next.
+        """
+        if check_start and self.tok_type not in EXPRESSION_START:
             self.errors.register_error(InvalidSyntaxError(
                 "Expected INT, IDENTIFIER, '+', '-', '(', '['",
-                self.current_tok.position_start,
-                self.current_tok.position_end,
+                self.tok_start,
+                self.tok_end,
             ))
-            return None
+            return None, None, None, CONTEXT
 
-    def parse_comparator_expression(self):
-        position_start = self.current_tok.position_start
-        left = self.expression()
-        if self.current_tok.type in (LESS_THAN, LESS_THAN_OR_EQUAL, GREATER_THAN, GREATER_THAN_OR_EQUAL, DOUBLE_EQUAL, NOT_EQUAL):
-            operator = self.current_tok
-            self.advance()
-
-            right = self.expression()
-            return BinaryOperationNode(left, operator, right, position_start, self.current_tok.position_end)
-        else:
-            return left
-
-    def expression(self):
-        position_start = self.current_tok.position_start
-        left = self.term()
+        prefix = None
+        if self.tok_type in UNARY_OPERATORS:
+            prefix = []
+            while self.tok_type in UNARY_OPERATORS:
+                prefix.append(Token(self.tok_type, None, self.tok_start, self.tok_end))
+                self.advance()
 
-        while self.current_tok is not None and self.current_tok.type in (PLUS, MINUS):
-            if not self.current_tok.type in (PLUS, MINUS):
-                self.errors.register_error(InvalidSyntaxError(
-                    "Expected '+' or '-'",
-                    self.current_tok.position_start,
-                    self.current_tok.position_end,
-                ))
-                return None
-            operation_tok = self.current_tok
+        start = self.tok_start
+        node_class = PRIMARY_NODES[self.tok_type]
+        if node_class is not None:
+            tok = Token(self.tok_type, self.values.get(self.index), start, self.tok_end)
             self.advance()
-            right = self.term()
-            left = BinaryOperationNode(left, operation_tok, right, position_start, self.current_tok.position_end)
-
-        return left
-
-    def term(self):
-        position_start = self.current_tok.position_start
-        left = self.parse_call_or_index_expr()
-
-        while self.current_tok is not None and self.current_tok.type in (ASTERISK, SLASH):
-            if not self.current_tok.type in (ASTERISK, SLASH):
-                self.errors.register_error(InvalidSyntaxError(
-                    "Expected '*' or '/'",
-                    self.current_tok.position_start,
-                    self.current_tok.position_end,
-                ))
+            node = node_class(tok, start, self.tok_end)
+        elif self.tok_type == LPAREN:
+            self.advance()
+            if self.tok_type != RPAREN:
+                stack.append((-1, PAREN, start, prefix))
                 return None
-            operation_tok = self.current_tok
+            position_end = self.tok_end
             self.advance()
-            right = self.parse_call_or_index_expr()
-            left = BinaryOperationNode(left, operation_tok, right, position_start, self.current_tok.position_end)
-
-        return left
-    
-    def parse_call_or_index_expr(self):
-        position_start = self.current_tok.position_start
-        left = self.parse_arrow_func_expression()
+            node = SetNode([], start, position_end)
+        elif self.tok_type == LSQUAREBRACKET:
+            node = self.parse_list_literal()
+        else:
+            self.errors.register_error(InvalidSyntaxError(
+                "Expected INT, IDENTIFIER, '+', '-', '(', '[', 'if'",
+                self.tok_start,
+                self.tok_end,
+            ))
+            node = None
+        return node, start, prefix, FACTOR
+
+    def parse_infix(self, stack, factor_only, node, start, prefix, resume):
+        """Parse what follows an operand.
+
+        The steps from `resume` on run in the order they are listed. A step
+        that needs another operand pushes what is waiting for it and
+        returns; once the stack is empty the expression is returned.
+        """
+        while True:
+            if resume <= FACTOR:
+                # Unary operators apply to the factor alone, then a
+                # following `=>` turns it into a function.
+                if prefix:
+                    for operation_tok in reversed(prefix):
+                        node = UnaryOperationNode(operation_tok, node, operation_tok.position_start, self.tok_end)
+                    start = prefix[0].position_start
+                if factor_only and len(stack) == 1:
+                    stack.pop()
+                    return node
+                if self.tok_type == ARROW:
+                    self.advance()
+                    # The loops around a function are not around its body.
+                    loop_depth = self.loop_depth
+                    self.loop_depth = 0
+                    code_block = self.parse_block_statement()
+                    self.loop_depth = loop_depth
+                    self.advance()
+                    node = FunctionNode("anonymous", node, code_block, start, self.tok_end)
 
-        while self.current_tok.type in (LPAREN, LSQUAREBRACKET):
-            if self.current_tok.type == LPAREN:
-                left = CallNode(left, self.parse_paren_expr(), position_start, self.current_tok.position_end)
-                self.advance()
-            else:
+            if resume <= POSTFIX and self.tok_type in POSTFIX_START:
+                # One call or index per pass.
+                if self.tok_type == LSQUAREBRACKET:
+                    self.advance()
+                    stack.append((-1, INDEX, start, node))
+                    return None
+                args_start = self.tok_start
                 self.advance()
-                left = IndexNode(left, self.parse_math_expression(), position_start, self.current_tok.position_end)
-                if self.current_tok.type != RSQUAREBRACKET:
+                if self.tok_type == RPAREN:
+                    node = CallNode(node, ArgNode([], args_start, self.tok_end), start, self.tok_end)
+                elif self.tok_type == EOF:
                     self.errors.register_error(InvalidSyntaxError(
-                        "Expected ']'",
-                        self.current_tok.position_start,
-                        self.current_tok.position_end,
+                        "EOF error(maybe you forgot a '}') :))",
+                        self.tok_start,
+                        self.tok_end,
                     ))
+                    node = CallNode(node, None, start, self.tok_end)
+                else:
+                    stack.append((-1, CALL, start, node, [], args_start))
                     return None
                 self.advance()
-        return left
-
-    def parse_arrow_func_expression(self):
-        position_start = self.current_tok.position_start
-        left = self.factor()
-
-        if self.current_tok.type == ARROW:
-            self.advance()
-            code_block = self.parse_block_statement()
-            self.advance()
-            return FunctionNode("anonymous", left, code_block, position_start, self.current_tok.position_end)
-        return left
-
-    def factor(self):
-        position_start = self.current_tok.position_start
-        tok = self.current_tok
-
-        if tok.type == LPAREN:
-            self.advance()
-
-            if self.current_tok.type == RPAREN:
-                position_end = self.current_tok.position_end
-                self.advance()
-                return SetNode([], position_start, position_end)
+                resume = POSTFIX
+                continue
+
+            if resume <= INFIX:
+                # Fold the pending operators that bind at least as tightly
+                # as the next one. Comparisons do not chain, so one that has
+                # just been folded ends the expression.
+                precedence = BINARY_PRECEDENCE[self.tok_type]
+                folded = 0
+                while stack[-1][0] >= precedence:
+                    folded, left, operation_tok, start = stack.pop()
+                    node = BinaryOperationNode(left, operation_tok, node, start, self.tok_end)
+                if precedence and (precedence != COMPARISON_PRECEDENCE or folded != COMPARISON_PRECEDENCE):
+                    stack.append((precedence, node, Token(self.tok_type, None, self.tok_start, self.tok_end), start))
+                    self.advance()
+                    return None
 
-            result = self.parse_math_expression()
-            if self.current_tok.type != COMMA:
-                if self.current_tok.type != RPAREN:
+            # A finished expression goes to whatever is waiting for it.
+            frame = stack.pop()
+            kind = frame[1]
+            if kind == ROOT:
+                return node
+            elif kind == PAREN:
+                _, _, start, prefix = frame
+                if self.tok_type == COMMA:
+                    self.advance()
+                    if self.tok_type != RPAREN:
+                        stack.append((-1, SET, start, prefix, [node]))
+                        return None
+                    self.advance()
+                    node = SetNode([node], start, self.tok_end)
+                elif self.tok_type == RPAREN:
+                    self.advance()
+                else:
                     self.errors.register_error(InvalidSyntaxError(
                         "Expected ')'",
-                        self.current_tok.position_start,
-                        self.current_tok.position_end,
+                        self.tok_start,
+                        self.tok_end,
                     ))
-                    return None
-                self.advance()
-                return result
-            elements = []
-            elements.append(result)
-            self.advance()
-            while self.current_tok.type != RPAREN:
-                elements.append(self.parse_math_expression())
-                if self.current_tok.type == COMMA:
+                    node = None
+                resume = FACTOR
+            elif kind == CALL:
+                _, _, start, callee, args, args_start = frame
+                args.append(node)
+                if self.tok_type == COMMA:
                     self.advance()
-            self.advance()
-            return SetNode(elements, position_start, self.current_tok.position_end)
-        elif tok.type == INT or tok.type == FLOAT:
-            self.advance()
-            return NumberNode(tok, position_start, self.current_tok.position_end)
-        elif tok.type == STRING:
-            self.advance()
-            return StringNode(tok, position_start, self.current_tok.position_end)
-        elif tok.type == IDENTIFIER:
-            self.advance()
-            return IdentifierNode(tok, position_start, self.current_tok.position_end)
-        elif tok.type in (PLUS, MINUS, NOT):
-            if self.current_tok.type not in (PLUS, MINUS, NOT):
-                self.errors.register_error(InvalidSyntaxError(
-                    "Expected '+', '-' or '!'",
-                    self.current_tok.position_start,
-                    self.current_tok.position_end,
-                ))
-                return None
-            op_tok = self.current_tok
-            self.advance()
-            right = self.factor()
-            return UnaryOperationNode(op_tok, right, position_start, self.current_tok.position_end)
-        elif tok.type == LSQUAREBRACKET:
-            elements = []
-            while not self.current_tok.type == RSQUAREBRACKET:
-                self.advance()
-                elements.append(self.current_tok)
-                self.advance()
-                if self.current_tok.type not in (RSQUAREBRACKET, COMMA):
+                    if self.tok_type == EOF:
+                        self.errors.register_error(InvalidSyntaxError(
+                            "EOF error(maybe you forgot a '}') :))",
+                            self.tok_start,
+                            self.tok_end,
+                        ))
+                        node = CallNode(callee, None, start, self.tok_end)
+                    elif self.tok_type != RPAREN:
+                        stack.append(frame)
+                        return None
+                    else:
+                        node = CallNode(callee, ArgNode(args, args_start, self.tok_end), start, self.tok_end)
+                elif self.tok_type == RPAREN:
+                    node = CallNode(callee, ArgNode(args, args_start, self.tok_end), start, self.tok_end)
+                else:
                     self.errors.register_error(InvalidSyntaxError(
-                        "Expected ',' or ']'",
-                        self.current_tok.position_start,
-                        self.current_tok.position_end,
+                        "Expected ',' or '('",
+                        self.tok_start,
+                        self.tok_end,
                     ))
-                    return None
-            self.advance()
-            return ListNode(elements, position_start, self.current_tok.position_end)
-        self.errors.register_error(InvalidSyntaxError(
-            "Expected INT, IDENTIFIER, '+', '-', '(', '[', 'if'",
-            self.current_tok.position_start,
-            self.current_tok.position_end,
-        ))
-    
-    def parse_paren_expr(self):
-        position_start = self.current_tok.position_start
-        if self.current_tok.type == LPAREN:
-            self.advance()
-            args = []
-
-            if self.current_tok.type == RPAREN:
-                return ArgNode(args, position_start, self.current_tok.position_end)
-
-            while self.current_tok.type != RPAREN:
-                if self.current_tok.type == EOF:
+                    node = CallNode(callee, None, start, self.tok_end)
+                self.advance()
+                resume = POSTFIX
+            elif kind == INDEX:
+                _, _, start, operand = frame
+                node = IndexNode(operand, node, start, self.tok_end)
+                if self.tok_type != RSQUAREBRACKET:
                     self.errors.register_error(InvalidSyntaxError(
-                        "EOF error(maybe you forgot a '}') :))",
-                        self.current_tok.position_start,
-                        self.current_tok.position_end,
+                        "Expected ']'",
+                        self.tok_start,
+                        self.tok_end,
                     ))
-                    return None
-
-                args.append(self.parse_math_expression())
-                if self.current_tok.type != COMMA and self.current_tok.type != RPAREN:
+                    node = None
+                    resume = INFIX
+                else:
+                    self.advance()
+                    resume = POSTFIX
+            else:
+                _, _, start, prefix, elements = frame
+                elements.append(node)
+                resume = FACTOR
+                if self.tok_type == COMMA:
+                    self.advance()
+                elif self.tok_type != RPAREN:
                     self.errors.register_error(InvalidSyntaxError(
-                        "Expected ',' or '('",
-                        self.current_tok.position_start,
-                        self.current_tok.position_end,
+                        "Expected ',' or ')'",
+                        self.tok_start,
+                        self.tok_end,
                     ))
+                    node = None
+                    continue
+                if self.tok_type != RPAREN:
+                    stack.append(frame)
                     return None
-                elif self.current_tok.type == RPAREN:
-                    break
-
                 self.advance()
-            
-            return ArgNode(args, position_start, self.current_tok.position_end)
+                node = SetNode(elements, start, self.tok_end)
+
+    def parse_list_literal(self):
+        position_start = self.tok_start
+        elements = []
+        while not self.tok_type == RSQUAREBRACKET:
+            self.advance()
+            elements.append(self.current_tok)
+            self.advance()
+            if self.tok_type not in LIST_SEPARATORS:
+                self.errors.register_error(InvalidSyntaxError(
+                    "Expected ',' or ']'",
+                    self.tok_start,
+                    self.tok_end,
+                ))
+                return None
+        self.advance()
+        return ListNode(elements, position_start, self.tok_end)
     
     def is_type(self, token):
         return True if token.matches(KEYWORD, "int") or token.matches(KEYWORD, "float") or token.matches(KEYWORD, "string") or token.matches(KEYWORD, "bool") else False
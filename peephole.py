@@ -0,0 +1,362 @@
+import math
+import time
+import operator
+from token_ import FLOAT
+from objfile import CONSTANT_BASE
+from vm import *
+
+###################
+# Instructions
+###################
+# Opcodes that push a number known before the program runs.
+CONSTANTS = frozenset((PUSH16, PUSHC))
+ARITHMETIC = {ADD: operator.add, SUB: operator.sub, MUL: operator.mul, DIV: operator.truediv}
+# Opcodes that push something and nothing else, with no way to fail.
+PURE_PUSHES = frozenset((PUSH16, PUSHC, PUSHS, PUSH_NONE, MAKE_FUNCTION))
+STORE_KEEPS = {STORE_GLOBAL: KEEP_GLOBAL, STORE_LOCAL: KEEP_LOCAL}
+KEEP_STORES = {KEEP_GLOBAL: STORE_GLOBAL, KEEP_LOCAL: STORE_LOCAL}
+STORE_LOADS = {STORE_GLOBAL: LOAD_GLOBAL, STORE_LOCAL: LOAD_LOCAL}
+CONST_OPS = {ADD: ADD_CONST, SUB: SUB_CONST}
+LOAD_COMPARE_JUMPS = {LOAD_GLOBAL: GLOBAL_COMPARE_JUMP, LOAD_LOCAL: LOCAL_COMPARE_JUMP}
+# Opcodes whose first operand is a constant address.
+CONSTANT_OPERANDS = frozenset((PUSHC, ADD_CONST, SUB_CONST, CONST_COMPARE_JUMP))
+
+
+class Instruction(object):
+    """One decoded instruction.
+
+    Jump targets are kept as offsets in the code the pass started from;
+    `origins` holds the offsets that now lead to this instruction, since
+    a jump to an instruction that was removed or fused lands here. An
+    instruction whose origins include a target starts a block, which no
+    rewrite reaches across. `position` is the source range an error here
+    reports, and `position2` that of the second part of a superinstruction
+    that can fail in two places.
+    """
+    def __init__(self, op, args, origins, position=None, position2=None):
+        self.op = op
+        self.args = args
+        self.origins = origins
+        self.position = position
+        self.position2 = position2
+
+    @property
+    def target(self):
+        return self.args[-1]
+
+
+###################
+# Peephole
+###################
+class Peephole(object):
+    """Rewrites the code of a Compiler to do the same in fewer instructions.
+
+    In order, over the instructions of each block:
+    - sequences that work on numbers known before the program runs are
+      folded to one push, and branches on them to a jump or nothing;
+    - a value pushed and popped again is not pushed, and a store followed
+      by a load of the same variable keeps the value on the stack instead
+      of loading it back;
+    - a constant followed by + or -, and a comparison followed by a branch
+      with the constant or variable before it, become superinstructions.
+    Then jumps to jumps go straight to the end of the chain, jumps to the
+    next instruction are removed and so is code no path reaches. Jump
+    targets, function entries and the position table are moved with the
+    code and constants no longer used are dropped from the pool.
+
+    Nothing that can fail is folded away, so the program gives the same
+    output and errors. `counts` says what was done, as Optimizer's passes
+    do, and `before` and `after` are the instruction counts.
+    """
+    def __init__(self):
+        self.counts = {}
+        self.before = 0
+        self.after = 0
+        self.elapsed = 0.0
+
+    def optimize(self, compiler):
+        start = time.perf_counter()
+        self.compiler = compiler
+        self.values = {constant.address: constant.data for constant in compiler.constants.values()}
+        instructions = self.decode(compiler)
+        self.before = len(instructions)
+        self.targets = self.find_targets(instructions)
+        instructions = self.rewrite(instructions)
+        instructions = self.clean_jumps(instructions)
+        self.after = len(instructions)
+        self.compact_constants(instructions)
+        self.encode(instructions)
+        self.elapsed = time.perf_counter() - start
+        return compiler
+
+    def count(self, description, n=1):
+        self.counts[description] = self.counts.get(description, 0) + n
+
+    def eliminated(self):
+        return self.before - self.after
+
+    def report(self):
+        lines = [f"peephole {self.elapsed * 1000:.2f} ms, {self.before} -> {self.after} instructions, {self.eliminated()} eliminated"]
+        done = ", ".join(f"{n} {description}" for description, n in self.counts.items()) or "no changes"
+        lines.append(f"  {done}")
+        return "\n".join(lines)
+
+    ###################
+    # Decoding
+    ###################
+    def decode(self, compiler):
+        code = compiler.code
+        positions = compiler.positions
+        instructions = []
+        position = None
+        i = 0
+        pc = 0
+        while pc < len(code):
+            while i < len(positions) and positions[i][0] <= pc:
+                position = positions[i][1:]
+                i += 1
+            op = code[pc]
+            args = []
+            at = pc + 1
+            for size in OPERANDS[op]:
+                args.append(int.from_bytes(code[at:at + size], "big"))
+                at += size
+            instructions.append(Instruction(op, args, [pc], position))
+            pc = at
+        return instructions
+
+    def find_targets(self, instructions):
+        targets = {offset for offset, slot_count, arg_slot in self.compiler.functions}
+        targets.update(instruction.target for instruction in instructions if instruction.op in JUMPS)
+        return targets
+
+    def starts_block(self, instruction):
+        return any(origin in self.targets for origin in instruction.origins)
+
+    ###################
+    # Rewriting
+    ###################
+    def rewrite(self, instructions):
+        out = []
+        # Origins of instructions removed at a block start, for the next.
+        pending = []
+        for instruction in instructions:
+            if pending:
+                instruction.origins = pending + instruction.origins
+                pending = []
+            out.append(instruction)
+            while out:
+                result = self.reduce(out)
+                if result is None:
+                    break
+                n, replacement = result
+                window = out[-n:]
+                del out[-n:]
+                if replacement is not None:
+                    replacement.origins = window[0].origins
+                    out.append(replacement)
+                elif self.starts_block(window[0]):
+                    pending = window[0].origins + pending
+        return out
+
+    def tail(self, out, n):
+        """The last `n` instructions, if they are in the same block."""
+        if len(out) < n:
+            return None
+        window = out[-n:]
+        for instruction in window[1:]:
+            if self.starts_block(instruction):
+                return None
+        return window
+
+    def reduce(self, out):
+        """Find a rewrite of the end of `out`. Returns (how many
+        instructions it replaces, the new instruction or None), or None."""
+        last = out[-1]
+        op = last.op
+
+        if op in ARITHMETIC:
+            window = self.tail(out, 3)
+            if window and window[0].op in CONSTANTS and window[1].op in CONSTANTS:
+                value = self.evaluate(op, self.value(window[0]), self.value(window[1]))
+                if value is not None:
+                    self.count("constant sequences folded")
+                    return 3, self.push(value)
+            window = self.tail(out, 2)
+            if window and window[0].op in CONSTANTS and op in CONST_OPS:
+                self.count("superinstructions made")
+                return 2, Instruction(CONST_OPS[op], [self.constant_address(window[0])], None, last.position)
+
+        elif op == NEG:
+            window = self.tail(out, 2)
+            if window and window[0].op in CONSTANTS:
+                self.count("constant sequences folded")
+                return 2, self.push(-self.value(window[0]))
+
+        elif op == POP:
+            window = self.tail(out, 2)
+            if window and window[0].op in PURE_PUSHES:
+                self.count("redundant loads and stores removed")
+                return 2, None
+            if window and window[0].op in KEEP_STORES:
+                self.count("redundant loads and stores removed")
+                return 2, Instruction(KEEP_STORES[window[0].op], window[0].args, None, window[0].position)
+
+        elif op in (LOAD_GLOBAL, LOAD_LOCAL):
+            # A store followed by a load of what was just stored. The value
+            # is set, so the load cannot fail.
+            window = self.tail(out, 2)
+            if window and STORE_LOADS.get(window[0].op) == op and window[0].args[0] == last.args[0]:
+                self.count("redundant loads and stores removed")
+                return 2, Instruction(STORE_KEEPS[window[0].op], window[0].args, None, window[0].position)
+
+        elif op == JUMP_IF_FALSE:
+            return self.reduce_branch(out)
+        return None
+
+    def reduce_branch(self, out):
+        last = out[-1]
+        window = self.tail(out, 4)
+        if window and window[0].op in CONSTANTS and window[1].op in CONSTANTS and window[2].op in COMPARISONS:
+            passed = COMPARISONS[window[2].op](self.value(window[0]), self.value(window[1]))
+            self.count("branches on constants resolved")
+            return 4, None if passed else Instruction(JUMP, [last.target], None)
+        window = self.tail(out, 2)
+        if window and window[0].op in CONSTANTS:
+            self.count("branches on constants resolved")
+            return 2, None if self.value(window[0]) != 0 else Instruction(JUMP, [last.target], None)
+
+        window = self.tail(out, 3)
+        if window and window[1].op in COMPARISONS:
+            compare = window[1]
+            if window[0].op in LOAD_COMPARE_JUMPS:
+                self.count("superinstructions made")
+                load = window[0]
+                return 3, Instruction(LOAD_COMPARE_JUMPS[load.op], load.args + [compare.op, last.target], None, load.position, compare.position)
+            if window[0].op in CONSTANTS:
+                self.count("superinstructions made")
+                return 3, Instruction(CONST_COMPARE_JUMP, [self.constant_address(window[0]), compare.op, last.target], None, compare.position)
+        window = self.tail(out, 2)
+        if window and window[0].op in COMPARISONS:
+            self.count("superinstructions made")
+            return 2, Instruction(COMPARE_JUMP, [window[0].op, last.target], None, window[0].position)
+        return None
+
+    ###################
+    # Constants
+    ###################
+    def value(self, instruction):
+        # Numbers pushed by PUSH16 are floats too.
+        if instruction.op == PUSH16:
+            return float(instruction.args[0])
+        return self.values[instruction.args[0]]
+
+    def evaluate(self, op, left, right):
+        # Division by 0 is left for the VM to report.
+        if op == DIV and right == 0:
+            return None
+        value = ARITHMETIC[op](left, right)
+        return value if math.isfinite(value) else None
+
+    def push(self, value):
+        # As optimizer.make_number: whole numbers that fit are immediates.
+        if value.is_integer() and 0 <= value <= 0xffff and math.copysign(1, value) > 0:
+            return Instruction(PUSH16, [int(value)], None)
+        return Instruction(PUSHC, [self.constant_address_of(value)], None)
+
+    def constant_address(self, instruction):
+        if instruction.op == PUSHC:
+            return instruction.args[0]
+        return self.constant_address_of(float(instruction.args[0]))
+
+    def constant_address_of(self, value):
+        address = self.compiler.add_constant(FLOAT, value).address
+        self.values[address] = value
+        return address
+
+    def compact_constants(self, instructions):
+        """Drop constants no instruction uses any more, keeping the order
+        of the rest."""
+        used = sorted({instruction.args[0] for instruction in instructions if instruction.op in CONSTANT_OPERANDS})
+        addresses = {address: CONSTANT_BASE + i for i, address in enumerate(used)}
+        constants = {}
+        for key, constant in self.compiler.constants.items():
+            if constant.address in addresses:
+                constant.address = addresses[constant.address]
+                constants[key] = constant
+        self.compiler.constants = constants
+        self.compiler.last_constant_address = CONSTANT_BASE + len(used)
+        for instruction in instructions:
+            if instruction.op in CONSTANT_OPERANDS:
+                instruction.args[0] = addresses[instruction.args[0]]
+
+    ###################
+    # Jumps
+    ###################
+    def clean_jumps(self, instructions):
+        """Thread jumps to jumps, then remove jumps to the next instruction
+        and unreachable code, until nothing changes."""
+        changed = True
+        while changed:
+            changed = False
+            self.targets = self.find_targets(instructions)
+            index = {origin: i for i, instruction in enumerate(instructions) for origin in instruction.origins}
+            for instruction in instructions:
+                if instruction.op not in JUMPS:
+                    continue
+                target = instruction.target
+                seen = set()
+                while instructions[index[target]].op == JUMP and target not in seen:
+                    seen.add(target)
+                    target = instructions[index[target]].target
+                if target != instruction.target:
+                    self.count("jumps threaded")
+                    instruction.args[-1] = target
+                    changed = True
+
+            out = []
+            reachable = True
+            for i, instruction in enumerate(instructions):
+                if self.starts_block(instruction):
+                    reachable = True
+                if not reachable:
+                    self.count("unreachable instructions removed")
+                    changed = True
+                    continue
+                if instruction.op == JUMP and index[instruction.target] == i + 1:
+                    self.count("jumps to the next instruction removed")
+                    instructions[i + 1].origins = instruction.origins + instructions[i + 1].origins
+                    changed = True
+                    continue
+                out.append(instruction)
+                if instruction.op in ENDS:
+                    reachable = False
+            instructions = out
+        return instructions
+
+    ###################
+    # Encoding
+    ###################
+    def encode(self, instructions):
+        offsets = {}
+        pc = 0
+        for instruction in instructions:
+            for origin in instruction.origins:
+                offsets[origin] = pc
+            pc += OPCODE_SIZES[instruction.op]
+
+        code = bytearray()
+        positions = []
+        for instruction in instructions:
+            args = instruction.args
+            if instruction.op in JUMPS:
+                args = args[:-1] + [offsets[instruction.target]]
+            for position, at in ((instruction.position, len(code)), (instruction.position2, len(code) + 1)):
+                if position is not None and (not positions or positions[-1][1:] != position):
+                    positions.append((at,) + tuple(position))
+            code.append(instruction.op)
+            for size, arg in zip(OPERANDS[instruction.op], args):
+                code += arg.to_bytes(size, "big")
+        self.compiler.code = code
+        self.compiler.positions = positions
+        self.compiler.functions = [(offsets[offset], slot_count, arg_slot) for offset, slot_count, arg_slot in self.compiler.functions]
@@ -0,0 +1,378 @@
+import operator
+from errors import RTError, RTException
+from token_ import *
+from ast import *
+from closures import ClosureCompiler, NO_RETURN, frame_of, can_leave, assignment_target
+from interpreter import Function, Number, NoneType, Context, BREAK, CONTINUE, loop_stops, loop_range, truth
+
+
+###################
+# RaisingCompiler
+###################
+class RaisingCompiler(ClosureCompiler):
+    """ClosureCompiler in exception mode.
+
+    Closures return bare values and raise RTException with the RTError the
+    other engines would return, so the happy path neither builds (value,
+    error) tuples nor tests them. Arithmetic and comparisons on two Numbers
+    are done inline and anything else goes through the Value methods, so
+    results and error messages are the same as the tree walker's. The
+    Functions it makes have raising bodies and are called by its own call
+    closures, not Function.execute. `compile` returns the usual
+    (value, error) at the top.
+    """
+    def compile(self, node):
+        closure = self.build(node)
+        names = self.resolver.scopes[node].names
+
+        def run(context):
+            symbols = context.symbol_table.symbols
+            context.frame = [symbols.get(name) for name in names]
+            context.return_value = NO_RETURN
+            try:
+                return closure(context), None
+            except RTException as e:
+                return None, e.error
+        return run
+
+    def visit_Program(self, node):
+        return self.compile_statements(node.statements)
+
+    def visit_Block(self, node):
+        return self.compile_statements(node.statements)
+
+    def compile_statements(self, statements):
+        statements = [self.visit(stmt) for stmt in statements]
+
+        def run_statements(context):
+            res = []
+            for stmt in statements:
+                value = stmt(context)
+                if not isinstance(context.return_value, NoneType):
+                    break
+                res.append(value.repr())
+            return res
+        return run_statements
+
+    def visit_NumberNode(self, node):
+        literal = node.tok.value
+        literal = int(literal) if str(int(literal)) == literal else float(literal)
+        position_start = node.position_start
+        position_end = node.position_end
+
+        def number(context):
+            return Number(literal).set_context(context).set_pos(position_start, position_end)
+        return number
+
+    def visit_IdentifierNode(self, node):
+        name = node.tok.value
+        address = self.resolver.addresses[node]
+        position_start = node.position_start
+        position_end = node.position_end
+
+        depth, slot = address[0]
+        if len(address) == 1 and depth == 0:
+            def identifier(context):
+                value = context.frame[slot]
+                if value is None:
+                    raise RTException(RTError(f"Name {name} does not exist", position_start, position_end, context))
+                return value
+        elif len(address) == 1:
+            def identifier(context):
+                value = frame_of(context, depth)[slot]
+                if value is None:
+                    raise RTException(RTError(f"Name {name} does not exist", position_start, position_end, context))
+                return value
+        else:
+            def identifier(context):
+                for depth, slot in address:
+                    value = frame_of(context, depth)[slot]
+                    if value is not None:
+                        return value
+                raise RTException(RTError(f"Name {name} does not exist", position_start, position_end, context))
+        return identifier
+
+    def visit_UnaryOperationNode(self, node):
+        operand = self.visit(node.node)
+        operation_tok = node.operation_tok
+
+        def unary(context):
+            result, error = operand(context).unary(operation_tok)
+            if error:
+                raise RTException(error)
+            return result
+        return unary
+
+    def visit_BinaryOperationNode(self, node):
+        left = self.visit(node.left_node)
+        right = self.visit(node.right_node)
+        make = BINARY_OPERATIONS[node.operation_tok.type]
+        return make(left, right, node.position_start, node.position_end)
+
+    def assignment(self, name_node, value_node):
+        value_closure = self.visit(value_node)
+        address = self.resolver.addresses[name_node]
+        slot = address[0][1]
+        outer = address[1:]
+
+        def assign(context):
+            value = value_closure(context)
+            frame = context.frame
+            if frame[slot] is None:
+                for depth, outer_slot in outer:
+                    outer_frame = frame_of(context, depth)
+                    if outer_frame[outer_slot] is not None:
+                        outer_frame[outer_slot] = value
+                        return NoneType()
+            frame[slot] = value
+            return NoneType()
+        return assign
+
+    def visit_FunctionNode(self, node):
+        name = "anonymous"
+        position_start = node.position_start
+        position_end = node.position_end
+        arg_node = node.arg_node
+        if not isinstance(arg_node, IdentifierNode):
+            def bad_argument(context):
+                raise RTException(RTError("Function argument must be an identifier", arg_node.position_start, arg_node.position_end, context))
+            return bad_argument
+
+        arg_names = [arg_node.tok.value]
+        code_node = node.code_block
+        run_body = self.visit(code_node)
+        scope = self.resolver.scopes[node]
+
+        def function(context):
+            return Function(name, arg_names, code_node, run_body, scope).set_context(context).set_pos(position_start, position_end)
+        return function
+
+    def visit_CallNode(self, node):
+        operand = self.visit(node.operand)
+        args = [self.visit(arg) for arg in node.arg_node.args]
+        position_start = node.position_start
+        position_end = node.position_end
+
+        if len(args) == 1:
+            arg = args[0]
+
+            def call(context):
+                value = operand(context).set_pos(position_start, position_end)
+                if type(value) is Function:
+                    return call_function(value, [arg(context)])
+                return_value, error = value.execute([arg(context)])
+                if error:
+                    raise RTException(error)
+                return return_value
+        else:
+            def call(context):
+                value = operand(context).set_pos(position_start, position_end)
+                arg_values = []
+                for arg in args:
+                    arg_values.append(arg(context))
+                if type(value) is Function:
+                    return call_function(value, arg_values)
+                return_value, error = value.execute(arg_values)
+                if error:
+                    raise RTException(error)
+                return return_value
+        return call
+
+    def visit_ReturnNode(self, node):
+        value_closure = self.visit(node.return_value)
+
+        def return_(context):
+            context.return_value = value = value_closure(context)
+            return value
+        return return_
+
+    def visit_IfNode(self, node):
+        branches = [(self.visit(node.if_condition), node.if_condition, self.visit(node.if_block_statement))]
+        for condition, block in zip(node.elif_conditions or (), node.elif_block_statements or ()):
+            branches.append((self.visit(condition), condition, self.visit(block)))
+        else_block = self.visit(node.else_block_statement) if node.else_block_statement else None
+
+        def if_(context):
+            for condition, condition_node, block in branches:
+                if is_true(condition(context), condition_node, context):
+                    block(context)
+                    return NoneType()
+            if else_block is not None:
+                else_block(context)
+            return NoneType()
+        return if_
+
+    def visit_WhileNode(self, node):
+        condition = self.visit(node.condition)
+        condition_node = node.condition
+        body = self.compile_loop_body(node.block)
+
+        if can_leave(node.block):
+            def while_(context):
+                while is_true(condition(context), condition_node, context):
+                    body(context)
+                    if context.return_value is not NO_RETURN and loop_stops(context):
+                        break
+                return NoneType()
+        else:
+            def while_(context):
+                while is_true(condition(context), condition_node, context):
+                    body(context)
+                return NoneType()
+        return while_
+
+    def visit_ForNode(self, node):
+        start = self.visit(node.start_value)
+        end = self.visit(node.end_value)
+        step = self.visit(node.step_value) if node.step_value is not None else None
+        body = self.compile_loop_body(node.block)
+        leaves = can_leave(node.block)
+        address = self.resolver.addresses[node.var_name]
+        slot = address[0][1]
+        outer = address[1:]
+        position_start = node.var_name.position_start
+        position_end = node.var_name.position_end
+
+        def for_(context):
+            values = [start(context), end(context)]
+            if step is not None:
+                values.append(step(context))
+            values = [value.value if type(value) is Number else value for value in values]
+            if step is None:
+                values.append(1)
+            numbers, error = loop_range(*values, node, context)
+            if error:
+                raise RTException(error)
+            if numbers:
+                # As in ClosureCompiler.
+                frame, frame_slot = assignment_target(context, slot, outer)
+                for i in numbers:
+                    frame[frame_slot] = Number(i).set_context(context).set_pos(position_start, position_end)
+                    body(context)
+                    if leaves and context.return_value is not NO_RETURN and loop_stops(context):
+                        break
+            return NoneType()
+        return for_
+
+    def compile_loop_body(self, block):
+        # As in ClosureCompiler. A body of one statement is just that
+        # statement.
+        statements = [(self.visit(stmt), can_leave(stmt)) for stmt in block.statements]
+        if len(statements) == 1:
+            return statements[0][0]
+        if not any(leaves for stmt, leaves in statements):
+            statements = [stmt for stmt, leaves in statements]
+
+            def run_body(context):
+                for stmt in statements:
+                    stmt(context)
+            return run_body
+
+        def run_body(context):
+            for stmt, leaves in statements:
+                stmt(context)
+                if leaves and not isinstance(context.return_value, NoneType):
+                    break
+        return run_body
+
+    def visit_BreakNode(self, node):
+        def break_(context):
+            context.return_value = BREAK
+            return BREAK
+        return break_
+
+    def visit_ContinueNode(self, node):
+        def continue_(context):
+            context.return_value = CONTINUE
+            return CONTINUE
+        return continue_
+
+
+def call_function(function, arg_values):
+    # Function.execute_compiled for bodies that raise.
+    if len(arg_values) != len(function.arg_names):
+        raise RTException(function.check_and_populate_args(arg_values)[1])
+    scope = function.scope
+    pool = scope.pool
+    exec_ctx = Context(function.name, parent=function.context, parent_start_pos=function.position_start)
+    exec_ctx.frame = frame = pool.pop() if pool else [None] * len(scope.names)
+    for i in range(len(arg_values)):
+        frame[scope.arg_slots[i]] = arg_values[i]
+    try:
+        function.body(exec_ctx)
+    finally:
+        if not scope.has_functions:
+            frame[:] = scope.empty_frame
+            pool.append(frame)
+    return exec_ctx.return_value
+
+
+def is_true(value, node, context):
+    # interpreter.truth for closures that raise.
+    if type(value) is Number:
+        return value.value != 0
+    raise RTException(truth(value, node, context)[1])
+
+
+###################
+# Binary operations
+###################
+def make_arithmetic(operation, method):
+    def make(left, right, position_start, position_end):
+        def arithmetic(context):
+            left_value = left(context)
+            right_value = right(context)
+            if type(left_value) is Number and type(right_value) is Number:
+                result = Number(operation(left_value.value, right_value.value)).set_context(left_value.context)
+            else:
+                result, error = method(left_value, right_value)
+                if error:
+                    raise RTException(error)
+            return result.set_pos(position_start, position_end)
+        return arithmetic
+    return make
+
+
+def make_div(left, right, position_start, position_end):
+    def div(context):
+        left_value = left(context)
+        right_value = right(context)
+        # Division by 0 is left to Number.div, which reports it.
+        if type(left_value) is Number and type(right_value) is Number and right_value.value != 0:
+            result = Number(left_value.value / right_value.value).set_context(left_value.context)
+        else:
+            result, error = left_value.div(right_value)
+            if error:
+                raise RTException(error)
+        return result.set_pos(position_start, position_end)
+    return div
+
+
+def make_comparison(operation, method):
+    def make(left, right, position_start, position_end):
+        def compare(context):
+            left_value = left(context)
+            right_value = right(context)
+            if type(left_value) is Number and type(right_value) is Number:
+                result = Number(int(operation(left_value.value, right_value.value))).set_context(left_value.context)
+            else:
+                result, error = method(left_value, right_value)
+                if error:
+                    raise RTException(error)
+            return result.set_pos(position_start, position_end)
+        return compare
+    return make
+
+
+BINARY_OPERATIONS = {
+    PLUS: make_arithmetic(operator.add, lambda left, right: left.add(right)),
+    MINUS: make_arithmetic(operator.sub, lambda left, right: left.sub(right)),
+    ASTERISK: make_arithmetic(operator.mul, lambda left, right: left.mul(right)),
+    SLASH: make_div,
+    LESS_THAN: make_comparison(operator.lt, lambda left, right: left.lt(right)),
+    GREATER_THAN: make_comparison(operator.gt, lambda left, right: left.gt(right)),
+    LESS_THAN_OR_EQUAL: make_comparison(operator.le, lambda left, right: left.lt_or_eq(right)),
+    GREATER_THAN_OR_EQUAL: make_comparison(operator.ge, lambda left, right: left.gt_or_eq(right)),
+    DOUBLE_EQUAL: make_comparison(operator.eq, lambda left, right: left.eq(right)),
+    NOT_EQUAL: make_comparison(operator.ne, lambda left, right: left.ne(right)),
+}
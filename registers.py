@@ -0,0 +1,921 @@
+import math
+import operator
+from array import array
+from token_ import *
+from ast import *
+from visitor import Visitor
+from errors import RTError
+from resolver import Resolver
+from interpreter import Context, NoneType, global_vars
+from compiler import Variable, Constant
+from stackless import MAX_DEPTH
+from vm import NUMBERS, NONE, WRITE, Closure, String, box, text_of, equal, not_equal, call_builtin, call_context
+
+###################
+# Opcodes
+###################
+MOVE = 1
+GET = 2
+GET_GLOBAL = 3
+GET_OUTER = 4
+LOOKUP = 5
+SET_GLOBAL = 6
+SET_OUTER = 7
+SET_NAME = 8
+ADD = 9
+SUB = 10
+MUL = 11
+DIV = 12
+LT = 13
+GT = 14
+LE = 15
+GE = 16
+EQ = 17
+NE = 18
+NEG = 19
+UNARY = 20
+JUMP = 21
+JUMP_IF_FALSE = 22
+JUMP_UNLESS = 23
+CALL = 24
+RETURN = 25
+RETURN_NONE = 26
+MAKE_FUNCTION = 27
+FOR_PREP = 28
+FOR_ITER = 29
+ERROR = 30
+RESULT = 31
+HALT = 32
+
+OPCODE_NAMES = {
+    MOVE: "MOVE",
+    GET: "GET",
+    GET_GLOBAL: "GET_GLOBAL",
+    GET_OUTER: "GET_OUTER",
+    LOOKUP: "LOOKUP",
+    SET_GLOBAL: "SET_GLOBAL",
+    SET_OUTER: "SET_OUTER",
+    SET_NAME: "SET_NAME",
+    ADD: "ADD",
+    SUB: "SUB",
+    MUL: "MUL",
+    DIV: "DIV",
+    LT: "LT",
+    GT: "GT",
+    LE: "LE",
+    GE: "GE",
+    EQ: "EQ",
+    NE: "NE",
+    NEG: "NEG",
+    UNARY: "UNARY",
+    JUMP: "JUMP",
+    JUMP_IF_FALSE: "JUMP_IF_FALSE",
+    JUMP_UNLESS: "JUMP_UNLESS",
+    CALL: "CALL",
+    RETURN: "RETURN",
+    RETURN_NONE: "RETURN_NONE",
+    MAKE_FUNCTION: "MAKE_FUNCTION",
+    FOR_PREP: "FOR_PREP",
+    FOR_ITER: "FOR_ITER",
+    ERROR: "ERROR",
+    RESULT: "RESULT",
+    HALT: "HALT",
+}
+
+# An instruction is a tuple of its opcode, its operands and, last, the Site
+# that locates its errors (None for those that cannot fail). What each
+# operand is, for liveness: d a register written, u a register read, U a
+# tuple of registers read, l a jump target and - anything else.
+#   MOVE d u                      copy a register
+#   GET d u                       copy a variable, which must be set
+#   GET_GLOBAL d slot             read a variable of the program
+#   GET_OUTER d depth slot        read a variable of an enclosing function
+#   LOOKUP d places               read the first of `places` that is set
+#   SET_GLOBAL slot u, SET_OUTER depth slot u, SET_NAME places u
+#   ADD..EQ, NE d u u             three-address operations
+#   NEG d u, UNARY token u
+#   JUMP l, JUMP_IF_FALSE u l
+#   JUMP_UNLESS comparison u u l  jump unless the comparison holds
+#   CALL d u U                    d = u(U...) when the call returns
+#   RETURN u, RETURN_NONE, RESULT u (a value of the program), HALT
+#   MAKE_FUNCTION d function
+#   FOR_PREP d u u u bound sites  d = iterator over range(u, u, u)
+#   FOR_ITER d u l                d = next(u), or jump when it is done
+#   ERROR message
+# A place is (depth, slot, global), as the resolver gives them.
+ROLES = {
+    MOVE: "du", GET: "du", GET_GLOBAL: "d-", GET_OUTER: "d--", LOOKUP: "d-",
+    SET_GLOBAL: "-u", SET_OUTER: "--u", SET_NAME: "-u",
+    ADD: "duu", SUB: "duu", MUL: "duu", DIV: "duu", LT: "duu", GT: "duu", LE: "duu", GE: "duu", EQ: "duu", NE: "duu",
+    NEG: "du", UNARY: "-u", JUMP: "l", JUMP_IF_FALSE: "ul", JUMP_UNLESS: "-uul",
+    CALL: "duU", RETURN: "u", RETURN_NONE: "", RESULT: "u", HALT: "", MAKE_FUNCTION: "d-",
+    FOR_PREP: "duuu-", FOR_ITER: "dul", ERROR: "-",
+}
+# Instructions after which the next one does not run.
+ENDS = frozenset((JUMP, RETURN_NONE, HALT, ERROR))
+
+OPERATIONS = {
+    PLUS: ADD,
+    MINUS: SUB,
+    ASTERISK: MUL,
+    SLASH: DIV,
+    LESS_THAN: LT,
+    GREATER_THAN: GT,
+    LESS_THAN_OR_EQUAL: LE,
+    GREATER_THAN_OR_EQUAL: GE,
+    DOUBLE_EQUAL: EQ,
+    NOT_EQUAL: NE,
+}
+COMPARISONS = {LT: operator.lt, GT: operator.gt, LE: operator.le, GE: operator.ge, EQ: equal, NE: not_equal}
+METHODS = {ADD: "add", SUB: "sub", MUL: "mul", DIV: "div", LT: "lt", GT: "gt", LE: "lt_or_eq", GE: "gt_or_eq", EQ: "eq", NE: "ne"}
+
+# Statements that leave no value, and nodes whose value is a constant. Tuples
+# for isinstance, as in compiler.STATEMENTS.
+STATEMENTS = (VarAssignNode, ConstAssignNode, ReturnNode, IfNode, WhileNode, ForNode, BreakNode, ContinueNode)
+LITERALS = (NumberNode, StringNode)
+
+
+###################
+# Code
+###################
+class Site(object):
+    """Where an instruction's errors are reported, and the variables it
+    reads straight from their registers, as (register, name, start, end)
+    in the order the program reads them. Those are checked for being set
+    before anything else about the instruction fails."""
+    def __init__(self, position_start=None, position_end=None, names=()):
+        self.position_start = position_start
+        self.position_end = position_end
+        self.names = names
+
+
+class Temp(object):
+    """A virtual register, for a value only the code of one function
+    sees. `allocate` gives it a real one."""
+    def __init__(self):
+        self.register = None
+
+
+class Label(object):
+    def __init__(self):
+        self.index = None
+
+
+class Loop(object):
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+
+
+class Prototype(object):
+    """A compiled function, or the program.
+
+    `frame` is what a call's registers start as: the slots of the scope's
+    variables, then its constants, then the registers of its temporaries,
+    and last the frame the function was made in.
+    """
+    def __init__(self, code, frame, arg_slot, temps, registers):
+        self.code = code
+        self.frame = frame
+        self.arg_slot = arg_slot
+        # How many virtual registers allocation started with and how many
+        # real ones they were given.
+        self.temps = temps
+        self.registers = registers
+
+
+###################
+# RegisterCompiler
+###################
+class RegisterCompiler(Visitor):
+    """Compiles a tree to the register machine run by RegisterVM.
+
+    Like Compiler, every name lives at a fixed address: the resolver's
+    slot in the frame of its scope, which here is a register, as
+    `variables` lists for the program. Constants get the registers after
+    the variables, once per distinct value. An operation reads its
+    operands from registers and writes its result to one, so a variable
+    is used in place and `s = s + i` is one instruction. Where the program
+    would read a variable before something that can change or fail, it is
+    copied first, so operands are read in the program's order.
+
+    Intermediate values go to virtual registers. Once a function is
+    compiled, `allocate` works out where each is live and gives ones that
+    are never live at the same time the same real register.
+    """
+    def __init__(self, max_depth=MAX_DEPTH):
+        self.max_depth = max_depth
+        self.variables = {}
+        self.functions = []
+        self.resolver = None
+        self.scope = None
+        self.root = None
+        self.code = None
+        self.constants = None
+        self.loops = None
+
+    def visit(self, node, dst=None):
+        func = self.handlers.get(type(node))
+        if func is None:
+            func = self.handler(type(node))
+        return func(self, node, dst)
+
+    def translate(self, program):
+        """The program as a Prototype, with its functions in
+        `functions`."""
+        self.resolver = Resolver().resolve(program, global_vars)
+        self.scope = self.root = self.resolver.scopes[program]
+        for slot, name in enumerate(self.root.names):
+            self.variables[name] = Variable(IDENTIFIER, name, slot)
+        self.code, self.constants, self.loops = [], {}, []
+        for stmt in program.statements:
+            self.statement(stmt, True)
+        self.emit(HALT, None)
+        return self.finish(None)
+
+    def compile(self, program):
+        main = self.translate(program)
+        functions = self.functions
+        max_depth = self.max_depth
+
+        def run(context):
+            return RegisterVM(main, functions, context.source, max_depth).run()
+        return run
+
+    def run(self, program, context):
+        return self.compile(program)(context)
+
+    def emit(self, op, *operands):
+        self.code.append([op, *operands])
+
+    def place_label(self, label):
+        label.index = len(self.code)
+
+    ###################
+    # Registers
+    ###################
+    def add_constant(self, type, data):
+        key = (type, repr(data))
+        constant = self.constants.get(key)
+        if constant is None:
+            value = String(data) if type == STRING else data
+            constant = Constant(type, value, len(self.scope.names) + len(self.constants))
+            self.constants[key] = constant
+        return constant.address
+
+    def own_register(self, node):
+        """The register of a variable only ever in the running frame."""
+        if isinstance(node, IdentifierNode):
+            address = self.resolver.addresses[node]
+            if len(address) == 1 and address[0][0] == 0:
+                return address[0][1]
+        return None
+
+    def simple(self, node):
+        # Reading these cannot fail or change anything.
+        return isinstance(node, LITERALS) or self.own_register(node) is not None
+
+    def places(self, address):
+        scope = self.scope
+        depths = []
+        for depth in range(max(depth for depth, slot in address) + 1):
+            depths.append(scope is self.root)
+            scope = scope.parent
+        return tuple((depth, slot, depths[depth] and depth > 0) for depth, slot in address)
+
+    def operand(self, node, direct):
+        """A register holding the value of `node` and the variables read in
+        place for it. With `direct`, a variable is read where it is."""
+        if isinstance(node, NumberNode):
+            return self.add_constant(FLOAT, float(node.tok.value)), ()
+        if isinstance(node, StringNode):
+            return self.add_constant(STRING, node.tok.value), ()
+        register = self.own_register(node)
+        if direct and register is not None:
+            return register, ((register, node.tok.value, node.position_start, node.position_end),)
+        return self.visit(node), ()
+
+    def operands(self, nodes):
+        """Registers for `nodes` evaluated in order, and what they read in
+        place."""
+        registers = []
+        names = ()
+        for i, node in enumerate(nodes):
+            register, read = self.operand(node, all(self.simple(later) for later in nodes[i + 1:]))
+            registers.append(register)
+            names += read
+        return registers, names
+
+    ###################
+    # Statements
+    ###################
+    def statement(self, stmt, top_level=False):
+        if isinstance(stmt, STATEMENTS):
+            self.visit(stmt)
+        elif top_level:
+            register, names = self.operand(stmt, True)
+            self.emit(RESULT, register, Site(names=names))
+        elif not isinstance(stmt, LITERALS):
+            self.visit(stmt)
+
+    def visit_Block(self, node, dst):
+        for stmt in node.statements:
+            self.statement(stmt)
+
+    def visit_VarAssignNode(self, node, dst):
+        self.assign(node.var_name, node.var_value)
+
+    def visit_ConstAssignNode(self, node, dst):
+        self.assign(node.const_name, node.const_value)
+
+    def assign(self, name, value):
+        register = self.own_register(name)
+        if register is not None:
+            self.visit(value, register)
+            return
+        self.store(self.resolver.addresses[name], self.value(value))
+
+    def store(self, address, value):
+        if len(address) > 1:
+            self.emit(SET_NAME, self.places(address), value, None)
+            return
+        depth, slot, is_global = self.places(address)[0]
+        if is_global:
+            self.emit(SET_GLOBAL, slot, value, None)
+        else:
+            self.emit(SET_OUTER, depth, slot, value, None)
+
+    def value(self, node):
+        # A register holding what `node` evaluates to, checked if it is a
+        # variable.
+        if isinstance(node, LITERALS):
+            return self.operand(node, False)[0]
+        return self.visit(node)
+
+    def visit_ReturnNode(self, node, dst):
+        register, names = self.operand(node.return_value, True)
+        self.emit(RETURN, register, Site(names=names))
+
+    def branch(self, condition, label):
+        """Jump to `label` unless `condition` holds."""
+        if isinstance(condition, BinaryOperationNode) and OPERATIONS.get(condition.operation_tok.type) in COMPARISONS:
+            (left, right), names = self.operands([condition.left_node, condition.right_node])
+            site = Site(condition.position_start, condition.position_end, names)
+            self.emit(JUMP_UNLESS, OPERATIONS[condition.operation_tok.type], left, right, label, site)
+            return
+        register, names = self.operand(condition, True)
+        self.emit(JUMP_IF_FALSE, register, label, Site(condition.position_start, condition.position_end, names))
+
+    def visit_IfNode(self, node, dst):
+        # As in Compiler.visit_IfNode.
+        conditions = [node.if_condition] + (node.elif_conditions or [])
+        blocks = [node.if_block_statement] + (node.elif_block_statements or [])
+        to_end = Label()
+        for i, (condition, block) in enumerate(zip(conditions, blocks)):
+            to_next = Label()
+            self.branch(condition, to_next)
+            self.visit(block)
+            if i < len(conditions) - 1 or node.else_block_statement:
+                self.emit(JUMP, to_end, None)
+            self.place_label(to_next)
+        if node.else_block_statement:
+            self.visit(node.else_block_statement)
+        self.place_label(to_end)
+
+    def visit_WhileNode(self, node, dst):
+        loop = Loop(Label(), Label())
+        self.place_label(loop.start)
+        self.branch(node.condition, loop.end)
+        self.loop_body(node.block, loop)
+        self.emit(JUMP, loop.start, None)
+        self.place_label(loop.end)
+
+    def visit_ForNode(self, node, dst):
+        bounds = [node.start_value, node.end_value]
+        if node.step_value is not None:
+            bounds.append(node.step_value)
+        registers, names = self.operands(bounds)
+        # Every bound is evaluated before any is checked. The default step
+        # is checked too, which only makes it an int.
+        sites = tuple(Site(bound.position_start, bound.position_end) for bound in bounds)
+        if node.step_value is None:
+            registers.append(self.add_constant(FLOAT, 1.0))
+            sites += (Site(),)
+        iterator = Temp()
+        self.emit(FOR_PREP, iterator, *registers, sites, Site(sites[2].position_start, sites[2].position_end, names))
+        loop = Loop(Label(), Label())
+        self.place_label(loop.start)
+        register = self.own_register(node.var_name)
+        if register is not None:
+            self.emit(FOR_ITER, register, iterator, loop.end, None)
+        else:
+            value = Temp()
+            self.emit(FOR_ITER, value, iterator, loop.end, None)
+            self.store(self.resolver.addresses[node.var_name], value)
+        self.loop_body(node.block, loop)
+        self.emit(JUMP, loop.start, None)
+        self.place_label(loop.end)
+
+    def loop_body(self, block, loop):
+        self.loops.append(loop)
+        self.visit(block)
+        self.loops.pop()
+
+    def visit_BreakNode(self, node, dst):
+        self.emit(JUMP, self.loops[-1].end, None)
+
+    def visit_ContinueNode(self, node, dst):
+        self.emit(JUMP, self.loops[-1].start, None)
+
+    ###################
+    # Expressions
+    ###################
+    # Each returns the register its value is in: `dst` if given, else a
+    # new virtual register, or that of a constant.
+    def visit_NumberNode(self, node, dst):
+        return self.move(self.add_constant(FLOAT, float(node.tok.value)), dst)
+
+    def visit_StringNode(self, node, dst):
+        return self.move(self.add_constant(STRING, node.tok.value), dst)
+
+    def move(self, register, dst):
+        if dst is None:
+            return register
+        self.emit(MOVE, dst, register, None)
+        return dst
+
+    def visit_IdentifierNode(self, node, dst):
+        dst = Temp() if dst is None else dst
+        name = node.tok.value
+        address = self.resolver.addresses[node]
+        site = Site(node.position_start, node.position_end, ((None, name, node.position_start, node.position_end),))
+        register = self.own_register(node)
+        if register is not None:
+            self.emit(GET, dst, register, Site(node.position_start, node.position_end, ((register,) + site.names[0][1:],)))
+        elif len(address) > 1:
+            self.emit(LOOKUP, dst, self.places(address), site)
+        else:
+            depth, slot, is_global = self.places(address)[0]
+            if is_global:
+                self.emit(GET_GLOBAL, dst, slot, site)
+            else:
+                self.emit(GET_OUTER, dst, depth, slot, site)
+        return dst
+
+    def visit_BinaryOperationNode(self, node, dst):
+        (left, right), names = self.operands([node.left_node, node.right_node])
+        dst = Temp() if dst is None else dst
+        self.emit(OPERATIONS[node.operation_tok.type], dst, left, right, Site(node.position_start, node.position_end, names))
+        return dst
+
+    def visit_UnaryOperationNode(self, node, dst):
+        register, names = self.operand(node.node, True)
+        dst = Temp() if dst is None else dst
+        site = Site(node.position_start, node.position_end, names)
+        if node.operation_tok.type == MINUS:
+            self.emit(NEG, dst, register, site)
+        else:
+            # Anything but a minus fails; the VM makes the error.
+            self.emit(UNARY, node.operation_tok.type, register, site)
+        return dst
+
+    def visit_CallNode(self, node, dst):
+        registers, names = self.operands([node.operand] + node.arg_node.args)
+        dst = Temp() if dst is None else dst
+        self.emit(CALL, dst, registers[0], tuple(registers[1:]), Site(node.position_start, node.position_end, names))
+        return dst
+
+    def visit_FunctionNode(self, node, dst):
+        dst = Temp() if dst is None else dst
+        if not isinstance(node.arg_node, IdentifierNode):
+            self.emit(ERROR, "Function argument must be an identifier", Site(node.arg_node.position_start, node.arg_node.position_end))
+            return dst
+
+        scope = self.resolver.scopes[node]
+        outer = self.scope, self.code, self.constants, self.loops
+        self.scope, self.code, self.constants, self.loops = scope, [], {}, []
+        self.visit(node.code_block)
+        self.emit(RETURN_NONE, None)
+        self.functions.append(self.finish(scope.arg_slots[0]))
+        self.scope, self.code, self.constants, self.loops = outer
+        self.emit(MAKE_FUNCTION, dst, len(self.functions) - 1, None)
+        return dst
+
+    ###################
+    # Allocation
+    ###################
+    def finish(self, arg_slot):
+        """Allocate the registers of the function just compiled and make
+        its Prototype."""
+        base = len(self.scope.names) + len(self.constants)
+        temps, registers = self.allocate(self.code, base)
+        frame = [None] * len(self.scope.names)
+        if self.scope is self.root:
+            predefined = {"true": 1, "false": 0, "none": NONE, "write": WRITE}
+            frame = [predefined.get(name) for name in self.scope.names]
+        frame += [constant.data for constant in self.constants.values()]
+        frame += [None] * (registers + 1)
+        code = [self.lower(instruction) for instruction in self.code]
+        return Prototype(code, frame, arg_slot, temps, registers)
+
+    def lower(self, instruction):
+        # The tuple the VM runs, with real registers and jump targets.
+        operands = []
+        for role, operand in zip("-" + ROLES[instruction[0]], instruction):
+            if type(operand) is Temp:
+                operand = operand.register
+            elif type(operand) is Label:
+                operand = operand.index
+            elif role == "U":
+                operand = tuple(register.register if type(register) is Temp else register for register in operand)
+            operands.append(operand)
+        # The site, which ROLES leaves out.
+        operands.append(instruction[-1])
+        return tuple(operands)
+
+    def allocate(self, code, base):
+        """Give each virtual register of `code` a real one from `base` on.
+        Returns how many virtual registers there were and how many real
+        ones they take.
+
+        A virtual register is live from where it is written to where it is
+        last read, along every path through the code. Two that are never
+        live at once can share, so each gets the lowest register that
+        none of those live where it is written has.
+        """
+        uses = []
+        defs = []
+        successors = []
+        temps = {}
+        for i, instruction in enumerate(code):
+            used = []
+            defined = []
+            targets = []
+            for role, operand in zip(ROLES[instruction[0]], instruction[1:]):
+                if role == "d" and type(operand) is Temp:
+                    defined.append(operand)
+                elif role == "u" and type(operand) is Temp:
+                    used.append(operand)
+                elif role == "U":
+                    used.extend(register for register in operand if type(register) is Temp)
+                elif role == "l":
+                    targets.append(operand.index)
+            for temp in defined + used:
+                temps.setdefault(temp, len(temps))
+            uses.append(frozenset(used))
+            defs.append(frozenset(defined))
+            if instruction[0] not in ENDS and i + 1 < len(code):
+                targets.append(i + 1)
+            successors.append(targets)
+
+        # What is live going into each instruction, worked out backwards
+        # until nothing changes; loops take more than one round.
+        live_in = [frozenset()] * len(code)
+        changed = True
+        while changed:
+            changed = False
+            for i in range(len(code) - 1, -1, -1):
+                live_out = frozenset().union(*(live_in[j] for j in successors[i]))
+                live = uses[i] | (live_out - defs[i])
+                if live != live_in[i]:
+                    live_in[i] = live
+                    changed = True
+
+        interferes = {temp: set() for temp in temps}
+        for i in range(len(code)):
+            live_out = frozenset().union(*(live_in[j] for j in successors[i]))
+            for temp in defs[i]:
+                for other in live_out:
+                    if other is not temp:
+                        interferes[temp].add(other)
+                        interferes[other].add(temp)
+
+        colors = {}
+        for temp in temps:
+            taken = {colors[other] for other in interferes[temp] if other in colors}
+            color = 0
+            while color in taken:
+                color += 1
+            colors[temp] = color
+            temp.register = base + color
+        return len(temps), max(colors.values(), default=-1) + 1
+
+
+###################
+# RegisterVM
+###################
+class RegisterVM(object):
+    """Runs the program RegisterCompiler made of a tree.
+
+    A frame is a list of registers, which `Prototype.frame` is copied to
+    on each call, ending in the frame the function was made in. The
+    program's own frame is also where functions find its variables. A
+    call pushes (caller's code, return index, caller's frame, register
+    for the result, call site) on `frames`.
+
+    Values, output and errors are those of vm.VM, and `counts` holds how
+    many times each opcode has run.
+    """
+    def __init__(self, main, functions, source=None, max_depth=MAX_DEPTH):
+        self.main = main
+        self.functions = functions
+        self.source = source
+        self.max_depth = max_depth
+        self.counts = array("Q", bytes(8 * 256))
+
+    def run(self):
+        """Returns (the values of the program's expression statements,
+        error), as vm.VM.run."""
+        functions = self.functions
+        counts = self.counts
+        max_depth = self.max_depth
+        code = self.main.code
+        globals_ = regs = list(self.main.frame)
+        results = []
+        frames = []
+        pc = 0
+        while True:
+            instruction = code[pc]
+            op = instruction[0]
+            counts[op] += 1
+            if op == ADD:
+                left = regs[instruction[2]]
+                right = regs[instruction[3]]
+                try:
+                    regs[instruction[1]] = left + right
+                except TypeError:
+                    return None, self.operation_error(instruction, left, right, regs, frames)
+                pc += 1
+            elif op == JUMP_UNLESS:
+                left = regs[instruction[2]]
+                right = regs[instruction[3]]
+                try:
+                    passed = COMPARISONS[instruction[1]](left, right)
+                except TypeError:
+                    return None, self.operation_error(instruction, left, right, regs, frames)
+                pc = pc + 1 if passed else instruction[4]
+            elif op == SUB:
+                left = regs[instruction[2]]
+                right = regs[instruction[3]]
+                try:
+                    regs[instruction[1]] = left - right
+                except TypeError:
+                    return None, self.operation_error(instruction, left, right, regs, frames)
+                pc += 1
+            elif op == JUMP:
+                pc = instruction[1]
+            elif op == GET_GLOBAL:
+                value = globals_[instruction[2]]
+                if value is None:
+                    return None, self.name_error(instruction[-1].names[0], regs, frames)
+                regs[instruction[1]] = value
+                pc += 1
+            elif op == FOR_ITER:
+                value = next(regs[instruction[2]], None)
+                if value is None:
+                    pc = instruction[3]
+                else:
+                    regs[instruction[1]] = value
+                    pc += 1
+            elif op == CALL:
+                callee = regs[instruction[2]]
+                args = instruction[3]
+                if instruction[-1].names:
+                    error = self.unset(instruction[-1], regs, frames)
+                    if error:
+                        return None, error
+                if type(callee) is Closure and len(args) == 1:
+                    if len(frames) >= max_depth:
+                        return None, self.depth_error(callee, instruction[-1], regs, frames)
+                    function = callee.function
+                    frame = function.frame.copy()
+                    frame[-1] = callee.env
+                    frame[function.arg_slot] = regs[args[0]]
+                    frames.append((code, pc + 1, regs, instruction[1], instruction[-1]))
+                    code = function.code
+                    regs = frame
+                    pc = 0
+                else:
+                    value, error = self.call_value(callee, [regs[arg] for arg in args], instruction[-1], regs, frames)
+                    if error:
+                        return None, error
+                    regs[instruction[1]] = value
+                    pc += 1
+            elif op == RETURN:
+                # A `return` whose value is none does not end the body.
+                value = regs[instruction[1]]
+                if value is None:
+                    return None, self.unset(instruction[-1], regs, frames)
+                if type(value) is NoneType:
+                    pc += 1
+                elif not frames:
+                    return self.results(results), None
+                else:
+                    code, pc, caller, dst, site = frames.pop()
+                    caller[dst] = value
+                    regs = caller
+            elif op == RETURN_NONE:
+                code, pc, caller, dst, site = frames.pop()
+                caller[dst] = NONE
+                regs = caller
+            elif op == MUL:
+                left = regs[instruction[2]]
+                right = regs[instruction[3]]
+                try:
+                    regs[instruction[1]] = left * right
+                except TypeError:
+                    return None, self.operation_error(instruction, left, right, regs, frames)
+                pc += 1
+            elif op == DIV:
+                left = regs[instruction[2]]
+                right = regs[instruction[3]]
+                try:
+                    regs[instruction[1]] = left / right
+                except (TypeError, ZeroDivisionError):
+                    return None, self.operation_error(instruction, left, right, regs, frames)
+                pc += 1
+            elif op == GET:
+                value = regs[instruction[2]]
+                if value is None:
+                    return None, self.name_error(instruction[-1].names[0], regs, frames)
+                regs[instruction[1]] = value
+                pc += 1
+            elif op == MOVE:
+                regs[instruction[1]] = regs[instruction[2]]
+                pc += 1
+            elif op == JUMP_IF_FALSE:
+                value = regs[instruction[1]]
+                if type(value) not in NUMBERS:
+                    if value is None:
+                        return None, self.unset(instruction[-1], regs, frames)
+                    # Only numbers have a truth, as in interpreter.truth.
+                    return None, self.runtime_error("Illegal Operation", instruction[-1], regs, frames)
+                pc = instruction[2] if value == 0 else pc + 1
+            elif op in COMPARISONS:
+                left = regs[instruction[2]]
+                right = regs[instruction[3]]
+                try:
+                    regs[instruction[1]] = 1 if COMPARISONS[op](left, right) else 0
+                except TypeError:
+                    return None, self.operation_error(instruction, left, right, regs, frames)
+                pc += 1
+            elif op == SET_GLOBAL:
+                globals_[instruction[1]] = regs[instruction[2]]
+                pc += 1
+            elif op == GET_OUTER:
+                frame = regs
+                for _ in range(instruction[2]):
+                    frame = frame[-1]
+                value = frame[instruction[3]]
+                if value is None:
+                    return None, self.name_error(instruction[-1].names[0], regs, frames)
+                regs[instruction[1]] = value
+                pc += 1
+            elif op == SET_OUTER:
+                frame = regs
+                for _ in range(instruction[1]):
+                    frame = frame[-1]
+                frame[instruction[2]] = regs[instruction[3]]
+                pc += 1
+            elif op == LOOKUP:
+                for place in instruction[2]:
+                    value = self.frame_of(place, regs, globals_)[place[1]]
+                    if value is not None:
+                        break
+                else:
+                    return None, self.name_error(instruction[-1].names[0], regs, frames)
+                regs[instruction[1]] = value
+                pc += 1
+            elif op == SET_NAME:
+                # As closures.assignment_target: the name's own slot, unless
+                # it is unset and an enclosing scope has the name set.
+                places = instruction[1]
+                target = places[0]
+                for place in places:
+                    if self.frame_of(place, regs, globals_)[place[1]] is not None:
+                        target = place
+                        break
+                self.frame_of(target, regs, globals_)[target[1]] = regs[instruction[2]]
+                pc += 1
+            elif op == RESULT:
+                value = regs[instruction[1]]
+                if value is None:
+                    return None, self.unset(instruction[-1], regs, frames)
+                results.append(value)
+                pc += 1
+            elif op == MAKE_FUNCTION:
+                regs[instruction[1]] = Closure(functions[instruction[2]], regs)
+                pc += 1
+            elif op == NEG:
+                value = regs[instruction[2]]
+                if type(value) not in NUMBERS:
+                    return None, self.unary_error(MINUS, value, instruction[-1], regs, frames)
+                regs[instruction[1]] = -value
+                pc += 1
+            elif op == FOR_PREP:
+                value, error = self.for_range(instruction, regs, frames)
+                if error:
+                    return None, error
+                regs[instruction[1]] = value
+                pc += 1
+            elif op == UNARY:
+                return None, self.unary_error(instruction[1], regs[instruction[2]], instruction[-1], regs, frames)
+            elif op == ERROR:
+                return None, self.runtime_error(instruction[1], instruction[-1], regs, frames)
+            else:
+                return self.results(results), None
+
+    def results(self, values):
+        return [text_of(value) if type(value) not in NUMBERS else value for value in values]
+
+    def frame_of(self, place, regs, globals_):
+        depth, slot, is_global = place
+        if is_global:
+            return globals_
+        frame = regs
+        for _ in range(depth):
+            frame = frame[-1]
+        return frame
+
+    def for_range(self, instruction, regs, frames):
+        error = self.unset(instruction[-1], regs, frames)
+        if error:
+            return None, error
+        bounds = []
+        for register, site in zip(instruction[2:5], instruction[5]):
+            value = regs[register]
+            if type(value) is float and math.isfinite(value) and value.is_integer():
+                value = int(value)
+            elif type(value) is not int:
+                return None, self.runtime_error("For loop bounds must be whole numbers", site, regs, frames)
+            bounds.append(value)
+        if bounds[2] == 0:
+            return None, self.runtime_error("For loop step must not be 0", instruction[-1], regs, frames)
+        return iter(range(*bounds)), None
+
+    def call_value(self, callee, args, site, regs, frames):
+        if type(callee) is Closure:
+            context = self.context_of(frames, regs, callee.env)
+        else:
+            context = self.context(frames, regs)
+        return call_builtin(callee, args, site.position_start, site.position_end, context)
+
+    ###################
+    # Errors
+    ###################
+    def context(self, frames, regs):
+        return self.context_of(frames, regs, regs)
+
+    def context_of(self, frames, regs, frame):
+        activations = [frames[i + 1][2] for i in range(len(frames) - 1)] + [regs] if frames else []
+        return call_context(activations, lambda i: frames[i][4].position_start, frame, self.source)
+
+    def runtime_error(self, text, site, regs, frames):
+        return RTError(text, site.position_start, site.position_end, self.context(frames, regs))
+
+    def name_error(self, name, regs, frames):
+        register, text, position_start, position_end = name
+        return RTError(f"Name {text} does not exist", position_start, position_end, self.context(frames, regs))
+
+    def unset(self, site, regs, frames):
+        """The error for the first variable `site` reads in place that is
+        not set, or None."""
+        for name in site.names:
+            if regs[name[0]] is None:
+                return self.name_error(name, regs, frames)
+        return None
+
+    def operation_error(self, instruction, left, right, regs, frames):
+        site = instruction[-1]
+        error = self.unset(site, regs, frames)
+        if error:
+            return error
+        op = instruction[1] if instruction[0] == JUMP_UNLESS else instruction[0]
+        context = self.context(frames, regs)
+        left = box(left, site.position_start, None, context)
+        right = box(right, None, site.position_end, context)
+        result, error = getattr(left, METHODS[op])(right)
+        return error
+
+    def unary_error(self, token_type, value, site, regs, frames):
+        error = self.unset(site, regs, frames)
+        if error:
+            return error
+        value = box(value, None, site.position_end, self.context(frames, regs))
+        result, error = value.unary(Token(token_type, None, site.position_start, site.position_end))
+        return error
+
+    def depth_error(self, callee, site, regs, frames):
+        context = Context("anonymous", parent=self.context_of(frames, regs, callee.env), parent_start_pos=site.position_start)
+        return RTError(f"Maximum call depth of {self.max_depth} exceeded", site.position_start, site.position_end, context)
+
+    def instruction_count(self):
+        return sum(self.counts)
+
+    def report(self):
+        """Executed instructions per opcode, most frequent first."""
+        lines = [f"{self.instruction_count()} instructions"]
+        for op in sorted(OPCODE_NAMES, key=lambda op: -self.counts[op]):
+            if self.counts[op]:
+                lines.append(f"  {OPCODE_NAMES[op]:<19} {self.counts[op]}")
+        return "\n".join(lines)
@@ -0,0 +1,191 @@
+from ast import *
+from visitor import Visitor
+
+
+###################
+# Scope
+###################
+class Scope(object):
+    """The variables of the program or of one function body.
+
+    A scope has a slot for every name it assigns, its argument, and for
+    the root, the predefined names such as the builtins. A frame is a list
+    of len(names) values with None in the slots not set yet.
+
+    Frames of a scope with no functions inside it cannot outlive their
+    call, so calls take them from and give them back to `pool`.
+    """
+    def __init__(self, node, parent=None):
+        self.node = node
+        self.parent = parent
+        self.names = []
+        self.slots = {}
+        self.arg_slots = []
+        self.has_functions = False
+        self.pool = []
+        self.empty_frame = []
+        # Addresses of the names used here, so every use shares one tuple.
+        self.addresses = {}
+
+    def declare(self, name):
+        slot = self.slots.get(name)
+        if slot is None:
+            slot = self.slots[name] = len(self.names)
+            self.names.append(name)
+        return slot
+
+    def address(self, name):
+        """The (depth, slot) of every scope from this one out that may hold
+        `name`, innermost first."""
+        address = self.addresses.get(name)
+        if address is None:
+            address = []
+            scope = self
+            depth = 0
+            while scope is not None:
+                if name in scope.slots:
+                    address.append((depth, scope.slots[name]))
+                scope = scope.parent
+                depth += 1
+            address = self.addresses[name] = tuple(address)
+        return address
+
+
+###################
+# Resolver
+###################
+class Resolver(Visitor):
+    """Works out where each variable lives before the program runs.
+
+    A name refers to the innermost scope where it is currently set,
+    walking out through the scopes the function was defined in, and
+    assigning a name that is not set anywhere sets it in the current
+    scope. Whether a name is set is only known at run time, but only
+    scopes that assign it can hold it, so each use gets the short list of
+    (depth, slot) pairs to try: depth is how many scopes out and slot the
+    index in that scope's frame. Most names have a single pair.
+
+    After `resolve`, `addresses` maps each IdentifierNode (including the
+    names in assignments and function arguments) to its pairs and `scopes`
+    maps the root and each FunctionNode to its Scope.
+    """
+    def __init__(self):
+        self.addresses = {}
+        self.scopes = {}
+        self.uses = []
+
+    def visit(self, node, scope):
+        func = self.handlers.get(type(node))
+        if func is None:
+            func = self.handler(type(node))
+        return func(self, node, scope)
+
+    def resolve(self, node, predefined=(), root=None):
+        """Resolve the tree under `node`, run with `predefined` names set.
+
+        Given the `root` scope of the statements before it, `node` is
+        resolved as the next statement of that program instead. A name set
+        nowhere so far then gets its slot in the root, where a later
+        statement may set it.
+        """
+        scope_of_unset = root
+        if root is None:
+            root = Scope(node)
+            for name in predefined:
+                root.declare(name)
+        self.scopes[node] = root
+        self.visit(node, root)
+        # Scopes are complete only once the whole tree has been seen. A name
+        # set nowhere gets a slot here, which stays empty.
+        for node, scope in self.uses:
+            name = node.tok.value
+            if name not in scope.slots and scope.address(name) == ():
+                scope.addresses.pop(name)
+                (scope_of_unset or scope).declare(name)
+            self.addresses[node] = scope.address(name)
+        self.uses = []
+        for scope in self.scopes.values():
+            scope.empty_frame = [None] * len(scope.names)
+        return self
+
+    def no_visit_method(self, node, scope):
+        # Nodes no engine runs yet, such as lists and indexing.
+        pass
+
+    def visit_Program(self, node, scope):
+        for stmt in node.statements:
+            self.visit(stmt, scope)
+
+    def visit_Block(self, node, scope):
+        for stmt in node.statements:
+            self.visit(stmt, scope)
+
+    def visit_NumberNode(self, node, scope):
+        pass
+
+    def visit_IdentifierNode(self, node, scope):
+        self.uses.append((node, scope))
+
+    def visit_UnaryOperationNode(self, node, scope):
+        self.visit(node.node, scope)
+
+    def visit_BinaryOperationNode(self, node, scope):
+        self.visit(node.left_node, scope)
+        self.visit(node.right_node, scope)
+
+    def visit_VarAssignNode(self, node, scope):
+        self.visit(node.var_value, scope)
+        scope.declare(node.var_name.tok.value)
+        self.uses.append((node.var_name, scope))
+
+    def visit_ConstAssignNode(self, node, scope):
+        # A `let` is a `var`: every engine runs it as one, so it writes the
+        # nearest binding of its name and can be assigned again.
+        self.visit(node.const_value, scope)
+        scope.declare(node.const_name.tok.value)
+        self.uses.append((node.const_name, scope))
+
+    def visit_FunctionNode(self, node, scope):
+        scope.has_functions = True
+        self.scopes[node] = inner = Scope(node, scope)
+        if isinstance(node.arg_node, IdentifierNode):
+            inner.arg_slots.append(inner.declare(node.arg_node.tok.value))
+            self.uses.append((node.arg_node, inner))
+        self.visit(node.code_block, inner)
+
+    def visit_CallNode(self, node, scope):
+        self.visit(node.operand, scope)
+        for arg in node.arg_node.args:
+            self.visit(arg, scope)
+
+    def visit_ReturnNode(self, node, scope):
+        self.visit(node.return_value, scope)
+
+    def visit_IfNode(self, node, scope):
+        self.visit(node.if_condition, scope)
+        self.visit(node.if_block_statement, scope)
+        for condition, block in zip(node.elif_conditions or (), node.elif_block_statements or ()):
+            self.visit(condition, scope)
+            self.visit(block, scope)
+        if node.else_block_statement:
+            self.visit(node.else_block_statement, scope)
+
+    def visit_WhileNode(self, node, scope):
+        self.visit(node.condition, scope)
+        self.visit(node.block, scope)
+
+    def visit_ForNode(self, node, scope):
+        self.visit(node.start_value, scope)
+        self.visit(node.end_value, scope)
+        if node.step_value is not None:
+            self.visit(node.step_value, scope)
+        # The loop assigns its name like a `var`.
+        scope.declare(node.var_name.tok.value)
+        self.uses.append((node.var_name, scope))
+        self.visit(node.block, scope)
+
+    def visit_BreakNode(self, node, scope):
+        pass
+
+    def visit_ContinueNode(self, node, scope):
+        pass
@@ -1,33 +1,192 @@
-from lexer import Lexer
+from lexer import Lexer, StreamLexer
 from parser_ import Parser
 from interpreter import Interpreter, Context, SymbolTable
 from compiler import Compiler
-import sys
+from closures import ClosureCompiler
+from raising import RaisingCompiler
+from unboxed import UnboxedCompiler
+from stackless import StacklessCompiler, MAX_DEPTH
+from optimizer import Optimizer, DEFAULT_PASSES
+from native import CGenerator, build
+from transpile import Transpiler, CodeCache
+from vm import VM
+from registers import RegisterCompiler
+from peephole import Peephole
+from objfile import ObjectFile, save, load
+from token_ import TokenBuffer
+from cache import ParseCache
+from source import Source
+from errors import CompileError
+import argparse
+import os
+import subprocess
 
 
-if __name__ == "__main__":
-    filename = sys.argv[1]
+def report(errors):
+    for error in errors:
+        print(error.as_string())
+    exit()
+
+
+def parse_file(filename, cache=None):
     with open(filename, 'r') as f:
         code = f.read()
 
+    if cache is not None:
+        ast = cache.load(code)
+        if ast is not None:
+            return ast, Source(code, 'stdin')
+
     lexer = Lexer(code, 'stdin')
     tokens, errors = lexer.tokenize()
 
     if errors:
-        for error in errors:
-            print(error.as_string())
-        exit()
+        report(errors)
 
-    parser = Parser(tokens)
+    parser = Parser(tokens, lexer.source)
     ast = parser.parse_program()
     if parser.errors.errors:
-        for error in parser.errors.errors:
-            print(error.as_string())
+        report(parser.errors.errors)
+    if cache is not None:
+        cache.store(code, ast)
+    return ast, lexer.source
+
+
+def optimize(ast, passes, show_report):
+    optimizer = Optimizer(passes.split(","))
+    ast = optimizer.optimize(ast)
+    if show_report:
+        print(optimizer.report())
+    return ast
+
+
+def interpret(ast, source, engine, max_depth=MAX_DEPTH, code_cache=None):
+    context = Context('<program>', source=source)
+    context.make_main_symbol_table()
+    if engine == "closure":
+        result, error = ClosureCompiler().run(ast, context)
+    elif engine == "raising":
+        result, error = RaisingCompiler().run(ast, context)
+    elif engine == "unboxed":
+        result, error = UnboxedCompiler().run(ast, context)
+    elif engine == "stackless":
+        result, error = StacklessCompiler(max_depth).run(ast, context)
+    elif engine == "transpile":
+        result, error = Transpiler(code_cache).run(ast, context)
+    elif engine == "registers":
+        result, error = RegisterCompiler(max_depth).run(ast, context)
+    else:
+        result, error = Interpreter().visit(ast, context)
+    if error:
+        print(error.as_string())
+
+
+def compile_native(ast, source, filename, max_depth=MAX_DEPTH, run=False):
+    # The C file, and the executable, are written next to the program.
+    base = os.path.splitext(filename)[0]
+    with open(base + ".c", "w") as f:
+        f.write(CGenerator(source, max_depth).generate(ast))
+    if not run:
+        return
+    error = build(base + ".c", base + ".out")
+    if error:
+        print(error, end="")
+        exit(1)
+    exit(subprocess.run([os.path.abspath(base + ".out")]).returncode)
+
+
+def compile_stream(filename, compiler):
+    # Statements are printed and compiled as soon as they are parsed, so
+    # neither the tokens nor the tree of the whole file are kept around.
+    lexer = StreamLexer(filename, 'stdin')
+    parser = Parser(TokenBuffer(lexer.iter_tokens()), lexer.source)
+    for stmt in parser.iter_statements():
+        if lexer.errors or parser.errors.errors:
+            continue
+        print(f" [ {stmt} ] ", end="")
+        compiler.compile_statement(stmt)
+    print()
+
+    if lexer.errors:
+        report(lexer.errors)
+    if parser.errors.errors:
+        report(parser.errors.errors)
+    compiler.finish()
+    return lexer.source
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("filename")
+    arg_parser.add_argument("--stream", action="store_true", help="lex and parse the file incrementally instead of reading it whole")
+    arg_parser.add_argument("--no-cache", action="store_true", help="always lex and parse, and transpile, without reading or writing the caches")
+    arg_parser.add_argument("--cache-dir", help="directory of the parse cache and of code transpiled by --engine transpile")
+    arg_parser.add_argument("--vm", action="store_true", help="run the compiled program on the bytecode VM")
+    arg_parser.add_argument("--optimize", action="store_true", help="optimize the tree first")
+    arg_parser.add_argument("--passes", metavar="PASSES", help=f"comma-separated optimizer passes to run, implies --optimize (default {','.join(DEFAULT_PASSES)})")
+    arg_parser.add_argument("--optimizer-report", action="store_true", help="print what each optimizer pass and the peephole pass did and how long it took")
+    arg_parser.add_argument("--no-peephole", action="store_true", help="save the bytecode as compiled, without the peephole pass")
+    arg_parser.add_argument("--engine", choices=["tree", "closure", "raising", "unboxed", "stackless", "transpile", "registers"], help="run the program with this interpreter engine instead of compiling it")
+    arg_parser.add_argument("--emit-c", action="store_true", help="write the program as a C file next to it instead of compiling it to bytecode")
+    arg_parser.add_argument("--native", action="store_true", help="like --emit-c, then build the C file with the system C compiler ($CC or cc) and run it")
+    arg_parser.add_argument("--max-depth", type=int, default=MAX_DEPTH, help=f"how many calls deep the stackless and registers engines, the VM and native programs let a program go (default {MAX_DEPTH})")
+    args = arg_parser.parse_args()
+    filename = args.filename
+    passes = None
+    if args.passes is not None:
+        passes = args.passes
+    elif args.optimize:
+        passes = ",".join(DEFAULT_PASSES)
+    if passes is not None and args.stream:
+        arg_parser.error("--optimize needs the whole program and cannot be used with --stream")
+    if passes is not None:
+        try:
+            Optimizer(passes.split(","))
+        except ValueError as e:
+            arg_parser.error(str(e))
+    if (args.emit_c or args.native) and (args.stream or args.engine or args.vm):
+        arg_parser.error("--emit-c and --native cannot be used with --stream, --engine or --vm")
+
+    if args.emit_c or args.native:
+        ast, source = parse_file(filename, None if args.no_cache else ParseCache(args.cache_dir))
+        if passes is not None:
+            ast = optimize(ast, passes, args.optimizer_report)
+        compile_native(ast, source, filename, args.max_depth, args.native)
+        exit()
+
+    if args.engine:
+        ast, source = parse_file(filename, None if args.no_cache else ParseCache(args.cache_dir))
+        if passes is not None:
+            ast = optimize(ast, passes, args.optimizer_report)
+        interpret(ast, source, args.engine, args.max_depth, None if args.no_cache else CodeCache(args.cache_dir))
         exit()
-    print(ast)
-    
+
     compiler = Compiler()
-    compiler.visit(ast)
+    try:
+        if args.stream:
+            source = compile_stream(filename, compiler)
+        else:
+            ast, source = parse_file(filename, None if args.no_cache else ParseCache(args.cache_dir))
+            if passes is not None:
+                ast = optimize(ast, passes, args.optimizer_report)
+            print(ast)
+            compiler.visit(ast)
+    except ValueError as e:
+        # A pool that is full; the program does not fit in an object file.
+        report([CompileError(str(e), None, None)])
+    if not args.no_peephole:
+        peephole = Peephole()
+        peephole.optimize(compiler)
+        if args.optimizer_report:
+            print(peephole.report())
+
+    save(filename[:-3] + "bin", ObjectFile.from_compiler(compiler))
 
-    with open(filename[:-3] + "bin", "w+") as f:
-        f.write(" ".join(compiler.code))
\ No newline at end of file
+    if args.vm:
+        vm = VM(load(filename[:-3] + "bin"), source, args.max_depth)
+        values, error = vm.run()
+        if error:
+            print(error.as_string())
+        else:
+            print(values)
+        print(vm.report())
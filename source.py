@@ -0,0 +1,88 @@
+import re
+from array import array
+from bisect import bisect_right
+
+NEWLINE = re.compile("\n")
+
+
+###################
+# Source
+###################
+class Source(object):
+    """The text of one input file.
+
+    Tokens and nodes only keep integer offsets into the text. Line and
+    column numbers are computed from a line-start index that is built the
+    first time an error needs one.
+    """
+    def __init__(self, _text, _filename):
+        self.text = _text
+        self.filename = _filename
+        self._line_starts = None
+
+    @property
+    def line_starts(self):
+        if self._line_starts is None:
+            starts = array("q", [0])
+            starts.extend(match.end() for match in NEWLINE.finditer(self.text))
+            self._line_starts = starts
+        return self._line_starts
+
+    def line_of(self, offset):
+        """Zero-based line containing `offset`."""
+        return bisect_right(self.line_starts, offset) - 1
+
+    def column_of(self, offset):
+        """Zero-based column of `offset` within its line."""
+        return offset - self.line_starts[self.line_of(offset)]
+
+    def location(self, offset):
+        line = self.line_of(offset)
+        return line, offset - self.line_starts[line]
+
+
+###################
+# FileSource
+###################
+class FileSource(object):
+    """A file that is read in chunks rather than held in memory.
+
+    Offsets are byte offsets. Lines are counted by rescanning the file when
+    an error asks for one, resuming from the previous answer when errors
+    are reported in order.
+    """
+    def __init__(self, _path, _filename):
+        self.path = _path
+        self.filename = _filename
+        self._checkpoint = (0, 0)
+
+    def line_of(self, offset):
+        start, line = self._checkpoint
+        if offset < start:
+            start, line = 0, 0
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            remaining = offset - start
+            while remaining > 0:
+                chunk = f.read(min(remaining, 1 << 20))
+                if not chunk:
+                    break
+                line += chunk.count(b"\n")
+                remaining -= len(chunk)
+        self._checkpoint = (offset, line)
+        return line
+
+    def column_of(self, offset):
+        with open(self.path, "rb") as f:
+            end = offset
+            while end > 0:
+                start = max(0, end - 4096)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b"\n")
+                if newline != -1:
+                    return offset - (start + newline + 1)
+                end = start
+        return offset
+
+    def location(self, offset):
+        return self.line_of(offset), self.column_of(offset)
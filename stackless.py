@@ -0,0 +1,470 @@
+import operator
+from errors import RTError, RTException
+from token_ import *
+from ast import *
+from closures import NO_RETURN, frame_of, can_leave, assignment_target
+from optimizer import children
+from unboxed import UnboxedCompiler, NUMBERS, box, unbox, truth, fail
+from interpreter import Function, NoneType, Context, loop_stops, loop_range
+
+# How many calls deep a program may go by default.
+MAX_DEPTH = 10000
+
+# inspect.CO_GENERATOR; inspect itself cannot be imported next to ast.py.
+CO_GENERATOR = 0x20
+
+
+###################
+# StacklessCompiler
+###################
+class StacklessCompiler(UnboxedCompiler):
+    """UnboxedCompiler that keeps the language's call stack off Python's.
+
+    Nodes with a call somewhere under them (not counting the bodies of
+    functions they define) compile to generator functions instead of plain
+    closures. A call yields (function, arguments, tail) and the generator
+    is resumed with the result, so `drive` runs every call from one loop
+    over an explicit stack of suspended function bodies, and Python's
+    stack only grows with how deeply expressions are nested. Nodes without
+    calls are the UnboxedCompiler's closures.
+
+    A `return f(...)` that is the last thing its function body can run
+    is a tail call: the caller's entry on the stack is replaced by the
+    callee's, so tail recursion runs in constant space. A `return` whose
+    value is none does not end a body, so the tail position has to be the
+    end of the body for the call to be eliminated without changing what
+    runs.
+
+    Going more than `max_depth` calls deep is an RTError at the call, in
+    the context of the function being called.
+    """
+    def __init__(self, max_depth=MAX_DEPTH):
+        self.max_depth = max_depth
+
+    def compile(self, node):
+        closure = self.build(node)
+        names = self.resolver.scopes[node].names
+        max_depth = self.max_depth
+        resumable = node in self.resumable
+
+        def run(context):
+            symbols = context.symbol_table.symbols
+            context.frame = [unbox(symbols.get(name)) for name in names]
+            context.return_value = NO_RETURN
+            try:
+                if resumable:
+                    return drive(closure(context), max_depth), None
+                return closure(context), None
+            except RTException as e:
+                return None, e.error
+        return run
+
+    def build(self, node):
+        # Which nodes have calls under them and which returns are tail
+        # calls has to be known before their parents are compiled.
+        self.resumable = set()
+        self.tail_returns = set()
+        find_calls(node, self.resumable, self.tail_returns)
+        return super().build(node)
+
+    def visit(self, node):
+        if node in self.resumable:
+            return resumer(node)(self, node)
+        return super().visit(node)
+
+    def resume_statements(self, node):
+        statements = [(self.visit(stmt), stmt in self.resumable) for stmt in node.statements]
+
+        def run_statements(context):
+            res = []
+            for stmt, resumable in statements:
+                value = (yield from stmt(context)) if resumable else stmt(context)
+                if not isinstance(context.return_value, NoneType):
+                    break
+                res.append(value if type(value) in NUMBERS else value.repr())
+            return res
+        return run_statements
+
+    def resume_UnaryOperationNode(self, node):
+        operand = self.visit(node.node)
+        operation_tok = node.operation_tok
+        negate = operation_tok.type == MINUS
+        position_start = node.node.position_start
+        position_end = node.node.position_end
+
+        def unary(context):
+            value = yield from operand(context)
+            if negate and type(value) in NUMBERS:
+                return -value
+            result, error = box(value, position_start, position_end, context).unary(operation_tok)
+            if error:
+                raise RTException(error)
+            return result
+        return unary
+
+    def resume_BinaryOperationNode(self, node):
+        left = self.visit(node.left_node)
+        right = self.visit(node.right_node)
+        left_resumable = node.left_node in self.resumable
+        right_resumable = node.right_node in self.resumable
+        operate = OPERATIONS[node.operation_tok.type]
+        left_node = node.left_node
+        right_node = node.right_node
+
+        def binary(context):
+            left_value = (yield from left(context)) if left_resumable else left(context)
+            right_value = (yield from right(context)) if right_resumable else right(context)
+            return operate(left_value, right_value, left_node, right_node, context)
+        return binary
+
+    def resume_VarAssignNode(self, node):
+        return self.resume_assignment(node.var_name, node.var_value)
+
+    def resume_ConstAssignNode(self, node):
+        return self.resume_assignment(node.const_name, node.const_value)
+
+    def resume_assignment(self, name_node, value_node):
+        value_closure = self.visit(value_node)
+        address = self.resolver.addresses[name_node]
+        slot = address[0][1]
+        outer = address[1:]
+
+        def assign(context):
+            # As in RaisingCompiler.
+            value = yield from value_closure(context)
+            frame = context.frame
+            if frame[slot] is None:
+                for depth, outer_slot in outer:
+                    outer_frame = frame_of(context, depth)
+                    if outer_frame[outer_slot] is not None:
+                        outer_frame[outer_slot] = value
+                        return NoneType()
+            frame[slot] = value
+            return NoneType()
+        return assign
+
+    def resume_CallNode(self, node, tail=False):
+        operand = self.visit(node.operand)
+        operand_resumable = node.operand in self.resumable
+        args = [(self.visit(arg), arg in self.resumable) for arg in node.arg_node.args]
+        arg_nodes = node.arg_node.args
+        position_start = node.position_start
+        position_end = node.position_end
+
+        def call(context):
+            value = (yield from operand(context)) if operand_resumable else operand(context)
+            if type(value) is Function:
+                value.set_pos(position_start, position_end)
+                arg_values = []
+                for arg, resumable in args:
+                    arg_values.append((yield from arg(context)) if resumable else arg(context))
+                return (yield value, arg_values, tail)
+            # As in UnboxedCompiler.
+            value = box(value, position_start, position_end, context).set_pos(position_start, position_end)
+            arg_values = []
+            for (arg, resumable), arg_node in zip(args, arg_nodes):
+                arg_value = (yield from arg(context)) if resumable else arg(context)
+                arg_values.append(box(arg_value, arg_node.position_start, arg_node.position_end, context))
+            return_value, error = value.execute(arg_values)
+            if error:
+                raise RTException(error)
+            return unbox(return_value)
+        return call
+
+    def resume_ReturnNode(self, node):
+        if node in self.tail_returns:
+            value_closure = self.resume_CallNode(node.return_value, tail=True)
+        else:
+            value_closure = self.visit(node.return_value)
+
+        def return_(context):
+            # A tail call to a Function is never resumed.
+            context.return_value = value = yield from value_closure(context)
+            return value
+        return return_
+
+    def resume_IfNode(self, node):
+        # (condition, its node, whether it is resumable, block, whether it
+        # is resumable) of the if and each elif, in order.
+        branches = []
+        conditions = [node.if_condition] + (node.elif_conditions or [])
+        blocks = [node.if_block_statement] + (node.elif_block_statements or [])
+        for condition, block in zip(conditions, blocks):
+            branches.append((self.visit(condition), condition, condition in self.resumable, self.visit(block), block in self.resumable))
+        else_block = self.visit(node.else_block_statement) if node.else_block_statement else None
+        else_resumable = node.else_block_statement in self.resumable
+
+        def if_(context):
+            for condition, condition_node, condition_resumable, block, block_resumable in branches:
+                value = (yield from condition(context)) if condition_resumable else condition(context)
+                if truth(value, condition_node, context) != 0:
+                    if block_resumable:
+                        yield from block(context)
+                    else:
+                        block(context)
+                    return NoneType()
+            if else_block is not None:
+                if else_resumable:
+                    yield from else_block(context)
+                else:
+                    else_block(context)
+            return NoneType()
+        return if_
+
+    def resume_WhileNode(self, node):
+        condition = self.visit(node.condition)
+        condition_node = node.condition
+        condition_resumable = node.condition in self.resumable
+        body_resumable = node.block in self.resumable
+        body = self.resume_loop_body(node.block) if body_resumable else self.compile_loop_body(node.block)
+        leaves = can_leave(node.block)
+
+        def while_(context):
+            while True:
+                condition_value = (yield from condition(context)) if condition_resumable else condition(context)
+                if truth(condition_value, condition_node, context) == 0:
+                    break
+                if body_resumable:
+                    yield from body(context)
+                else:
+                    body(context)
+                if leaves and context.return_value is not NO_RETURN and loop_stops(context):
+                    break
+            return NoneType()
+        return while_
+
+    def resume_ForNode(self, node):
+        bound_nodes = [node.start_value, node.end_value] + [node.step_value] * (node.step_value is not None)
+        bounds = [(self.visit(bound), bound in self.resumable) for bound in bound_nodes]
+        body_resumable = node.block in self.resumable
+        body = self.resume_loop_body(node.block) if body_resumable else self.compile_loop_body(node.block)
+        leaves = can_leave(node.block)
+        address = self.resolver.addresses[node.var_name]
+        slot = address[0][1]
+        outer = address[1:]
+
+        def for_(context):
+            values = []
+            for bound, resumable in bounds:
+                values.append((yield from bound(context)) if resumable else bound(context))
+            if len(values) == 2:
+                values.append(1)
+            numbers, error = loop_range(*values, node, context)
+            if error:
+                raise RTException(error)
+            if numbers:
+                # As in UnboxedCompiler.
+                frame, frame_slot = assignment_target(context, slot, outer)
+                for i in numbers:
+                    frame[frame_slot] = i
+                    if body_resumable:
+                        yield from body(context)
+                    else:
+                        body(context)
+                    if leaves and context.return_value is not NO_RETURN and loop_stops(context):
+                        break
+            return NoneType()
+        return for_
+
+    def resume_loop_body(self, block):
+        # As in RaisingCompiler.compile_loop_body.
+        statements = [(self.visit(stmt), stmt in self.resumable, can_leave(stmt)) for stmt in block.statements]
+
+        def run_body(context):
+            for stmt, resumable, leaves in statements:
+                if resumable:
+                    yield from stmt(context)
+                else:
+                    stmt(context)
+                if leaves and not isinstance(context.return_value, NoneType):
+                    break
+        return run_body
+
+
+RESUMABLE = {
+    Program: StacklessCompiler.resume_statements,
+    Block: StacklessCompiler.resume_statements,
+    UnaryOperationNode: StacklessCompiler.resume_UnaryOperationNode,
+    BinaryOperationNode: StacklessCompiler.resume_BinaryOperationNode,
+    VarAssignNode: StacklessCompiler.resume_VarAssignNode,
+    ConstAssignNode: StacklessCompiler.resume_ConstAssignNode,
+    CallNode: StacklessCompiler.resume_CallNode,
+    ReturnNode: StacklessCompiler.resume_ReturnNode,
+    IfNode: StacklessCompiler.resume_IfNode,
+    WhileNode: StacklessCompiler.resume_WhileNode,
+    ForNode: StacklessCompiler.resume_ForNode,
+}
+
+
+def resumer(node):
+    """The RESUMABLE entry for the class of `node`, or of the node class an
+    arena view subclasses, or None."""
+    for node_class in type(node).__mro__:
+        resume = RESUMABLE.get(node_class)
+        if resume is not None:
+            return resume
+    return None
+
+
+def find_calls(node, resumable, tail_returns):
+    """Add to `resumable` the nodes under `node` that run a call, and to
+    `tail_returns` the returns that are tail calls. Returns whether
+    `node` runs a call."""
+    if isinstance(node, FunctionNode):
+        # The body only runs when the function is called.
+        find_calls(node.code_block, resumable, tail_returns)
+        mark_tail_returns(node.code_block, tail_returns)
+        return False
+    calls = isinstance(node, CallNode)
+    for child in children(node):
+        if find_calls(child, resumable, tail_returns):
+            calls = True
+    if calls and resumer(node) is not None:
+        resumable.add(node)
+    return calls
+
+
+def mark_tail_returns(block, tail_returns):
+    # The last statement of a body is in tail position, and so are the last
+    # statements of the blocks of an `if` that is.
+    if not block.statements:
+        return
+    last = block.statements[-1]
+    if isinstance(last, ReturnNode) and isinstance(last.return_value, CallNode):
+        tail_returns.add(last)
+    elif isinstance(last, IfNode):
+        mark_tail_returns(last.if_block_statement, tail_returns)
+        for block in last.elif_block_statements or ():
+            mark_tail_returns(block, tail_returns)
+        if last.else_block_statement is not None:
+            mark_tail_returns(last.else_block_statement, tail_returns)
+
+
+###################
+# Driver
+###################
+def drive(generator, max_depth):
+    """Run the program's generator and every call it makes to the end.
+
+    Each entry on `stack` is (generator, function, context) for a function
+    body, with None for the program's own. What a body returns or raises
+    is sent or thrown into its caller at the call.
+    """
+    stack = [(generator, None, None)]
+    value = None
+    exception = None
+    while True:
+        generator, function, exec_ctx = stack[-1]
+        try:
+            if exception is None:
+                request = generator.send(value)
+            else:
+                request, exception = generator.throw(exception), None
+        except StopIteration as stop:
+            stack.pop()
+            if function is None:
+                return stop.value
+            release(function, exec_ctx)
+            value = exec_ctx.return_value
+            continue
+        except BaseException as e:
+            stack.pop()
+            if function is None:
+                raise
+            release(function, exec_ctx)
+            exception = e
+            continue
+
+        callee, arg_values, tail = request
+        value = None
+        if len(arg_values) != len(callee.arg_names):
+            exception = RTException(callee.check_and_populate_args(arg_values)[1])
+            continue
+        scope = callee.scope
+        pool = scope.pool
+        callee_ctx = Context(callee.name, parent=callee.context, parent_start_pos=callee.position_start)
+        if not tail and len(stack) > max_depth:
+            exception = RTException(RTError(f"Maximum call depth of {max_depth} exceeded", callee.position_start, callee.position_end, callee_ctx))
+            continue
+        callee_ctx.frame = frame = pool.pop() if pool else [None] * len(scope.names)
+        for i in range(len(arg_values)):
+            frame[scope.arg_slots[i]] = arg_values[i]
+        if tail:
+            # The caller has nothing left to run: it ends with the
+            # callee's value.
+            stack.pop()
+            generator.close()
+            release(function, exec_ctx)
+
+        if callee.body.__code__.co_flags & CO_GENERATOR:
+            stack.append((callee.body(callee_ctx), callee, callee_ctx))
+            continue
+        # A body without calls runs right here, and its value goes to the
+        # top of the stack, which for a tail call is the caller's caller.
+        try:
+            callee.body(callee_ctx)
+        except BaseException as e:
+            exception = e
+            continue
+        finally:
+            release(callee, callee_ctx)
+        value = callee_ctx.return_value
+
+
+def release(function, exec_ctx):
+    # As in raising.call_function.
+    scope = function.scope
+    if not scope.has_functions:
+        exec_ctx.frame[:] = scope.empty_frame
+        scope.pool.append(exec_ctx.frame)
+
+
+###################
+# Binary operations
+###################
+# As in unboxed, on values that are already known.
+def arithmetic(operation, method):
+    def operate(left_value, right_value, left_node, right_node, context):
+        try:
+            return operation(left_value, right_value)
+        except TypeError:
+            fail(method, left_value, right_value, left_node, right_node, context)
+    return operate
+
+
+def operate_div(left_value, right_value, left_node, right_node, context):
+    try:
+        return left_value / right_value
+    except (TypeError, ZeroDivisionError):
+        fail(lambda left, right: left.div(right), left_value, right_value, left_node, right_node, context)
+
+
+def comparison(operation, method):
+    def operate(left_value, right_value, left_node, right_node, context):
+        try:
+            return 1 if operation(left_value, right_value) else 0
+        except TypeError:
+            fail(method, left_value, right_value, left_node, right_node, context)
+    return operate
+
+
+def equality(operation, method):
+    def operate(left_value, right_value, left_node, right_node, context):
+        if type(left_value) in NUMBERS and type(right_value) in NUMBERS:
+            return 1 if operation(left_value, right_value) else 0
+        fail(method, left_value, right_value, left_node, right_node, context)
+    return operate
+
+
+OPERATIONS = {
+    PLUS: arithmetic(operator.add, lambda left, right: left.add(right)),
+    MINUS: arithmetic(operator.sub, lambda left, right: left.sub(right)),
+    ASTERISK: arithmetic(operator.mul, lambda left, right: left.mul(right)),
+    SLASH: operate_div,
+    LESS_THAN: comparison(operator.lt, lambda left, right: left.lt(right)),
+    GREATER_THAN: comparison(operator.gt, lambda left, right: left.gt(right)),
+    LESS_THAN_OR_EQUAL: comparison(operator.le, lambda left, right: left.lt_or_eq(right)),
+    GREATER_THAN_OR_EQUAL: comparison(operator.ge, lambda left, right: left.gt_or_eq(right)),
+    DOUBLE_EQUAL: equality(operator.eq, lambda left, right: left.eq(right)),
+    NOT_EQUAL: equality(operator.ne, lambda left, right: left.ne(right)),
+}
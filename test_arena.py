@@ -0,0 +1,87 @@
+"""Checks that the compilers give an arena's views the code they give the
+tree it was made from, and that every engine runs them alike.
+
+Run it as `python test_arena.py`. The ast.py here shadows the standard
+library's, which unittest and pytest import, so this is a plain script.
+"""
+from lexer import Lexer
+from parser_ import Parser
+from arena import Arena
+from compiler import Compiler
+from registers import RegisterCompiler, Site
+from benchmark import ENGINES, run_engine
+
+# Expression statements in blocks, which are popped, next to statements,
+# which leave nothing to pop.
+PROGRAM = """var f = n => {
+    n; 1;
+    if n < 2 { n; return n; } elif n > 5 { 2; } else { f; }
+    while n < 3 { n; n = n + 1; }
+    for i = 0, 2 { i; }
+    return f(n - 1);
+};
+f(3);
+"""
+
+# Loops left early, lets and calls in tail position and under operators.
+RUN_PROGRAM = """var s = 0;
+for i = 0, 10 { if i == 7 { break; } elif i == 2 { continue; } s = s + i; }
+var n = 0;
+while 1 { n = n + 1; if n > 3 { break; } }
+var f = n => { let k = 2; if n < 1 { return k; } return f(n - 1) * k + 1; };
+write(s); write(n); write(f(4)); write(1 + f(2));
+"""
+
+
+def parse(text):
+    lexer = Lexer(text, "<test>")
+    tokens, errors = lexer.tokenize()
+    return Parser(tokens, lexer.source).parse_program()
+
+
+def register_code(prototype):
+    # Sites are compared by identity, so leave them out.
+    return [without_sites(instruction) for instruction in prototype.code]
+
+
+def without_sites(operands):
+    return tuple(without_sites(operand) if type(operand) is tuple else operand
+                 for operand in operands if not isinstance(operand, Site))
+
+
+def views(text=PROGRAM):
+    tree = parse(text)
+    arena = Arena.from_tree(tree)
+    return tree, arena.node(arena.root)
+
+
+def test_bytecode():
+    tree, view = views()
+    tree_compiler, view_compiler = Compiler(), Compiler()
+    tree_compiler.visit(tree)
+    view_compiler.visit(view)
+    assert bytes(view_compiler.code) == bytes(tree_compiler.code)
+
+
+def test_register_code():
+    tree, view = views()
+    tree_compiler, view_compiler = RegisterCompiler(), RegisterCompiler()
+    assert register_code(view_compiler.translate(view)) == register_code(tree_compiler.translate(tree))
+    view_functions = [register_code(function) for function in view_compiler.functions]
+    assert view_functions == [register_code(function) for function in tree_compiler.functions]
+
+
+def test_engines():
+    tree, view = views(RUN_PROGRAM)
+    for engine in ENGINES:
+        tree_run = run_engine(engine, tree, None)()
+        view_run = run_engine(engine, view, None)()
+        assert tree_run.output == "19.04.047.012.0", (engine, tree_run.output)
+        assert view_run.output == tree_run.output, (engine, view_run.output)
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(name, "ok")
@@ -0,0 +1,36 @@
+"""Checks that an edited Document ends up as a new Document of the edited
+text would be.
+
+Run it as `python test_incremental.py`. The ast.py here shadows the
+standard library's, which unittest and pytest import, so this is a plain
+script.
+"""
+from incremental import Document
+
+
+def messages(document):
+    return [(error.position_start, error.as_string()) for error in document.errors]
+
+
+def check_edit(text, offset, deleted, inserted):
+    document = Document(text, "<test>")
+    document.edit(offset, deleted, inserted)
+    fresh = Document(document.text, "<test>")
+    assert repr(document.program) == repr(fresh.program), (text, document.text)
+    assert messages(document) == messages(fresh), (text, document.text, messages(document))
+
+
+def test_edit_removing_an_error():
+    # The `}` had the error, and the re-parse starts after it.
+    check_edit("} f(1);", 0, 1, " ")
+
+
+def test_edit_adding_an_error():
+    check_edit("var a = 1; f(a);", 11, 1, "}")
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(name, "ok")
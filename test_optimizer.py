@@ -0,0 +1,38 @@
+"""Checks that the optimized programs print what the programs they were
+made from print, on every engine.
+
+Run it as `python test_optimizer.py`. The ast.py here shadows the standard
+library's, which unittest and pytest import, so this is a plain script.
+"""
+from benchmark import ENGINES, parse, run_engine
+from optimizer import Optimizer
+
+
+def outputs(text):
+    """What `text` writes on each engine, as it is and optimized."""
+    program, source = parse(text)
+    optimized = Optimizer().optimize(program)
+    for engine in ENGINES:
+        yield engine, run_engine(engine, program, source)().output, run_engine(engine, optimized, source)().output
+
+
+def test_let_writing_an_outer_variable():
+    # The `let` in the function writes the global `k`, so it is not inlined.
+    program = "var k = 1; var f = n => { let k = 5; return k; }; f(1); write(k);"
+    for engine, output, optimized_output in outputs(program):
+        assert output == "5.0", (engine, output)
+        assert optimized_output == output, (engine, optimized_output)
+
+
+def test_let_in_a_function():
+    program = "var f = n => { let k = 5; return k + n; }; write(f(1));"
+    for engine, output, optimized_output in outputs(program):
+        assert output == "6.0", (engine, output)
+        assert optimized_output == output, (engine, optimized_output)
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(name, "ok")
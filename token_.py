@@ -1,34 +1,69 @@
+from array import array
+from itertools import islice
+
 ###################
 # Token Types
 ###################
-INT = "INT"
-FLOAT = "FLOAT"
-STRING = "STRING"
-IDENTIFIER = "IDENTIFIER"
-KEYWORD = "KEYWORD"
-PLUS = "PLUS"
-MINUS = "MINUS"
-ASTERISK = "ASTERISK"
-SLASH = "SLASH"
-LPAREN = "LPAREN"
-RPAREN = "RPAREN"
-LSQUAREBRACKET = "LSQUAREBRACKET"
-RSQUAREBRACKET = "RSQUAREBRACKET"
-LBRACKET = "LBRACKET"
-RBRACKET = "RBRACKET"
-EQUAL = "EQUAL"
-DOUBLE_EQUAL = "DOUBLE_EQUAL"
-NOT_EQUAL = "NOT_EQUAL"
-LESS_THAN = "LESS_THAN"
-GREATER_THAN = "GREATER_THAN"
-LESS_THAN_OR_EQUAL = "LESS_THAN_OR_EQUAL"
-GREATER_THAN_OR_EQUAL = "GREATER_THAN_OR_EQUAL"
-COLON = "COLON"
-NOT = "NOT"
-SEMICOLON = "SEMICOLON"
-COMMA = "COMMA"
-ARROW = "A"
-EOF = "EOF"
+INT = 0
+FLOAT = 1
+STRING = 2
+IDENTIFIER = 3
+KEYWORD = 4
+PLUS = 5
+MINUS = 6
+ASTERISK = 7
+SLASH = 8
+LPAREN = 9
+RPAREN = 10
+LSQUAREBRACKET = 11
+RSQUAREBRACKET = 12
+LBRACKET = 13
+RBRACKET = 14
+EQUAL = 15
+DOUBLE_EQUAL = 16
+NOT_EQUAL = 17
+LESS_THAN = 18
+GREATER_THAN = 19
+LESS_THAN_OR_EQUAL = 20
+GREATER_THAN_OR_EQUAL = 21
+COLON = 22
+NOT = 23
+SEMICOLON = 24
+COMMA = 25
+ARROW = 26
+EOF = 27
+
+# Printable names, indexed by token type.
+TOKEN_NAMES = [
+    "INT",
+    "FLOAT",
+    "STRING",
+    "IDENTIFIER",
+    "KEYWORD",
+    "PLUS",
+    "MINUS",
+    "ASTERISK",
+    "SLASH",
+    "LPAREN",
+    "RPAREN",
+    "LSQUAREBRACKET",
+    "RSQUAREBRACKET",
+    "LBRACKET",
+    "RBRACKET",
+    "EQUAL",
+    "DOUBLE_EQUAL",
+    "NOT_EQUAL",
+    "LESS_THAN",
+    "GREATER_THAN",
+    "LESS_THAN_OR_EQUAL",
+    "GREATER_THAN_OR_EQUAL",
+    "COLON",
+    "NOT",
+    "SEMICOLON",
+    "COMMA",
+    "A",
+    "EOF",
+]
 
 ###################
 # KEYWORDS
@@ -43,6 +78,8 @@ keywords = [
     "return",
     "while",
     "for",
+    "break",
+    "continue",
     "int",
     "float",
     "str",
@@ -54,15 +91,18 @@ keywords = [
 # Token
 ###################
 class Token(object):
+    __slots__ = ("type", "value", "position_start", "position_end")
+
     def __init__(self, _type, _value=None, _position_start=None, _position_end=None):
         self.type = _type
         self.value = _value
 
+        # Offsets into the source text; see source.Source for line numbers.
         self.position_start = _position_start
-        if _position_end:
+        if _position_end is not None:
             self.position_end = _position_end
         else:
-            self.position_end = _position_start.advance()
+            self.position_end = _position_start + 1
 
     def matches(self, _type, _val):
         if self.type == _type and self.value == _val:
@@ -72,6 +112,78 @@ class Token(object):
 
     def __repr__(self):
         if self.value:
-            return "{}:{}".format(self.type, self.value)
-        return "{}".format(self.type)
+            return "{}:{}".format(TOKEN_NAMES[self.type], self.value)
+        return "{}".format(TOKEN_NAMES[self.type])
+
+
+###################
+# TokenStream
+###################
+class TokenStream(object):
+    """Tokens stored column-wise.
+
+    `kinds` holds the token types, `starts`/`ends` the source offsets, and
+    `values` maps a token index to its literal value for the tokens that
+    have one. Indexing builds a `Token` view on demand.
+    """
+    # Every token is present; see TokenBuffer for a partial window.
+    complete = True
+
+    def __init__(self):
+        self.kinds = array("B")
+        self.starts = array("q")
+        self.ends = array("q")
+        self.values = {}
+
+    @classmethod
+    def from_tokens(cls, tokens):
+        stream = cls()
+        for tok in tokens:
+            stream.append(tok.type, tok.value, tok.position_start, tok.position_end)
+        return stream
+
+    def append(self, _type, _value, _position_start, _position_end):
+        if _value is not None:
+            self.values[len(self.kinds)] = _value
+        self.kinds.append(_type)
+        self.starts.append(_position_start)
+        self.ends.append(_position_end)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.kinds)
+        return Token(self.kinds[index], self.values.get(index), self.starts[index], self.ends[index])
+
+    def __iter__(self):
+        for index in range(len(self.kinds)):
+            yield self[index]
+
+
+###################
+# TokenBuffer
+###################
+class TokenBuffer(TokenStream):
+    """A bounded window of a token iterator, for parsing streamed input.
+
+    `fill` replaces the window with the next `size` tokens, so indexes are
+    relative to the current window and memory does not grow with the input.
+    """
+    complete = False
+
+    def __init__(self, tokens, size=4096):
+        super().__init__()
+        self.pending = iter(tokens)
+        self.size = size
 
+    def fill(self):
+        del self.kinds[:]
+        del self.starts[:]
+        del self.ends[:]
+        self.values.clear()
+        for tok in islice(self.pending, self.size):
+            self.append(tok.type, tok.value, tok.position_start, tok.position_end)
+            if tok.type == EOF:
+                self.complete = True
@@ -0,0 +1,776 @@
+import os
+import sys
+import marshal
+import hashlib
+from types import FunctionType, CodeType
+from errors import RTError
+from token_ import *
+from ast import *
+from visitor import Visitor
+from resolver import Resolver
+from optimizer import children
+from cache import ParseCache, encode_tree, LANGUAGE_VERSION, DEFAULT_DIRECTORY, DEFAULT_MAX_SIZE
+from interpreter import Function, Number, NoneType, BuiltInFunction, Context, global_vars, loop_range
+from interpreter import truth as truth_of
+
+# Bump whenever the generated code changes. The cache key also has the
+# Python version, whose code objects are not portable.
+CODE_VERSION = 2
+
+# co_filename of the generated code, which is how its frames are told apart
+# from the runtime's in a traceback.
+FILENAME = "<transpiled>"
+
+CODE_DIRECTORY = os.path.join(os.path.dirname(DEFAULT_DIRECTORY), "code")
+
+NUMBERS = (float, int)
+NONE = global_vars["none"]
+WRITE = global_vars["write"]
+
+# Python precedence of the generated expressions, loosest first.
+SUM, PRODUCT, UNARY, ATOM = range(4)
+
+
+###################
+# Runtime
+###################
+# The names the generated code uses besides its own variables.
+class Fail(Exception):
+    """Raised by the runtime with the values an operation failed on. The
+    line table says which operation it was."""
+    def __init__(self, *values):
+        super().__init__()
+        self.values = values
+
+
+def fail(*values):
+    raise Fail(*values)
+
+
+def crash(exception):
+    raise exception
+
+
+def truth(value):
+    # Only numbers have a truth.
+    if type(value) in NUMBERS:
+        return value
+    raise Fail(value)
+
+
+def eq(left, right):
+    if type(left) in NUMBERS and type(right) in NUMBERS:
+        return 1 if left == right else 0
+    raise Fail(left, right)
+
+
+def ne(left, right):
+    if type(left) in NUMBERS and type(right) in NUMBERS:
+        return 1 if left != right else 0
+    raise Fail(left, right)
+
+
+def numbers(start, end, step):
+    """The range of a `for` loop, given its bounds."""
+    bounds = []
+    for value in (start, end, step):
+        if type(value) is float and value.is_integer():
+            value = int(value)
+        if type(value) is not int:
+            raise Fail(start, end, step)
+        bounds.append(value)
+    if bounds[2] == 0:
+        raise Fail(start, end, step)
+    return range(*bounds)
+
+
+def write(text):
+    if type(text) in NUMBERS:
+        sys.stdout.write(str(text))
+    else:
+        sys.stdout.write(str(box(text, None, None, None).repr()))
+    return NONE
+
+
+def box(value, position_start, position_end, context):
+    """The Value the other engines would have for `value`."""
+    if type(value) in NUMBERS:
+        return Number(value).set_context(context).set_pos(position_start, position_end)
+    if value is write:
+        return WRITE
+    if type(value) is FunctionType:
+        return Function("anonymous", list(value.__code__.co_varnames[:1]), None).set_context(context).set_pos(position_start, position_end)
+    return value
+
+
+def unbox(value):
+    if type(value) is Number:
+        return value.value
+    if type(value) is NoneType:
+        return NONE
+    if type(value) is BuiltInFunction:
+        return write
+    return value
+
+
+RUNTIME = {
+    "NONE": NONE,
+    "fail": fail,
+    "crash": crash,
+    "truth": truth,
+    "eq": eq,
+    "ne": ne,
+    "numbers": numbers,
+    "write": write,
+}
+
+
+class Span(object):
+    # Stands in for a node where only its positions are needed.
+    def __init__(self, position_start, position_end):
+        self.position_start = position_start
+        self.position_end = position_end
+
+
+###################
+# Expr
+###################
+class Expr(object):
+    """Python source for one expression of the program.
+
+    `spans` are (start, end, entry) with the columns of the operations that
+    can fail relative to the start of `text`, and `entry` what the line
+    table gets for them. `name` is set for a bare variable, which can be
+    read again after an error; `condition`, for comparisons, is the text
+    to test without turning the result into 0 or 1.
+    """
+    __slots__ = ("text", "spans", "precedence", "numeric", "calls", "name", "condition")
+
+    def __init__(self, text, spans=(), precedence=ATOM, numeric=False, calls=False, name=None, condition=None):
+        self.text = text
+        self.spans = list(spans)
+        self.precedence = precedence
+        self.numeric = numeric
+        self.calls = calls
+        self.name = name
+        self.condition = condition
+
+
+def shift(spans, offset):
+    return [(start + offset, end + offset, entry) for start, end, entry in spans]
+
+
+def wrap(expr, precedence):
+    """`expr` in parentheses, if it binds looser than `precedence`."""
+    if expr.precedence >= precedence:
+        return expr
+    return Expr(f"({expr.text})", shift(expr.spans, 1), ATOM, expr.numeric, expr.calls)
+
+
+# Line table entries are plain tuples, so they can be cached with the code.
+# Operands that have to be looked at after an error are ("const", value) or
+# ("local", python name).
+
+
+###################
+# Transpiler
+###################
+class Transpiler(Visitor):
+    """Turns a program into the source of a Python function and compiles it.
+
+    Language functions become nested Python functions, variables their
+    locals, with the names resolver.Resolver resolves to, and arithmetic
+    and comparisons the Python operators on bare floats and ints, as in
+    the unboxed engine. Nothing is checked on the happy path: reading a
+    name that is not set fails as reading an unbound Python local, and an
+    operation on the wrong types raises TypeError. Only names that more
+    than one scope can hold are kept as None while unset and tested.
+
+    The line table maps the line and columns of every operation that can
+    fail to what it is, so after an exception `locate` finds the operation
+    from the instruction the traceback points at and makes the RTError the
+    other engines give. Output and error messages are the same as the tree
+    walker's, as is the traceback unless a function outlived the call it
+    was made in, which Python frames do not record; the line of that call
+    is left out. Calls nest as deep as Python's recursion limit allows.
+
+    `compile` returns a function that runs the program in a Context and
+    returns (None, error). The generated code, compiled, can be cached on
+    disk in a CodeCache.
+    """
+    def __init__(self, cache=None):
+        self.cache = cache
+
+    def visit(self, node):
+        func = self.handlers.get(type(node))
+        if func is None:
+            func = self.handler(type(node))
+        return func(self, node)
+
+    def compile(self, node):
+        """A function that runs `node` in a given context."""
+        entry = self.cache.load(node) if self.cache is not None else None
+        if entry is None:
+            text, names, table = self.translate(node)
+            entry = (compile(text, FILENAME, "exec"), names, table)
+            if self.cache is not None:
+                self.cache.store(node, entry)
+        code, names, table = entry
+        namespace = dict(RUNTIME)
+        exec(code, namespace)
+        program = namespace["program"]
+        parents = code_parents(program.__code__, {})
+
+        def run(context):
+            symbols = context.symbol_table.symbols
+            initial = [unbox(symbols.get(name)) for name in names]
+            try:
+                program(initial)
+            except Exception as e:
+                error = locate(e, table, parents, context)
+                if error is None:
+                    raise
+                return None, error
+            return None, None
+        return run
+
+    def run(self, node, context):
+        """Compile `node` and run it in `context`."""
+        return self.compile(node)(context)
+
+    def translate(self, node):
+        """(source, root names, line table) for `node`."""
+        self.resolver = Resolver().resolve(node, global_vars)
+        self.scope_numbers = {}
+        for scope in self.resolver.scopes.values():
+            self.scope_numbers[scope] = len(self.scope_numbers)
+        self.dynamic = dynamic_names(self.resolver.scopes.values())
+        self.lines = []
+        self.table = {}
+        self.indent = 0
+        self.temps = 0
+        self.functions = 0
+
+        root = self.resolver.scopes[node]
+        self.scope = root
+        self.in_function = False
+        self.emit("def program(initial):")
+        self.indent += 1
+        for slot, name in enumerate(root.names):
+            variable = self.variable(root, slot)
+            if (root, name) in self.dynamic:
+                self.emit(f"{variable} = initial[{slot}]")
+            else:
+                self.emit(f"if initial[{slot}] is not None: {variable} = initial[{slot}]")
+        self.visit(node)
+        self.emit("pass")
+        return "\n".join(self.lines) + "\n", list(root.names), self.table
+
+    ###################
+    # Output
+    ###################
+    def emit(self, text, expr=None, suffix=""):
+        """Add a line of `text`, then `expr`'s text and `suffix`, recording
+        the spans of `expr` in the line table."""
+        line = "    " * self.indent + text
+        lineno = len(self.lines) + 1
+        if expr is not None:
+            for start, end, entry in shift(expr.spans, len(line)):
+                self.table[lineno, start, end] = entry
+            line += expr.text
+        self.lines.append(line + suffix)
+
+    def temp(self):
+        self.temps += 1
+        return f"_t{self.temps}"
+
+    def variable(self, scope, slot):
+        """The Python name of a slot. Names the generated code uses itself
+        never end in _ and a number."""
+        return f"{scope.names[slot]}_{self.scope_numbers[scope]}"
+
+    def address(self, address):
+        """(Python name, dynamic) of each (depth, slot) of an address."""
+        names = []
+        for depth, slot in address:
+            scope = self.scope
+            for _ in range(depth):
+                scope = scope.parent
+            names.append((self.variable(scope, slot), (scope, scope.names[slot]) in self.dynamic))
+        return names
+
+    def operand(self, node, expr, calls_after):
+        """(source, expr) for an operand looked at after an error: the
+        value of a literal, the variable of a bare name that nothing run
+        after it can assign, or else a temporary `expr` is stored in."""
+        if isinstance(node, NumberNode):
+            return ("const", float(node.tok.value)), expr
+        if expr.name is not None and not calls_after:
+            return ("local", expr.name), expr
+        name = self.temp()
+        prefix = f"({name} := "
+        return ("local", name), Expr(prefix + expr.text + ")", shift(expr.spans, len(prefix)), ATOM, expr.numeric, expr.calls)
+
+    def condition(self, node):
+        """Expr for the truth of `node` in an `if` or `while`."""
+        expr = self.visit(node)
+        if expr.condition is not None:
+            return expr.condition
+        if expr.numeric:
+            return expr
+        text = f"truth({expr.text})"
+        spans = shift(expr.spans, 6) + [(0, len(text), ("condition", node.position_start, node.position_end))]
+        return Expr(text, spans, ATOM, True, expr.calls)
+
+    ###################
+    # Statements
+    ###################
+    def no_visit_method(self, node):
+        # The tree walker only fails once it reaches the node.
+        return Expr(f"crash(NotImplementedError({ascii('No visit method for ' + type(node).__name__)}))", calls=True)
+
+    def visit_Program(self, node):
+        self.visit_statements(node.statements)
+
+    def visit_Block(self, node):
+        self.visit_statements(node.statements)
+
+    def visit_statements(self, statements):
+        for stmt in statements:
+            result = self.visit(stmt)
+            if result is not None:
+                # An expression statement.
+                self.emit("", result)
+
+    def block(self, node):
+        self.indent += 1
+        count = len(self.lines)
+        self.visit(node)
+        if len(self.lines) == count:
+            self.emit("pass")
+        self.indent -= 1
+
+    def visit_VarAssignNode(self, node):
+        value = self.visit(node.var_value)
+        self.assign(node.var_name, value)
+
+    def visit_ConstAssignNode(self, node):
+        value = self.visit(node.const_value)
+        self.assign(node.const_name, value)
+
+    def assign(self, name_node, value):
+        # As closures.assignment_target: the name's own slot, unless it is
+        # unset and an enclosing scope has the name set.
+        names = self.address(self.resolver.addresses[name_node])
+        own = names[0][0]
+        if len(names) == 1:
+            self.emit(f"{own} = ", value)
+            return
+        self.emit("_v = ", value)
+        keyword = "if"
+        for outer, dynamic in names[1:]:
+            self.emit(f"{keyword} {own} is None and {outer} is not None: {outer} = _v")
+            keyword = "elif"
+        self.emit(f"else: {own} = _v")
+
+    def visit_ReturnNode(self, node):
+        # A `return` whose value is none does not end the body.
+        value = self.visit(node.return_value)
+        leave = "return _r" if self.in_function else "return"
+        if value.numeric or isinstance(node.return_value, FunctionNode):
+            if self.in_function:
+                self.emit("return ", value)
+            else:
+                self.emit("", value)
+                self.emit("return")
+        else:
+            self.emit("if (_r := ", value, f") is not NONE: {leave}")
+
+    def visit_IfNode(self, node):
+        conditions = [node.if_condition] + (node.elif_conditions or [])
+        blocks = [node.if_block_statement] + (node.elif_block_statements or [])
+        indent = self.indent
+        keyword = "if "
+        for condition, block in zip(conditions, blocks):
+            if keyword == "elif " and defines_function(condition):
+                # The def of the function has to come before the test, so
+                # this branch and the ones after it go in an else block.
+                self.emit("else:")
+                self.indent += 1
+                keyword = "if "
+            self.emit(keyword, self.condition(condition), ":")
+            self.block(block)
+            keyword = "elif "
+        if node.else_block_statement:
+            self.emit("else:")
+            self.block(node.else_block_statement)
+        self.indent = indent
+
+    def visit_WhileNode(self, node):
+        self.emit("while ", self.condition(node.condition), ":")
+        self.block(node.block)
+
+    def visit_ForNode(self, node):
+        bounds = [self.visit(node.start_value), self.visit(node.end_value)]
+        bounds.append(self.visit(node.step_value) if node.step_value is not None else Expr("1"))
+        text = "numbers(" + ", ".join(bound.text for bound in bounds) + ")"
+        spans = []
+        offset = len("numbers(")
+        for bound in bounds:
+            spans += shift(bound.spans, offset)
+            offset += len(bound.text) + 2
+        step = node.step_value
+        spans.append((0, len(text), ("for",
+            (node.start_value.position_start, node.start_value.position_end),
+            (node.end_value.position_start, node.end_value.position_end),
+            (step.position_start, step.position_end) if step is not None else None)))
+        numbers_expr = Expr(text, spans, calls=True)
+
+        names = self.address(self.resolver.addresses[node.var_name])
+        if len(names) == 1:
+            self.emit(f"for {names[0][0]} in ", numbers_expr, ":")
+            self.block(node.block)
+        else:
+            self.emit("for _i in ", numbers_expr, ":")
+            self.indent += 1
+            self.assign(node.var_name, Expr("_i"))
+            self.visit(node.block)
+            self.indent -= 1
+
+    def visit_BreakNode(self, node):
+        self.emit("break")
+
+    def visit_ContinueNode(self, node):
+        self.emit("continue")
+
+    ###################
+    # Expressions
+    ###################
+    def visit_NumberNode(self, node):
+        value = float(node.tok.value)
+        return Expr(repr(value) if value != float("inf") else "1e999", numeric=True)
+
+    def visit_IdentifierNode(self, node):
+        names = self.address(self.resolver.addresses[node])
+        entry = ("name", node.tok.value, node.position_start, node.position_end, None)
+        if len(names) == 1 and not names[0][1]:
+            name = names[0][0]
+            return Expr(name, [(0, len(name), entry[:-1] + (name,))], name=name)
+        text = "(" + "".join(f"{name} if {name} is not None else " for name, dynamic in names)
+        spans = [(len(text), len(text) + 6, entry)]
+        return Expr(text + "fail())", spans)
+
+    def visit_UnaryOperationNode(self, node):
+        operand = self.visit(node.node)
+        tok = node.operation_tok
+        if tok.type == MINUS:
+            source, operand = self.operand(node.node, operand, False)
+            operand = wrap(operand, UNARY)
+            text = "-" + operand.text
+        else:
+            # Anything but a minus fails; the Value method has the message.
+            source = None
+            text = f"fail({operand.text})"
+        offset = len(text) - len(operand.text) - (tok.type != MINUS)
+        entry = ("unary", tok.type, tok.position_start, tok.position_end, source, node.node.position_start, node.node.position_end)
+        spans = shift(operand.spans, offset)
+        spans.append((0, len(text), entry))
+        return Expr(text, spans, UNARY if tok.type == MINUS else ATOM, True, operand.calls)
+
+    def visit_BinaryOperationNode(self, node):
+        left = self.visit(node.left_node)
+        right = self.visit(node.right_node)
+        op = node.operation_tok.type
+        calls = left.calls or right.calls
+        method, symbol, precedence = BINARY_OPERATIONS[op]
+
+        entry_start = (node.left_node.position_start, node.left_node.position_end, node.right_node.position_start, node.right_node.position_end)
+        if op == DOUBLE_EQUAL or op == NOT_EQUAL:
+            # Python compares anything with == and !=, so unless both sides
+            # are numbers the runtime's eq or ne checks the types.
+            if left.numeric and right.numeric:
+                left, right = wrap(left, SUM), wrap(right, SUM)
+                condition = self.join(left, f" {symbol} ", right, None, SUM)
+                return self.comparison(condition, calls)
+            return self.call_text(method, [left, right], ("binary", method, None, None) + entry_start, True, calls)
+
+        left_source, left = self.operand(node.left_node, left, right.calls)
+        right_source, right = self.operand(node.right_node, right, False)
+        entry = ("binary", method, left_source, right_source) + entry_start
+        if precedence is None:
+            left, right = wrap(left, SUM), wrap(right, SUM)
+            return self.comparison(self.join(left, f" {symbol} ", right, entry, SUM), calls)
+        left, right = wrap(left, precedence), wrap(right, precedence + 1)
+        return self.join(left, f" {symbol} ", right, entry, precedence, True, calls)
+
+    def join(self, left, symbol, right, entry, precedence, numeric=False, calls=False):
+        text = left.text + symbol + right.text
+        spans = left.spans + shift(right.spans, len(left.text) + len(symbol))
+        if entry is not None:
+            spans.append((0, len(text), entry))
+        return Expr(text, spans, precedence, numeric, calls)
+
+    def comparison(self, condition, calls):
+        # Comparisons give 0 or 1, but an `if` can test the bool.
+        prefix = "(1 if "
+        expr = Expr(prefix + condition.text + " else 0)", shift(condition.spans, len(prefix)), ATOM, True, calls)
+        expr.condition = Expr(condition.text, condition.spans, SUM, True, calls)
+        return expr
+
+    def call_text(self, function, args, entry, numeric=False, calls=True):
+        text = function + "("
+        spans = []
+        for i, arg in enumerate(args):
+            if i:
+                text += ", "
+            spans += shift(arg.spans, len(text))
+            text += arg.text
+        text += ")"
+        if entry is not None:
+            spans.append((0, len(text), entry))
+        return Expr(text, spans, ATOM, numeric, calls)
+
+    def visit_CallNode(self, node):
+        operand = self.visit(node.operand)
+        args = [self.visit(arg) for arg in node.arg_node.args]
+        source, operand = self.operand(node.operand, operand, any(arg.calls for arg in args))
+        operand = wrap(operand, ATOM)
+        entry = ("call", len(args), source, node.position_start, node.position_end)
+        expr = self.call_text(operand.text, args, entry)
+        expr.spans = operand.spans + expr.spans
+        return expr
+
+    def visit_FunctionNode(self, node):
+        arg_node = node.arg_node
+        if not isinstance(arg_node, IdentifierNode):
+            return Expr("fail()", [(0, 6, ("function", arg_node.position_start, arg_node.position_end))], calls=True)
+
+        scope = self.resolver.scopes[node]
+        self.functions += 1
+        name = f"_f{self.functions}"
+        outer_scope, in_function = self.scope, self.in_function
+        self.scope, self.in_function = scope, True
+        arg = self.variable(scope, scope.arg_slots[0])
+        self.emit(f"def {name}({arg}):")
+        self.indent += 1
+        nonlocals = sorted(set(self.outer_assignments(node.code_block)))
+        if nonlocals:
+            self.emit("nonlocal " + ", ".join(nonlocals))
+        for slot, slot_name in enumerate(scope.names):
+            if (scope, slot_name) in self.dynamic and slot not in scope.arg_slots:
+                self.emit(f"{self.variable(scope, slot)} = None")
+        self.visit(node.code_block)
+        self.emit("return NONE")
+        self.indent -= 1
+        self.scope, self.in_function = outer_scope, in_function
+        return Expr(name, name=name)
+
+    def outer_assignments(self, node):
+        """Python names of the enclosing scopes' variables assigned in the
+        function body under `node`, not counting the functions in it."""
+        if isinstance(node, FunctionNode):
+            return
+        if isinstance(node, (VarAssignNode, ConstAssignNode, ForNode)):
+            name_node = node.const_name if isinstance(node, ConstAssignNode) else node.var_name
+            for name, dynamic in self.address(self.resolver.addresses[name_node])[1:]:
+                yield name
+        for child in children(node):
+            yield from self.outer_assignments(child)
+
+
+BINARY_OPERATIONS = {
+    PLUS: ("add", "+", SUM),
+    MINUS: ("sub", "-", SUM),
+    ASTERISK: ("mul", "*", PRODUCT),
+    SLASH: ("div", "/", PRODUCT),
+    LESS_THAN: ("lt", "<", None),
+    GREATER_THAN: ("gt", ">", None),
+    LESS_THAN_OR_EQUAL: ("lt_or_eq", "<=", None),
+    GREATER_THAN_OR_EQUAL: ("gt_or_eq", ">=", None),
+    DOUBLE_EQUAL: ("eq", "==", None),
+    NOT_EQUAL: ("ne", "!=", None),
+}
+
+
+def defines_function(node):
+    """Whether translating the expression `node` emits a def."""
+    return isinstance(node, FunctionNode) or any(defines_function(child) for child in children(node))
+
+
+def dynamic_names(scopes):
+    """(scope, name) for the names another scope in or around the scope
+    also has, which a use may have to look for in more than one place."""
+    dynamic = set()
+    for scope in scopes:
+        outer = scope.parent
+        while outer is not None:
+            for name in scope.slots:
+                if name in outer.slots:
+                    dynamic.add((scope, name))
+                    dynamic.add((outer, name))
+            outer = outer.parent
+    return dynamic
+
+
+###################
+# Errors
+###################
+# The exceptions each kind of operation fails with.
+EXPECTED = {
+    "name": (NameError, Fail),
+    "binary": (TypeError, ZeroDivisionError, Fail),
+    "unary": (TypeError, Fail),
+    "call": (TypeError,),
+    "for": (Fail,),
+    "function": (Fail,),
+    "condition": (Fail,),
+}
+
+
+def instruction_span(tb, offset=0):
+    lineno, end_lineno, start, end = list(tb.tb_frame.f_code.co_positions())[tb.tb_lasti // 2 + offset]
+    return lineno, start, end
+
+
+def unbound_span(tb, exception, table):
+    """The span of the variable a NameError is about. Python can run two
+    loads as one instruction, and then reports the first one even when it
+    is the second that fails."""
+    variable = str(exception).split("'")[1:2]
+    for offset in (0, 1):
+        span = instruction_span(tb, offset)
+        entry = table.get(span)
+        if entry is not None and entry[0] == "name" and [entry[4]] == variable:
+            return span
+    return instruction_span(tb)
+
+
+def code_parents(code, parents):
+    """Map the id of each function's code to the code it is defined in."""
+    for const in code.co_consts:
+        if type(const) is CodeType:
+            parents[id(const)] = code
+            code_parents(const, parents)
+    return parents
+
+
+def locate(exception, table, parents, context):
+    """The RTError for an exception raised by a transpiled program run in
+    `context`, or None if the tree walker would have raised it as well."""
+    if isinstance(exception, RecursionError):
+        return None
+    spans = []
+    frames = []
+    last = None
+    tb = exception.__traceback__
+    while tb is not None:
+        if tb.tb_frame.f_code.co_filename == FILENAME:
+            spans.append(instruction_span(tb))
+            frames.append(tb.tb_frame)
+            last = tb
+        tb = tb.tb_next
+    if not frames or (last.tb_next is not None and not isinstance(exception, Fail)):
+        return None
+    if isinstance(exception, NameError):
+        spans[-1] = unbound_span(last, exception, table)
+    entry = table.get(spans[-1])
+    if entry is None or not isinstance(exception, EXPECTED[entry[0]]):
+        return None
+
+    # The context of a call has the context of the call its function was
+    # made in as parent, which is the nearest frame of the enclosing code
+    # while it still runs, and the program's otherwise.
+    contexts = [context]
+    for i in range(1, len(frames)):
+        parent = 0
+        code = parents.get(id(frames[i].f_code))
+        for j in range(i - 1, 0, -1):
+            if frames[j].f_code is code:
+                parent = j
+                break
+        call = table.get(spans[i - 1])
+        contexts.append(Context("anonymous", parent=contexts[parent], parent_start_pos=call[3] if call and call[0] == "call" else None))
+    return make_error(exception, entry, frames[-1], contexts[-1])
+
+
+def operand_value(source, frame):
+    kind, value = source
+    if kind == "const":
+        return value
+    return frame.f_locals[value]
+
+
+def make_error(exception, entry, frame, context):
+    kind = entry[0]
+    if kind == "name":
+        kind, name, position_start, position_end, variable = entry
+        return RTError(f"Name {name} does not exist", position_start, position_end, context)
+
+    if kind == "binary":
+        kind, method, left_source, right_source, left_start, left_end, right_start, right_end = entry
+        if isinstance(exception, Fail):
+            left, right = exception.values
+        else:
+            left, right = operand_value(left_source, frame), operand_value(right_source, frame)
+        left = box(left, left_start, left_end, context)
+        right = box(right, right_start, right_end, context)
+        result, error = getattr(left, method)(right)
+        return error
+
+    if kind == "unary":
+        kind, tok_type, tok_start, tok_end, source, position_start, position_end = entry
+        if isinstance(exception, Fail):
+            value = exception.values[0]
+        else:
+            value = operand_value(source, frame)
+        result, error = box(value, position_start, position_end, context).unary(Token(tok_type, None, tok_start, tok_end))
+        return error
+
+    if kind == "call":
+        kind, count, source, position_start, position_end = entry
+        value = box(operand_value(source, frame), position_start, position_end, context).set_pos(position_start, position_end)
+        result, error = value.execute([NONE] * count)
+        return error
+
+    if kind == "for":
+        kind, start, end, step = entry
+        node = ForNode(None, Span(*start), Span(*end), Span(*step) if step is not None else None, None, None, None)
+        numbers, error = loop_range(*exception.values, node, context)
+        return error
+
+    if kind == "condition":
+        kind, position_start, position_end = entry
+        true, error = truth_of(exception.values[0], Span(position_start, position_end), context)
+        return error
+
+    kind, position_start, position_end = entry
+    return RTError("Function argument must be an identifier", position_start, position_end, context)
+
+
+###################
+# CodeCache
+###################
+class CodeCache(ParseCache):
+    """Transpiled programs stored on disk, keyed by a hash of their tree.
+
+    An entry is the compiled code with the names and line table it needs
+    to run, in marshal's format, so only the Python version that wrote it
+    reads it.
+    """
+    suffix = ".code"
+    header = b"OASCODE" + bytes((CODE_VERSION,))
+
+    def __init__(self, _directory=None, _max_size=DEFAULT_MAX_SIZE):
+        super().__init__(_directory or CODE_DIRECTORY, _max_size)
+
+    def key(self, program):
+        digest = hashlib.sha256(f"{LANGUAGE_VERSION}.{CODE_VERSION}.{sys.implementation.cache_tag}\0".encode())
+        digest.update(marshal.dumps(encode_tree(program)))
+        return digest.hexdigest()
+
+    def encode(self, entry):
+        return marshal.dumps(entry)
+
+    def decode(self, data):
+        code, names, table = marshal.loads(data)
+        return code, names, table
@@ -0,0 +1,290 @@
+import operator
+from errors import RTException
+from token_ import *
+from ast import *
+from closures import NO_RETURN, can_leave, assignment_target
+from raising import RaisingCompiler, call_function, is_true
+from interpreter import Function, Number, NoneType, loop_stops, loop_range
+
+# Types of the numbers the unboxed engine passes around.
+NUMBERS = (float, int)
+
+
+###################
+# UnboxedCompiler
+###################
+class UnboxedCompiler(RaisingCompiler):
+    """RaisingCompiler with numbers kept as plain Python floats and ints.
+
+    Arithmetic, comparisons and variables hold the bare number, so the hot
+    path allocates nothing beyond what Python does for the result. `true`
+    and `false` are the ints 1 and 0 and comparisons give 0 or 1 as well,
+    which Python shares, like all small ints. Other values (functions,
+    none, builtins) are the usual Value objects.
+
+    A Number is only made where a Value is needed: for an error, a call to
+    a builtin, or calling a number. It gets the position of the node the
+    number came from and the running context, so an error that involves a
+    number read from a variable or returned by a call is reported where it
+    is used rather than where it was made. Results and error messages are
+    otherwise the same as the tree walker's.
+    """
+    def compile(self, node):
+        closure = self.build(node)
+        names = self.resolver.scopes[node].names
+
+        def run(context):
+            symbols = context.symbol_table.symbols
+            context.frame = [unbox(symbols.get(name)) for name in names]
+            context.return_value = NO_RETURN
+            try:
+                return closure(context), None
+            except RTException as e:
+                return None, e.error
+        return run
+
+    def compile_statements(self, statements):
+        statements = [self.visit(stmt) for stmt in statements]
+
+        def run_statements(context):
+            res = []
+            for stmt in statements:
+                value = stmt(context)
+                if not isinstance(context.return_value, NoneType):
+                    break
+                res.append(value if type(value) in NUMBERS else value.repr())
+            return res
+        return run_statements
+
+    def visit_NumberNode(self, node):
+        literal = node.tok.value
+        literal = int(literal) if str(int(literal)) == literal else float(literal)
+
+        def number(context):
+            return literal
+        return number
+
+    def visit_UnaryOperationNode(self, node):
+        operand = self.visit(node.node)
+        operation_tok = node.operation_tok
+        negate = operation_tok.type == MINUS
+        position_start = node.node.position_start
+        position_end = node.node.position_end
+
+        def unary(context):
+            value = operand(context)
+            if negate and type(value) in NUMBERS:
+                return -value
+            result, error = box(value, position_start, position_end, context).unary(operation_tok)
+            if error:
+                raise RTException(error)
+            return result
+        return unary
+
+    def visit_BinaryOperationNode(self, node):
+        left = self.visit(node.left_node)
+        right = self.visit(node.right_node)
+        make = BINARY_OPERATIONS[node.operation_tok.type]
+        return make(left, right, node.left_node, node.right_node)
+
+    def visit_CallNode(self, node):
+        operand = self.visit(node.operand)
+        args = [self.visit(arg) for arg in node.arg_node.args]
+        arg_nodes = node.arg_node.args
+        position_start = node.position_start
+        position_end = node.position_end
+
+        def call_value(value, context):
+            # Builtins and the errors for calling anything else need Values.
+            value = box(value, position_start, position_end, context).set_pos(position_start, position_end)
+            arg_values = []
+            for arg, arg_node in zip(args, arg_nodes):
+                arg_values.append(box(arg(context), arg_node.position_start, arg_node.position_end, context))
+            return_value, error = value.execute(arg_values)
+            if error:
+                raise RTException(error)
+            return unbox(return_value)
+
+        if len(args) == 1:
+            arg = args[0]
+
+            def call(context):
+                value = operand(context)
+                if type(value) is Function:
+                    value.set_pos(position_start, position_end)
+                    return call_function(value, [arg(context)])
+                return call_value(value, context)
+        else:
+            def call(context):
+                value = operand(context)
+                if type(value) is Function:
+                    value.set_pos(position_start, position_end)
+                    arg_values = []
+                    for arg in args:
+                        arg_values.append(arg(context))
+                    return call_function(value, arg_values)
+                return call_value(value, context)
+        return call
+
+    def visit_IfNode(self, node):
+        branches = [(self.visit(node.if_condition), node.if_condition, self.visit(node.if_block_statement))]
+        for condition, block in zip(node.elif_conditions or (), node.elif_block_statements or ()):
+            branches.append((self.visit(condition), condition, self.visit(block)))
+        else_block = self.visit(node.else_block_statement) if node.else_block_statement else None
+
+        def if_(context):
+            for condition, condition_node, block in branches:
+                if truth(condition(context), condition_node, context) != 0:
+                    block(context)
+                    return NoneType()
+            if else_block is not None:
+                else_block(context)
+            return NoneType()
+        return if_
+
+    def visit_WhileNode(self, node):
+        condition = self.visit(node.condition)
+        condition_node = node.condition
+        body = self.compile_loop_body(node.block)
+
+        if can_leave(node.block):
+            def while_(context):
+                while truth(condition(context), condition_node, context) != 0:
+                    body(context)
+                    if context.return_value is not NO_RETURN and loop_stops(context):
+                        break
+                return NoneType()
+        else:
+            def while_(context):
+                while truth(condition(context), condition_node, context) != 0:
+                    body(context)
+                return NoneType()
+        return while_
+
+    def visit_ForNode(self, node):
+        start = self.visit(node.start_value)
+        end = self.visit(node.end_value)
+        step = self.visit(node.step_value) if node.step_value is not None else None
+        body = self.compile_loop_body(node.block)
+        leaves = can_leave(node.block)
+        address = self.resolver.addresses[node.var_name]
+        slot = address[0][1]
+        outer = address[1:]
+
+        def for_(context):
+            numbers, error = loop_range(start(context), end(context), step(context) if step is not None else 1, node, context)
+            if error:
+                raise RTException(error)
+            if numbers:
+                # The name holds the bare ints of the range.
+                frame, frame_slot = assignment_target(context, slot, outer)
+                if leaves:
+                    for i in numbers:
+                        frame[frame_slot] = i
+                        body(context)
+                        if context.return_value is not NO_RETURN and loop_stops(context):
+                            break
+                else:
+                    for i in numbers:
+                        frame[frame_slot] = i
+                        body(context)
+            return NoneType()
+        return for_
+
+
+def box(value, position_start, position_end, context):
+    """The Value the other engines would have for `value`."""
+    if type(value) in NUMBERS:
+        return Number(value).set_context(context).set_pos(position_start, position_end)
+    return value
+
+
+def unbox(value):
+    if type(value) is Number:
+        return value.value
+    return value
+
+
+def truth(value, node, context):
+    # The number to test, which is true unless it is 0. Anything else is
+    # not a Number, and is_true fails on it.
+    if type(value) in NUMBERS:
+        return value
+    return is_true(value, node, context)
+
+
+###################
+# Binary operations
+###################
+# Each operation is tried on the bare values; Python raises TypeError
+# unless both are numbers, and then the Value method gives the error.
+def fail(method, left_value, right_value, left_node, right_node, context):
+    left_value = box(left_value, left_node.position_start, left_node.position_end, context)
+    right_value = box(right_value, right_node.position_start, right_node.position_end, context)
+    result, error = method(left_value, right_value)
+    raise RTException(error)
+
+
+def make_arithmetic(operation, method):
+    def make(left, right, left_node, right_node):
+        def arithmetic(context):
+            left_value = left(context)
+            right_value = right(context)
+            try:
+                return operation(left_value, right_value)
+            except TypeError:
+                fail(method, left_value, right_value, left_node, right_node, context)
+        return arithmetic
+    return make
+
+
+def make_div(left, right, left_node, right_node):
+    def div(context):
+        left_value = left(context)
+        right_value = right(context)
+        try:
+            return left_value / right_value
+        except (TypeError, ZeroDivisionError):
+            # Number.div reports division by 0.
+            fail(lambda left, right: left.div(right), left_value, right_value, left_node, right_node, context)
+    return div
+
+
+def make_comparison(operation, method):
+    def make(left, right, left_node, right_node):
+        def compare(context):
+            left_value = left(context)
+            right_value = right(context)
+            try:
+                return 1 if operation(left_value, right_value) else 0
+            except TypeError:
+                fail(method, left_value, right_value, left_node, right_node, context)
+        return compare
+    return make
+
+
+def make_equality(operation, method):
+    # == and != do not raise for other types, so check them first.
+    def make(left, right, left_node, right_node):
+        def compare(context):
+            left_value = left(context)
+            right_value = right(context)
+            if type(left_value) in NUMBERS and type(right_value) in NUMBERS:
+                return 1 if operation(left_value, right_value) else 0
+            fail(method, left_value, right_value, left_node, right_node, context)
+        return compare
+    return make
+
+
+BINARY_OPERATIONS = {
+    PLUS: make_arithmetic(operator.add, lambda left, right: left.add(right)),
+    MINUS: make_arithmetic(operator.sub, lambda left, right: left.sub(right)),
+    ASTERISK: make_arithmetic(operator.mul, lambda left, right: left.mul(right)),
+    SLASH: make_div,
+    LESS_THAN: make_comparison(operator.lt, lambda left, right: left.lt(right)),
+    GREATER_THAN: make_comparison(operator.gt, lambda left, right: left.gt(right)),
+    LESS_THAN_OR_EQUAL: make_comparison(operator.le, lambda left, right: left.lt_or_eq(right)),
+    GREATER_THAN_OR_EQUAL: make_comparison(operator.ge, lambda left, right: left.gt_or_eq(right)),
+    DOUBLE_EQUAL: make_equality(operator.eq, lambda left, right: left.eq(right)),
+    NOT_EQUAL: make_equality(operator.ne, lambda left, right: left.ne(right)),
+}
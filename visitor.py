@@ -0,0 +1,36 @@
+###################
+# Visitor
+###################
+class Visitor(object):
+    """Base of the tree walkers.
+
+    Subclasses define visit_<node class name> methods. The method for a node
+    class is looked up by name the first time that class is visited and
+    kept in a dict on the visitor class, so a visit costs one lookup keyed
+    by type(node) instead of building a name and calling getattr.
+    Visitors with a fixed signature override `visit` with the same lookup
+    to avoid packing the extra arguments.
+    """
+    handlers = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.handlers = {}
+
+    @classmethod
+    def handler(cls, node_class):
+        """The unbound method for `node_class`, cached on first use."""
+        func = cls.handlers.get(node_class)
+        if func is None:
+            func = getattr(cls, "visit_" + node_class.__name__, cls.no_visit_method)
+            cls.handlers[node_class] = func
+        return func
+
+    def visit(self, node, *args):
+        func = self.handlers.get(type(node))
+        if func is None:
+            func = self.handler(type(node))
+        return func(self, node, *args)
+
+    def no_visit_method(self, node, *args):
+        raise NotImplementedError(f"No visit method for {type(node).__name__}")
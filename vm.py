@@ -0,0 +1,757 @@
+import sys
+import math
+import operator
+from array import array
+
+from errors import RTError
+from token_ import Token, MINUS
+from objfile import CONSTANT_BASE, STRING_BASE, VARIABLE_BASE
+from interpreter import Context, Function, Number, NoneType, Value, global_vars
+from stackless import MAX_DEPTH
+
+###################
+# Opcodes
+###################
+PUSH16 = 3
+PUSHC = 4
+ADD = 5
+SUB = 6
+MUL = 7
+DIV = 8
+HALT = 9
+POP = 10
+PUSHS = 11
+PUSH_NONE = 12
+LOAD_GLOBAL = 13
+STORE_GLOBAL = 14
+LOAD_LOCAL = 15
+STORE_LOCAL = 16
+LOAD_OUTER = 17
+STORE_OUTER = 18
+JUMP = 19
+JUMP_IF_FALSE = 20
+JUMP_IF_SET = 21
+ERROR = 22
+LT = 24
+GT = 25
+LE = 26
+GE = 27
+EQ = 28
+NE = 29
+NEG = 30
+UNARY = 31
+MAKE_FUNCTION = 32
+CALL = 33
+RETURN = 34
+RETURN_NONE = 35
+CHECK_BOUND = 36
+FOR_PREP = 37
+FOR_ITER = 38
+# Superinstructions, made by peephole.Peephole out of common sequences.
+ADD_CONST = 39
+SUB_CONST = 40
+COMPARE_JUMP = 41
+CONST_COMPARE_JUMP = 42
+GLOBAL_COMPARE_JUMP = 43
+LOCAL_COMPARE_JUMP = 44
+KEEP_GLOBAL = 45
+KEEP_LOCAL = 46
+
+OPCODE_NAMES = {
+    PUSH16: "PUSH16",
+    PUSHC: "PUSHC",
+    ADD: "ADD",
+    SUB: "SUB",
+    MUL: "MUL",
+    DIV: "DIV",
+    HALT: "HALT",
+    POP: "POP",
+    PUSHS: "PUSHS",
+    PUSH_NONE: "PUSH_NONE",
+    LOAD_GLOBAL: "LOAD_GLOBAL",
+    STORE_GLOBAL: "STORE_GLOBAL",
+    LOAD_LOCAL: "LOAD_LOCAL",
+    STORE_LOCAL: "STORE_LOCAL",
+    LOAD_OUTER: "LOAD_OUTER",
+    STORE_OUTER: "STORE_OUTER",
+    JUMP: "JUMP",
+    JUMP_IF_FALSE: "JUMP_IF_FALSE",
+    JUMP_IF_SET: "JUMP_IF_SET",
+    ERROR: "ERROR",
+    LT: "LT",
+    GT: "GT",
+    LE: "LE",
+    GE: "GE",
+    EQ: "EQ",
+    NE: "NE",
+    NEG: "NEG",
+    UNARY: "UNARY",
+    MAKE_FUNCTION: "MAKE_FUNCTION",
+    CALL: "CALL",
+    RETURN: "RETURN",
+    RETURN_NONE: "RETURN_NONE",
+    CHECK_BOUND: "CHECK_BOUND",
+    FOR_PREP: "FOR_PREP",
+    FOR_ITER: "FOR_ITER",
+    ADD_CONST: "ADD_CONST",
+    SUB_CONST: "SUB_CONST",
+    COMPARE_JUMP: "COMPARE_JUMP",
+    CONST_COMPARE_JUMP: "CONST_COMPARE_JUMP",
+    GLOBAL_COMPARE_JUMP: "GLOBAL_COMPARE_JUMP",
+    LOCAL_COMPARE_JUMP: "LOCAL_COMPARE_JUMP",
+    KEEP_GLOBAL: "KEEP_GLOBAL",
+    KEEP_LOCAL: "KEEP_LOCAL",
+}
+
+# Operands, all big-endian:
+#   PUSH16 value16, PUSHC constant32, PUSHS string32
+#   LOAD_GLOBAL address32 name32, STORE_GLOBAL address32
+#   LOAD_LOCAL slot32 name32, STORE_LOCAL slot32
+#   LOAD_OUTER depth8 slot32 name32, STORE_OUTER depth8 slot32
+#   JUMP, JUMP_IF_FALSE, JUMP_IF_SET, FOR_ITER target32
+#   ERROR string32, MAKE_FUNCTION function32
+#   UNARY token type8, CALL argument count8, CHECK_BOUND depth8
+# and for the superinstructions:
+#   ADD_CONST, SUB_CONST constant32
+#   COMPARE_JUMP comparison8 target32
+#   CONST_COMPARE_JUMP constant32 comparison8 target32
+#   GLOBAL_COMPARE_JUMP address32 name32 comparison8 target32
+#   LOCAL_COMPARE_JUMP slot32 name32 comparison8 target32
+#   KEEP_GLOBAL address32, KEEP_LOCAL slot32
+# A load's name is the string address of the variable's name, reported when
+# the variable is not set, or NO_NAME for a load that pushes None instead.
+# A comparison is the opcode of LT, GT, LE, GE, EQ or NE. A jump's target is
+# always its last operand.
+NO_NAME = 0xffffffff
+
+# The size in bytes of each operand.
+OPERANDS = {
+    PUSH16: (2,), PUSHC: (4,), ADD: (), SUB: (), MUL: (), DIV: (), HALT: (), POP: (), PUSHS: (4,), PUSH_NONE: (),
+    LOAD_GLOBAL: (4, 4), STORE_GLOBAL: (4,), LOAD_LOCAL: (4, 4), STORE_LOCAL: (4,), LOAD_OUTER: (1, 4, 4), STORE_OUTER: (1, 4),
+    JUMP: (4,), JUMP_IF_FALSE: (4,), JUMP_IF_SET: (4,), ERROR: (4,),
+    LT: (), GT: (), LE: (), GE: (), EQ: (), NE: (), NEG: (), UNARY: (1,),
+    MAKE_FUNCTION: (4,), CALL: (1,), RETURN: (), RETURN_NONE: (), CHECK_BOUND: (1,), FOR_PREP: (), FOR_ITER: (4,),
+    ADD_CONST: (4,), SUB_CONST: (4,), COMPARE_JUMP: (1, 4), CONST_COMPARE_JUMP: (4, 1, 4),
+    GLOBAL_COMPARE_JUMP: (4, 4, 1, 4), LOCAL_COMPARE_JUMP: (4, 4, 1, 4), KEEP_GLOBAL: (4,), KEEP_LOCAL: (4,),
+}
+# Bytes taken by each instruction, opcode included.
+OPCODE_SIZES = {op: 1 + sum(operands) for op, operands in OPERANDS.items()}
+# Where the name is in each instruction that loads a variable, and the
+# comparison in each that compares.
+NAME_OFFSETS = {LOAD_GLOBAL: 5, LOAD_LOCAL: 5, LOAD_OUTER: 6, GLOBAL_COMPARE_JUMP: 5, LOCAL_COMPARE_JUMP: 5}
+COMPARISON_OFFSETS = {COMPARE_JUMP: 1, CONST_COMPARE_JUMP: 5, GLOBAL_COMPARE_JUMP: 9, LOCAL_COMPARE_JUMP: 9}
+# Values each instruction pops and pushes; CALL also pops its arguments.
+STACK_EFFECTS = {
+    PUSH16: (0, 1), PUSHC: (0, 1), PUSHS: (0, 1), PUSH_NONE: (0, 1),
+    ADD: (2, 1), SUB: (2, 1), MUL: (2, 1), DIV: (2, 1),
+    LT: (2, 1), GT: (2, 1), LE: (2, 1), GE: (2, 1), EQ: (2, 1), NE: (2, 1), NEG: (1, 1), UNARY: (1, 1),
+    POP: (1, 0), LOAD_GLOBAL: (0, 1), STORE_GLOBAL: (1, 0), LOAD_LOCAL: (0, 1), STORE_LOCAL: (1, 0),
+    LOAD_OUTER: (0, 1), STORE_OUTER: (1, 0), JUMP: (0, 0), JUMP_IF_FALSE: (1, 0), JUMP_IF_SET: (1, 0),
+    ERROR: (0, 0), MAKE_FUNCTION: (0, 1), CALL: (1, 1), RETURN: (1, 0), RETURN_NONE: (0, 0),
+    CHECK_BOUND: (0, 0), FOR_PREP: (3, 1), FOR_ITER: (0, 1), HALT: (0, 0),
+    ADD_CONST: (1, 1), SUB_CONST: (1, 1), COMPARE_JUMP: (2, 0), CONST_COMPARE_JUMP: (1, 0),
+    GLOBAL_COMPARE_JUMP: (1, 0), LOCAL_COMPARE_JUMP: (1, 0), KEEP_GLOBAL: (1, 1), KEEP_LOCAL: (1, 1),
+}
+JUMPS = frozenset((JUMP, JUMP_IF_FALSE, JUMP_IF_SET, FOR_ITER, COMPARE_JUMP, CONST_COMPARE_JUMP, GLOBAL_COMPARE_JUMP, LOCAL_COMPARE_JUMP))
+# Instructions after which the next one does not run.
+ENDS = frozenset((JUMP, ERROR, RETURN_NONE, HALT))
+
+NUMBERS = (float, int)
+NONE = global_vars["none"]
+WRITE = global_vars["write"]
+RANGE_ITERATOR = type(iter(range(0)))
+
+
+def equal(left, right):
+    # == does not raise for other types, so check them first.
+    if type(left) not in NUMBERS or type(right) not in NUMBERS:
+        raise TypeError("== needs numbers")
+    return left == right
+
+
+def not_equal(left, right):
+    if type(left) not in NUMBERS or type(right) not in NUMBERS:
+        raise TypeError("!= needs numbers")
+    return left != right
+
+
+# How the compare and jump superinstructions compare.
+COMPARISONS = {LT: operator.lt, GT: operator.gt, LE: operator.le, GE: operator.ge, EQ: equal, NE: not_equal}
+
+
+def verify(code, constant_count=0, string_count=0, functions=(), global_count=0):
+    """Check that `code` decodes, that its operands refer to constants,
+    strings, functions, variables and instructions that exist, and that
+    every path through the program and each function keeps the stack
+    balanced, with the program ending in HALT. Returns an error or None.
+    """
+    starts = set()
+    pc = 0
+    while pc < len(code):
+        op = code[pc]
+        if op not in OPCODE_SIZES:
+            return RTError(f"Unknown opcode {op} at {pc}", None, None, None)
+        if pc + OPCODE_SIZES[op] > len(code):
+            return RTError(f"Truncated {OPCODE_NAMES[op]} at {pc}", None, None, None)
+        starts.add(pc)
+        pc += OPCODE_SIZES[op]
+
+    def operand(pc, i, size=4):
+        return int.from_bytes(code[pc + i:pc + i + size], "big")
+
+    def target(pc):
+        size = OPERANDS[code[pc]][-1]
+        return operand(pc, OPCODE_SIZES[code[pc]] - size, size)
+
+    for pc in sorted(starts):
+        op = code[pc]
+        name = OPCODE_NAMES[op]
+        if op in (PUSHC, ADD_CONST, SUB_CONST, CONST_COMPARE_JUMP) and not 0 <= operand(pc, 1) - CONSTANT_BASE < constant_count:
+            return RTError(f"Unknown constant in {name} at {pc}", None, None, None)
+        if op in (PUSHS, ERROR) and not 0 <= operand(pc, 1) - STRING_BASE < string_count:
+            return RTError(f"Unknown string in {name} at {pc}", None, None, None)
+        if op in NAME_OFFSETS:
+            string = operand(pc, NAME_OFFSETS[op])
+            if string != NO_NAME and not 0 <= string - STRING_BASE < string_count:
+                return RTError(f"Unknown string in {name} at {pc}", None, None, None)
+        if op in (LOAD_GLOBAL, STORE_GLOBAL, KEEP_GLOBAL, GLOBAL_COMPARE_JUMP) and not 0 <= operand(pc, 1) - VARIABLE_BASE < global_count:
+            return RTError(f"Unknown variable in {name} at {pc}", None, None, None)
+        if op in COMPARISON_OFFSETS and code[pc + COMPARISON_OFFSETS[op]] not in COMPARISONS:
+            return RTError(f"Unknown comparison in {name} at {pc}", None, None, None)
+        if op in JUMPS and target(pc) not in starts:
+            return RTError(f"Bad jump target in {name} at {pc}", None, None, None)
+        if op == MAKE_FUNCTION and not operand(pc, 1) < len(functions):
+            return RTError(f"Unknown function in {name} at {pc}", None, None, None)
+    for offset, slot_count, arg_slot in functions:
+        if offset not in starts or not arg_slot < slot_count:
+            return RTError(f"Bad function at {offset}", None, None, None)
+
+    # The depth of the stack before each instruction, from the start of the
+    # program or of a function body.
+    depths = {}
+    work = [(0, 0)] + [(offset, 0) for offset, slot_count, arg_slot in functions]
+    while work:
+        pc, depth = work.pop()
+        while True:
+            if pc >= len(code):
+                return RTError("Program does not end in HALT", None, None, None)
+            if pc in depths:
+                if depths[pc] != depth:
+                    return RTError(f"Stack depth differs between paths at {pc}", None, None, None)
+                break
+            depths[pc] = depth
+            op = code[pc]
+            pops, pushes = STACK_EFFECTS[op]
+            if op == CALL:
+                pops += code[pc + 1]
+            needed = code[pc + 1] + 1 if op == CHECK_BOUND else max(pops, op == FOR_ITER)
+            if depth < needed:
+                return RTError(f"Stack underflow in {OPCODE_NAMES[op]} at {pc}", None, None, None)
+            if op == FOR_ITER:
+                # Leaving the loop pops the iterator.
+                work.append((target(pc), depth - 1))
+            depth += pushes - pops
+            if op in JUMPS and op != FOR_ITER:
+                work.append((target(pc), depth))
+            if op in ENDS:
+                break
+            pc += OPCODE_SIZES[op]
+    return None
+
+
+###################
+# Values
+###################
+class Closure(object):
+    """A function value: its entry in the function table and the frame of
+    the call it was made in, None for the program's."""
+    __slots__ = ("function", "env")
+
+    def __init__(self, function, env):
+        self.function = function
+        self.env = env
+
+
+class String(object):
+    """A string value. Wrapping it keeps Python's + and * for str away from
+    it, so arithmetic fails on strings as on any other value."""
+    __slots__ = ("text",)
+
+    def __init__(self, text):
+        self.text = text
+
+
+def box(value, position_start, position_end, context):
+    """The Value the interpreter would have for `value`."""
+    if type(value) in NUMBERS:
+        return Number(value).set_context(context).set_pos(position_start, position_end)
+    if type(value) is Closure:
+        return Function("anonymous", ["argument"], None).set_context(context).set_pos(position_start, position_end)
+    if type(value) is String:
+        return Value().set_context(context).set_pos(position_start, position_end)
+    return value
+
+
+def text_of(value):
+    """What `write` prints for `value`."""
+    if type(value) in NUMBERS:
+        return str(value)
+    if type(value) is String:
+        return value.text
+    return str(box(value, None, None, None).repr())
+
+
+def call_builtin(callee, args, position_start, position_end, context):
+    """Call anything but a Closure: write, or what fails as the tree
+    walker fails when called. Returns (value, error)."""
+    if callee is WRITE and len(args) == 1:
+        # Calling the builtin gives it a position, as in the tree walker.
+        WRITE.set_pos(position_start, position_end)
+        sys.stdout.write(text_of(args[0]))
+        return NONE, None
+    value = box(callee, position_start, position_end, context).set_pos(position_start, position_end)
+    return value.execute([box(arg, None, None, context) for arg in args])
+
+
+def call_context(activations, call_start, frame, source):
+    """The Context of the running call whose frame is `frame`, or the
+    program's if that is None or the call has returned.
+
+    `activations` are the frames of the running calls, outermost first,
+    each ending in the frame its function was made in, and call_start(i)
+    is where call i starts in the source. As in the interpreter, the
+    parent of a call's context is the one its function was made in.
+    """
+    contexts = {}
+
+    def context_at(i):
+        if i < 0:
+            return Context("<program>", source=source)
+        if i not in contexts:
+            parent = activations[i][-1]
+            j = i - 1
+            while j >= 0 and activations[j] is not parent:
+                j -= 1
+            contexts[i] = Context("anonymous", parent=context_at(j), parent_start_pos=call_start(i))
+        return contexts[i]
+
+    i = len(activations) - 1
+    while i >= 0 and activations[i] is not frame:
+        i -= 1
+    return context_at(i)
+
+
+BINARY_METHODS = {ADD: "add", SUB: "sub", MUL: "mul", DIV: "div", LT: "lt", GT: "gt", LE: "lt_or_eq", GE: "gt_or_eq", EQ: "eq", NE: "ne"}
+
+
+###################
+# VM
+###################
+class VM(object):
+    """Runs a compiled program (an objfile.ObjectFile).
+
+    The code is checked once up front, so the dispatch loop needs no bounds
+    or underflow checks. Values are those of the unboxed engine: bare
+    floats and ints for numbers, with none and write as the interpreter's
+    Values, plus Closure and String. The operand stack is a list shared
+    by all calls. A call pushes (return pc, caller's frame, stack base,
+    call pc) on `frames` and runs the body in a new frame: a list of the
+    function's slots with the frame of the call it was made in at the
+    end, which LOAD_OUTER walks out through. The program's variables are
+    the globals, one per symbol.
+
+    Output and errors are those of the tree walker, and errors are located
+    through the program's position table and `source`. A superinstruction
+    that can fail in two places has the position of the second at the
+    offset after its own. The traceback follows the calls still running,
+    so it leaves out the call a function was made in once that call has
+    returned. Calls go `max_depth` deep.
+
+    `counts` holds how many times each opcode has run, indexed by opcode.
+    """
+    def __init__(self, program, source=None, max_depth=MAX_DEPTH):
+        self.program = program
+        self.code = program.code
+        self.constants = program.constants
+        self.strings = [String(text) for text in program.strings]
+        self.source = source
+        self.max_depth = max_depth
+        self.counts = array("Q", bytes(8 * 256))
+        # Each function's entry offset, an empty frame to copy and the slot
+        # of its argument.
+        self.functions = [(offset, [None] * (slot_count + 1), arg_slot) for offset, slot_count, arg_slot in program.functions]
+        self.initial_globals = [None] * len(program.symbols)
+        predefined = {"true": 1, "false": 0, "none": NONE, "write": WRITE}
+        for name, (address, type) in program.symbols.items():
+            if name in predefined:
+                self.initial_globals[address - VARIABLE_BASE] = predefined[name]
+        self.error = verify(self.code, len(self.constants), len(self.strings), program.functions, len(self.initial_globals))
+
+    def run(self):
+        """Execute to HALT or a `return` in the program. Returns (the
+        values of the program's expression statements, error)."""
+        if self.error:
+            return None, self.error
+        code = self.code
+        constants = self.constants
+        strings = self.strings
+        functions = self.functions
+        globals_ = list(self.initial_globals)
+        counts = self.counts
+        max_depth = self.max_depth
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        frames = []
+        env = None
+        base = 0
+        pc = 0
+        while True:
+            op = code[pc]
+            counts[op] += 1
+            if op == LOAD_LOCAL:
+                value = env[code[pc + 1] << 24 | code[pc + 2] << 16 | code[pc + 3] << 8 | code[pc + 4]]
+                if value is None and (code[pc + 5] << 24 | code[pc + 6] << 16 | code[pc + 7] << 8 | code[pc + 8]) != NO_NAME:
+                    return None, self.name_error(pc, frames, env)
+                push(value)
+                pc += 9
+            elif op == LOAD_GLOBAL:
+                value = globals_[(code[pc + 1] << 24 | code[pc + 2] << 16 | code[pc + 3] << 8 | code[pc + 4]) - VARIABLE_BASE]
+                if value is None and (code[pc + 5] << 24 | code[pc + 6] << 16 | code[pc + 7] << 8 | code[pc + 8]) != NO_NAME:
+                    return None, self.name_error(pc, frames, env)
+                push(value)
+                pc += 9
+            elif op == PUSHC:
+                push(constants[(code[pc + 1] << 24 | code[pc + 2] << 16 | code[pc + 3] << 8 | code[pc + 4]) - CONSTANT_BASE])
+                pc += 5
+            elif op == ADD_CONST:
+                left = stack[-1]
+                right = constants[(code[pc + 1] << 24 | code[pc + 2] << 16 | code[pc + 3] << 8 | code[pc + 4]) - CONSTANT_BASE]
+                try:
+                    stack[-1] = left + right
+                except TypeError:
+                    return None, self.binary_error(ADD, left, right, pc, frames, env)
+                pc += 5
+            elif op == GLOBAL_COMPARE_JUMP:
+                right = globals_[(code[pc + 1] << 24 | code[pc + 2] << 16 | code[pc + 3] << 8 | code[pc + 4]) - VARIABLE_BASE]
+                if right is None and (code[pc + 5] << 24 | code[pc + 6] << 16 | code[pc + 7] << 8 | code[pc + 8]) != NO_NAME:
+                    return None, self.name_error(pc, frames, env)
+                left = pop()
+                try:
+                    passed = COMPARISONS[code[pc + 9]](left, right)
+                except TypeError:
+                    # The comparison's position is the one after the load's.
+                    return None, self.binary_error(code[pc + 9], left, right, pc + 1, frames, env)
+                pc = pc + 14 if passed else code[pc + 10] << 24 | code[pc + 11] << 16 | code[pc + 12] << 8 | code[pc + 13]
+            elif op == LOCAL_COMPARE_JUMP:
+                right = env[code[pc + 1] << 24 | code[pc + 2] << 16 | code[pc + 3] << 8 | code[pc + 4]]
+                if right is None and (code[pc + 5] << 24 | code[pc + 6] << 16 | code[pc + 7] << 8 | code[pc + 8]) != NO_NAME:
+                    return None, self.name_error(pc, frames, env)
+                left = pop()
+                try:
+                    passed = COMPARISONS[code[pc + 9]](left, right)
+                except TypeError:
+                    return None, self.binary_error(code[pc + 9], left, right, pc + 1, frames, env)
+                pc = pc + 14 if passed else code[pc + 10] << 24 | code[pc + 11] << 16 | code[pc + 12] << 8 | code[pc + 13]
+            elif op == CONST_COMPARE_JUMP:
+                right = constants[(code[pc + 1] << 24 | code[pc + 2] << 16 | code[pc + 3] << 8 | code[pc + 4]) - CONSTANT_BASE]
+                left = pop()
+                try:
+                    passed = COMPARISONS[code[pc + 5]](left, right)
+                except TypeError:
+                    return None, self.binary_error(code[pc + 5], left, right, pc, frames, env)
+                pc = pc + 10 if passed else code[pc + 6] << 24 | code[pc + 7] << 16 | code[pc + 8] << 8 | code[pc + 9]
+            elif op == COMPARE_JUMP:
+                right = pop()
+                left = pop()
+                try:
+                    passed = COMPARISONS[code[pc + 1]](left, right)
+                except TypeError:
+                    return None, self.binary_error(code[pc + 1], left, right, pc, frames, env)
+                pc = pc + 6 if passed else code[pc + 2] << 24 | code[pc + 3] << 16 | code[pc + 4] << 8 | code[pc + 5]
+            elif op == KEEP_GLOBAL:
+                globals_[(code[pc + 1] << 24 | code[pc + 2] << 16 | code[pc + 3] << 8 | code[pc + 4]) - VARIABLE_BASE] = stack[-1]
+                pc += 5
+            elif op == KEEP_LOCAL:
+                env[code[pc + 1] << 24 | code[pc + 2] << 16 | code[pc + 3] << 8 | code[pc + 4]] = stack[-1]
+                pc += 5
+            elif op == SUB_CONST:
+                left = stack[-1]
+                right = constants[(code[pc + 1] << 24 | code[pc + 2] << 16 | code[pc + 3] << 8 | code[pc + 4]) - CONSTANT_BASE]
+                try:
+                    stack[-1] = left - right
+                except TypeError:
+                    return None, self.binary_error(SUB, left, right, pc, frames, env)
+                pc += 5
+            elif op == PUSH16:
+                push(float(code[pc + 1] << 8 | code[pc + 2]))
+                pc += 3
+            elif op == JUMP_IF_FALSE:
+                value = pop()
+                if type(value) not in NUMBERS:
+                    # Only numbers have a truth, as in interpreter.truth.
+                    return None, self.runtime_error("Illegal Operation", pc, frames, env)
+                if value == 0:
+                    pc = code[pc + 1] << 24 | code[pc + 2] << 16 | code[pc + 3] << 8 | code[pc + 4]
+                else:
+                    pc += 5
+            elif op == JUMP:
+                pc = code[pc + 1] << 24 | code[pc + 2] << 16 | code[pc + 3] << 8 | code[pc + 4]
+            elif op == STORE_LOCAL:
+                env[code[pc + 1] << 24 | code[pc + 2] << 16 | code[pc + 3] << 8 | code[pc + 4]] = pop()
+                pc += 5
+            elif op == STORE_GLOBAL:
+                globals_[(code[pc + 1] << 24 | code[pc + 2] << 16 | code[pc + 3] << 8 | code[pc + 4]) - VARIABLE_BASE] = pop()
+                pc += 5
+            elif op == ADD:
+                right = pop()
+                left = stack[-1]
+                try:
+                    stack[-1] = left + right
+                except TypeError:
+                    return None, self.binary_error(op, left, right, pc, frames, env)
+                pc += 1
+            elif op == SUB:
+                right = pop()
+                left = stack[-1]
+                try:
+                    stack[-1] = left - right
+                except TypeError:
+                    return None, self.binary_error(op, left, right, pc, frames, env)
+                pc += 1
+            elif op == MUL:
+                right = pop()
+                left = stack[-1]
+                try:
+                    stack[-1] = left * right
+                except TypeError:
+                    return None, self.binary_error(op, left, right, pc, frames, env)
+                pc += 1
+            elif op == DIV:
+                right = pop()
+                left = stack[-1]
+                try:
+                    stack[-1] = left / right
+                except (TypeError, ZeroDivisionError):
+                    return None, self.binary_error(op, left, right, pc, frames, env)
+                pc += 1
+            elif op == LT:
+                right = pop()
+                left = stack[-1]
+                try:
+                    stack[-1] = 1 if left < right else 0
+                except TypeError:
+                    return None, self.binary_error(op, left, right, pc, frames, env)
+                pc += 1
+            elif op == GT:
+                right = pop()
+                left = stack[-1]
+                try:
+                    stack[-1] = 1 if left > right else 0
+                except TypeError:
+                    return None, self.binary_error(op, left, right, pc, frames, env)
+                pc += 1
+            elif op == LE:
+                right = pop()
+                left = stack[-1]
+                try:
+                    stack[-1] = 1 if left <= right else 0
+                except TypeError:
+                    return None, self.binary_error(op, left, right, pc, frames, env)
+                pc += 1
+            elif op == GE:
+                right = pop()
+                left = stack[-1]
+                try:
+                    stack[-1] = 1 if left >= right else 0
+                except TypeError:
+                    return None, self.binary_error(op, left, right, pc, frames, env)
+                pc += 1
+            elif op == EQ:
+                # == does not raise for other types, so check them first.
+                right = pop()
+                left = stack[-1]
+                if type(left) not in NUMBERS or type(right) not in NUMBERS:
+                    return None, self.binary_error(op, left, right, pc, frames, env)
+                stack[-1] = 1 if left == right else 0
+                pc += 1
+            elif op == NE:
+                right = pop()
+                left = stack[-1]
+                if type(left) not in NUMBERS or type(right) not in NUMBERS:
+                    return None, self.binary_error(op, left, right, pc, frames, env)
+                stack[-1] = 1 if left != right else 0
+                pc += 1
+            elif op == CALL:
+                argc = code[pc + 1]
+                callee = stack[-1 - argc]
+                if type(callee) is Closure and argc == 1:
+                    if len(frames) >= max_depth:
+                        return None, self.depth_error(callee, pc, frames, env)
+                    offset, empty, arg_slot = callee.function
+                    frame = empty.copy()
+                    frame[-1] = callee.env
+                    frame[arg_slot] = pop()
+                    pop()
+                    frames.append((pc + 2, env, base, pc))
+                    env = frame
+                    base = len(stack)
+                    pc = offset
+                else:
+                    value, error = self.call_value(callee, stack[len(stack) - argc:], pc, frames, env)
+                    if error:
+                        return None, error
+                    del stack[len(stack) - argc - 1:]
+                    push(value)
+                    pc += 2
+            elif op == RETURN:
+                # A `return` whose value is none does not end the body.
+                value = pop()
+                if type(value) is NoneType:
+                    pc += 1
+                elif not frames:
+                    return self.results(stack), None
+                else:
+                    del stack[base:]
+                    pc, env, base, call_pc = frames.pop()
+                    push(value)
+            elif op == RETURN_NONE:
+                del stack[base:]
+                pc, env, base, call_pc = frames.pop()
+                push(NONE)
+            elif op == POP:
+                pop()
+                pc += 1
+            elif op == FOR_ITER:
+                value = next(stack[-1], None)
+                if value is None:
+                    pop()
+                    pc = code[pc + 1] << 24 | code[pc + 2] << 16 | code[pc + 3] << 8 | code[pc + 4]
+                else:
+                    push(value)
+                    pc += 5
+            elif op == LOAD_OUTER:
+                frame = env
+                for _ in range(code[pc + 1]):
+                    frame = frame[-1]
+                value = frame[code[pc + 2] << 24 | code[pc + 3] << 16 | code[pc + 4] << 8 | code[pc + 5]]
+                if value is None and (code[pc + 6] << 24 | code[pc + 7] << 16 | code[pc + 8] << 8 | code[pc + 9]) != NO_NAME:
+                    return None, self.name_error(pc, frames, env)
+                push(value)
+                pc += 10
+            elif op == STORE_OUTER:
+                frame = env
+                for _ in range(code[pc + 1]):
+                    frame = frame[-1]
+                frame[code[pc + 2] << 24 | code[pc + 3] << 16 | code[pc + 4] << 8 | code[pc + 5]] = pop()
+                pc += 6
+            elif op == JUMP_IF_SET:
+                if pop() is not None:
+                    pc = code[pc + 1] << 24 | code[pc + 2] << 16 | code[pc + 3] << 8 | code[pc + 4]
+                else:
+                    pc += 5
+            elif op == MAKE_FUNCTION:
+                push(Closure(functions[code[pc + 1] << 24 | code[pc + 2] << 16 | code[pc + 3] << 8 | code[pc + 4]], env))
+                pc += 5
+            elif op == NEG:
+                value = stack[-1]
+                if type(value) in NUMBERS:
+                    stack[-1] = -value
+                else:
+                    return None, self.unary_error(MINUS, value, pc, frames, env)
+                pc += 1
+            elif op == PUSH_NONE:
+                push(NONE)
+                pc += 1
+            elif op == PUSHS:
+                push(strings[(code[pc + 1] << 24 | code[pc + 2] << 16 | code[pc + 3] << 8 | code[pc + 4]) - STRING_BASE])
+                pc += 5
+            elif op == CHECK_BOUND:
+                i = -1 - code[pc + 1]
+                value = stack[i]
+                if type(value) is float and math.isfinite(value) and value.is_integer():
+                    stack[i] = int(value)
+                elif type(value) is not int:
+                    return None, self.runtime_error("For loop bounds must be whole numbers", pc, frames, env)
+                pc += 2
+            elif op == FOR_PREP:
+                step = pop()
+                end = pop()
+                start = pop()
+                if step == 0:
+                    return None, self.runtime_error("For loop step must not be 0", pc, frames, env)
+                push(iter(range(start, end, step)))
+                pc += 1
+            elif op == UNARY:
+                return None, self.unary_error(code[pc + 1], pop(), pc, frames, env)
+            elif op == ERROR:
+                return None, self.runtime_error(strings[(code[pc + 1] << 24 | code[pc + 2] << 16 | code[pc + 3] << 8 | code[pc + 4]) - STRING_BASE].text, pc, frames, env)
+            else:
+                return self.results(stack), None
+
+    def results(self, stack):
+        # A `return` in a loop of the program leaves the loop's iterator.
+        return [text_of(value) if type(value) not in NUMBERS else value for value in stack if type(value) is not RANGE_ITERATOR]
+
+    def call_value(self, callee, args, pc, frames, env):
+        """Call a builtin, or make the error for calling anything else."""
+        position_start, position_end = self.program.position_of(pc)
+        if type(callee) is Closure:
+            context = self.context_of(frames, env, callee.env)
+        else:
+            context = self.context(frames, env)
+        return call_builtin(callee, args, position_start, position_end, context)
+
+    ###################
+    # Errors
+    ###################
+    def context(self, frames, env):
+        """The Context of the running call."""
+        return self.context_of(frames, env, env)
+
+    def context_of(self, frames, env, frame):
+        """The Context of the call running in `frame`, or the program's if
+        that is None or the call has returned."""
+        activations = [frames[i + 1][1] for i in range(len(frames) - 1)] + [env] if frames else []
+        return call_context(activations, lambda i: self.program.position_of(frames[i][3])[0], frame, self.source)
+
+    def runtime_error(self, text, pc, frames=(), env=None):
+        position_start, position_end = self.program.position_of(pc)
+        return RTError(text, position_start, position_end, self.context(frames, env))
+
+    def name_error(self, pc, frames, env):
+        at = pc + NAME_OFFSETS[self.code[pc]]
+        name = self.strings[int.from_bytes(self.code[at:at + 4], "big") - STRING_BASE].text
+        return self.runtime_error(f"Name {name} does not exist", pc, frames, env)
+
+    def binary_error(self, op, left, right, pc, frames, env):
+        # The Value method gives the error.
+        position_start, position_end = self.program.position_of(pc)
+        context = self.context(frames, env)
+        left = box(left, position_start, None, context)
+        right = box(right, None, position_end, context)
+        result, error = getattr(left, BINARY_METHODS[op])(right)
+        return error
+
+    def unary_error(self, token_type, value, pc, frames, env):
+        position_start, position_end = self.program.position_of(pc)
+        value = box(value, None, position_end, self.context(frames, env))
+        result, error = value.unary(Token(token_type, None, position_start, position_end))
+        return error
+
+    def depth_error(self, callee, pc, frames, env):
+        position_start, position_end = self.program.position_of(pc)
+        context = Context("anonymous", parent=self.context_of(frames, env, callee.env), parent_start_pos=position_start)
+        return RTError(f"Maximum call depth of {self.max_depth} exceeded", position_start, position_end, context)
+
+    def instruction_count(self):
+        return sum(self.counts)
+
+    def report(self):
+        """Executed instructions per opcode, most frequent first."""
+        lines = [f"{self.instruction_count()} instructions"]
+        for op in sorted(OPCODE_NAMES, key=lambda op: -self.counts[op]):
+            if self.counts[op]:
+                lines.append(f"  {OPCODE_NAMES[op]:<19} {self.counts[op]}")
+        return "\n".join(lines)
+